@@ -0,0 +1,32 @@
+#!/usr/bin/env bash
+# Easy Local Chat - Mock LLM Server for load tests (Ollama-compatible API)
+#
+# Usage:
+#   ./deployment/start_mock_llm.sh [--port 11435] [--tokens-per-sec 30] [--ttft-ms 200]
+#                                  [--jitter 0.1] [--failure-rate 0.0] [--seed 0]
+#
+# Then start the chat server against it:
+#   OLLAMA_HOST=http://127.0.0.1:11435 ./deployment/start_server.sh
+
+set -e  # Exit on error
+
+# Move to project root
+cd "$(dirname "$0")/.."
+
+echo "=========================================="
+echo "Easy Local Chat - Mock LLM Server"
+echo "=========================================="
+echo ""
+
+# Activate virtual environment if present
+if [ -f "venv/bin/activate" ]; then
+    source venv/bin/activate
+elif [ -f "venv/Scripts/activate" ]; then
+    source venv/Scripts/activate
+fi
+
+echo "Press Ctrl+C to stop"
+echo "=========================================="
+echo ""
+
+python -m src.managers.mock_llm_backend "$@"
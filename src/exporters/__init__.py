@@ -1,4 +1,4 @@
-from .data_exporter import DataExporter
-
-__all__ = ["DataExporter"]
+from .data_exporter import DataExporter, ExportDelta
+from .parallel_export import ParallelExportEngine
 
+__all__ = ["DataExporter", "ExportDelta", "ParallelExportEngine"]
@@ -0,0 +1,401 @@
+"""列指向形式（Parquet / Arrow IPC(Feather)）での実験データのエクスポート
+
+ワイド形式CSVは数千列・数百MBになると pandas / R での読み込みが遅く、型も失われる
+（リッカートの回答が文字列に、複数選択の回答がJSON文字列になる）。
+pyarrow がインストールされている場合のみ、以下のデータセットを型付きの列指向形式で出力する。
+
+- wide     : ワイド形式（1行 = 1セッション、列構成はワイド形式CSVと同じ）
+- messages : 全メッセージ（ロング形式、1行 = 1メッセージ）
+- sessions : セッション情報
+
+列の型:
+- 回答の列は実験フローの質問定義から決める（リッカート → int64、数値入力 → float64、
+  複数選択 → list<string>、選択肢のある単一選択 → 辞書エンコード、その他・フローにない質問 → string）。
+  AI評価のスコアは int64。値を見て型を推定しないため、ワイド形式の行も1行ずつ作りながら書き出せる
+- 条件ラベル・実験グループ・ステータス・モデル名などは辞書エンコード（カテゴリ型として読み込まれる）
+- 日時は timestamp[us]（タイムゾーン付きの値はサーバーのローカル時刻に変換）
+- 欠損値は null
+
+ROW_GROUP_ROWS 行ごとにレコードバッチを作って書き出す（Parquetは行グループ、Arrow IPCはバッチ）。
+ワイド形式の行・メッセージは1行ずつ作りながら書き出すため、メモリ使用量は行グループ1つ分に収まる
+（ワイド形式の列構成を決めるためのセッションごとの材料は全セッション分を持つ）。
+辞書エンコードの辞書はバッチ間で追記のみ行う（Arrow IPCファイル形式の辞書デルタ）。
+
+使い方:
+    pip install pyarrow
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow は任意の依存
+    pa = None
+
+from ..managers.experiment_manager import ExperimentManager
+from ..managers.message_store import MessageStore
+from ..managers.session_manager import SessionManager
+from .data_exporter import DataExporter, ExportDelta, FlowIndex
+
+# 出力形式: 形式名 → (拡張子, MIMEタイプ)
+COLUMNAR_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'feather': ('feather', 'application/vnd.apache.arrow.file'),
+}
+
+COLUMNAR_DATASETS = ('wide', 'messages', 'sessions')
+
+# 1つの行グループ（レコードバッチ）の行数
+ROW_GROUP_ROWS = 10000
+
+# 圧縮方式（Parquet・Arrow IPC 共通）
+COMPRESSION = 'zstd'
+
+# 列の種類
+KIND_STRING = 'string'
+KIND_DICTIONARY = 'dictionary'  # 辞書エンコードした文字列（カテゴリ）
+KIND_INT = 'int'
+KIND_FLOAT = 'float'
+KIND_BOOL = 'bool'
+KIND_TIMESTAMP = 'timestamp'
+KIND_LIST = 'list'  # 文字列のリスト（カンマ区切りの文字列は分割）
+KIND_MAP = 'map'  # 文字列 → 文字列
+
+# ワイド形式の基本列の種類
+WIDE_BASE_KINDS = {
+    'experiment_id': KIND_DICTIONARY,
+    'session_id': KIND_STRING,
+    'participant_code': KIND_STRING,
+    'client_id': KIND_STRING,
+    'condition_id': KIND_DICTIONARY,
+    'experiment_group': KIND_DICTIONARY,
+    'status': KIND_DICTIONARY,
+    'flow_completed': KIND_BOOL,
+    'completed_steps_count': KIND_INT,
+    'started_at': KIND_TIMESTAMP,
+    'ended_at': KIND_TIMESTAMP,
+    'duration_seconds': KIND_INT,
+    'total_messages': KIND_INT,
+    'user_message_count': KIND_INT,
+    'bot_message_count': KIND_INT,
+    'total_user_chars': KIND_INT,
+    'total_user_words': KIND_INT,
+    'avg_user_chars': KIND_FLOAT,
+    'avg_user_words': KIND_FLOAT,
+}
+
+MESSAGE_COLUMNS = [
+    ('experiment_id', KIND_DICTIONARY),
+    ('session_id', KIND_STRING),
+    ('experiment_group', KIND_DICTIONARY),
+    ('message_id', KIND_STRING),
+    ('client_id', KIND_STRING),
+    ('internal_id', KIND_STRING),
+    ('message_type', KIND_DICTIONARY),
+    ('content', KIND_STRING),
+    ('timestamp', KIND_TIMESTAMP),
+    ('char_count', KIND_INT),
+    ('word_count', KIND_INT),
+]
+
+SESSION_COLUMNS = [
+    ('experiment_id', KIND_DICTIONARY),
+    ('session_id', KIND_STRING),
+    ('participant_code', KIND_STRING),
+    ('experiment_group', KIND_DICTIONARY),
+    ('condition_id', KIND_DICTIONARY),
+    ('assigned_conditions', KIND_MAP),
+    ('created_at', KIND_TIMESTAMP),
+    ('ended_at', KIND_TIMESTAMP),
+    ('status', KIND_DICTIONARY),
+    ('participant_count', KIND_INT),
+    ('participants', KIND_LIST),
+    ('total_messages', KIND_INT),
+    ('duration_seconds', KIND_FLOAT),
+]
+
+# 質問タイプ（experiment_flow.js の回答の収集と同じ分類）
+LIKERT_TYPES = ('likert', 'scale')
+SINGLE_CHOICE_TYPES = ('radio', 'single_choice', 'choice')
+MULTI_CHOICE_TYPES = ('checkbox', 'multiple_choice')
+
+
+def is_available() -> bool:
+    """pyarrow がインストールされているか"""
+    return pa is not None
+
+
+def _arrow_type(kind: str):
+    return {
+        KIND_STRING: pa.string(),
+        KIND_DICTIONARY: pa.dictionary(pa.int32(), pa.string()),
+        KIND_INT: pa.int64(),
+        KIND_FLOAT: pa.float64(),
+        KIND_BOOL: pa.bool_(),
+        KIND_TIMESTAMP: pa.timestamp('us'),
+        KIND_LIST: pa.list_(pa.string()),
+        KIND_MAP: pa.map_(pa.string(), pa.string()),
+    }[kind]
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """ISO形式の日時を変換（タイムゾーン付きはローカル時刻に揃える、変換できない値は欠損）"""
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def _convert(kind: str, value: Any) -> Any:
+    """値を列の種類に合わせて変換（None と空文字列は欠損）"""
+    if value is None or value == '':
+        return None
+    try:
+        if kind in (KIND_STRING, KIND_DICTIONARY):
+            if isinstance(value, (list, dict)):
+                return json.dumps(value, ensure_ascii=False)
+            return str(value)
+        if kind == KIND_INT:
+            return int(value)
+        if kind == KIND_FLOAT:
+            return float(value)
+        if kind == KIND_BOOL:
+            return bool(value)
+        if kind == KIND_TIMESTAMP:
+            return _parse_timestamp(value)
+        if kind == KIND_LIST:
+            if isinstance(value, str):
+                return value.split(',')
+            return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+        if kind == KIND_MAP:
+            return [(str(key), str(item)) for key, item in dict(value).items()]
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+class _DictionaryEncoder:
+    """バッチ間で共有する辞書（新しい値は末尾に追記するのみ）"""
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def encode(self, values: List[Optional[str]]):
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            position = self.index.get(value)
+            if position is None:
+                position = self.index[value] = len(self.values)
+                self.values.append(value)
+            indices.append(position)
+        return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()),
+                                              pa.array(self.values, type=pa.string()))
+
+
+class ColumnarWriter:
+    """行を受け取り、ROW_GROUP_ROWS 行ごとにレコードバッチとして書き出す"""
+
+    def __init__(self, sink, fmt: str, columns: List[Tuple[str, str]],
+                 row_group_rows: Optional[int] = None):
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(f"Unsupported columnar format: {fmt}")
+        self.names = [name for name, _ in columns]
+        self.kinds = [kind for _, kind in columns]
+        self.schema = pa.schema([(name, _arrow_type(kind)) for name, kind in columns])
+        self.row_group_rows = row_group_rows or ROW_GROUP_ROWS
+        self.encoders = {i: _DictionaryEncoder() for i, kind in enumerate(self.kinds) if kind == KIND_DICTIONARY}
+        self._columns: List[List[Any]] = [[] for _ in columns]
+        self.rows = 0
+        if fmt == 'parquet':
+            self._writer = pq.ParquetWriter(sink, self.schema, compression=COMPRESSION)
+        else:
+            options = pa_ipc.IpcWriteOptions(compression=COMPRESSION, emit_dictionary_deltas=True)
+            self._writer = pa_ipc.new_file(sink, self.schema, options=options)
+
+    def add_row(self, row: List[Any]):
+        for i, value in enumerate(row):
+            self._columns[i].append(_convert(self.kinds[i], value))
+        self.rows += 1
+        if len(self._columns[0]) >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._columns or not self._columns[0]:
+            return
+        arrays = []
+        for i, values in enumerate(self._columns):
+            if i in self.encoders:
+                arrays.append(self.encoders[i].encode(values))
+            else:
+                arrays.append(pa.array(values, type=self.schema.field(i).type))
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self._columns = [[] for _ in self._columns]
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+class ColumnarExporter:
+    """実験データを Parquet / Arrow IPC(Feather) で出力する"""
+
+    def __init__(self, data_exporter: DataExporter):
+        self.data_exporter = data_exporter
+
+    def export(self, dataset: str, fmt: str, sink, experiment_id: str,
+               session_manager: SessionManager, message_store: MessageStore,
+               experiment_manager: Optional[ExperimentManager] = None,
+               delta: Optional[ExportDelta] = None) -> int:
+        """データセットを sink（ファイルパスまたはファイルオブジェクト）に書き出し、行数を返す
+
+        delta を指定すると、その範囲に保存されたセッション・メッセージのみを出力する（CSVの差分エクスポートと同じ）。
+        """
+        if not is_available():
+            raise RuntimeError("pyarrow is not installed (pip install pyarrow)")
+        if dataset == 'wide':
+            columns, rows = self._wide(experiment_id, session_manager, message_store, experiment_manager, delta)
+        elif dataset == 'messages':
+            columns, rows = MESSAGE_COLUMNS, self._message_rows(experiment_id, session_manager, message_store, delta)
+        elif dataset == 'sessions':
+            columns, rows = SESSION_COLUMNS, self._session_rows(experiment_id, session_manager, delta)
+        else:
+            raise ValueError(f"Unknown dataset: {dataset}")
+
+        writer = ColumnarWriter(sink, fmt, columns)
+        try:
+            for row in rows:
+                writer.add_row(row)
+        finally:
+            writer.close()
+        return writer.rows
+
+    def _message_rows(self, experiment_id: str, session_manager: SessionManager,
+                      message_store: MessageStore, delta: Optional[ExportDelta] = None) -> Iterator[list]:
+        # メッセージは1セッションずつ読み込む
+        exporter = self.data_exporter
+        for session in exporter._message_delta_sessions(experiment_id, session_manager, message_store, delta):
+            for msg in exporter._session_messages(session.session_id, message_store, delta):
+                yield [
+                    experiment_id,
+                    session.session_id,
+                    session.experiment_group,
+                    msg.message_id,
+                    msg.client_id,
+                    msg.internal_id,
+                    msg.message_type,
+                    msg.content,
+                    msg.timestamp,
+                    msg.metadata.char_count,
+                    msg.metadata.word_count,
+                ]
+
+    def _session_rows(self, experiment_id: str, session_manager: SessionManager,
+                      delta: Optional[ExportDelta] = None) -> Iterator[list]:
+        for session in self.data_exporter._experiment_sessions(experiment_id, session_manager, delta):
+            duration = None
+            if session.ended_at:
+                started_at = _parse_timestamp(session.created_at)
+                ended_at = _parse_timestamp(session.ended_at)
+                if started_at and ended_at:
+                    duration = (ended_at - started_at).total_seconds()
+            yield [
+                experiment_id,
+                session.session_id,
+                session.participant_code,
+                session.experiment_group,
+                session.condition_id,
+                session.assigned_conditions or None,
+                session.created_at,
+                session.ended_at,
+                session.status,
+                len(session.participants),
+                list(session.participants),
+                session.total_messages,
+                duration,
+            ]
+
+    def _wide(self, experiment_id: str, session_manager: SessionManager, message_store: MessageStore,
+              experiment_manager: Optional[ExperimentManager],
+              delta: Optional[ExportDelta] = None) -> Tuple[List[Tuple[str, str]], Iterator[list]]:
+        """ワイド形式の列（名前, 種類）と行（列構成はワイド形式CSVと同じ）"""
+        exporter = self.data_exporter
+        flow_index = exporter._get_flow_index(experiment_id, experiment_manager)
+        extracts = exporter._collect_session_extracts(experiment_id, session_manager, message_store, flow_index, delta)
+        layout = exporter._wide_layout(experiment_id, session_manager, extracts, flow_index)
+        # 行は書き出しながら1行ずつ作る（列の種類は値ではなくフローの質問定義から決める）
+        rows = (exporter._wide_row(experiment_id, extract, flow_index, layout, typed=True) for extract in extracts)
+
+        question_kinds = self._question_kinds(flow_index)
+        condition_value_kind = self._condition_value_kind(flow_index)
+        columns = []
+        for name in layout.headers():
+            if name in WIDE_BASE_KINDS:
+                kind = WIDE_BASE_KINDS[name]
+            elif name in layout.branch_fields:
+                # 条件ID・条件ラベルは辞書エンコード、条件の値はフローに設定された値の型
+                kind = condition_value_kind if name.endswith('_condition_value') else KIND_DICTIONARY
+            elif name in layout.chat_fields:
+                kind = KIND_INT if name.endswith('_chat_duration_seconds') else KIND_DICTIONARY
+            elif name in layout.question_order_fields:
+                kind = KIND_LIST
+            elif name in layout.ai_eval_ids:
+                kind = KIND_INT  # AI評価のスコア（1〜7の整数）
+            else:
+                # フローにない質問（旧形式の回答・削除された質問）は文字列
+                kind = question_kinds.get(name, KIND_STRING)
+            columns.append((name, kind))
+        return columns, rows
+
+    def _question_kinds(self, flow_index: FlowIndex) -> Dict[str, str]:
+        """質問ID → 列の種類（質問タイプ・選択肢・入力形式から決める）
+
+        ブランチ内とアンケートランダマイザー内の質問も含む。同じIDの質問が複数あり種類が異なる場合は文字列。
+        """
+        kinds: Dict[str, str] = {}
+        for step_dict in flow_index.all_steps:
+            questions = list(step_dict.get('survey_questions') or [])
+            # アンケートランダマイザーの各アイテム（'steps'、旧形式は 'surveys'）
+            for item in step_dict.get('steps') or step_dict.get('surveys') or []:
+                if isinstance(item, dict):
+                    questions.extend(item.get('survey_questions') or [])
+            for question in questions:
+                if not isinstance(question, dict) or not question.get('question_id'):
+                    continue
+                kind = _question_kind(question)
+                question_id = question['question_id']
+                if kinds.setdefault(question_id, kind) != kind:
+                    kinds[question_id] = KIND_STRING
+        return kinds
+
+    def _condition_value_kind(self, flow_index: FlowIndex) -> str:
+        """ブランチの条件の値（数値コード）の列の種類（すべて整数 → int、数値 → float、それ以外は文字列）"""
+        values = [value for _, value in flow_index.branch_info.values() if value is not None and value != '']
+        if values and all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            return KIND_INT
+        if values and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            return KIND_FLOAT
+        return KIND_STRING
+
+
+def _question_kind(question: Dict[str, Any]) -> str:
+    """1つの質問の回答の列の種類（experiment_flow.js が保存する回答の型に合わせる）"""
+    question_type = question.get('question_type')
+    if question_type in LIKERT_TYPES:
+        return KIND_INT  # 選択した尺度の値（整数）
+    if question_type in MULTI_CHOICE_TYPES:
+        return KIND_LIST  # 選択した値の配列
+    if question_type in SINGLE_CHOICE_TYPES and (question.get('options') or question.get('choices')):
+        return KIND_DICTIONARY  # 選択肢の文字列
+    if question_type == 'text' and question.get('input_type') == 'number':
+        return KIND_FLOAT
+    return KIND_STRING
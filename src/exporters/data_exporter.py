@@ -1,19 +1,62 @@
 import csv
 import json
 import io
-import zipfile
-from typing import List, Dict, Set, Optional, Any, Tuple
+from typing import List, Dict, Set, Optional, Any, Tuple, Iterable, Iterator
 from datetime import datetime
 from ..models.message import Message
 from ..models.session import Session
 from ..managers.session_manager import SessionManager
 from ..managers.message_store import MessageStore
 from ..managers.experiment_manager import ExperimentManager
+from ..managers.change_sequence import current_change_seq
+from ..managers.survey_index import SurveySession
 from collections import OrderedDict
+from .zip_stream import iter_zip
 
 # UTF-8 BOM（Excelで日本語を正しく認識させるため）
 UTF8_BOM = '\ufeff'
 
+# ストリーミング出力で1チャンクにまとめる行数
+STREAM_CHUNK_ROWS = 500
+
+# 実験全体のメッセージCSVのヘッダー（実験情報を追加）
+EXPERIMENT_MESSAGES_CSV_HEADER = (
+    'experiment_id',
+    'session_id',
+    'experiment_group',
+    'message_id',
+    'client_id',
+    'internal_id',
+    'message_type',
+    'content',
+    'timestamp',
+    'char_count',
+    'word_count',
+)
+
+# ワイド形式（コード化データを含む）の基本列
+WIDE_BASE_HEADERS = (
+    'experiment_id',
+    'session_id',
+    'participant_code',
+    'client_id',
+    'condition_id',
+    'experiment_group',
+    'status',                # セッションステータス（completed, active など）
+    'flow_completed',        # フローが最後まで完了したか（TRUE/FALSE）
+    'completed_steps_count', # 完了したステップ数
+    'started_at',
+    'ended_at',
+    'duration_seconds',
+    'total_messages',
+    'user_message_count',
+    'bot_message_count',
+    'total_user_chars',      # ユーザーメッセージの総文字数
+    'total_user_words',      # ユーザーメッセージの総単語数
+    'avg_user_chars',
+    'avg_user_words',
+)
+
 # 欠損値の表現オプション
 MISSING_VALUE_OPTIONS = {
     'blank': '',      # 空文字列
@@ -21,12 +64,230 @@ MISSING_VALUE_OPTIONS = {
     'dot': '.',       # ピリオド（SAS/Stata形式）
 }
 
+# 参加者コードの状態のCSV列（フルバンドル用、ログイン用のパスワードは含めない）
+PARTICIPANT_CODES_CSV_HEADER = (
+    'participant_code',
+    'status',
+    'client_id',
+    'session_id',
+    'created_at',
+    'completed_at',
+    'admin_modified_at',
+)
+
+
+def _clean_answer(answer: Any) -> Any:
+    """CSV用に回答を整形（配列はJSON文字列、文字列は改行をスペースに置換）"""
+    if isinstance(answer, list):
+        return json.dumps(answer, ensure_ascii=False)
+    if isinstance(answer, str):
+        # 改行をスペースに置換（CSVの行分割を防ぐ）
+        return answer.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
+    return answer
+
+
+class FlowIndex:
+    """実験フロー（辞書形式）から1回だけ作る検索用インデックス
+    
+    ブランチ内も含めたステップの一覧・チャットステップ・ブランチの条件ラベル/値を保持し、
+    セッションごとにフローを再帰的に探索しなくて済むようにする。
+    """
+    
+    def __init__(self, experiment_flow_raw: Optional[List[Dict]]):
+        self.flow = experiment_flow_raw or []
+        self.all_steps: List[Dict] = []  # ブランチ内を含む全ステップ（深さ優先の出現順）
+        self.chat_steps: List[Dict] = []  # チャットステップ（深さ優先の出現順）
+        self.chat_by_id: Dict[str, Dict] = {}  # step_id → 最初に出現したチャットステップ
+        self.branch_step_ids: Set[str] = set()  # トップレベルのブランチステップID
+        self.branch_info: Dict[Tuple[str, str], Tuple[Any, Any]] = {}  # (ブランチステップID, branch_id) → (ラベル, 値)
+        
+        self._collect(self.flow)
+        for step_dict in self.chat_steps:
+            self.chat_by_id.setdefault(step_dict.get('step_id'), step_dict)
+        
+        # ブランチのラベルと値はトップレベルのブランチステップから取得（最初に一致したものを使用）
+        for step_dict in self.flow:
+            if isinstance(step_dict, dict) and step_dict.get('step_type') == 'branch':
+                branch_step_id = step_dict.get('step_id', '')
+                self.branch_step_ids.add(branch_step_id)
+                for branch in step_dict.get('branches', []):
+                    self.branch_info.setdefault(
+                        (branch_step_id, branch.get('branch_id')),
+                        (branch.get('condition_label', ''), branch.get('condition_value', ''))
+                    )
+    
+    def _collect(self, steps: List[Dict]):
+        for step_dict in steps:
+            if not isinstance(step_dict, dict):
+                continue
+            self.all_steps.append(step_dict)
+            if step_dict.get('step_type') == 'chat':
+                self.chat_steps.append(step_dict)
+            elif step_dict.get('step_type') == 'branch':
+                # ブランチ内のステップも探索
+                for branch in step_dict.get('branches', []):
+                    branch_steps = branch.get('steps', [])
+                    if branch_steps:
+                        self._collect(branch_steps)
+    
+    def chat_field_names(self) -> List[str]:
+        """チャットステップ情報の列名（重複を除いて出現順）"""
+        fields = OrderedDict()
+        for step_dict in self.chat_steps:
+            step_id = step_dict.get('step_id', '')
+            fields[f"{step_id}_ai_model"] = True
+            fields[f"{step_id}_bot_name"] = True
+            fields[f"{step_id}_chat_duration_seconds"] = True
+        return list(fields.keys())
+
+
+class SessionColumns:
+    """1セッションの step_responses / survey_responses を1回走査して得た列の値と列名"""
+    __slots__ = ('question_ids', 'legacy_question_ids', 'survey_steps', 'ai_eval_ids', 'legacy_branch_fields',
+                 'answers', 'legacy_answers', 'question_orders', 'ai_evals', 'legacy_branch_values')
+    
+    def __init__(self, session: Session):
+        self.question_ids: List[str] = []  # step_responses 内の質問ID（出現順）
+        self.legacy_question_ids: List[str] = []  # 旧形式 survey_responses の質問ID
+        self.survey_steps: List[str] = []  # アンケート回答を含むステップID
+        self.ai_eval_ids: List[str] = []  # ai_eval_{評価項目}
+        self.legacy_branch_fields: List[str] = []  # 旧形式のブランチ選択列
+        self.answers: Dict[str, Any] = {}  # 質問ID → 回答（未整形、後の回答で上書き）
+        self.legacy_answers: Dict[str, Any] = {}
+        self.question_orders: Dict[str, str] = {}  # {step_id}_question_order → カンマ区切り
+        self.ai_evals: Dict[str, Any] = {}  # ai_eval_{評価項目} → スコア（未整形）
+        self.legacy_branch_values: Dict[str, Any] = {}  # 旧形式のブランチ選択（列名 → 値、最初の値を優先）
+        
+        for step_id, step_data in (session.step_responses or {}).items():
+            if not isinstance(step_data, dict):
+                continue
+            for client_data in step_data.values():
+                if isinstance(client_data, dict):
+                    self._add_step_response(step_id, client_data)
+        
+        # 旧形式: survey_responses（後方互換性のため）
+        for responses in (session.survey_responses or {}).values():
+            for response in responses:
+                if hasattr(response, 'question_id'):
+                    self.legacy_question_ids.append(response.question_id)
+                    if hasattr(response, 'answer'):
+                        self.legacy_answers[response.question_id] = response.answer
+    
+    def _add_step_response(self, step_id: str, client_data: Dict):
+        # アンケート回答・ランダマイザーの回答
+        for key in ('survey_responses', 'randomizer_responses'):
+            if key in client_data:
+                self.survey_steps.append(step_id)  # 質問順序情報が必要
+                for response in client_data[key]:
+                    if isinstance(response, dict) and 'question_id' in response:
+                        self.question_ids.append(response['question_id'])
+                        self.answers[response['question_id']] = response.get('answer')
+        # AI評価結果
+        eval_results = client_data.get('evaluation_results')
+        if isinstance(eval_results, dict):
+            for eval_q_id, score in eval_results.items():
+                self.ai_eval_ids.append(f"ai_eval_{eval_q_id}")
+                self.ai_evals[f"ai_eval_{eval_q_id}"] = score
+        # ブランチ選択結果（後方互換性）
+        for key, suffix in (('branch_selected', 'branch_selected'), ('condition_label', 'condition_label'),
+                            ('condition_value', 'condition_value')):
+            if key in client_data:
+                field_name = f"{step_id}_{suffix}"
+                self.legacy_branch_fields.append(field_name)
+                self.legacy_branch_values.setdefault(field_name, client_data[key])
+        # 質問順序
+        order_list = client_data.get('question_order')
+        if isinstance(order_list, list):
+            self.question_orders[f"{step_id}_question_order"] = ','.join(order_list)
+
+
+class WideLayout:
+    """ワイド形式の列構成（全セッションの回答から列名を出現順に登録）"""
+    
+    def __init__(self, extracts: List['SessionExtract'], flow_index: FlowIndex):
+        branch_fields = OrderedDict()  # ブランチ選択フィールド
+        question_ids = OrderedDict()  # 出現順を保持
+        ai_eval_ids = OrderedDict()  # AI評価質問ID
+        survey_steps = set()  # 質問順序情報が必要なステップID
+        
+        for extract in extracts:
+            session, columns = extract.session, extract.columns
+            # ブランチ選択結果（assigned_conditions）: ID、ラベル、値（数値コード）の列
+            for branch_step_id in (session.assigned_conditions or {}):
+                branch_fields[f"{branch_step_id}_condition"] = True
+                branch_fields[f"{branch_step_id}_condition_label"] = True
+                branch_fields[f"{branch_step_id}_condition_value"] = True
+            for field_name in columns.legacy_branch_fields:
+                branch_fields[field_name] = True
+            for q_id in columns.question_ids + columns.legacy_question_ids:
+                question_ids[q_id] = True
+            for eval_id in columns.ai_eval_ids:
+                ai_eval_ids[eval_id] = True
+            survey_steps.update(columns.survey_steps)
+        
+        self.branch_fields: List[str] = list(branch_fields.keys())
+        self.chat_fields: List[str] = flow_index.chat_field_names()
+        self.question_order_fields: List[str] = [f"{step_id}_question_order" for step_id in sorted(survey_steps)]
+        self.question_ids: List[str] = list(question_ids.keys())
+        self.ai_eval_ids: List[str] = list(ai_eval_ids.keys())
+    
+    def headers(self) -> List[str]:
+        # 基本情報 → ブランチ選択（IDとラベル）→ チャットステップ情報 → 質問順序 → サーベイ質問 → AI評価
+        return (list(WIDE_BASE_HEADERS) + self.branch_fields + self.chat_fields
+                + self.question_order_fields + self.question_ids + self.ai_eval_ids)
+
+
+class SessionExtract:
+    """ワイド形式・コード化データの1セッション分の材料
+    
+    並列エクスポート（ParallelExportEngine）ではワーカープロセスで作成して親プロセスに返す。
+    """
+    __slots__ = ('session', 'columns', 'message_stats', 'chat_info')
+    
+    def __init__(self, session: Session, columns: SessionColumns,
+                 message_stats: Tuple[int, int, int, int], chat_info: Dict[str, Any]):
+        self.session = session
+        self.columns = columns
+        self.message_stats = message_stats  # (ユーザー発言数, ボット発言数, ユーザー総文字数, ユーザー総単語数)
+        self.chat_info = chat_info
+
+
+class ExportDelta:
+    """差分エクスポートの範囲（変更シーケンスによるウォーターマーク）
+    
+    - セッション: since より後に保存されたもの（最新の状態、session_id で上書き）
+    - メッセージ: since より後、watermark 以下に保存されたもの（次回 since=watermark で漏れ・重複なく追記）
+    
+    - 削除: since より後、watermark 以下に削除されたセッションの削除記録（deleted_sessions、呼び出し側で設定）
+    
+    since が None の場合は全件（メッセージは watermark 以下のみ）。
+    """
+    __slots__ = ('since', 'watermark', 'deleted_sessions')
+    
+    def __init__(self, since: Optional[int] = None, watermark: Optional[int] = None):
+        self.since = since
+        self.watermark = watermark if watermark is not None else current_change_seq()
+        self.deleted_sessions: List[Dict[str, Any]] = []
+    
+    @property
+    def is_full(self) -> bool:
+        return self.since is None
+    
+    def includes_session(self, session: Session) -> bool:
+        return self.since is None or session.change_seq > self.since
+
 
 class DataExporter:
     """データエクスポートクラス - メモリ上で直接データを生成"""
     
-    def __init__(self):
-        pass  # ファイル保存しないのでディレクトリ不要
+    def __init__(self, parallel_engine=None, wide_tables=None, survey_index=None):
+        # ファイル保存しないのでディレクトリ不要
+        # 大規模な実験のエクスポートを並列に作成するエンジン（ParallelExportEngine、未設定なら逐次処理）
+        self.parallel_engine = parallel_engine
+        # 実験ごとにマテリアライズしたワイド形式テーブル（WideTableStore、未設定なら毎回全件から作成）
+        self.wide_tables = wide_tables
+        # 実験ごとのアンケート回答インデックス（SurveyIndexStore、未設定なら毎回全セッションから作成）
+        self.survey_index = survey_index
     
     def _add_bom_if_excel(self, content: str, excel_format: bool = False) -> str:
         """Excel形式の場合はBOMを追加"""
@@ -38,15 +299,56 @@ class DataExporter:
         """欠損値の表現を取得"""
         return MISSING_VALUE_OPTIONS.get(missing_value_style, '')
     
+    def _iter_csv(self, rows: Iterable[list], excel_format: bool = False) -> Iterator[str]:
+        """行をCSVテキストのチャンクとして順に返す（Excel形式のBOMは先頭で1回だけ送る）"""
+        if excel_format:
+            yield UTF8_BOM
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        pending = 0
+        for row in rows:
+            writer.writerow(row)
+            pending += 1
+            if pending >= STREAM_CHUNK_ROWS:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if pending:
+            yield buffer.getvalue()
+    
+    def _iter_json_document(self, fields: Dict[str, Any], list_key: str,
+                            items: Iterable[Dict]) -> Iterator[str]:
+        """fields の後に list_key の配列を1要素ずつ出力するJSONを順に返す
+        
+        json.dumps(..., ensure_ascii=False, indent=2) と同じ整形で、配列全体をメモリに持たない。
+        """
+        yield '{\n'
+        for key, value in fields.items():
+            dumped = json.dumps(value, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+            yield f'  {json.dumps(key, ensure_ascii=False)}: {dumped},\n'
+        yield f'  {json.dumps(list_key, ensure_ascii=False)}: ['
+        first = True
+        for item in items:
+            dumped = json.dumps(item, ensure_ascii=False, indent=2).replace('\n', '\n    ')
+            yield ('\n    ' if first else ',\n    ') + dumped
+            first = False
+        yield ']\n}' if first else '\n  ]\n}'
+    
     def export_messages_to_csv(self, session_id: str, message_store: MessageStore) -> str:
         """メッセージをCSV形式でエクスポート（文字列として返す）"""
+        return ''.join(self.iter_messages_csv(session_id, message_store))
+    
+    def iter_messages_csv(self, session_id: str, message_store: MessageStore) -> Iterator[str]:
+        """メッセージをCSV形式で順に出力（ストリーミング用）"""
+        return self._iter_csv(self._messages_csv_rows(session_id, message_store))
+    
+    def _messages_csv_rows(self, session_id: str, message_store: MessageStore) -> Iterator[list]:
+        """メッセージCSVの行（ヘッダーを含む）"""
         messages = message_store.get_messages_by_session(session_id)
         
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
         # ヘッダー
-        writer.writerow([
+        yield [
             'message_id',
             'session_id',
             'client_id',
@@ -57,26 +359,25 @@ class DataExporter:
             'char_count',
             'word_count',
             'client_color'
-        ])
+        ]
         
         # データ行
         for msg in messages:
-            writer.writerow(msg.to_csv_row())
-        
-        return output.getvalue()
+            yield msg.to_csv_row()
     
     def export_messages_to_json(self, session_id: str, message_store: MessageStore) -> str:
         """メッセージをJSON形式でエクスポート（文字列として返す）"""
+        return ''.join(self.iter_messages_json(session_id, message_store))
+    
+    def iter_messages_json(self, session_id: str, message_store: MessageStore) -> Iterator[str]:
+        """メッセージをJSON形式で順に出力（ストリーミング用）"""
         messages = message_store.get_messages_by_session(session_id)
         
-        data = {
+        return self._iter_json_document({
             "session_id": session_id,
             "exported_at": datetime.now().isoformat(),
             "total_messages": len(messages),
-            "messages": [msg.to_dict() for msg in messages]
-        }
-        
-        return json.dumps(data, ensure_ascii=False, indent=2)
+        }, "messages", (msg.to_dict() for msg in messages))
     
     def export_session_summary(self, session_id: str, session_manager: SessionManager, 
                               message_store: MessageStore) -> str:
@@ -129,25 +430,31 @@ class DataExporter:
     
     def export_all_sessions_summary(self, session_manager: SessionManager) -> str:
         """全セッションのサマリーをエクスポート（文字列として返す）"""
+        return ''.join(self.iter_all_sessions_json(session_manager))
+    
+    def iter_all_sessions_json(self, session_manager: SessionManager) -> Iterator[str]:
+        """全セッションのサマリーをJSON形式で順に出力（ストリーミング用）"""
         sessions = session_manager.get_all_sessions()
         
-        data = {
+        return self._iter_json_document({
             "total_sessions": len(sessions),
             "exported_at": datetime.now().isoformat(),
-            "sessions": [session.to_dict() for session in sessions]
-        }
-        
-        return json.dumps(data, ensure_ascii=False, indent=2)
+        }, "sessions", (session.to_dict() for session in sessions))
     
     def export_all_sessions_to_csv(self, session_manager: SessionManager) -> str:
         """全セッションのサマリーをCSV形式でエクスポート（文字列として返す）"""
+        return ''.join(self.iter_all_sessions_csv(session_manager))
+    
+    def iter_all_sessions_csv(self, session_manager: SessionManager) -> Iterator[str]:
+        """全セッションのサマリーをCSV形式で順に出力（ストリーミング用）"""
+        return self._iter_csv(self._all_sessions_csv_rows(session_manager))
+    
+    def _all_sessions_csv_rows(self, session_manager: SessionManager) -> Iterator[list]:
+        """全セッションのサマリーCSVの行（ヘッダーを含む）"""
         sessions = session_manager.get_all_sessions()
         
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
         # ヘッダー
-        writer.writerow([
+        yield [
             'session_id',
             'participant_code',
             'created_at',
@@ -159,11 +466,11 @@ class DataExporter:
             'experiment_id',
             'experiment_group',
             'condition_id'
-        ])
+        ]
         
         # データ行
         for session in sessions:
-            writer.writerow([
+            yield [
                 session.session_id,
                 session.participant_code or '',
                 session.created_at,
@@ -175,9 +482,7 @@ class DataExporter:
                 session.experiment_id or '',
                 session.experiment_group or '',
                 session.condition_id or ''
-            ])
-        
-        return output.getvalue()
+            ]
     
     def export_complete_dataset(self, session_id: str, session_manager: SessionManager,
                                message_store: MessageStore) -> Dict[str, str]:
@@ -233,19 +538,22 @@ class DataExporter:
     
     def export_survey_responses_to_csv(self, session_id: str, session_manager: SessionManager) -> str:
         """アンケート回答をCSV形式でエクスポート（文字列として返す）"""
+        return ''.join(self.iter_survey_responses_csv(session_id, session_manager))
+    
+    def iter_survey_responses_csv(self, session_id: str, session_manager: SessionManager) -> Iterator[str]:
+        """アンケート回答をCSV形式で順に出力（ストリーミング用）"""
+        return self._iter_csv(self._survey_responses_csv_rows(session_id, session_manager))
+    
+    def _survey_responses_csv_rows(self, session_id: str, session_manager: SessionManager) -> Iterator[list]:
+        """アンケート回答CSVの行（ヘッダーを含む）"""
         session = session_manager.load_session(session_id)
         if not session or not session.survey_responses:
             # アンケート回答がない場合は空のCSVを返す
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(['session_id', 'participant_code', 'client_id', 'question_id', 'answer', 'answered_at'])
-            return output.getvalue()
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
+            yield ['session_id', 'participant_code', 'client_id', 'question_id', 'answer', 'answered_at']
+            return
         
         # ヘッダー
-        writer.writerow([
+        yield [
             'session_id',
             'participant_code',
             'client_id',
@@ -253,7 +561,7 @@ class DataExporter:
             'question_id',
             'answer',
             'answered_at'
-        ])
+        ]
         
         # データ行
         for client_id, responses in session.survey_responses.items():
@@ -266,7 +574,7 @@ class DataExporter:
                     # 改行をスペースに置換（CSVの行分割を防ぐ）
                     answer = answer.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
                 
-                writer.writerow([
+                yield [
                     session_id,
                     session.participant_code or '',
                     client_id,
@@ -274,9 +582,7 @@ class DataExporter:
                     response.question_id,
                     answer,
                     response.answered_at
-                ])
-        
-        return output.getvalue()
+                ]
     
     def export_survey_responses_to_json(self, session_id: str, session_manager: SessionManager) -> str:
         """アンケート回答をJSON形式でエクスポート（文字列として返す）"""
@@ -300,15 +606,23 @@ class DataExporter:
     def export_experiment_survey_responses_to_csv(self, experiment_id: str, 
                                                    session_manager: SessionManager) -> str:
         """実験全体のアンケート回答をCSV形式でエクスポート（文字列として返す）"""
+        return ''.join(self.iter_experiment_survey_responses_csv(experiment_id, session_manager))
+    
+    def iter_experiment_survey_responses_csv(self, experiment_id: str,
+                                             session_manager: SessionManager,
+                                             delta: Optional[ExportDelta] = None) -> Iterator[str]:
+        """実験全体のアンケート回答をCSV形式で順に出力（ストリーミング用、delta指定時は変更されたセッションのみ）"""
+        return self._iter_csv(self._experiment_survey_csv_rows(experiment_id, session_manager, delta))
+    
+    def _experiment_survey_csv_rows(self, experiment_id: str,
+                                    session_manager: SessionManager,
+                                    delta: Optional[ExportDelta] = None) -> Iterator[list]:
+        """実験全体のアンケート回答CSVの行（ヘッダーを含む）"""
         # 実験に属する全セッションを取得
-        all_sessions = session_manager.get_all_sessions()
-        exp_sessions = [s for s in all_sessions if s.experiment_id == experiment_id]
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
+        exp_sessions = self._survey_sessions(experiment_id, session_manager, delta)
         
         # ヘッダー
-        writer.writerow([
+        yield [
             'experiment_id',
             'session_id',
             'participant_code',
@@ -318,11 +632,11 @@ class DataExporter:
             'question_id',
             'answer',
             'answered_at'
-        ])
+        ]
         
         # 各セッションのアンケート回答を出力
         for session in exp_sessions:
-            for client_id, responses in session.survey_responses.items():
+            for client_id, responses in session.legacy_responses.items():
                 for response in responses:
                     # 回答が配列の場合はJSON文字列に変換、文字列の場合は改行を置換
                     answer = response.answer
@@ -332,7 +646,7 @@ class DataExporter:
                         # 改行をスペースに置換（CSVの行分割を防ぐ）
                         answer = answer.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
                     
-                    writer.writerow([
+                    yield [
                         experiment_id,
                         session.session_id,
                         session.participant_code or '',
@@ -342,91 +656,170 @@ class DataExporter:
                         response.question_id,
                         answer,
                         response.answered_at
-                    ])
-        
-        return output.getvalue()
+                    ]
     
     def export_experiment_survey_responses_to_json(self, experiment_id: str,
                                                     session_manager: SessionManager) -> str:
         """実験全体のアンケート回答をJSON形式でエクスポート（文字列として返す）"""
+        return ''.join(self.iter_experiment_survey_responses_json(experiment_id, session_manager))
+    
+    def iter_experiment_survey_responses_json(self, experiment_id: str,
+                                              session_manager: SessionManager,
+                                              delta: Optional[ExportDelta] = None) -> Iterator[str]:
+        """実験全体のアンケート回答をJSON形式で順に出力（ストリーミング用、delta指定時は変更されたセッションのみ）"""
         # 実験に属する全セッションを取得
-        all_sessions = session_manager.get_all_sessions()
-        exp_sessions = [s for s in all_sessions if s.experiment_id == experiment_id]
+        exp_sessions = self._survey_sessions(experiment_id, session_manager, delta)
+        
+        # 各セッションのアンケート回答を1件ずつ整形
+        def session_items():
+            for session in exp_sessions:
+                session_data = {
+                    "session_id": session.session_id,
+                    "experiment_group": session.experiment_group,
+                    "created_at": session.created_at,
+                    "survey_responses": {}
+                }
+                
+                for client_id, responses in session.legacy_responses.items():
+                    session_data["survey_responses"][client_id] = [resp.to_dict() for resp in responses]
+                
+                yield session_data
         
-        data = {
+        fields = {
             "experiment_id": experiment_id,
             "exported_at": datetime.now().isoformat(),
             "total_sessions": len(exp_sessions),
-            "sessions": []
         }
-        
-        # 各セッションのアンケート回答を収集
-        for session in exp_sessions:
-            session_data = {
-                "session_id": session.session_id,
-                "experiment_group": session.experiment_group,
-                "created_at": session.created_at,
-                "survey_responses": {}
-            }
-            
-            for client_id, responses in session.survey_responses.items():
-                session_data["survey_responses"][client_id] = [resp.to_dict() for resp in responses]
-            
-            data["sessions"].append(session_data)
-        
-        return json.dumps(data, ensure_ascii=False, indent=2)
+        if delta is not None:
+            fields["since"] = delta.since
+            fields["watermark"] = delta.watermark
+        return self._iter_json_document(fields, "sessions", session_items())
     
     def export_experiment_all_data_to_csv(self, experiment_id: str, 
                                           session_manager: SessionManager,
                                           message_store: MessageStore) -> str:
         """実験全体のメッセージデータをCSV形式でエクスポート（1つの大きなCSVファイル）"""
-        # 実験に属する全セッションを取得
-        all_sessions = session_manager.get_all_sessions()
-        exp_sessions = [s for s in all_sessions if s.experiment_id == experiment_id]
+        return ''.join(self.iter_experiment_all_data_csv(experiment_id, session_manager, message_store))
+    
+    def iter_experiment_all_data_csv(self, experiment_id: str,
+                                     session_manager: SessionManager,
+                                     message_store: MessageStore,
+                                     delta: Optional[ExportDelta] = None) -> Iterator[str]:
+        """実験全体のメッセージデータをCSV形式で順に出力（メッセージは1セッションずつ読み込む）
         
-        output = io.StringIO()
-        writer = csv.writer(output)
+        delta指定時は since より後・watermark 以下に保存されたメッセージのみ。
+        """
+        engine = self.parallel_engine
+        if (engine is not None and (delta is None or delta.is_full)
+                and engine.should_parallelize(session_manager.data_dir)):
+            return engine.iter_messages_csv(experiment_id, session_manager.data_dir, message_store.data_dir,
+                                            until=delta.watermark if delta is not None else None)
+        return self._iter_csv(self._experiment_messages_csv_rows(experiment_id, session_manager, message_store, delta))
+    
+    def _experiment_messages_csv_rows(self, experiment_id: str,
+                                      session_manager: SessionManager,
+                                      message_store: MessageStore,
+                                      delta: Optional[ExportDelta] = None) -> Iterator[list]:
+        """実験全体のメッセージCSVの行（ヘッダーを含む）"""
+        # 実験に属する全セッションを取得
+        exp_sessions = self._message_delta_sessions(experiment_id, session_manager, message_store, delta)
         
         # ヘッダー（実験情報を追加）
-        writer.writerow([
-            'experiment_id',
-            'session_id',
-            'experiment_group',
-            'message_id',
-            'client_id',
-            'internal_id',
-            'message_type',
-            'content',
-            'timestamp',
-            'char_count',
-            'word_count'
-        ])
-        
-        # 各セッションのメッセージを出力
-        for session in exp_sessions:
-            messages = message_store.get_messages_by_session(session.session_id)
+        yield list(EXPERIMENT_MESSAGES_CSV_HEADER)
+        yield from self._session_messages_csv_rows(
+            experiment_id, [(s.session_id, s.experiment_group) for s in exp_sessions], message_store,
+            delta=delta
+        )
+    
+    def _session_messages_csv_rows(self, experiment_id: str,
+                                   session_refs: List[Tuple[str, Optional[str]]],
+                                   message_store: MessageStore,
+                                   delta: Optional[ExportDelta] = None,
+                                   until: Optional[int] = None) -> Iterator[list]:
+        """(セッションID, 実験グループ) の順にメッセージCSVの行を出力（ヘッダーなし）"""
+        for session_id, experiment_group in session_refs:
+            messages = self._session_messages(session_id, message_store, delta, until)
             for msg in messages:
                 row = [
                     experiment_id,
-                    session.session_id,
-                    session.experiment_group or '',
+                    session_id,
+                    experiment_group or '',
                 ]
                 row.extend(msg.to_csv_row())
-                writer.writerow(row)
+                yield row
+    
+    def _experiment_sessions(self, experiment_id: str, session_manager: SessionManager,
+                             delta: Optional[ExportDelta] = None) -> List[Session]:
+        """実験に属するセッション（差分エクスポートでは since より後に保存されたもののみ）"""
+        if delta is not None and not delta.is_full:
+            sessions = session_manager.get_sessions_changed_since(delta.since)
+        else:
+            sessions = session_manager.get_all_sessions()
+        return [s for s in sessions if s.experiment_id == experiment_id]
+    
+    def _survey_sessions(self, experiment_id: str, session_manager: SessionManager,
+                         delta: Optional[ExportDelta] = None) -> List[SurveySession]:
+        """アンケート回答を出力するセッション（並び順・差分の範囲は _experiment_sessions と同じ）
         
-        return output.getvalue()
+        回答インデックスが設定されていればそこから読み、セッションファイルは変更されたものだけを読み込む。
+        差分エクスポートはインデックスを使わず、変更されたセッションファイルを直接読み込む
+        （読み込めないファイルを読み飛ばさないため）。
+        """
+        if self.survey_index is None or (delta is not None and not delta.is_full):
+            return [SurveySession(s) for s in self._experiment_sessions(experiment_id, session_manager, delta)]
+        return self.survey_index.sessions(experiment_id, session_manager)
+    
+    def _message_delta_sessions(self, experiment_id: str, session_manager: SessionManager,
+                                message_store: MessageStore,
+                                delta: Optional[ExportDelta] = None) -> List[Session]:
+        """メッセージを出力するセッション
+        
+        入退室などのシステムメッセージはセッションを保存し直さないため、差分エクスポートでは
+        メッセージファイルの更新時刻から対象セッションを絞り込む。読み込めないセッションファイルは
+        読み飛ばさずエクスポートを失敗させる（ウォーターマークがそのメッセージを越えないように）。
+        """
+        if delta is None or delta.is_full:
+            return self._experiment_sessions(experiment_id, session_manager)
+        sessions = []
+        for session_id in message_store.get_session_ids_changed_since(delta.since):
+            try:
+                session = session_manager.load_session(session_id)
+            except ValueError as e:
+                print(f"[Export] ❌ Cannot read session file {session_id}.json: {e}")
+                raise
+            if session is not None and session.experiment_id == experiment_id:
+                sessions.append(session)
+        sessions.sort(key=lambda s: s.created_at, reverse=True)
+        return sessions
+    
+    def _session_messages(self, session_id: str, message_store: MessageStore,
+                          delta: Optional[ExportDelta] = None, until: Optional[int] = None) -> List[Message]:
+        """セッションのメッセージ（delta/until 指定時は範囲内に保存されたもののみ）"""
+        if delta is not None:
+            return message_store.get_messages_changed_since(session_id, delta.since, delta.watermark)
+        if until is not None:
+            return message_store.get_messages_changed_since(session_id, None, until)
+        return message_store.get_messages_by_session(session_id)
     
     def export_experiment_sessions_to_csv(self, experiment_id: str,
                                           session_manager: SessionManager) -> str:
         """実験全体のセッション情報をCSV形式でエクスポート"""
-        all_sessions = session_manager.get_all_sessions()
-        exp_sessions = [s for s in all_sessions if s.experiment_id == experiment_id]
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
+        return ''.join(self.iter_experiment_sessions_csv(experiment_id, session_manager))
+    
+    def iter_experiment_sessions_csv(self, experiment_id: str,
+                                     session_manager: SessionManager,
+                                     delta: Optional[ExportDelta] = None) -> Iterator[str]:
+        """実験全体のセッション情報をCSV形式で順に出力（ストリーミング用、delta指定時は変更されたセッションのみ）"""
+        return self._iter_csv(self._experiment_sessions_csv_rows(experiment_id, session_manager, delta))
+    
+    def _experiment_sessions_csv_rows(self, experiment_id: str,
+                                      session_manager: SessionManager,
+                                      delta: Optional[ExportDelta] = None) -> Iterator[list]:
+        """実験全体のセッション情報CSVの行（ヘッダーを含む）"""
+        exp_sessions = self._experiment_sessions(experiment_id, session_manager, delta)
         
         # ヘッダー
-        writer.writerow([
+        yield [
             'experiment_id',
             'session_id',
             'participant_code',
@@ -440,7 +833,7 @@ class DataExporter:
             'participants',
             'total_messages',
             'duration_seconds'
-        ])
+        ]
         
         # データ行
         for session in exp_sessions:
@@ -459,7 +852,7 @@ class DataExporter:
             if hasattr(session, 'assigned_conditions') and session.assigned_conditions:
                 assigned_conditions_str = json.dumps(session.assigned_conditions, ensure_ascii=False)
             
-            writer.writerow([
+            yield [
                 experiment_id,
                 session.session_id,
                 session.participant_code or '',
@@ -473,9 +866,7 @@ class DataExporter:
                 ', '.join(session.participants),
                 session.total_messages,
                 duration
-            ])
-        
-        return output.getvalue()
+            ]
     
     def export_experiment_wide_format_csv(self, experiment_id: str, 
                                           session_manager: SessionManager,
@@ -530,452 +921,257 @@ class DataExporter:
         )
         ```
         """
-        # 実験に属する全セッションを取得（statusに関係なく全て）
-        all_sessions = session_manager.get_all_sessions()
-        exp_sessions = [s for s in all_sessions if s.experiment_id == experiment_id]
-        
-        if not exp_sessions:
+        return ''.join(self.iter_experiment_wide_format_csv(
+            experiment_id, session_manager, message_store, experiment_manager,
+            excel_format=excel_format, missing_value=missing_value
+        ))
+    
+    def iter_experiment_wide_format_csv(self, experiment_id: str,
+                                        session_manager: SessionManager,
+                                        message_store: MessageStore = None,
+                                        experiment_manager: Optional[ExperimentManager] = None,
+                                        excel_format: bool = False,
+                                        missing_value: str = 'blank',
+                                        delta: Optional[ExportDelta] = None) -> Iterator[str]:
+        """ワイド形式CSVを順に出力（ストリーミング用、列は export_experiment_wide_format_csv と同じ）
+        
+        delta指定時は since より後に保存されたセッションの行のみ（列は対象セッションの回答から決まる）。
+        """
+        return self._iter_csv(self._wide_format_csv_rows(
+            experiment_id, session_manager, message_store, experiment_manager, missing_value, delta
+        ), excel_format)
+    
+    def _wide_format_csv_rows(self, experiment_id: str,
+                              session_manager: SessionManager,
+                              message_store: MessageStore = None,
+                              experiment_manager: Optional[ExperimentManager] = None,
+                              missing_value: str = 'blank',
+                              delta: Optional[ExportDelta] = None) -> Iterator[list]:
+        """ワイド形式CSVの行（ヘッダーを含む）
+        
+        各セッションの回答は1回だけ走査し（SessionColumns）、トランスクリプトも1回だけ読み込む。
+        """
+        flow_index = self._get_flow_index(experiment_id, experiment_manager)
+        # 実験に属する全セッション（statusに関係なく全て）
+        extracts = self._collect_session_extracts(experiment_id, session_manager, message_store, flow_index, delta)
+        yield from self._wide_rows(experiment_id, session_manager, extracts, flow_index, missing_value)
+    
+    def _wide_rows(self, experiment_id: str, session_manager: SessionManager,
+                   extracts: List[SessionExtract], flow_index: FlowIndex,
+                   missing_value: str = 'blank') -> Iterator[list]:
+        """作成済みのセッションの材料からワイド形式CSVの行（ヘッダーを含む）を出力"""
+        if not extracts:
             # セッションがない場合は空のCSVを返す
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(['experiment_id', 'session_id', 'participant_code', 'status', 'message'])
-            writer.writerow([experiment_id, '', '', 'no_data', 'No sessions found for this experiment'])
-            return output.getvalue()
-        
-        # 実験フローを取得（チャットステップ情報の取得用）
-        experiment = None
-        experiment_flow = None
-        experiment_flow_raw = None  # 元のJSONデータ（ブランチ情報を含む）
-        if experiment_manager:
-            experiment = experiment_manager.get_experiment(experiment_id)
-            if experiment and experiment.experiment_flow:
-                from ..models.condition import ExperimentStep
-                experiment_flow = [ExperimentStep.from_dict(step) for step in experiment.experiment_flow]
-                # 元のJSONデータも保持（ブランチ情報を含む）
-                experiment_flow_raw = experiment.experiment_flow
-        
-        # すべてのquestion_idを収集（カラムヘッダー用）
-        all_question_ids = OrderedDict()  # 出現順を保持
-        all_ai_eval_ids = OrderedDict()   # AI評価質問ID
-        all_branch_fields = OrderedDict()  # ブランチ選択フィールド
-        all_chat_fields = OrderedDict()  # チャットステップ情報
-        all_survey_steps = set()  # 質問順序情報が必要なステップID
-        
-        # チャットステップ情報を収集（実験フローから、再帰的に探索）
-        def collect_chat_steps_from_dict(steps_dict, chat_steps_list):
-            """実験フロー（辞書形式）からチャットステップを再帰的に収集"""
-            for step_dict in steps_dict:
-                if isinstance(step_dict, dict):
-                    if step_dict.get('step_type') == 'chat':
-                        chat_steps_list.append(step_dict)
-                    elif step_dict.get('step_type') == 'branch':
-                        # ブランチ内のステップも探索
-                        branches = step_dict.get('branches', [])
-                        for branch in branches:
-                            branch_steps = branch.get('steps', [])
-                            if branch_steps:
-                                collect_chat_steps_from_dict(branch_steps, chat_steps_list)
-        
-        chat_steps_in_flow = []
-        if experiment_flow_raw:
-            collect_chat_steps_from_dict(experiment_flow_raw, chat_steps_in_flow)
-            for step_dict in chat_steps_in_flow:
-                # チャットステップの情報フィールドを追加
-                step_id = step_dict.get('step_id', '')
-                field_name = f"{step_id}_ai_model"
-                if field_name not in all_chat_fields:
-                    all_chat_fields[field_name] = True
-                field_name = f"{step_id}_bot_name"
-                if field_name not in all_chat_fields:
-                    all_chat_fields[field_name] = True
-                field_name = f"{step_id}_chat_duration_seconds"
-                if field_name not in all_chat_fields:
-                    all_chat_fields[field_name] = True
-        
-        for session in exp_sessions:
-            # ブランチ選択結果をassigned_conditionsから収集
-            if hasattr(session, 'assigned_conditions') and session.assigned_conditions:
-                for branch_step_id, branch_id in session.assigned_conditions.items():
-                    # ブランチIDの列
-                    field_name = f"{branch_step_id}_condition"
-                    if field_name not in all_branch_fields:
-                        all_branch_fields[field_name] = True
-                    # ブランチラベルの列
-                    label_field = f"{branch_step_id}_condition_label"
-                    if label_field not in all_branch_fields:
-                        all_branch_fields[label_field] = True
-                    # ブランチ値の列（数値コード）
-                    value_field = f"{branch_step_id}_condition_value"
-                    if value_field not in all_branch_fields:
-                        all_branch_fields[value_field] = True
-            
-            # 🆕 新形式: step_responsesからアンケート回答を収集
-            if hasattr(session, 'step_responses') and session.step_responses:
-                for step_id, step_data in session.step_responses.items():
-                    if isinstance(step_data, dict):
-                        for client_id, client_data in step_data.items():
-                            if isinstance(client_data, dict):
-                                # アンケート回答
-                                if 'survey_responses' in client_data:
-                                    all_survey_steps.add(step_id)  # 質問順序情報が必要
-                                    for response in client_data['survey_responses']:
-                                        if isinstance(response, dict) and 'question_id' in response:
-                                            if response['question_id'] not in all_question_ids:
-                                                all_question_ids[response['question_id']] = True
-                                # ランダマイザーの回答（randomizer_responses内）
-                                if 'randomizer_responses' in client_data:
-                                    all_survey_steps.add(step_id)  # 質問順序情報が必要
-                                    for response in client_data['randomizer_responses']:
-                                        if isinstance(response, dict) and 'question_id' in response:
-                                            if response['question_id'] not in all_question_ids:
-                                                all_question_ids[response['question_id']] = True
-                                # AI評価結果
-                                if 'evaluation_results' in client_data:
-                                    eval_results = client_data['evaluation_results']
-                                    if isinstance(eval_results, dict):
-                                        for eval_q_id in eval_results.keys():
-                                            full_id = f"ai_eval_{eval_q_id}"
-                                            if full_id not in all_ai_eval_ids:
-                                                all_ai_eval_ids[full_id] = True
-                                # ブランチ選択結果（後方互換性）
-                                if 'branch_selected' in client_data:
-                                    field_name = f"{step_id}_branch_selected"
-                                    if field_name not in all_branch_fields:
-                                        all_branch_fields[field_name] = True
-                                if 'condition_label' in client_data:
-                                    field_name = f"{step_id}_condition_label"
-                                    if field_name not in all_branch_fields:
-                                        all_branch_fields[field_name] = True
-                                if 'condition_value' in client_data:
-                                    field_name = f"{step_id}_condition_value"
-                                    if field_name not in all_branch_fields:
-                                        all_branch_fields[field_name] = True
-            
-            # 旧形式: survey_responses（後方互換性のため）
-            if hasattr(session, 'survey_responses') and session.survey_responses:
-                for client_id, responses in session.survey_responses.items():
-                    for response in responses:
-                        if hasattr(response, 'question_id'):
-                            if response.question_id not in all_question_ids:
-                                all_question_ids[response.question_id] = True
-        
-        # ヘッダー行を構築
-        headers = [
-            'experiment_id',
-            'session_id',
-            'participant_code',
-            'client_id',
-            'condition_id',
-            'experiment_group',
-            'status',                # セッションステータス（completed, active など）
-            'flow_completed',        # フローが最後まで完了したか（TRUE/FALSE）
-            'completed_steps_count', # 完了したステップ数
-            'started_at',
-            'ended_at',
-            'duration_seconds',
-            'total_messages',
-            'user_message_count',
-            'bot_message_count',
-            'total_user_chars',      # ユーザーメッセージの総文字数
-            'total_user_words',      # ユーザーメッセージの総単語数
-            'avg_user_chars',
-            'avg_user_words'
-        ]
+            yield ['experiment_id', 'session_id', 'participant_code', 'status', 'message']
+            yield [experiment_id, '', '', 'no_data', 'No sessions found for this experiment']
+            return
         
-        # ブランチ選択列を追加（IDとラベルの両方）
-        headers.extend(list(all_branch_fields.keys()))
+        layout = self._wide_layout(experiment_id, session_manager, extracts, flow_index)
+        yield layout.headers()
         
-        # チャットステップ情報列を追加
-        headers.extend(list(all_chat_fields.keys()))
-        
-        # 質問順序情報の列を追加
-        question_order_fields = [f"{step_id}_question_order" for step_id in sorted(all_survey_steps)]
-        headers.extend(question_order_fields)
-        
-        # サーベイ質問列を追加
-        headers.extend(list(all_question_ids.keys()))
-        
-        # AI評価列を追加
-        headers.extend(list(all_ai_eval_ids.keys()))
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(headers)
+        # 欠損値処理: 指定されたスタイルで欠損値を表現
+        missing_val = self._get_missing_value(missing_value)
         
         # 各セッションのデータを行として出力
-        for session in exp_sessions:
-            # 基本情報
-            duration_seconds = ''
-            if session.ended_at:
-                try:
-                    start = datetime.fromisoformat(session.created_at)
-                    end = datetime.fromisoformat(session.ended_at)
-                    duration_seconds = str(int((end - start).total_seconds()))
-                except:
-                    pass
-            
-            # メッセージ統計を計算
-            user_msg_count = 0
-            bot_msg_count = 0
-            total_user_chars = 0
-            total_user_words = 0
-            
-            if message_store:
-                messages = message_store.get_messages_by_session(session.session_id)
-                # 'user'と'message'の両方をユーザーメッセージとして扱う
-                user_messages = [m for m in messages if m.message_type in ['user', 'message']]
-                bot_messages = [m for m in messages if m.message_type == 'bot']
-                
-                user_msg_count = len(user_messages)
-                bot_msg_count = len(bot_messages)
-                
-                for msg in user_messages:
-                    total_user_chars += msg.metadata.char_count
-                    total_user_words += msg.metadata.word_count
-            
+        for extract in extracts:
+            row_data = self._wide_row(experiment_id, extract, flow_index, layout)
+            yield [missing_val if (cell is None or cell == '') else cell for cell in row_data]
+    
+    def _wide_row(self, experiment_id: str, extract: SessionExtract, flow_index: FlowIndex,
+                  layout: 'WideLayout', typed: bool = False) -> list:
+        """ワイド形式の1行（layout.headers() と同じ列順）
+        
+        typed=True の場合は回答・AI評価を元の型のまま返し、flow_completed は真偽値、
+        平均値は数値にする（列指向形式のエクスポート用）。
+        """
+        session, columns = extract.session, extract.columns
+        user_msg_count, bot_msg_count, total_user_chars, total_user_words = extract.message_stats
+        if typed:
+            avg_user_chars = total_user_chars / user_msg_count if user_msg_count > 0 else None
+            avg_user_words = total_user_words / user_msg_count if user_msg_count > 0 else None
+        else:
             avg_user_chars = f"{total_user_chars / user_msg_count:.2f}" if user_msg_count > 0 else ''
             avg_user_words = f"{total_user_words / user_msg_count:.2f}" if user_msg_count > 0 else ''
-            
-            # client_idを取得（session.client_idを優先、なければparticipantsから）
-            client_id = session.client_id if hasattr(session, 'client_id') and session.client_id else (session.participants[0] if session.participants else '')
-            
-            # セッション情報を計算
-            completed_steps_count = len(session.completed_steps) if hasattr(session, 'completed_steps') and session.completed_steps else 0
-            # フロー完了判定（実験フローがある場合、全ステップ完了しているか）
-            flow_completed = ''
-            if experiment_flow_raw:
-                # フローのトップレベルステップ数（ブランチ内は個別にカウントされる）
-                # completed_steps にはブランチ内のステップも含まれるため、
-                # 最後のステップが完了していればフロー完了とみなす
-                if hasattr(session, 'flow_completed') and session.flow_completed is not None:
-                    flow_completed = 'TRUE' if session.flow_completed else 'FALSE'
-                elif session.status == 'completed':
-                    flow_completed = 'TRUE'
-                elif completed_steps_count > 0:
-                    flow_completed = 'FALSE'
-            
-            # 行データの基本部分
-            row_data = [
-                experiment_id,
-                session.session_id,
-                session.participant_code or '',
-                client_id,
-                session.condition_id or '',
-                session.experiment_group or '',
-                session.status or '',
-                flow_completed,
-                completed_steps_count,
-                session.created_at,
-                session.ended_at or '',
-                duration_seconds,
-                session.total_messages,
-                user_msg_count,
-                bot_msg_count,
-                total_user_chars,
-                total_user_words,
-                avg_user_chars,
-                avg_user_words
-            ]
-            
-            # サーベイ回答を追加（question_idの順番に従って）
-            survey_answers = {}
-            
-            # 🆕 新形式: step_responsesからアンケート回答を取得
-            if hasattr(session, 'step_responses') and session.step_responses:
-                for step_id, step_data in session.step_responses.items():
-                    if isinstance(step_data, dict):
-                        for client_id_resp, client_data in step_data.items():
-                            if isinstance(client_data, dict):
-                                # 通常のアンケート回答
-                                if 'survey_responses' in client_data:
-                                    for response in client_data['survey_responses']:
-                                        if isinstance(response, dict) and 'question_id' in response:
-                                            # 配列回答はJSON文字列に変換、文字列回答は改行を置換
-                                            answer = response.get('answer')
-                                            if isinstance(answer, list):
-                                                answer = json.dumps(answer, ensure_ascii=False)
-                                            elif isinstance(answer, str):
-                                                # 改行をスペースに置換（CSVの行分割を防ぐ）
-                                                answer = answer.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
-                                            survey_answers[response['question_id']] = answer
-                                # ランダマイザーの回答
-                                if 'randomizer_responses' in client_data:
-                                    for response in client_data['randomizer_responses']:
-                                        if isinstance(response, dict) and 'question_id' in response:
-                                            # 配列回答はJSON文字列に変換、文字列回答は改行を置換
-                                            answer = response.get('answer')
-                                            if isinstance(answer, list):
-                                                answer = json.dumps(answer, ensure_ascii=False)
-                                            elif isinstance(answer, str):
-                                                # 改行をスペースに置換（CSVの行分割を防ぐ）
-                                                answer = answer.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
-                                            survey_answers[response['question_id']] = answer
-            
-            # 旧形式: survey_responses（後方互換性のため）
-            if hasattr(session, 'survey_responses') and session.survey_responses:
-                for client_id_resp, responses in session.survey_responses.items():
-                    for response in responses:
-                        if hasattr(response, 'question_id') and hasattr(response, 'answer'):
-                            # 配列回答はJSON文字列に変換、文字列回答は改行を置換
-                            answer = response.answer
-                            if isinstance(answer, list):
-                                answer = json.dumps(answer, ensure_ascii=False)
-                            elif isinstance(answer, str):
-                                # 改行をスペースに置換（CSVの行分割を防ぐ）
-                                answer = answer.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
-                            survey_answers[response.question_id] = answer
-            
-            # ブランチ選択結果を追加（ID、ラベル、値の3種類）
-            branch_answers = {}
-            
-            # 実験フローからブランチ情報を取得するヘルパー関数
-            def get_branch_info_from_flow(branch_step_id, branch_id):
-                """実験フローから指定されたbranch_idのラベルと値を取得"""
-                if not experiment_flow_raw:
-                    return '', ''
-                for step_dict in experiment_flow_raw:
-                    if isinstance(step_dict, dict) and step_dict.get('step_id') == branch_step_id:
-                        if step_dict.get('step_type') == 'branch':
-                            branches = step_dict.get('branches', [])
-                            for branch in branches:
-                                if branch.get('branch_id') == branch_id:
-                                    label = branch.get('condition_label', '')
-                                    value = branch.get('condition_value', '')
-                                    return label, value
-                return '', ''
-            
-            # 新形式: assigned_conditionsから取得（優先）
-            if hasattr(session, 'assigned_conditions') and session.assigned_conditions:
-                for branch_step_id, branch_id in session.assigned_conditions.items():
-                    # ブランチID
-                    field_name = f"{branch_step_id}_condition"
-                    branch_answers[field_name] = branch_id
-                    # ブランチラベルと値（実験フローから取得）
-                    label, value = get_branch_info_from_flow(branch_step_id, branch_id)
-                    label_field = f"{branch_step_id}_condition_label"
-                    branch_answers[label_field] = label
-                    value_field = f"{branch_step_id}_condition_value"
-                    branch_answers[value_field] = value
-            
-            # 旧形式: step_responsesから取得（後方互換性）
-            if hasattr(session, 'step_responses') and session.step_responses:
-                for step_id, step_data in session.step_responses.items():
-                    if isinstance(step_data, dict):
-                        for client_id_resp, client_data in step_data.items():
-                            if isinstance(client_data, dict):
-                                if 'branch_selected' in client_data:
-                                    field_name = f"{step_id}_branch_selected"
-                                    if field_name not in branch_answers:  # 新形式を優先
-                                        branch_answers[field_name] = client_data['branch_selected']
-                                if 'condition_label' in client_data:
-                                    field_name = f"{step_id}_condition_label"
-                                    if field_name not in branch_answers:  # 新形式を優先
-                                        branch_answers[field_name] = client_data['condition_label']
-                                if 'condition_value' in client_data:
-                                    field_name = f"{step_id}_condition_value"
-                                    if field_name not in branch_answers:  # 新形式を優先
-                                        branch_answers[field_name] = client_data['condition_value']
-            
-            for field_name in all_branch_fields.keys():
-                row_data.append(branch_answers.get(field_name, ''))
-            
-            # チャットステップ情報を追加
-            chat_info = {}
-            if experiment_flow_raw and message_store:
-                # 完了したチャットステップを特定（ブランチ内も含めて再帰的に探索）
-                def find_chat_step_by_id_from_dict(steps_dict, target_step_id):
-                    """実験フロー（辞書形式）から指定されたstep_idのチャットステップを再帰的に検索"""
-                    for step_dict in steps_dict:
-                        if isinstance(step_dict, dict):
-                            if step_dict.get('step_id') == target_step_id and step_dict.get('step_type') == 'chat':
-                                return step_dict
-                            elif step_dict.get('step_type') == 'branch':
-                                # ブランチ内のステップも探索
-                                branches = step_dict.get('branches', [])
-                                for branch in branches:
-                                    branch_steps = branch.get('steps', [])
-                                    if branch_steps:
-                                        found = find_chat_step_by_id_from_dict(branch_steps, target_step_id)
-                                        if found:
-                                            return found
-                    return None
-                
-                completed_chat_steps = []
-                if hasattr(session, 'completed_steps'):
-                    for step_id in session.completed_steps:
-                        # 実験フローからチャットステップを再帰的に検索
-                        found_step = find_chat_step_by_id_from_dict(experiment_flow_raw, step_id)
-                        if found_step:
-                            completed_chat_steps.append(found_step)
-                
-                # 各チャットステップの情報を取得
-                for step_dict in completed_chat_steps:
-                    step_id = step_dict.get('step_id', '')
-                    # AIモデルとbot_name
-                    chat_info[f"{step_id}_ai_model"] = step_dict.get('bot_model', '')
-                    chat_info[f"{step_id}_bot_name"] = step_dict.get('bot_name', '')
-                    
-                    # チャット時間を計算（メッセージから）
-                    messages = message_store.get_messages_by_session(session.session_id)
-                    chat_messages = [m for m in messages if m.message_type in ['user', 'bot']]
-                    if chat_messages:
-                        try:
-                            start_time = datetime.fromisoformat(chat_messages[0].timestamp.replace('Z', '+00:00'))
-                            end_time = datetime.fromisoformat(chat_messages[-1].timestamp.replace('Z', '+00:00'))
-                            duration = int((end_time - start_time).total_seconds())
-                            chat_info[f"{step_id}_chat_duration_seconds"] = duration
-                        except:
-                            chat_info[f"{step_id}_chat_duration_seconds"] = ''
-                    else:
-                        chat_info[f"{step_id}_chat_duration_seconds"] = ''
-            
-            for field_name in all_chat_fields.keys():
-                row_data.append(chat_info.get(field_name, ''))
-            
-            # 質問順序情報を追加
-            question_order_data = {}
-            if hasattr(session, 'step_responses') and session.step_responses:
-                for step_id, step_data in session.step_responses.items():
-                    if isinstance(step_data, dict):
-                        for client_id_resp, client_data in step_data.items():
-                            if isinstance(client_data, dict):
-                                # question_orderフィールドがある場合
-                                if 'question_order' in client_data:
-                                    order_list = client_data['question_order']
-                                    if isinstance(order_list, list):
-                                        # リストをカンマ区切りの文字列に変換
-                                        question_order_data[f"{step_id}_question_order"] = ','.join(order_list)
-            
-            for field_name in question_order_fields:
-                row_data.append(question_order_data.get(field_name, ''))
-            
-            # サーベイ回答を追加
-            for q_id in all_question_ids.keys():
-                row_data.append(survey_answers.get(q_id, ''))
-            
-            # AI評価結果を追加
-            ai_eval_answers = {}
-            for step_id, step_data in session.step_responses.items():
-                if isinstance(step_data, dict):
-                    for client_id_resp, client_data in step_data.items():
-                        if isinstance(client_data, dict) and 'evaluation_results' in client_data:
-                            eval_results = client_data['evaluation_results']
-                            if isinstance(eval_results, dict):
-                                for eval_q_id, score in eval_results.items():
-                                    full_id = f"ai_eval_{eval_q_id}"
-                                    ai_eval_answers[full_id] = str(score)
-            
-            for eval_id in all_ai_eval_ids.keys():
-                row_data.append(ai_eval_answers.get(eval_id, ''))
-            
-            # 欠損値処理: 指定されたスタイルで欠損値を表現
-            # missing_value: 'blank'=空文字列, 'NA'=NA文字列, 'comma'=空セル
-            missing_val = self._get_missing_value(missing_value)
-            row_data = [missing_val if (cell is None or cell == '') else cell for cell in row_data]
-            
-            writer.writerow(row_data)
         
-        return self._add_bom_if_excel(output.getvalue(), excel_format)
+        # セッション情報を計算
+        completed_steps_count = len(session.completed_steps) if session.completed_steps else 0
+        # フロー完了判定（completed_steps にはブランチ内のステップも含まれるため、状態から判定）
+        flow_completed = ''
+        if flow_index.flow:
+            if session.status == 'completed':
+                flow_completed = True if typed else 'TRUE'
+            elif completed_steps_count > 0:
+                flow_completed = False if typed else 'FALSE'
+        
+        # 行データの基本部分
+        row_data = [
+            experiment_id,
+            session.session_id,
+            session.participant_code or '',
+            self._session_client_id(session),
+            session.condition_id or '',
+            session.experiment_group or '',
+            session.status or '',
+            flow_completed,
+            completed_steps_count,
+            session.created_at,
+            session.ended_at or '',
+            self._session_duration_seconds(session),
+            session.total_messages,
+            user_msg_count,
+            bot_msg_count,
+            total_user_chars,
+            total_user_words,
+            avg_user_chars,
+            avg_user_words
+        ]
+        
+        # ブランチ選択結果（新形式: assigned_conditions を優先し、旧形式は未設定の列のみ）
+        branch_answers = {}
+        for branch_step_id, branch_id in (session.assigned_conditions or {}).items():
+            label, value = flow_index.branch_info.get((branch_step_id, branch_id), ('', ''))
+            branch_answers[f"{branch_step_id}_condition"] = branch_id
+            branch_answers[f"{branch_step_id}_condition_label"] = label
+            branch_answers[f"{branch_step_id}_condition_value"] = value
+        for field_name, value in columns.legacy_branch_values.items():
+            branch_answers.setdefault(field_name, value)
+        row_data.extend(branch_answers.get(field_name, '') for field_name in layout.branch_fields)
+        
+        # チャットステップ情報
+        row_data.extend(extract.chat_info.get(field_name, '') for field_name in layout.chat_fields)
+        
+        # 質問順序情報
+        row_data.extend(columns.question_orders.get(field_name, '') for field_name in layout.question_order_fields)
+        
+        # サーベイ回答（旧形式の survey_responses が後から上書き）
+        if typed:
+            survey_answers = dict(columns.answers)
+            survey_answers.update(columns.legacy_answers)
+        else:
+            survey_answers = {q_id: _clean_answer(answer) for q_id, answer in columns.answers.items()}
+            survey_answers.update((q_id, _clean_answer(answer)) for q_id, answer in columns.legacy_answers.items())
+        row_data.extend(survey_answers.get(q_id, '') for q_id in layout.question_ids)
+        
+        # AI評価結果
+        for eval_id in layout.ai_eval_ids:
+            if eval_id not in columns.ai_evals:
+                row_data.append('')
+            else:
+                score = columns.ai_evals[eval_id]
+                row_data.append(score if typed else str(score))
+        
+        return row_data
+    
+    def _collect_session_extracts(self, experiment_id: str,
+                                  session_manager: SessionManager,
+                                  message_store: Optional[MessageStore],
+                                  flow_index: FlowIndex,
+                                  delta: Optional[ExportDelta] = None) -> List[SessionExtract]:
+        """実験に属する全セッションの材料を作成（セッション数が多い場合はプロセスプールで並列に作成）
+        
+        マテリアライズしたテーブルがあれば保持している行を使う（変わったファイルの行だけ読み直す）。
+        差分エクスポートでは変更されたセッションのみ（件数が少ないため逐次処理）。
+        """
+        full_export = delta is None or delta.is_full
+        if self.wide_tables is not None and message_store is not None and full_export:
+            return self.wide_tables.extracts(experiment_id, flow_index, session_manager, message_store)
+        engine = self.parallel_engine
+        if engine is not None and full_export and engine.should_parallelize(session_manager.data_dir):
+            return engine.extract_sessions(
+                experiment_id, session_manager.data_dir,
+                message_store.data_dir if message_store else None, flow_index.flow
+            )
+        return [self._extract_session(session, flow_index, message_store, strict=not full_export)
+                for session in self._experiment_sessions(experiment_id, session_manager, delta)]
+    
+    def _wide_layout(self, experiment_id: str, session_manager: SessionManager,
+                     extracts: List[SessionExtract], flow_index: FlowIndex) -> WideLayout:
+        """ワイド形式の列構成（マテリアライズしたテーブルの行なら登録済みの列構成を使い回す）"""
+        if self.wide_tables is not None:
+            return self.wide_tables.layout(experiment_id, session_manager, extracts, flow_index)
+        return WideLayout(extracts, flow_index)
+    
+    def _extract_session(self, session: Session, flow_index: FlowIndex,
+                         message_store: Optional[MessageStore], strict: bool = False) -> SessionExtract:
+        """1セッションの回答を走査し、トランスクリプトを1回だけ読み込んで材料を作成
+        
+        strict=True（差分エクスポート）では、読み込めないトランスクリプトを空として扱わず ValueError を送出する。
+        """
+        if not message_store:
+            messages = []
+        elif strict:
+            messages = message_store.get_messages_changed_since(session.session_id, None)
+        else:
+            messages = message_store.get_messages_by_session(session.session_id)
+        chat_info = self._chat_info(session, flow_index, messages) if message_store else {}
+        return SessionExtract(session, SessionColumns(session), self._message_stats(messages), chat_info)
+    
+    def _get_flow_index(self, experiment_id: str,
+                        experiment_manager: Optional[ExperimentManager]) -> FlowIndex:
+        """実験フローのインデックスを作成（実験がない場合は空のインデックス）"""
+        experiment_flow_raw = None
+        if experiment_manager:
+            experiment = experiment_manager.get_experiment(experiment_id)
+            if experiment and experiment.experiment_flow:
+                experiment_flow_raw = experiment.experiment_flow
+        return FlowIndex(experiment_flow_raw)
+    
+    def _session_client_id(self, session: Session) -> str:
+        """client_idを取得（session.client_idを優先、なければparticipantsから）"""
+        return session.client_id or (session.participants[0] if session.participants else '')
+    
+    def _session_duration_seconds(self, session: Session) -> str:
+        """セッションの開始から終了までの秒数（終了していない場合は空）"""
+        if not session.ended_at:
+            return ''
+        try:
+            start = datetime.fromisoformat(session.created_at)
+            end = datetime.fromisoformat(session.ended_at)
+            return str(int((end - start).total_seconds()))
+        except (ValueError, TypeError):
+            return ''
+    
+    def _message_stats(self, messages: List[Message]) -> Tuple[int, int, int, int]:
+        """ユーザー・ボットのメッセージ数とユーザーメッセージの総文字数・総単語数"""
+        user_msg_count = 0
+        bot_msg_count = 0
+        total_user_chars = 0
+        total_user_words = 0
+        for msg in messages:
+            # 'user'と'message'の両方をユーザーメッセージとして扱う
+            if msg.message_type in ('user', 'message'):
+                user_msg_count += 1
+                total_user_chars += msg.metadata.char_count
+                total_user_words += msg.metadata.word_count
+            elif msg.message_type == 'bot':
+                bot_msg_count += 1
+        return user_msg_count, bot_msg_count, total_user_chars, total_user_words
+    
+    def _chat_info(self, session: Session, flow_index: FlowIndex, messages: List[Message]) -> Dict[str, Any]:
+        """完了したチャットステップのAIモデル・ボット名・チャット時間（秒）"""
+        completed_chat_steps = [flow_index.chat_by_id[step_id] for step_id in session.completed_steps
+                                if step_id in flow_index.chat_by_id]
+        if not completed_chat_steps:
+            return {}
+        
+        # チャット時間を計算（メッセージから）
+        duration = ''
+        chat_messages = [m for m in messages if m.message_type in ('user', 'bot')]
+        if chat_messages:
+            try:
+                start_time = datetime.fromisoformat(chat_messages[0].timestamp.replace('Z', '+00:00'))
+                end_time = datetime.fromisoformat(chat_messages[-1].timestamp.replace('Z', '+00:00'))
+                duration = int((end_time - start_time).total_seconds())
+            except (ValueError, TypeError):
+                duration = ''
+        
+        chat_info = {}
+        for step_dict in completed_chat_steps:
+            step_id = step_dict.get('step_id', '')
+            chat_info[f"{step_id}_ai_model"] = step_dict.get('bot_model', '')
+            chat_info[f"{step_id}_bot_name"] = step_dict.get('bot_name', '')
+            chat_info[f"{step_id}_chat_duration_seconds"] = duration
+        return chat_info
     
     def export_experiment_wide_format_with_codebook(self, experiment_id: str, 
                                                      session_manager: SessionManager,
@@ -991,18 +1187,51 @@ class DataExporter:
         Returns:
             bytes: ZIPファイルのバイナリデータ
         """
-        # 実験に属する全セッションを取得
-        all_sessions = session_manager.get_all_sessions()
-        exp_sessions = [s for s in all_sessions if s.experiment_id == experiment_id]
+        return b''.join(self.iter_experiment_wide_format_with_codebook(
+            experiment_id, session_manager, message_store, experiment_manager,
+            excel_format=excel_format, missing_value=missing_value
+        ))
+    
+    def iter_experiment_wide_format_with_codebook(self, experiment_id: str,
+                                                  session_manager: SessionManager,
+                                                  message_store: MessageStore = None,
+                                                  experiment_manager: Optional[ExperimentManager] = None,
+                                                  excel_format: bool = False,
+                                                  missing_value: str = 'blank') -> Iterator[bytes]:
+        """コードブック付きZIPを順に出力（ストリーミング用、内容は export_experiment_wide_format_with_codebook と同じ）
+        
+        データCSVは行を作りながら圧縮し、ZIP全体をメモリに持たない。
+        """
+        # 実験フローのインデックス（ブランチ内を含む全ステップ）
+        flow_index = self._get_flow_index(experiment_id, experiment_manager)
         
-        # 実験フローを取得
-        experiment = None
-        experiment_flow_raw = None
-        if experiment_manager:
-            experiment = experiment_manager.get_experiment(experiment_id)
-            if experiment and experiment.experiment_flow:
-                experiment_flow_raw = experiment.experiment_flow
+        # 実験に属する全セッション
+        extracts = self._collect_session_extracts(experiment_id, session_manager, message_store, flow_index)
         
+        yield from iter_zip(self._codebook_members(experiment_id, extracts, flow_index, excel_format, missing_value))
+    
+    def _codebook_members(self, experiment_id: str, extracts: List[SessionExtract],
+                          flow_index: FlowIndex, excel_format: bool = False,
+                          missing_value: str = 'blank') -> Iterator[Tuple[str, Iterable[str]]]:
+        """コードブック付きZIPのメンバー（数値コード版データCSV、コードブックCSV）"""
+        codebook_entries, branch_code_map, categorical_maps = self._codebook_mappings(flow_index)
+        
+        # --- データCSV（値のみ版）: 行を作りながら書き込む ---
+        yield f'data_{experiment_id}.csv', self._iter_csv(
+            self._coded_data_csv_rows(extracts, experiment_id, flow_index, branch_code_map,
+                                      categorical_maps, missing_value),
+            excel_format
+        )
+        
+        # --- コードブックCSV ---
+        yield f'codebook_{experiment_id}.csv', [self._generate_codebook_csv(codebook_entries, excel_format)]
+    
+    def _codebook_mappings(self, flow_index: FlowIndex) -> Tuple[List[Tuple[str, Any, str]], Dict, Dict]:
+        """実験フローからコードブックのエントリと数値コードの対応を作成
+        
+        Returns:
+            (codebook_entries, branch_code_map, categorical_maps)
+        """
         # コードブック用のマッピングを収集
         codebook_entries = []  # [(variable, value, label), ...]
         
@@ -1012,24 +1241,8 @@ class DataExporter:
         # カテゴリカル変数のマッピング（実験フローから動的に取得）
         categorical_maps = {}  # {question_id: {label: value}}
         
-        # 再帰的に実験フローからステップを収集する関数
-        def collect_steps_from_flow(steps_list, collected_steps):
-            for step_dict in steps_list:
-                if isinstance(step_dict, dict):
-                    collected_steps.append(step_dict)
-                    # ブランチの場合は内部のステップも収集
-                    if step_dict.get('step_type') == 'branch':
-                        for branch in step_dict.get('branches', []):
-                            branch_steps = branch.get('steps', [])
-                            if branch_steps:
-                                collect_steps_from_flow(branch_steps, collected_steps)
-        
-        all_steps = []
-        if experiment_flow_raw:
-            collect_steps_from_flow(experiment_flow_raw, all_steps)
-        
         # 各ステップを処理
-        for step_dict in all_steps:
+        for step_dict in flow_index.all_steps:
             step_type = step_dict.get('step_type', '')
             
             # ブランチステップの処理
@@ -1071,24 +1284,70 @@ class DataExporter:
         codebook_entries.append(('flow_completed', 1, 'TRUE'))
         codebook_entries.append(('flow_completed', 0, 'FALSE'))
         
-        # --- データCSVの生成（値のみ版） ---
-        data_csv = self._generate_coded_data_csv(
-            exp_sessions, experiment_id, experiment_flow_raw,
-            branch_code_map, categorical_maps,
-            message_store, missing_value, excel_format
+        return codebook_entries, branch_code_map, categorical_maps
+    
+    def iter_experiment_bundle(self, experiment_id: str,
+                               session_manager: SessionManager,
+                               message_store: MessageStore,
+                               experiment_manager: Optional[ExperimentManager] = None,
+                               excel_format: bool = False,
+                               missing_value: str = 'blank',
+                               delta: Optional[ExportDelta] = None) -> Iterator[bytes]:
+        """実験の全データを1つのZIPで順に出力（ストリーミング用）
+        
+        メンバー:
+        - experiment_flow_{id}.json: 実験フロー
+        - participant_codes_{id}.csv: 参加者コードの状態（パスワードは含めない）
+        - sessions_{id}.csv / messages_{id}.csv: iter_experiment_sessions_csv / iter_experiment_all_data_csv と同じ
+        - wide_format_{id}.csv: iter_experiment_wide_format_csv と同じ
+        - data_{id}.csv / codebook_{id}.csv: コードブック付きZIPと同じ
+        
+        各メンバーは生成しながら圧縮する（メッセージは1セッションずつ読み込む）。メッセージは delta.watermark
+        までに保存されたものに揃える（常に全件で、since は使わない）。excel_format は単体のエクスポートと同じく
+        ワイド形式・コードブックのみに適用。
+        """
+        delta = delta or ExportDelta()
+        yield from iter_zip(self._bundle_members(
+            experiment_id, session_manager, message_store, experiment_manager,
+            excel_format, missing_value, delta
+        ))
+    
+    def _bundle_members(self, experiment_id: str, session_manager: SessionManager,
+                        message_store: MessageStore, experiment_manager: Optional[ExperimentManager],
+                        excel_format: bool, missing_value: str,
+                        delta: ExportDelta) -> Iterator[Tuple[str, Iterable[str]]]:
+        experiment = experiment_manager.get_experiment(experiment_id) if experiment_manager else None
+        
+        flow = experiment.experiment_flow if experiment and experiment.experiment_flow else []
+        yield f'experiment_flow_{experiment_id}.json', [json.dumps(flow, ensure_ascii=False, indent=2)]
+        
+        yield f'participant_codes_{experiment_id}.csv', self._iter_csv(
+            self._participant_codes_csv_rows(experiment.participant_codes if experiment else {})
         )
         
-        # --- コードブックCSVの生成 ---
-        codebook_csv = self._generate_codebook_csv(codebook_entries, excel_format)
+        yield f'sessions_{experiment_id}.csv', self.iter_experiment_sessions_csv(
+            experiment_id, session_manager, delta)
+        
+        yield f'messages_{experiment_id}.csv', self.iter_experiment_all_data_csv(
+            experiment_id, session_manager, message_store, delta)
         
-        # --- ZIPファイルの生成 ---
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr(f'data_{experiment_id}.csv', data_csv)
-            zf.writestr(f'codebook_{experiment_id}.csv', codebook_csv)
+        # ワイド形式とコードブックは同じセッションの材料から作成する
+        flow_index = self._get_flow_index(experiment_id, experiment_manager)
+        extracts = self._collect_session_extracts(experiment_id, session_manager, message_store, flow_index)
+        
+        yield f'wide_format_{experiment_id}.csv', self._iter_csv(
+            self._wide_rows(experiment_id, session_manager, extracts, flow_index, missing_value),
+            excel_format
+        )
         
-        zip_buffer.seek(0)
-        return zip_buffer.getvalue()
+        yield from self._codebook_members(experiment_id, extracts, flow_index, excel_format, missing_value)
+    
+    def _participant_codes_csv_rows(self, participant_codes: Dict[str, Dict]) -> Iterator[list]:
+        """参加者コードの状態の行（ヘッダーを含む、コード順）"""
+        yield list(PARTICIPANT_CODES_CSV_HEADER)
+        for code in sorted(participant_codes):
+            data = participant_codes[code] or {}
+            yield [code] + [data.get(field) or '' for field in PARTICIPANT_CODES_CSV_HEADER[1:]]
     
     def _generate_codebook_csv(self, codebook_entries: List[Tuple[str, Any, str]], 
                                 excel_format: bool = False) -> str:
@@ -1106,95 +1365,39 @@ class DataExporter:
         
         return self._add_bom_if_excel(output.getvalue(), excel_format)
     
-    def _generate_coded_data_csv(self, exp_sessions, experiment_id: str,
-                                  experiment_flow_raw, branch_code_map: Dict,
-                                  categorical_maps: Dict,
-                                  message_store, missing_value: str,
-                                  excel_format: bool = False) -> str:
-        """全て数値コードに変換したデータCSVを生成"""
-        if not exp_sessions:
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(['experiment_id', 'session_id', 'participant_code', 'status', 'message'])
-            writer.writerow([experiment_id, '', '', 'no_data', 'No sessions found for this experiment'])
-            return self._add_bom_if_excel(output.getvalue(), excel_format)
-        
-        # すべてのquestion_idを収集
+    def _coded_data_csv_rows(self, extracts: List[SessionExtract], experiment_id: str,
+                             flow_index: FlowIndex, branch_code_map: Dict,
+                             categorical_maps: Dict, missing_value: str) -> Iterator[list]:
+        """数値コード版データCSVの行（ヘッダーを含む）"""
+        if not extracts:
+            yield ['experiment_id', 'session_id', 'participant_code', 'status', 'message']
+            yield [experiment_id, '', '', 'no_data', 'No sessions found for this experiment']
+            return
+        
+        # すべてのquestion_idを収集（各セッションを1回だけ走査）
         all_question_ids = OrderedDict()
         all_ai_eval_ids = OrderedDict()
-        all_branch_step_ids = set()
-        all_chat_fields = OrderedDict()
         all_survey_steps = set()
         
-        # チャットステップ情報を収集
-        def collect_chat_steps_from_dict(steps_dict, chat_steps_list):
-            for step_dict in steps_dict:
-                if isinstance(step_dict, dict):
-                    if step_dict.get('step_type') == 'chat':
-                        chat_steps_list.append(step_dict)
-                    elif step_dict.get('step_type') == 'branch':
-                        branches = step_dict.get('branches', [])
-                        for branch in branches:
-                            branch_steps = branch.get('steps', [])
-                            if branch_steps:
-                                collect_chat_steps_from_dict(branch_steps, chat_steps_list)
-        
-        chat_steps_in_flow = []
-        if experiment_flow_raw:
-            collect_chat_steps_from_dict(experiment_flow_raw, chat_steps_in_flow)
-            for step_dict in chat_steps_in_flow:
-                step_id = step_dict.get('step_id', '')
-                all_chat_fields[f"{step_id}_ai_model"] = True
-                all_chat_fields[f"{step_id}_bot_name"] = True
-                all_chat_fields[f"{step_id}_chat_duration_seconds"] = True
-            
-            # ブランチステップIDを収集
-            for step_dict in experiment_flow_raw:
-                if isinstance(step_dict, dict) and step_dict.get('step_type') == 'branch':
-                    all_branch_step_ids.add(step_dict.get('step_id', ''))
+        for extract in extracts:
+            columns = extract.columns
+            for q_id in columns.question_ids:
+                all_question_ids[q_id] = True
+            for eval_id in columns.ai_eval_ids:
+                all_ai_eval_ids[eval_id] = True
+            all_survey_steps.update(columns.survey_steps)
         
-        for session in exp_sessions:
-            # step_responsesからアンケート回答を収集
-            if hasattr(session, 'step_responses') and session.step_responses:
-                for step_id, step_data in session.step_responses.items():
-                    if isinstance(step_data, dict):
-                        for client_id, client_data in step_data.items():
-                            if isinstance(client_data, dict):
-                                if 'survey_responses' in client_data:
-                                    all_survey_steps.add(step_id)
-                                    for response in client_data['survey_responses']:
-                                        if isinstance(response, dict) and 'question_id' in response:
-                                            if response['question_id'] not in all_question_ids:
-                                                all_question_ids[response['question_id']] = True
-                                if 'randomizer_responses' in client_data:
-                                    all_survey_steps.add(step_id)
-                                    for response in client_data['randomizer_responses']:
-                                        if isinstance(response, dict) and 'question_id' in response:
-                                            if response['question_id'] not in all_question_ids:
-                                                all_question_ids[response['question_id']] = True
-                                if 'evaluation_results' in client_data:
-                                    eval_results = client_data['evaluation_results']
-                                    if isinstance(eval_results, dict):
-                                        for eval_q_id in eval_results.keys():
-                                            full_id = f"ai_eval_{eval_q_id}"
-                                            if full_id not in all_ai_eval_ids:
-                                                all_ai_eval_ids[full_id] = True
+        branch_step_ids = sorted(flow_index.branch_step_ids)
         
         # ヘッダー行を構築（ラベル列を除外、値列のみ）
-        headers = [
-            'experiment_id', 'session_id', 'participant_code', 'client_id',
-            'condition_id', 'experiment_group', 'status', 'flow_completed',
-            'completed_steps_count', 'started_at', 'ended_at', 'duration_seconds',
-            'total_messages', 'user_message_count', 'bot_message_count',
-            'total_user_chars', 'total_user_words', 'avg_user_chars', 'avg_user_words'
-        ]
+        headers = list(WIDE_BASE_HEADERS)
         
         # ブランチ条件列（値のみ）
-        for step_id in sorted(all_branch_step_ids):
-            headers.append(f"{step_id}_condition")
+        headers.extend(f"{step_id}_condition" for step_id in branch_step_ids)
         
         # チャットステップ情報列
-        headers.extend(list(all_chat_fields.keys()))
+        chat_fields = flow_index.chat_field_names()
+        headers.extend(chat_fields)
         
         # 質問順序情報の列
         question_order_fields = [f"{step_id}_question_order" for step_id in sorted(all_survey_steps)]
@@ -1206,168 +1409,59 @@ class DataExporter:
         # AI評価列
         headers.extend(list(all_ai_eval_ids.keys()))
         
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(headers)
+        yield headers
+        
+        missing_val = self._get_missing_value(missing_value)
         
         # 各セッションのデータを行として出力
-        for session in exp_sessions:
-            duration_seconds = ''
-            if session.ended_at:
-                try:
-                    start = datetime.fromisoformat(session.created_at)
-                    end = datetime.fromisoformat(session.ended_at)
-                    duration_seconds = str(int((end - start).total_seconds()))
-                except:
-                    pass
-            
-            # メッセージ統計を計算
-            user_msg_count = 0
-            bot_msg_count = 0
-            total_user_chars = 0
-            total_user_words = 0
-            
-            if message_store:
-                messages = message_store.get_messages_by_session(session.session_id)
-                user_messages = [m for m in messages if m.message_type in ['user', 'message']]
-                bot_messages = [m for m in messages if m.message_type == 'bot']
-                user_msg_count = len(user_messages)
-                bot_msg_count = len(bot_messages)
-                for msg in user_messages:
-                    total_user_chars += msg.metadata.char_count
-                    total_user_words += msg.metadata.word_count
-            
+        for extract in extracts:
+            session, columns = extract.session, extract.columns
+            user_msg_count, bot_msg_count, total_user_chars, total_user_words = extract.message_stats
             avg_user_chars = f"{total_user_chars / user_msg_count:.2f}" if user_msg_count > 0 else ''
             avg_user_words = f"{total_user_words / user_msg_count:.2f}" if user_msg_count > 0 else ''
             
-            client_id = session.client_id if hasattr(session, 'client_id') and session.client_id else (session.participants[0] if session.participants else '')
-            completed_steps_count = len(session.completed_steps) if hasattr(session, 'completed_steps') and session.completed_steps else 0
+            completed_steps_count = len(session.completed_steps) if session.completed_steps else 0
             
             # flow_completedを数値コードに変換
             flow_completed = ''
-            if hasattr(session, 'flow_completed') and session.flow_completed is not None:
-                flow_completed = 1 if session.flow_completed else 0
-            elif session.status == 'completed':
+            if session.status == 'completed':
                 flow_completed = 1
             elif completed_steps_count > 0:
                 flow_completed = 0
             
             row_data = [
-                experiment_id, session.session_id, session.participant_code or '', client_id,
+                experiment_id, session.session_id, session.participant_code or '', self._session_client_id(session),
                 session.condition_id or '', session.experiment_group or '', session.status or '',
                 flow_completed, completed_steps_count, session.created_at, session.ended_at or '',
-                duration_seconds, session.total_messages, user_msg_count, bot_msg_count,
+                self._session_duration_seconds(session), session.total_messages, user_msg_count, bot_msg_count,
                 total_user_chars, total_user_words, avg_user_chars, avg_user_words
             ]
             
             # ブランチ条件の値（数値コードのみ）
-            for step_id in sorted(all_branch_step_ids):
-                branch_value = ''
-                if hasattr(session, 'assigned_conditions') and session.assigned_conditions:
-                    branch_id = session.assigned_conditions.get(step_id, '')
-                    if branch_id and step_id in branch_code_map:
-                        if branch_id in branch_code_map[step_id]:
-                            branch_value = branch_code_map[step_id][branch_id][0]  # 値のみ
-                row_data.append(branch_value)
+            assigned_conditions = session.assigned_conditions or {}
+            for step_id in branch_step_ids:
+                branch_id = assigned_conditions.get(step_id, '')
+                code = branch_code_map.get(step_id, {}).get(branch_id) if branch_id else None
+                row_data.append(code[0] if code else '')
             
             # チャットステップ情報
-            chat_info = {}
-            if experiment_flow_raw and message_store:
-                def find_chat_step_by_id_from_dict(steps_dict, target_step_id):
-                    for step_dict in steps_dict:
-                        if isinstance(step_dict, dict):
-                            if step_dict.get('step_id') == target_step_id and step_dict.get('step_type') == 'chat':
-                                return step_dict
-                            elif step_dict.get('step_type') == 'branch':
-                                for branch in step_dict.get('branches', []):
-                                    found = find_chat_step_by_id_from_dict(branch.get('steps', []), target_step_id)
-                                    if found:
-                                        return found
-                    return None
-                
-                completed_chat_steps = []
-                if hasattr(session, 'completed_steps'):
-                    for s_id in session.completed_steps:
-                        found_step = find_chat_step_by_id_from_dict(experiment_flow_raw, s_id)
-                        if found_step:
-                            completed_chat_steps.append(found_step)
-                
-                for step_dict in completed_chat_steps:
-                    s_id = step_dict.get('step_id', '')
-                    chat_info[f"{s_id}_ai_model"] = step_dict.get('bot_model', '')
-                    chat_info[f"{s_id}_bot_name"] = step_dict.get('bot_name', '')
-                    messages = message_store.get_messages_by_session(session.session_id)
-                    chat_messages = [m for m in messages if m.message_type in ['user', 'bot']]
-                    if chat_messages:
-                        try:
-                            start_time = datetime.fromisoformat(chat_messages[0].timestamp.replace('Z', '+00:00'))
-                            end_time = datetime.fromisoformat(chat_messages[-1].timestamp.replace('Z', '+00:00'))
-                            chat_info[f"{s_id}_chat_duration_seconds"] = int((end_time - start_time).total_seconds())
-                        except:
-                            chat_info[f"{s_id}_chat_duration_seconds"] = ''
-            
-            for field_name in all_chat_fields.keys():
-                row_data.append(chat_info.get(field_name, ''))
+            row_data.extend(extract.chat_info.get(field_name, '') for field_name in chat_fields)
             
             # 質問順序情報
-            question_order_data = {}
-            if hasattr(session, 'step_responses') and session.step_responses:
-                for step_id, step_data in session.step_responses.items():
-                    if isinstance(step_data, dict):
-                        for client_id_resp, client_data in step_data.items():
-                            if isinstance(client_data, dict) and 'question_order' in client_data:
-                                order_list = client_data['question_order']
-                                if isinstance(order_list, list):
-                                    question_order_data[f"{step_id}_question_order"] = ','.join(order_list)
-            
-            for field_name in question_order_fields:
-                row_data.append(question_order_data.get(field_name, ''))
+            row_data.extend(columns.question_orders.get(field_name, '') for field_name in question_order_fields)
             
-            # サーベイ回答（数値コード化）
+            # サーベイ回答（カテゴリカル変数を数値コード化）
             survey_answers = {}
-            if hasattr(session, 'step_responses') and session.step_responses:
-                for step_id, step_data in session.step_responses.items():
-                    if isinstance(step_data, dict):
-                        for client_id_resp, client_data in step_data.items():
-                            if isinstance(client_data, dict):
-                                for key in ['survey_responses', 'randomizer_responses']:
-                                    if key in client_data:
-                                        for response in client_data[key]:
-                                            if isinstance(response, dict) and 'question_id' in response:
-                                                answer = response.get('answer')
-                                                q_id = response['question_id']
-                                                # カテゴリカル変数を数値コード化
-                                                if q_id in categorical_maps and isinstance(answer, str):
-                                                    answer = categorical_maps[q_id].get(answer, answer)
-                                                elif isinstance(answer, list):
-                                                    answer = json.dumps(answer, ensure_ascii=False)
-                                                elif isinstance(answer, str):
-                                                    answer = answer.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
-                                                survey_answers[q_id] = answer
-            
-            for q_id in all_question_ids.keys():
-                row_data.append(survey_answers.get(q_id, ''))
+            for q_id, answer in columns.answers.items():
+                if q_id in categorical_maps and isinstance(answer, str):
+                    survey_answers[q_id] = categorical_maps[q_id].get(answer, answer)
+                else:
+                    survey_answers[q_id] = _clean_answer(answer)
+            row_data.extend(survey_answers.get(q_id, '') for q_id in all_question_ids)
             
             # AI評価結果
-            ai_eval_answers = {}
-            if hasattr(session, 'step_responses') and session.step_responses:
-                for step_id, step_data in session.step_responses.items():
-                    if isinstance(step_data, dict):
-                        for client_id_resp, client_data in step_data.items():
-                            if isinstance(client_data, dict) and 'evaluation_results' in client_data:
-                                eval_results = client_data['evaluation_results']
-                                if isinstance(eval_results, dict):
-                                    for eval_q_id, score in eval_results.items():
-                                        ai_eval_answers[f"ai_eval_{eval_q_id}"] = str(score)
-            
-            for eval_id in all_ai_eval_ids.keys():
-                row_data.append(ai_eval_answers.get(eval_id, ''))
+            row_data.extend(str(columns.ai_evals[eval_id]) if eval_id in columns.ai_evals else ''
+                            for eval_id in all_ai_eval_ids)
             
             # 欠損値処理
-            missing_val = self._get_missing_value(missing_value)
-            row_data = [missing_val if (cell is None or cell == '') else cell for cell in row_data]
-            
-            writer.writerow(row_data)
-        
-        return self._add_bom_if_excel(output.getvalue(), excel_format)
-
+            yield [missing_val if (cell is None or cell == '') else cell for cell in row_data]
@@ -0,0 +1,230 @@
+"""並列エクスポートのベンチマーク
+
+合成した実験（デフォルト: 20,000セッション × 20メッセージ）に対して、ワイド形式CSV・コードブック付きZIP・
+全メッセージCSVのエクスポート時間をワーカー数ごとに計測し、逐次処理との速度比を表示する。
+並列処理の出力が逐次処理と一致することも確認する。
+
+使い方:
+    python -m src.exporters.export_benchmark                        # 20,000セッション、1〜CPUコア数のワーカー
+    python -m src.exporters.export_benchmark --sessions 5000 --workers 1,2,4
+    python -m src.exporters.export_benchmark --data-dir /tmp/bench  # 合成データを残して次回以降は再利用
+
+合成データの実験フロー: 同意 → 事前アンケート → ブランチ（共感/中立のチャット）→ AI評価 → 事後アンケート
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from ..managers.experiment_manager import ExperimentManager
+from ..managers.message_store import MessageStore
+from ..managers.session_manager import SessionManager
+from .data_exporter import DataExporter
+from .parallel_export import ParallelExportEngine
+
+BENCH_EXPERIMENT_NAME = "export_benchmark"
+
+BENCH_FLOW = [
+    {"step_id": "consent", "step_type": "consent"},
+    {"step_id": "pre", "step_type": "survey", "survey_questions": [
+        {"question_id": f"pre_{i}", "question_type": "likert", "scale": 7, "question_text": f"事前質問{i}"}
+        for i in range(1, 6)
+    ] + [
+        {"question_id": "pre_gender", "question_type": "radio", "options": ["男性", "女性", "その他"],
+         "question_text": "性別"},
+    ]},
+    {"step_id": "branch1", "step_type": "branch", "branches": [
+        {"branch_id": "empathy", "condition_label": "共感", "condition_value": 1, "steps": [
+            {"step_id": "chat_e", "step_type": "chat", "bot_model": "gemma3:4b", "bot_name": "AI-E"}]},
+        {"branch_id": "neutral", "condition_label": "中立", "condition_value": 2, "steps": [
+            {"step_id": "chat_n", "step_type": "chat", "bot_model": "gemma3:4b", "bot_name": "AI-N"}]},
+    ]},
+    {"step_id": "eval", "step_type": "ai_evaluation"},
+    {"step_id": "post", "step_type": "survey", "survey_questions": [
+        {"question_id": f"post_{i}", "question_type": "likert", "scale": 7, "question_text": f"事後質問{i}"}
+        for i in range(1, 6)
+    ] + [
+        {"question_id": "post_free", "question_type": "text", "question_text": "自由記述"},
+        {"question_id": "post_multi", "question_type": "checkbox", "options": ["a", "b", "c"],
+         "question_text": "複数選択"},
+    ]},
+]
+
+
+def build_experiment(base_dir: Path, sessions: int, messages_per_session: int, seed: int = 0) -> str:
+    """合成実験を作成して実験IDを返す（同じ規模の合成実験があれば再利用）"""
+    experiment_manager = ExperimentManager(base_dir=str(base_dir))
+    for experiment in experiment_manager.get_all_experiments():
+        data_dir = Path(experiment.data_directory)
+        if (experiment.name == BENCH_EXPERIMENT_NAME
+                and len(list((data_dir / "sessions").glob("*.json"))) == sessions):
+            print(f"♻️  Reusing synthetic experiment: {data_dir}")
+            return experiment.experiment_id
+
+    experiment = experiment_manager.create_experiment(BENCH_EXPERIMENT_NAME, slug=f"bench_{sessions}")
+    experiment.experiment_flow = BENCH_FLOW
+    data_dir = Path(experiment.data_directory)
+    experiment_manager._save_experiment(experiment, data_dir)
+
+    print(f"🛠️  Generating {sessions} sessions × {messages_per_session} messages in {data_dir} ...")
+    started = time.time()
+    rnd = random.Random(seed)
+    base_time = datetime(2026, 1, 1, 9, 0, 0)
+    for i in range(sessions):
+        session_id = f"sess_{i:06d}"
+        client_id = f"p{i}"
+        created_at = base_time + timedelta(minutes=i)
+        branch = rnd.choice(["empathy", "neutral"])
+        chat_step = "chat_e" if branch == "empathy" else "chat_n"
+        completed = rnd.random() < 0.9
+        step_responses = {
+            "pre": {client_id: {
+                "survey_responses": [{"question_id": f"pre_{k}", "answer": rnd.randint(1, 7)} for k in range(1, 6)]
+                + [{"question_id": "pre_gender", "answer": rnd.choice(["男性", "女性", "その他"])}],
+                "question_order": [f"pre_{k}" for k in rnd.sample(range(1, 6), 5)],
+            }},
+            "eval": {"ai_system": {"evaluation_results": {"warmth": rnd.randint(1, 7),
+                                                          "competence": rnd.randint(1, 7)}}},
+        }
+        if completed:
+            step_responses["post"] = {client_id: {
+                "survey_responses": [{"question_id": f"post_{k}", "answer": rnd.randint(1, 7)} for k in range(1, 6)]
+                + [{"question_id": "post_free", "answer": "とても\n良かった"},
+                   {"question_id": "post_multi", "answer": rnd.sample(["a", "b", "c"], 2)}],
+            }}
+        session = {
+            "session_id": session_id,
+            "created_at": created_at.isoformat(),
+            "ended_at": (created_at + timedelta(minutes=15)).isoformat() if completed else None,
+            "status": "completed" if completed else "ended",
+            "participants": [],
+            "total_messages": messages_per_session,
+            "last_activity": created_at.isoformat(),
+            "experiment_id": experiment.experiment_id,
+            "participant_code": f"C{i:05d}",
+            "client_id": client_id,
+            "completed_steps": ["consent", "pre", chat_step, "eval"] + (["post"] if completed else []),
+            "step_responses": step_responses,
+            "assigned_conditions": {"branch1": branch},
+        }
+        with open(data_dir / "sessions" / f"{session_id}.json", 'w', encoding='utf-8') as f:
+            json.dump(session, f, ensure_ascii=False, indent=2)
+
+        messages = []
+        for k in range(messages_per_session):
+            is_bot = k % 2 == 1
+            content = ("こんにちは、今日はどうでしたか？" * rnd.randint(1, 6) if is_bot
+                       else f"message {k} from {client_id}、少し疲れました")
+            messages.append({
+                "message_id": f"msg_{i:06d}_{k:03d}",
+                "session_id": session_id,
+                "client_id": "bot" if is_bot else client_id,
+                "internal_id": "bot" if is_bot else client_id,
+                "message_type": "bot" if is_bot else "user",
+                "content": content,
+                "timestamp": (created_at + timedelta(seconds=30 * k)).isoformat(),
+                "metadata": {"char_count": len(content), "word_count": len(content.split())},
+            })
+        with open(data_dir / "messages" / f"{session_id}.json", 'w', encoding='utf-8') as f:
+            json.dump(messages, f, ensure_ascii=False, indent=2)
+    print(f"   done in {time.time() - started:.1f}s")
+    return experiment.experiment_id
+
+
+def _zip_members(content: bytes) -> Dict[str, bytes]:
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def run(base_dir: Path, sessions: int, messages_per_session: int, worker_counts: List[int]) -> List[Dict]:
+    experiment_id = build_experiment(base_dir, sessions, messages_per_session)
+    experiment_manager = ExperimentManager(base_dir=str(base_dir))
+    experiment_manager.current_data_dir = Path(experiment_manager.get_experiment(experiment_id).data_directory)
+    session_manager = SessionManager(experiment_manager=experiment_manager)
+    message_store = MessageStore(experiment_manager=experiment_manager)
+
+    exports: Dict[str, Callable[[DataExporter], object]] = {
+        "wide": lambda exporter: ''.join(exporter.iter_experiment_wide_format_csv(
+            experiment_id, session_manager, message_store, experiment_manager)),
+        "codebook": lambda exporter: _zip_members(exporter.export_experiment_wide_format_with_codebook(
+            experiment_id, session_manager, message_store, experiment_manager)),
+        "messages": lambda exporter: ''.join(exporter.iter_experiment_all_data_csv(
+            experiment_id, session_manager, message_store)),
+    }
+
+    results = []
+    baseline: Dict[str, object] = {}
+    baseline_seconds: Dict[str, float] = {}
+    for workers in worker_counts:
+        engine = ParallelExportEngine(workers=workers, min_sessions=0) if workers > 1 else None
+        exporter = DataExporter(parallel_engine=engine)
+        try:
+            if engine is not None:
+                # ワーカーの起動（spawn）は初回のみのため計測から除く
+                engine.warm_up()
+            for name, export in exports.items():
+                started = time.perf_counter()
+                output = export(exporter)
+                elapsed = time.perf_counter() - started
+                if workers == worker_counts[0]:
+                    baseline[name], baseline_seconds[name] = output, elapsed
+                results.append({
+                    "export": name,
+                    "workers": workers,
+                    "seconds": elapsed,
+                    "speedup": baseline_seconds[name] / elapsed if elapsed > 0 else 0.0,
+                    "identical": output == baseline[name],
+                })
+        finally:
+            if engine is not None:
+                engine.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel wide/codebook/messages exports")
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=20, help="messages per session")
+    parser.add_argument("--workers", default=None,
+                        help="comma-separated worker counts (default: 1,2,4,... up to CPU count); 1 = sequential")
+    parser.add_argument("--data-dir", default=None, help="keep synthetic data here and reuse it on later runs")
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    if args.workers:
+        worker_counts = [int(w) for w in args.workers.split(",")]
+    else:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= cpu_count:
+            worker_counts.append(worker_counts[-1] * 2)
+        if worker_counts[-1] != cpu_count:
+            worker_counts.append(cpu_count)
+    if worker_counts[0] != 1:
+        worker_counts.insert(0, 1)  # 速度比と出力の一致は逐次処理を基準にする
+
+    base_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp(prefix="export_bench_"))
+    print(f"CPU cores: {cpu_count}, worker counts: {worker_counts}")
+    try:
+        results = run(base_dir, args.sessions, args.messages, worker_counts)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    print(f"\n{'export':<10} {'workers':>7} {'seconds':>9} {'speedup':>8}  identical")
+    for result in results:
+        print(f"{result['export']:<10} {result['workers']:>7} {result['seconds']:>9.2f} "
+              f"{result['speedup']:>7.2f}x  {'yes' if result['identical'] else 'NO'}")
+    if not all(result["identical"] for result in results):
+        raise SystemExit("❌ Parallel export output differs from the sequential export")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""バックグラウンドのエクスポートジョブと exports/ のキャッシュ
+
+大規模な実験のエクスポートはHTTPリクエストの中で作成すると、完了まで管理画面の操作を待たせる。
+エクスポートをジョブとしてスレッドで作成し、成果物を実験ディレクトリの exports/ に保存する。
+管理者はジョブを開始したあとも画面を使い続け、完了後にダウンロードできる。
+
+成果物のファイル名は 実験ID・種類・オプション・データのバージョン から決まり、データが変わっていなければ
+同じ条件の2回目以降のエクスポートは保存済みのファイルをそのまま返す（サーバー再起動後も有効）。
+データのバージョンはセッション・メッセージファイルの件数・合計サイズ・最終更新時刻と experiment.json の
+更新時刻から求める（ファイルは読み込まない）。新しいバージョンを保存したら、同じ条件の古い成果物は削除する。
+
+設定（環境変数）:
+    EXPORT_JOB_WORKERS : 同時に実行するジョブ数（デフォルト: 1、それ以上は順番待ち）
+    EXPORT_JOB_HISTORY : メモリに残す完了済みジョブ数（デフォルト: 50）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..managers.experiment_manager import ExperimentManager
+from ..managers.message_store import MessageStore
+from ..managers.session_manager import SessionManager
+from ..models.experiment_group import ExperimentGroup
+from .data_exporter import MISSING_VALUE_OPTIONS, DataExporter
+from .columnar_export import COLUMNAR_DATASETS, COLUMNAR_FORMATS
+
+# ジョブの種類 → 説明
+EXPORT_JOB_KINDS = {
+    'wide': 'ワイド形式CSV',
+    'codebook': 'ワイド形式 + コードブック（ZIP）',
+    'messages': '全メッセージCSV',
+    'sessions': 'セッション情報CSV',
+    'survey': 'アンケート回答（CSV / JSON）',
+    'columnar': 'Parquet / Feather',
+    'bundle': '実験データ一式（ZIP）',
+}
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+# CSVの行末（csv.writer の既定）。書き出した行数の計測に使う
+CSV_LINE_TERMINATOR = '\r\n'
+
+
+def normalize_job_options(kind: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], str, str]:
+    """ジョブのオプションを検証・正規化し、(オプション, 拡張子, MIMEタイプ) を返す（不正な場合は ValueError）"""
+    if kind in ('wide', 'codebook', 'bundle'):
+        missing_value = params.get('missing_value') or 'blank'
+        if missing_value not in MISSING_VALUE_OPTIONS:
+            raise ValueError(f"missing_value must be one of {', '.join(MISSING_VALUE_OPTIONS)}")
+        options = {'excel_format': bool(params.get('excel_format')), 'missing_value': missing_value}
+        if kind in ('codebook', 'bundle'):
+            return options, 'zip', 'application/zip'
+        return options, 'csv', 'text/csv; charset=utf-8'
+    if kind in ('messages', 'sessions'):
+        return {}, 'csv', 'text/csv'
+    if kind == 'survey':
+        fmt = params.get('format') or 'json'
+        if fmt not in ('csv', 'json'):
+            raise ValueError("format must be csv or json")
+        return {'format': fmt}, fmt, 'text/csv' if fmt == 'csv' else 'application/json'
+    if kind == 'columnar':
+        dataset = params.get('dataset') or 'wide'
+        fmt = params.get('format') or 'parquet'
+        if dataset not in COLUMNAR_DATASETS:
+            raise ValueError(f"dataset must be one of {', '.join(COLUMNAR_DATASETS)}")
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(COLUMNAR_FORMATS)}")
+        extension, media_type = COLUMNAR_FORMATS[fmt]
+        return {'dataset': dataset, 'format': fmt}, extension, media_type
+    raise ValueError(f"kind must be one of {', '.join(EXPORT_JOB_KINDS)}")
+
+
+def _dir_signature(path: Path) -> Tuple[int, int, int]:
+    """ディレクトリ内のJSONファイルの (件数, 合計サイズ, 最終更新時刻ns)"""
+    count = size = latest = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                count += 1
+                size += st.st_size
+                latest = max(latest, st.st_mtime_ns)
+    except FileNotFoundError:
+        pass
+    return count, size, latest
+
+
+class ExportJob:
+    """1件のエクスポートジョブ（進捗はワーカースレッドが更新し、APIはそのまま読み出す）"""
+
+    def __init__(self, experiment_id: str, kind: str, options: Dict[str, Any], extension: str,
+                 media_type: str, artifact_path: Path, data_version: str, expected_rows: Optional[int]):
+        self.job_id = f"job_{uuid.uuid4().hex[:12]}"
+        self.experiment_id = experiment_id
+        self.kind = kind
+        self.options = options
+        self.extension = extension
+        self.media_type = media_type
+        self.artifact_path = artifact_path
+        self.data_version = data_version
+        self.status = STATUS_QUEUED
+        self.cache_hit = False
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.error: Optional[str] = None
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.expected_rows = expected_rows  # 1行 = 1セッションの形式のみ（進捗率の目安）
+
+    @property
+    def active(self) -> bool:
+        return self.status in (STATUS_QUEUED, STATUS_RUNNING)
+
+    def progress_percent(self) -> Optional[float]:
+        if self.status == STATUS_COMPLETED:
+            return 100.0
+        if not self.expected_rows or self.status != STATUS_RUNNING:
+            return None
+        # ヘッダー行を除く。完了までは100%にしない
+        return round(min(max(self.rows_written - 1, 0) / self.expected_rows * 100, 99.0), 1)
+
+    def download_filename(self) -> str:
+        """ダウンロード時のファイル名（直接エクスポートと同じ命名）"""
+        finished = datetime.fromisoformat(self.finished_at) if self.finished_at else datetime.now()
+        timestamp = finished.strftime("%Y%m%d_%H%M%S")
+        if self.kind in ('wide', 'codebook'):
+            suffix = "_excel" if self.options.get('excel_format') and self.kind == 'wide' else ""
+            return f"wide_format_{self.experiment_id}_{timestamp}{suffix}.{self.extension}"
+        if self.kind == 'columnar':
+            return f"{self.options['dataset']}_{self.experiment_id}_{timestamp}.{self.extension}"
+        if self.kind == 'bundle':
+            return f"bundle_{self.experiment_id}_{timestamp}.{self.extension}"
+        return f"{self.kind}_experiment_{self.experiment_id}_{timestamp}.{self.extension}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "experiment_id": self.experiment_id,
+            "kind": self.kind,
+            "options": self.options,
+            "status": self.status,
+            "cache_hit": self.cache_hit,
+            "data_version": self.data_version,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "progress": {
+                "rows_written": self.rows_written,
+                "bytes_written": self.bytes_written,
+                "expected_rows": self.expected_rows,
+                "percent": self.progress_percent(),
+            },
+            "filename": self.download_filename() if self.status == STATUS_COMPLETED else None,
+            "download_url": f"/api/export_jobs/{self.job_id}/download" if self.status == STATUS_COMPLETED else None,
+        }
+
+
+class ExportJobManager:
+    """エクスポートジョブの受付・実行・成果物のキャッシュ"""
+
+    def __init__(self, data_exporter: DataExporter, session_manager: SessionManager,
+                 message_store: MessageStore, experiment_manager: ExperimentManager,
+                 columnar_exporter=None, workers: Optional[int] = None, history: Optional[int] = None):
+        self.data_exporter = data_exporter
+        self.columnar_exporter = columnar_exporter
+        self.session_manager = session_manager
+        self.message_store = message_store
+        self.experiment_manager = experiment_manager
+        self.workers = max(workers if workers is not None else int(os.environ.get("EXPORT_JOB_WORKERS", 1)), 1)
+        self.history = max(history if history is not None else int(os.environ.get("EXPORT_JOB_HISTORY", 50)), 1)
+        self.jobs: "OrderedDict[str, ExportJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.cache_hits = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export-job")
+        return self._executor
+
+    def data_version(self, experiment: ExperimentGroup) -> Tuple[str, int]:
+        """(データのバージョン, セッションファイル数) をファイルの状態から求める"""
+        sessions = _dir_signature(self.session_manager.data_dir)
+        messages = _dir_signature(self.message_store.data_dir)
+        try:
+            experiment_mtime = (Path(experiment.data_directory) / "experiment.json").stat().st_mtime_ns
+        except FileNotFoundError:
+            experiment_mtime = 0
+        key = f"{self.session_manager.data_dir}|{sessions}|{self.message_store.data_dir}|{messages}|{experiment_mtime}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12], sessions[0]
+
+    def _artifact_prefix(self, experiment_id: str, kind: str, options: Dict[str, Any]) -> str:
+        options_key = hashlib.sha1(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        return f"{experiment_id}_{kind}_{options_key}_"
+
+    def submit(self, experiment: ExperimentGroup, kind: str, params: Dict[str, Any]) -> ExportJob:
+        """ジョブを登録して返す（同じ条件・同じデータの成果物があれば作成せずに完了済みとする）"""
+        options, extension, media_type = normalize_job_options(kind, params)
+        exports_dir = Path(experiment.data_directory) / "exports"
+        exports_dir.mkdir(parents=True, exist_ok=True)
+        data_version, session_files = self.data_version(experiment)
+        prefix = self._artifact_prefix(experiment.experiment_id, kind, options)
+        artifact_path = exports_dir / f"{prefix}{data_version}.{extension}"
+        expected_rows = session_files if kind in ('wide', 'sessions') else None
+
+        with self._lock:
+            # 同じ成果物を作成中のジョブがあればそれを返す
+            for job in self.jobs.values():
+                if job.active and job.artifact_path == artifact_path:
+                    return job
+            job = ExportJob(experiment.experiment_id, kind, options, extension, media_type,
+                            artifact_path, data_version, expected_rows)
+            self.jobs[job.job_id] = job
+            self._prune()
+
+        if artifact_path.exists():
+            job.status = STATUS_COMPLETED
+            job.cache_hit = True
+            job.bytes_written = artifact_path.stat().st_size
+            job.started_at = job.finished_at = datetime.fromtimestamp(artifact_path.stat().st_mtime).isoformat()
+            self.cache_hits += 1
+            print(f"[Export] 📦 Export job {job.job_id}: cached {artifact_path.name}")
+            return job
+
+        self._get_executor().submit(self._run, job)
+        print(f"[Export] ⏳ Export job {job.job_id} queued: {kind} {options} for {experiment.experiment_id}")
+        return job
+
+    def _prune(self):
+        """完了済みのジョブを古い順に履歴の上限まで削除（成果物のファイルは残す）"""
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def _run(self, job: ExportJob):
+        job.status = STATUS_RUNNING
+        job.started_at = datetime.now().isoformat()
+        started = time.time()
+        part_path = job.artifact_path.with_name(job.artifact_path.name + ".part")
+        try:
+            self._generate(job, part_path)
+            os.replace(part_path, job.artifact_path)
+            job.bytes_written = job.artifact_path.stat().st_size
+            job.finished_at = datetime.now().isoformat()
+            job.status = STATUS_COMPLETED
+            self._remove_old_versions(job)
+            print(f"[Export] ✅ Export job {job.job_id} completed: {job.artifact_path.name} "
+                  f"({job.bytes_written} bytes, {time.time() - started:.2f}s)")
+        except Exception as e:
+            job.error = str(e)
+            job.finished_at = datetime.now().isoformat()
+            job.status = STATUS_FAILED
+            if part_path.exists():
+                part_path.unlink()
+            print(f"[Export] ❌ Export job {job.job_id} failed: {e}")
+
+    def _generate(self, job: ExportJob, path: Path):
+        """成果物を path に書き出す"""
+        exporter = self.data_exporter
+        sm, ms, em = self.session_manager, self.message_store, self.experiment_manager
+        experiment_id, options = job.experiment_id, job.options
+
+        if job.kind == 'columnar':
+            if self.columnar_exporter is None:
+                raise RuntimeError("Columnar export is not configured")
+            job.rows_written = self.columnar_exporter.export(
+                options['dataset'], options['format'], str(path), experiment_id, sm, ms, em)
+            return
+
+        if job.kind == 'codebook':
+            chunks = exporter.iter_experiment_wide_format_with_codebook(
+                experiment_id, sm, ms, em,
+                excel_format=options['excel_format'], missing_value=options['missing_value'])
+        elif job.kind == 'bundle':
+            chunks = exporter.iter_experiment_bundle(
+                experiment_id, sm, ms, em,
+                excel_format=options['excel_format'], missing_value=options['missing_value'])
+        elif job.kind == 'wide':
+            chunks = exporter.iter_experiment_wide_format_csv(
+                experiment_id, sm, ms, em,
+                excel_format=options['excel_format'], missing_value=options['missing_value'])
+        elif job.kind == 'messages':
+            chunks = exporter.iter_experiment_all_data_csv(experiment_id, sm, ms)
+        elif job.kind == 'sessions':
+            chunks = exporter.iter_experiment_sessions_csv(experiment_id, sm)
+        elif options['format'] == 'csv':
+            chunks = exporter.iter_experiment_survey_responses_csv(experiment_id, sm)
+        else:
+            chunks = exporter.iter_experiment_survey_responses_json(experiment_id, sm)
+
+        is_csv = job.extension == 'csv'
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                # ZIPはバイト列のチャンク（行数は数えない）
+                data = chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+                f.write(data)
+                job.bytes_written += len(data)
+                if is_csv:
+                    job.rows_written += chunk.count(CSV_LINE_TERMINATOR)
+
+    def _remove_old_versions(self, job: ExportJob):
+        """同じ条件の古いバージョンの成果物を削除（並行して作成された新しい成果物は残す）"""
+        prefix = self._artifact_prefix(job.experiment_id, job.kind, job.options)
+        current_mtime = job.artifact_path.stat().st_mtime_ns
+        for old_path in job.artifact_path.parent.glob(f"{prefix}*.{job.extension}"):
+            if old_path == job.artifact_path:
+                continue
+            try:
+                if old_path.stat().st_mtime_ns <= current_mtime:
+                    old_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def get_job(self, job_id: str) -> Optional[ExportJob]:
+        return self.jobs.get(job_id)
+
+    def list_jobs(self, experiment_id: Optional[str] = None) -> List[ExportJob]:
+        """ジョブを新しい順に返す"""
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job for job in reversed(jobs) if experiment_id is None or job.experiment_id == experiment_id]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict:
+        jobs = self.list_jobs()
+        return {
+            "workers": self.workers,
+            "queued": sum(1 for job in jobs if job.status == STATUS_QUEUED),
+            "running": sum(1 for job in jobs if job.status == STATUS_RUNNING),
+            "completed": sum(1 for job in jobs if job.status == STATUS_COMPLETED),
+            "failed": sum(1 for job in jobs if job.status == STATUS_FAILED),
+            "cache_hits": self.cache_hits,
+        }
@@ -0,0 +1,222 @@
+"""大規模な実験のエクスポートをプロセスプールで並列に作成する
+
+ワイド形式・コードブック付きZIP・全メッセージのエクスポートは、セッション/メッセージJSONの読み込みと
+行の組み立てがCPU律速で、Webプロセスの1コアで実行されていた。
+セッションファイルを連続した区間（パーティション）に分けて ProcessPoolExecutor のワーカーで処理し、
+結果を逐次処理と同じセッション順（作成日時の降順、同時刻はファイルの列挙順）に並べ直して結合する。
+出力は逐次処理とバイト単位で一致する。
+
+- ワイド形式・コードブック: ワーカーがセッションの読み込み・回答の走査・トランスクリプトの集計を行い、
+  親プロセスは列名の登録と行の整形のみを行う
+- 全メッセージ: 1段目でセッションの順序を確定し、2段目でワーカーがセッション区間ごとにCSVテキストを作成する。
+  区間の結果はセッション順に受け取りながら送信する（処理中の区間数は上限あり）
+
+セッションファイル数が EXPORT_PARALLEL_MIN_SESSIONS 未満の場合は、プロセス間の受け渡しの方が
+高くつくため逐次処理のまま。ワーカーはWebサーバーのスレッドをforkしないよう spawn で起動し、
+最初の並列エクスポート時に作成して以降は使い回す。
+
+設定（環境変数）:
+    EXPORT_WORKERS               : ワーカープロセス数（デフォルト: CPUコア数の半分、1以下で並列化しない）
+                                   同じマシンで推論するOllamaのためにコアを残す
+    EXPORT_PARALLEL_MIN_SESSIONS : 並列化するセッションファイル数の下限（デフォルト: 2000）
+    EXPORT_PARTITION_SESSIONS    : 1タスクで処理するセッションファイル数（デフォルト: 500）
+"""
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..managers.message_store import MessageStore
+from ..models.session import Session
+from .data_exporter import EXPERIMENT_MESSAGES_CSV_HEADER, DataExporter, FlowIndex, SessionExtract
+
+# (列挙順, セッションファイルのパス)
+SessionFileRef = Tuple[int, str]
+
+
+def _load_sessions(file_refs: List[SessionFileRef]) -> Iterator[Tuple[int, Session]]:
+    """セッションファイルを読み込む（読めないファイルは逐次処理と同様にスキップ）"""
+    for index, path in file_refs:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                yield index, Session.from_dict(json.load(f))
+        except Exception as e:
+            print(f"Error loading session {path}: {e}")
+
+
+def _extract_partition(file_refs: List[SessionFileRef], experiment_id: str,
+                       messages_dir: Optional[str],
+                       experiment_flow_raw: Optional[List[Dict]]) -> List[Tuple[int, SessionExtract]]:
+    """ワーカー: 区間内の実験のセッションからワイド形式・コード化データの材料を作成"""
+    exporter = DataExporter()
+    flow_index = FlowIndex(experiment_flow_raw)
+    message_store = MessageStore(data_dir=messages_dir) if messages_dir else None
+    return [
+        (index, exporter._extract_session(session, flow_index, message_store))
+        for index, session in _load_sessions(file_refs)
+        if session.experiment_id == experiment_id
+    ]
+
+
+def _list_partition(file_refs: List[SessionFileRef], experiment_id: str) -> List[Tuple[int, str, str, Optional[str]]]:
+    """ワーカー: 区間内の実験のセッションの (列挙順, 作成日時, セッションID, 実験グループ)"""
+    return [
+        (index, session.created_at, session.session_id, session.experiment_group)
+        for index, session in _load_sessions(file_refs)
+        if session.experiment_id == experiment_id
+    ]
+
+
+def _render_messages_partition(experiment_id: str, session_refs: List[Tuple[str, Optional[str]]],
+                               messages_dir: str, until: Optional[int] = None) -> str:
+    """ワーカー: セッション区間のメッセージCSVテキスト（ヘッダーなし、until 指定時はその変更シーケンスまで）"""
+    exporter = DataExporter()
+    rows = exporter._session_messages_csv_rows(experiment_id, session_refs, MessageStore(data_dir=messages_dir),
+                                               until=until)
+    return ''.join(exporter._iter_csv(rows))
+
+
+def _warm_up(seconds: float):
+    """ワーカー: 起動とモジュールの読み込みのみ行う"""
+    time.sleep(seconds)
+
+
+def _session_order(items: List[Tuple[int, Any]], created_at: Callable[[Any], str]) -> List[Any]:
+    """逐次処理（SessionManager.get_all_sessions）と同じ順序に並べる: 作成日時の降順、同時刻は列挙順"""
+    items.sort(key=lambda item: item[0])
+    items.sort(key=lambda item: created_at(item[1]), reverse=True)
+    return [item[1] for item in items]
+
+
+class ParallelExportEngine:
+    """セッションを区間に分けてワーカープロセスでエクスポートを作成する"""
+
+    def __init__(self, workers: Optional[int] = None, min_sessions: Optional[int] = None,
+                 partition_size: Optional[int] = None):
+        self.workers = workers if workers is not None else int(
+            os.environ.get("EXPORT_WORKERS", max((os.cpu_count() or 1) // 2, 1)))
+        self.min_sessions = min_sessions if min_sessions is not None else int(
+            os.environ.get("EXPORT_PARALLEL_MIN_SESSIONS", 2000))
+        self.partition_size = max(partition_size if partition_size is not None else int(
+            os.environ.get("EXPORT_PARTITION_SESSIONS", 500)), 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.exports = 0
+        self.last_export: Optional[Dict] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def _session_files(self, sessions_dir: Path) -> List[SessionFileRef]:
+        return [(index, str(path)) for index, path in enumerate(Path(sessions_dir).glob("*.json"))]
+
+    def should_parallelize(self, sessions_dir: Path) -> bool:
+        """セッションファイル数が閾値以上の場合のみ並列化する"""
+        if not self.enabled:
+            return False
+        count = 0
+        for _ in Path(sessions_dir).glob("*.json"):
+            count += 1
+            if count >= self.min_sessions:
+                return True
+        return False
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def warm_up(self):
+        """すべてのワーカーを起動してモジュールを読み込ませる（初回エクスポートの待ち時間を減らす）"""
+        executor = self._get_executor()
+        for future in [executor.submit(_warm_up, 0.2) for _ in range(self.workers)]:
+            future.result()
+
+    def _partitions(self, items: List[Any]) -> List[List[Any]]:
+        return [items[i:i + self.partition_size] for i in range(0, len(items), self.partition_size)]
+
+    def _ordered_map(self, fn: Callable, tasks: Iterable[Tuple]) -> Iterator[Any]:
+        """タスクを並列に実行し、投入順に結果を返す（処理中のタスクは ワーカー数×2 まで）"""
+        executor = self._get_executor()
+        pending = deque()
+        try:
+            for args in tasks:
+                pending.append(executor.submit(fn, *args))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _record(self, kind: str, experiment_id: str, sessions: int, started: float):
+        elapsed = time.time() - started
+        self.exports += 1
+        self.last_export = {
+            "kind": kind,
+            "experiment_id": experiment_id,
+            "sessions": sessions,
+            "workers": self.workers,
+            "elapsed_seconds": round(elapsed, 3),
+        }
+        print(f"[Export] ⚡ Parallel {kind} export: {sessions} sessions, {self.workers} workers, {elapsed:.2f}s")
+
+    def extract_sessions(self, experiment_id: str, sessions_dir: Path, messages_dir: Optional[Path],
+                         experiment_flow_raw: Optional[List[Dict]]) -> List[SessionExtract]:
+        """実験の全セッションの材料をワーカーで作成し、逐次処理と同じセッション順で返す"""
+        started = time.time()
+        items = self.extract_session_files(experiment_id, self._session_files(sessions_dir),
+                                           messages_dir, experiment_flow_raw)
+        extracts = _session_order(items, lambda extract: extract.session.created_at)
+        self._record("wide", experiment_id, len(extracts), started)
+        return extracts
+
+    def extract_session_files(self, experiment_id: str, file_refs: List[SessionFileRef],
+                              messages_dir: Optional[Path],
+                              experiment_flow_raw: Optional[List[Dict]]) -> List[Tuple[int, SessionExtract]]:
+        """指定したセッションファイルのうち実験に属するものの材料をワーカーで作成（(列挙順, 材料) を返す）"""
+        messages_dir = str(messages_dir) if messages_dir else None
+        tasks = ((part, experiment_id, messages_dir, experiment_flow_raw) for part in self._partitions(file_refs))
+        return [item for result in self._ordered_map(_extract_partition, tasks) for item in result]
+
+    def iter_messages_csv(self, experiment_id: str, sessions_dir: Path, messages_dir: Path,
+                          until: Optional[int] = None) -> Iterator[str]:
+        """実験全体のメッセージCSVを区間ごとにワーカーで作成し、セッション順に出力
+        
+        until（ウォーターマーク）を指定すると、それより後に保存されたメッセージは含めない。
+        """
+        started = time.time()
+        tasks = ((part, experiment_id) for part in self._partitions(self._session_files(sessions_dir)))
+        items = [(index, (created_at, session_id, experiment_group))
+                 for result in self._ordered_map(_list_partition, tasks)
+                 for index, created_at, session_id, experiment_group in result]
+        session_refs = [(session_id, experiment_group)
+                        for _, session_id, experiment_group in _session_order(items, lambda ref: ref[0])]
+
+        yield from DataExporter()._iter_csv([list(EXPERIMENT_MESSAGES_CSV_HEADER)])
+        tasks = ((experiment_id, part, str(messages_dir), until) for part in self._partitions(session_refs))
+        for text in self._ordered_map(_render_messages_partition, tasks):
+            if text:
+                yield text
+        self._record("messages", experiment_id, len(session_refs), started)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "enabled": self.enabled,
+            "min_sessions": self.min_sessions,
+            "partition_size": self.partition_size,
+            "exports": self.exports,
+            "last_export": self.last_export,
+        }
@@ -0,0 +1,194 @@
+"""実験ごとのワイド形式テーブル（マテリアライズ）
+
+ワイド形式の作成で重いのは、全セッションJSONとトランスクリプトの読み込み・回答の走査。
+1行の値が変わるのはそのセッションがステップの回答を記録したとき・条件が割り当てられたとき・完了したときなので、
+フローの処理（add_step_response / assign_condition / 完了）から該当する行だけを作り直し、
+エクスポートは保持している行を並べて出力するだけにする。
+
+- 行: セッションごとの SessionExtract（走査済みの回答、発言数などの集計）
+- 列の登録: WideLayout。列順は従来どおり「作成日時の降順に並べたセッションでの出現順」のため、
+  行が変わったときに破棄し、次のエクスポートで保持している行から作り直す（ファイルの読み込みは不要）
+
+フローを通らない変更（管理画面からのステータス変更、チャットや入退室のメッセージ、セッションの削除、
+サーバー外でのファイル編集）を取りこぼさないよう、エクスポート時にセッション・メッセージファイルの
+状態（更新時刻とサイズ）を確認し、変わっていた行だけを読み直す（managers.file_row_cache）。出力は毎回全件から作成した場合と一致する。
+
+テーブルはメモリ上のみに持ち、サーバー起動後の最初のエクスポートで作成する。
+"""
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..managers.file_row_cache import CachedRow, FileRowCache, file_state
+from ..managers.message_store import MessageStore
+from ..managers.session_manager import SessionManager
+from ..models.session import Session
+from .data_exporter import DataExporter, FlowIndex, SessionExtract, WideLayout
+
+
+def _slim(extract: SessionExtract) -> SessionExtract:
+    """保持する行から回答の生データを除く（列の値は SessionColumns に走査済み）"""
+    extract.session = extract.session.model_copy(update={
+        'step_responses': {}, 'survey_responses': {}, 'status_history': [],
+    })
+    return extract
+
+
+class MaterializedWideTable(FileRowCache):
+    """1実験分のワイド形式の行と列構成
+
+    行の状態はセッションファイルとメッセージファイルの状態の組。
+    """
+
+    def __init__(self, experiment_id: str, sessions_dir: Path):
+        super().__init__(sessions_dir)
+        self.experiment_id = experiment_id
+        self.flow_index: Optional[FlowIndex] = None
+        self._flow_key: Optional[str] = None
+        self._extractor = DataExporter()
+        self._layout: Optional[WideLayout] = None
+
+    def _created_at(self, extract: SessionExtract) -> str:
+        return extract.session.created_at
+
+    def _row_replaced(self, old: Optional[CachedRow], new: Optional[CachedRow]):
+        self._layout = None
+
+    def _set_flow(self, flow_index: FlowIndex):
+        flow_key = json.dumps(flow_index.flow, ensure_ascii=False, sort_keys=True, default=str)
+        if flow_key != self._flow_key:
+            # チャットステップの情報は実験フローから決まるため、フローが変わったら全行を作り直す
+            self._clear()
+            self.flow_index, self._flow_key = flow_index, flow_key
+            self._layout = None
+
+    @staticmethod
+    def _states(path: Path, message_store: MessageStore) -> Tuple[Any, Any]:
+        return (file_state(path), file_state(message_store.data_dir / path.name))
+
+    def update_session(self, session: Session, message_store: MessageStore):
+        """保存直後のセッションの行を作り直す（セッションファイルは読み直さない）"""
+        with self._lock:
+            flow_index, flow_key = self.flow_index, self._flow_key
+        if flow_index is None:
+            return
+        # 状態は材料を作る前に記録する（途中で書き換えられても次のエクスポートで読み直される）
+        state = self._states(self.sessions_dir / f"{session.session_id}.json", message_store)
+        extract = _slim(self._extractor._extract_session(session, flow_index, message_store))
+        with self._lock:
+            if flow_key != self._flow_key:
+                return
+            self._put(session.session_id, extract, state)
+
+    def extracts(self, flow_index: FlowIndex, message_store: MessageStore,
+                 parallel_engine=None) -> List[SessionExtract]:
+        """出力順（作成日時の降順、同時刻はファイルの列挙順）の行。状態が変わったファイルの行だけ読み直す"""
+        with self._lock:
+            self._set_flow(flow_index)
+
+        def load(stale: List[Tuple[Path, Any]]) -> Dict[int, SessionExtract]:
+            refreshed = self._load(stale, flow_index, message_store, parallel_engine)
+            return {i: _slim(extract) for i, extract in refreshed.items() if extract}
+
+        return self._refresh(lambda path: self._states(path, message_store), load)
+
+    def _load(self, stale: List[Tuple[Path, Any]], flow_index: FlowIndex,
+              message_store: MessageStore, parallel_engine=None) -> Dict[int, SessionExtract]:
+        """読み直すファイルのうち実験に属するセッションの材料（件数が多い場合はプロセスプールで作成）"""
+        if (parallel_engine is not None and parallel_engine.enabled
+                and len(stale) >= parallel_engine.min_sessions):
+            file_refs = [(i, str(path)) for i, (path, _) in enumerate(stale)]
+            return dict(parallel_engine.extract_session_files(
+                self.experiment_id, file_refs, message_store.data_dir, flow_index.flow))
+
+        refreshed = {}
+        for i, (path, _) in enumerate(stale):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    session = Session.from_dict(json.load(f))
+            except Exception as e:
+                print(f"Error loading session {path}: {e}")
+                continue
+            if session.experiment_id == self.experiment_id:
+                refreshed[i] = self._extractor._extract_session(session, flow_index, message_store)
+        return refreshed
+
+    def layout(self, extracts: List[SessionExtract], flow_index: FlowIndex) -> WideLayout:
+        """列構成（行が変わっていなければ前回の登録を使い回す）"""
+        with self._lock:
+            if extracts is self._snapshot and self._layout is not None:
+                return self._layout
+        layout = WideLayout(extracts, flow_index)
+        with self._lock:
+            if extracts is self._snapshot:
+                self._layout = layout
+        return layout
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "experiment_id": self.experiment_id,
+                "rows": self.row_count(),
+                "columns": len(self._layout.headers()) if self._layout is not None else None,
+                "updates": self.updates,
+                "refreshes": self.refreshes,
+                "last_refreshed": self.last_refreshed,
+            }
+
+
+class WideTableStore:
+    """実験ごとのマテリアライズしたワイド形式テーブル（最初の全件エクスポートで作成）"""
+
+    def __init__(self, parallel_engine=None):
+        # 初回作成など読み直す行が多い場合に使う ParallelExportEngine
+        self.parallel_engine = parallel_engine
+        self._tables: Dict[Tuple[str, str], MaterializedWideTable] = {}
+        self._lock = threading.Lock()
+
+    def _table(self, experiment_id: str, sessions_dir: Path, create: bool = True) -> Optional[MaterializedWideTable]:
+        key = (experiment_id, str(sessions_dir))
+        with self._lock:
+            table = self._tables.get(key)
+            if table is None and create:
+                table = self._tables[key] = MaterializedWideTable(experiment_id, sessions_dir)
+            return table
+
+    def extracts(self, experiment_id: str, flow_index: FlowIndex, session_manager: SessionManager,
+                 message_store: MessageStore) -> List[SessionExtract]:
+        """実験の全セッションの行（出力順）"""
+        started = time.time()
+        table = self._table(experiment_id, session_manager.data_dir)
+        extracts = table.extracts(flow_index, message_store, self.parallel_engine)
+        print(f"[Export] 📋 Wide table {experiment_id}: {len(extracts)} rows "
+              f"({table.last_refreshed} files reloaded, {time.time() - started:.2f}s)")
+        return extracts
+
+    def layout(self, experiment_id: str, session_manager: SessionManager,
+               extracts: List[SessionExtract], flow_index: FlowIndex) -> WideLayout:
+        table = self._table(experiment_id, session_manager.data_dir, create=False)
+        if table is None:
+            return WideLayout(extracts, flow_index)
+        return table.layout(extracts, flow_index)
+
+    def update_session(self, session: Session, session_manager: SessionManager, message_store: MessageStore):
+        """フローの処理（回答の記録・条件の割り当て・完了）で保存されたセッションの行を更新
+
+        テーブルがまだない実験では何もしない（最初のエクスポートで全件から作成する）。
+        """
+        if not session.experiment_id:
+            return
+        table = self._table(session.experiment_id, session_manager.data_dir, create=False)
+        if table is None:
+            return
+        try:
+            table.update_session(session, message_store)
+        except Exception as e:
+            # 次のエクスポートでファイルの状態から読み直されるため、フローの処理は止めない
+            print(f"[Export] ⚠️  Failed to update wide table row for {session.session_id}: {e}")
+
+    def get_stats(self) -> List[Dict]:
+        with self._lock:
+            tables = list(self._tables.values())
+        return [table.get_stats() for table in tables]
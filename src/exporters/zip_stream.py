@@ -0,0 +1,63 @@
+"""ZIPアーカイブのストリーミング作成
+
+メンバーの内容（CSVなどのチャンク）を生成しながら圧縮し、できたバイト列を順に返す。
+zipfile にシークできない書き込み先を渡すと、各メンバーのサイズとCRCはデータの後ろ（データディスクリプタ）に
+書かれるため、アーカイブ全体やメンバー全体をメモリに持たずに送信できる。展開は通常のZIPと同じ。
+"""
+import time
+import zipfile
+from typing import Iterable, Iterator, List, Tuple, Union
+
+# 送信するチャンクの目安（圧縮後のバイト数がこれを超えたら返す）
+ZIP_STREAM_CHUNK_BYTES = 64 * 1024
+
+# (メンバー名, 内容のチャンク)。チャンクは str（UTF-8で書き込む）または bytes
+ZipMember = Tuple[str, Iterable[Union[str, bytes]]]
+
+
+class _ZipSink:
+    """ZipFile の書き込み先（シーク不可。書き込まれたバイト列を返すまで溜めておく）"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.pending = 0
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self.pending += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def iter_zip(members: Iterable[ZipMember], compression: int = zipfile.ZIP_DEFLATED,
+             chunk_bytes: int = ZIP_STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """メンバーを順に圧縮しながらZIPアーカイブのバイト列を返す
+
+    members は遅延評価でよい（前のメンバーを書き終えてから次のメンバーを取り出す）。
+    ZIP64 は使わないため、1メンバーの大きさは 2GiB 未満に限られる（zipfile.ZIP64_LIMIT）。
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression) as zf:
+        for name, chunks in members:
+            # ZipFile.writestr と同じ更新日時・パーミッション
+            info = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+            info.compress_type = compression
+            info.external_attr = 0o600 << 16
+            with zf.open(info, 'w') as member:
+                for chunk in chunks:
+                    member.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                    if sink.pending >= chunk_bytes:
+                        yield sink.drain()
+            if sink.pending >= chunk_bytes:
+                yield sink.drain()
+    # セントラルディレクトリ（ZipFile を閉じたときに書き込まれる）
+    yield sink.drain()
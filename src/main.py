@@ -2,20 +2,24 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Form
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi import Request
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response
-from typing import Dict, Optional
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Dict, List, Optional
 import json
 import random
+import re
 import os
 import hashlib
 import secrets
 import uuid
+import tempfile
 import asyncio
 import socket
 import logging
 import sys
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import quote
 
 # ========== Logging Setup ==========
 # ログディレクトリを作成
@@ -81,10 +85,22 @@ from .models.condition import Condition, SurveyQuestion
 from .models.experiment_group import ExperimentGroup
 from .managers.session_manager import SessionManager
 from .managers.message_store import MessageStore
-from .exporters.data_exporter import DataExporter
+from .exporters.data_exporter import DataExporter, ExportDelta, UTF8_BOM
+from .exporters.parallel_export import ParallelExportEngine
+from .exporters.wide_table import WideTableStore
+from .exporters.export_jobs import EXPORT_JOB_KINDS, ExportJobManager
+from .exporters import columnar_export
+from .exporters.columnar_export import COLUMNAR_DATASETS, COLUMNAR_FORMATS, ColumnarExporter
 from .managers.bot_manager import BotManager
+from .managers.response_cache import ResponseCache
+from .managers.residency_planner import DEFAULT_EVALUATION_MODEL
+from .managers.token_budget import TokenBudget, TokenBudgetExceeded
+from .managers.flow_timer import FlowTimer, FlowTimerService, KIND_WARNING
 from .managers.condition_manager import ConditionManager
 from .managers.experiment_manager import ExperimentManager
+from .managers.change_sequence import parse_watermark
+from .managers import survey_analytics
+from .managers.survey_index import SurveyIndexStore
 
 def generate_random_color():
     return f'#{random.randint(0, 0xFFFFFF):06x}'
@@ -135,6 +151,7 @@ client_colors: Dict[str, str] = {} # クライアントIDと色の対応を保
 client_sessions: Dict[str, str] = {} # 接続IDとセッションIDの対応を保持
 connection_to_display_name: Dict[str, str] = {} # 接続ID→表示名のマッピング
 connection_to_base_name: Dict[str, str] = {} # 接続ID→ベース名のマッピング
+bot_reply_tasks: Dict[str, asyncio.Task] = {} # セッションID→実行中のボット応答タスク
 
 # 実験管理のインスタンス（最初に初期化）
 experiment_manager = ExperimentManager()
@@ -151,14 +168,45 @@ message_store = MessageStore(
     data_dir=str(base_data_dir / "messages"),
     experiment_manager=experiment_manager  # 動的ディレクトリ参照用
 )
-data_exporter = DataExporter()
+export_engine = ParallelExportEngine()  # 大規模な実験はプロセスプールで並列にエクスポート
+wide_tables = WideTableStore(parallel_engine=export_engine)  # ワイド形式テーブル（フローの処理で行を更新）
+survey_index = SurveyIndexStore()  # 実験ごとのアンケート回答インデックス（回答の送信で行を更新）
+data_exporter = DataExporter(parallel_engine=export_engine, wide_tables=wide_tables, survey_index=survey_index)
+columnar_exporter = ColumnarExporter(data_exporter)  # Parquet / Arrow IPC（pyarrow がある場合のみ）
+export_jobs = ExportJobManager(  # バックグラウンドのエクスポート（成果物は実験の exports/ にキャッシュ）
+    data_exporter, session_manager, message_store, experiment_manager, columnar_exporter=columnar_exporter
+)
 condition_manager = ConditionManager(
     condition_file=str(base_data_dir / "conditions" / "conditions.json"),
     experiment_manager=experiment_manager  # 動的ディレクトリ参照用
 )
 
 # ボット管理のインスタンス（モデルは各セッション作成時に条件から設定）
-bot_manager = BotManager(bot_client_id="bot")
+# 会話履歴はMessageStoreから必要に応じて再構築される
+# 決定的な呼び出し（temperature=0 / seed固定）の応答はディスクにキャッシュして再利用できる
+response_cache = ResponseCache.from_env()
+bot_manager = BotManager(bot_client_id="bot", message_store=message_store,
+                         response_cache=response_cache)
+
+
+def load_experiment_token_usage(experiment_id: str):
+    """実験の全セッションの保存済みボットメッセージから (prompt_tokens, completion_tokens, calls) を集計"""
+    prompt_tokens = completion_tokens = calls = 0
+    for session in session_manager.get_all_sessions():
+        if session.experiment_id != experiment_id:
+            continue
+        usage = bot_manager.stored_token_usage(session.session_id)
+        prompt_tokens += usage.prompt_tokens
+        completion_tokens += usage.completion_tokens
+        calls += usage.calls
+    return prompt_tokens, completion_tokens, calls
+
+
+# 実験ごとのトークン使用量は再起動後の最初の参照時に保存済みメッセージから復元
+bot_manager.token_budgets.experiment_loader = load_experiment_token_usage
+
+# フローのステップタイマー（チャットの制限時間・教示文の最小表示時間をサーバー側で管理）
+flow_timers = FlowTimerService()
 
 # 管理者認証用
 ADMIN_CREDENTIALS_FILE = "data/admin_credentials.json"
@@ -212,25 +260,28 @@ def verify_admin_token(token: Optional[str]) -> bool:
     return is_valid
 
 # アプリケーション起動時の処理
-async def cleanup_empty_sessions():
-    """空のセッション（参加者0）を定期的にクリーンアップ"""
-    while True:
-        await asyncio.sleep(60)  # 1分ごとにチェック
-        
-        try:
-            sessions = session_manager.get_active_sessions()
-            for session in sessions:
-                # 作成から30秒以上経過 & 参加者が0
-                idle_seconds = session.get_idle_seconds()
-                if idle_seconds > 30 and len(session.participants) == 0:
-                    print(f"[Cleanup] 🧹 Ending empty session: {session.session_id} (idle for {idle_seconds:.0f}s)")
-                    session_manager.end_session(session.session_id)
-                    
-                    # ボット履歴もクリア
-                    if session.session_id in bot_manager.conversation_history:
-                        bot_manager.clear_history(session.session_id)
-        except Exception as e:
-            print(f"[Cleanup] Error during cleanup: {e}")
+def end_empty_session(session_id: str) -> bool:
+    """期限を過ぎた空のセッション（参加者0）を終了（期限管理から呼ばれ、対象のセッションのみ読み込む）"""
+    session = session_manager.load_session(session_id)
+    if not session or session.status != "active" or session.participants:
+        return False
+    idle_seconds = session.get_idle_seconds()
+    print(f"[Cleanup] 🧹 Ending empty session: {session_id} (idle for {idle_seconds:.0f}s)")
+    session_manager.end_session(session_id)
+    
+    # ボット設定と履歴・ステップタイマーも破棄
+    bot_manager.release_session(session_id)
+    flow_timers.forget(session_id)
+    return True
+
+def refresh_residency_plan():
+    """稼働中の実験のフローからモデルの常駐計画を更新"""
+    flows = {
+        experiment.experiment_id: experiment.experiment_flow
+        for experiment in experiment_manager.get_all_experiments()
+        if experiment.status == "active" and experiment.experiment_flow
+    }
+    bot_manager.residency_planner.set_experiment_flows(flows, bot_manager.default_model)
 
 @app.on_event("startup")
 async def startup_event():
@@ -253,39 +304,37 @@ async def startup_event():
     else:
         print(f"📁 Base Data Directory: data/")
         print(f"   ⚠️  No active experiment. Please create one from /admin")
+    
+    # 検出したハードウェア資源と推論パラメータの既定値
+    resources = bot_manager.resource_planner.resources
+    default_options = bot_manager.resource_planner.plan_for().defaults
+    print(f"🖥️  Resources: {resources.physical_cores} cores ({resources.logical_cpus} threads, "
+          f"NUMA {resources.numa_nodes}), RAM {resources.to_dict()['total_ram_gb']} GB")
+    print(f"   └─ Default inference options: {default_options}")
     print("="*60 + "\n")
     
     # Ollamaサービスの可用性をチェック
     print("\n" + "="*60)
     print("OLLAMA SERVICE CHECK")
     print("="*60)
-    try:
-        import ollama
-        ollama_client = ollama
-        models = ollama.list()
-        
-        # ollama-python 0.4.x対応: ListResponseオブジェクトまたは辞書形式
-        if hasattr(models, 'models'):
-            # 新形式: ListResponseオブジェクト
-            available_models = [m.model for m in models.models]
-        elif isinstance(models, dict) and 'models' in models:
-            # 旧形式: 辞書形式
-            available_models = [m.get('name', m.get('model', '')) for m in models['models']]
-        else:
-            available_models = []
-        
+    # モデルカタログを初回取得（以降はバックグラウンドで定期更新）
+    catalog = bot_manager.model_catalog
+    if await catalog.refresh():
+        available_models = catalog.get_model_names()
         if available_models:
             print(f"✓ Ollama is running with {len(available_models)} model(s) available:")
             for model_name in available_models[:5]:  # Show first 5 models
-                print(f"  - {model_name}")
+                info = catalog.get(model_name)
+                resident = " (loaded)" if info.resident else ""
+                print(f"  - {model_name} [{info.parameter_size or '?'}, {info.quantization_level or '?'}]{resident}")
             if len(available_models) > 5:
                 print(f"  ... and {len(available_models) - 5} more")
         else:
             print("✗ Warning: Ollama is running but no models are installed.")
             print("  Please pull at least one model (e.g., ollama pull gemma3:4b)")
-    except Exception as e:
+    else:
         print(f"✗ Warning: Could not connect to Ollama service.")
-        print(f"  Error: {e}")
+        print(f"  Error: {catalog.last_error}")
         print("  Please ensure Ollama is installed and running.")
         print("  Visit: https://ollama.ai/")
     print("="*60 + "\n")
@@ -326,8 +375,9 @@ async def startup_event():
                 break
         print("="*60 + "\n")
     
-    # 既存のアクティブなセッションをチェック
+    # 既存のアクティブなセッションをチェック（以降は期限管理がメモリ上で追跡する）
     active_sessions = session_manager.get_active_sessions()
+    session_manager.rebuild_activity_index(active_sessions)
     
     if active_sessions:
         print(f"Found {len(active_sessions)} active session(s):")
@@ -374,8 +424,20 @@ async def startup_event():
     print("="*60 + "\n")
     
     # バックグラウンドタスクを起動
-    asyncio.create_task(cleanup_empty_sessions())
-    print("🧹 Background cleanup task started (checks every 60 seconds)\n")
+    session_manager.reaper.start(end_empty_session)
+    flow_timers.start(handle_flow_timer)
+    print(f"🧹 Background cleanup started (empty sessions end after "
+          f"{session_manager.reaper.empty_grace_seconds:.0f}s, idle threshold "
+          f"{session_manager.reaper.idle_threshold_minutes:.0f} min)")
+    print("⏱️  Flow step timers enforced by the server (single scheduler task)\n")
+    refresh_residency_plan()
+    bot_manager.start_backend_health_checks()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # エクスポートジョブと並列エクスポートのワーカープロセスを終了
+    export_jobs.shutdown()
+    data_exporter.parallel_engine.shutdown()
 
 @app.get("/")
 async def get(request: Request):
@@ -720,6 +782,17 @@ async def websocket_endpoint(websocket: WebSocket):
                 
                 # 🆕 フローシステムがすべてのステップを管理（教示文含む）
             elif data["type"] == "message":
+                # 制限時間を過ぎたチャットへのメッセージは受け付けない
+                if flow_timers.is_chat_closed(session_id):
+                    await websocket.send_json({
+                        "type": "system",
+                        "client_id": "system",
+                        "internal_id": "system",
+                        "message": "⏱️ The time limit for this chat has been reached.",
+                        "timestamp": datetime.now().isoformat(),
+                    })
+                    continue
+                
                 # 表示名を取得
                 display_name = connection_to_display_name.get(client_id, client_id)
                 
@@ -747,69 +820,34 @@ async def websocket_endpoint(websocket: WebSocket):
                 await broadcast_message(message, target_session_id=session_id)
                 
                 # ボットが応答を生成（ボット自身のメッセージには反応しない）
+                # 受信ループを止めないようにバックグラウンドで実行し、
+                # 短時間に続けて届いたメッセージは1回のLLM呼び出しにまとめる
                 if not bot_manager.is_bot_message(client_id):
-                    try:
-                        # ボットの応答を生成
-                        bot_response = await bot_manager.generate_response(
-                            user_message=data["message"],
-                            session_id=session_id,
-                            client_id=client_id
-                        )
-                        
-                        # タイムアウトまたはキャンセル時はNoneが返される
-                        if bot_response is None:
-                            print(f"[Bot] Response generation was cancelled or timed out for session {session_id[:12]}...")
-                            # 中断通知を送信（エラーではなく情報として）
-                            interrupt_message = {
-                                "type": "system",
-                                "client_id": "system",
-                                "internal_id": "system",
-                                "message": "（応答生成が中断されました。再度メッセージを送信してください）",
-                                "timestamp": datetime.now().isoformat(),
-                            }
-                            # クライアントがまだ接続中なら通知
-                            if client_id in active_connections:
-                                try:
-                                    await active_connections[client_id].send_json(interrupt_message)
-                                except Exception:
-                                    pass  # 接続切れの場合は無視
-                            continue  # 次のメッセージ処理へ
-                        
-                        # ボットのメッセージを作成・保存
-                        bot_message_obj = Message(
-                            session_id=session_id,
-                            client_id=bot_manager.bot_client_id,
-                            internal_id="bot",  # ボット用の固定ID
-                            message_type="bot",  # ボット専用のメッセージタイプ
-                            content=bot_response,
-                            timestamp=datetime.now().isoformat()
+                    bot_manager.queue_user_message(session_id, data["message"])
+                    reply_task = bot_reply_tasks.get(session_id)
+                    if reply_task and not reply_task.done():
+                        # 実行中のタスクが次のターンでまとめて応答する（設定により生成中の応答はやり直す）
+                        if bot_manager.get_supersede_inflight(session_id) and \
+                                bot_manager.cancel_generation(session_id, reason="superseded"):
+                            print(f"[Bot] Superseding in-flight response for session {session_id[:12]}...")
+                    else:
+                        bot_reply_tasks[session_id] = asyncio.create_task(
+                            respond_as_bot(session_id, client_id)
                         )
-                        message_store.save_message(bot_message_obj)
-                        
-                        # セッションのメッセージ数をインクリメント
-                        session_manager.increment_message_count(session_id)
-                        
-                        # ボットの応答をブロードキャスト
-                        bot_broadcast = {
-                            "type": "bot",
-                            "client_id": bot_manager.bot_client_id,
-                            "internal_id": "bot",  # ボットも固定ID（色生成用）
-                            "message": bot_response,
-                            "timestamp": bot_message_obj.timestamp,
-                        }
-                        await broadcast_message(bot_broadcast, target_session_id=session_id)
-                        
-                    except asyncio.CancelledError:
-                        print(f"[Bot] Response cancelled for session {session_id[:12]}...")
-                        # キャンセル時は何もしない（接続が切れている可能性が高い）
-                    except Exception as e:
-                        print(f"Error generating bot response: {e}")
             elif data["type"] == "join":
                 # 新規参加者の通知（既に上で処理済み）
                 pass
 
     except WebSocketDisconnect:
         if client_id:
+            # セッションに他の参加者接続がなければ、実行中の応答生成を中断
+            has_other_connections = any(
+                sid == session_id and cid != client_id and not cid.startswith("admin_viewer_")
+                for cid, sid in client_sessions.items()
+            )
+            if not has_other_connections:
+                bot_manager.cancel_generation(session_id, reason="disconnect")
+            
             # 表示名を取得
             display_name = connection_to_display_name.get(client_id, client_id)
             base_name = connection_to_base_name.get(client_id)
@@ -854,15 +892,176 @@ async def websocket_endpoint(websocket: WebSocket):
                 # 全参加者が切断した場合
                 print(f"[Session] All participants left session {session_id}")
                 
-                # ボットの会話履歴をクリア
-                if session_id in bot_manager.conversation_history:
-                    print(f"[Session] Clearing bot conversation history for {session_id}")
-                    bot_manager.clear_history(session_id)
+                # ボットの設定と会話履歴を破棄
+                print(f"[Session] Releasing bot state for {session_id}")
+                bot_manager.release_session(session_id)
+                flow_timers.forget(session_id)
                 
                 # セッションを終了状態にする
                 print(f"[Session] Ending session {session_id} (no participants)")
                 session_manager.end_session(session_id)
 
+async def handle_flow_timer(timer: FlowTimer, kind: str):
+    """ステップタイマーの発火時の処理（タイマーのスケジューラが発火ごとのタスクで実行する）
+    
+    - time_warning: チャットの残り時間を通知
+    - time_up（チャット）: 応答生成を止めてチャットを締め切り、次のステップへ自動で進める
+    - time_up（教示文）: 最小表示時間の経過を通知（次へボタンを表示）
+    """
+    session_id = timer.session_id
+    if kind == KIND_WARNING:
+        remaining = timer.remaining()
+        await broadcast_message({
+            "type": "time_warning",
+            "step_id": timer.step_id,
+            "remaining_seconds": round(remaining, 1),
+            "message": f"⏱️ {max(round(remaining / 60), 1)} minute(s) remaining.",
+            "timestamp": datetime.now().isoformat(),
+        }, target_session_id=session_id)
+        return
+    
+    if timer.step_type != "chat":
+        await broadcast_message({
+            "type": "time_up",
+            "step_id": timer.step_id,
+            "action": "unlock",
+            "timestamp": datetime.now().isoformat(),
+        }, target_session_id=session_id)
+        return
+    
+    # チャットを締め切る（結合ウィンドウ内で応答待ちのメッセージと生成中の応答は破棄）
+    # 生成中なら生成を中断し（応答タスクは応答待ちのメッセージがないため終了する）、
+    # 生成前（結合ウィンドウ・トークン上限の待機中）なら応答タスクごと中断する
+    bot_manager.pending_messages.pop(session_id, None)
+    reply_task = bot_reply_tasks.get(session_id)
+    if reply_task and not reply_task.done():
+        if not bot_manager.cancel_generation(session_id, reason="time_up"):
+            reply_task.cancel()
+    
+    session = session_manager.load_session(session_id)
+    if not session or session.status != "active" or not session.experiment_id:
+        return
+    experiment = experiment_manager.get_experiment(session.experiment_id)
+    if not experiment or not experiment.experiment_flow:
+        return
+    
+    minutes = timer.duration / 60
+    content = f"⏱️ Time limit reached ({minutes:g} minutes). Moving to next step..."
+    message_store.save_message(Message(
+        session_id=session_id,
+        client_id="system",
+        internal_id="system",
+        message_type="system",
+        content=content,
+        timestamp=datetime.now().isoformat()
+    ))
+    print(f"[FlowTimer] ⏱️ Chat time limit reached for session {session_id[:12]}... ({minutes:g} min)")
+    
+    flow = advance_flow(session, experiment, session.client_id, None)
+    await broadcast_message({
+        "type": "time_up",
+        "step_id": timer.step_id,
+        "action": "advance",
+        "message": content,
+        "flow": flow,
+        "timestamp": datetime.now().isoformat(),
+    }, target_session_id=session_id)
+
+async def respond_as_bot(session_id: str, client_id: str):
+    """ボットの応答を生成して保存・ブロードキャスト（セッションごとのバックグラウンドタスク）
+    
+    応答待ちのメッセージがなくなるまで、結合ウィンドウごとにまとめて応答する。
+    """
+    try:
+        while True:
+            user_text = await bot_manager.wait_for_coalesced_turn(session_id)
+            if user_text is None:
+                return
+            await reply_to_turn(session_id, client_id, user_text)
+    except asyncio.CancelledError:
+        print(f"[Bot] Response cancelled for session {session_id[:12]}...")
+        # キャンセル時は何もしない（接続が切れている可能性が高い）
+    finally:
+        if bot_reply_tasks.get(session_id) is asyncio.current_task():
+            del bot_reply_tasks[session_id]
+
+async def reply_to_turn(session_id: str, client_id: str, user_text: str):
+    """まとめたユーザーターンに対する応答を1回生成して保存・ブロードキャスト"""
+    try:
+        try:
+            bot_response = await bot_manager.generate_response(
+                user_message=user_text,
+                session_id=session_id,
+                client_id=client_id
+            )
+        except TokenBudgetExceeded as e:
+            # トークン上限を超えた場合は応答せず、参加者に通知
+            if client_id in active_connections:
+                try:
+                    await active_connections[client_id].send_json({
+                        "type": "system",
+                        "client_id": "system",
+                        "internal_id": "system",
+                        "message": e.user_message,
+                        "timestamp": datetime.now().isoformat(),
+                    })
+                except Exception:
+                    pass  # 接続切れの場合は無視
+            return
+        
+        # タイムアウトまたはキャンセル時はNoneが返される
+        if bot_response is None:
+            # 新しいメッセージで置き換えられた場合は通知せず、次のターンでまとめて応答する
+            if bot_manager.has_pending_messages(session_id):
+                return
+            # 制限時間で締め切った場合は time_up で通知済み
+            if flow_timers.is_chat_closed(session_id):
+                return
+            print(f"[Bot] Response generation was cancelled or timed out for session {session_id[:12]}...")
+            # 中断通知を送信（エラーではなく情報として）
+            interrupt_message = {
+                "type": "system",
+                "client_id": "system",
+                "internal_id": "system",
+                "message": "（応答生成が中断されました。再度メッセージを送信してください）",
+                "timestamp": datetime.now().isoformat(),
+            }
+            # クライアントがまだ接続中なら通知
+            if client_id in active_connections:
+                try:
+                    await active_connections[client_id].send_json(interrupt_message)
+                except Exception:
+                    pass  # 接続切れの場合は無視
+            return
+        
+        # ボットのメッセージを作成・保存（LLM呼び出しの計測値をメタデータに記録）
+        bot_message_obj = Message(
+            session_id=session_id,
+            client_id=bot_manager.bot_client_id,
+            internal_id="bot",  # ボット用の固定ID
+            message_type="bot",  # ボット専用のメッセージタイプ
+            content=bot_response,
+            timestamp=datetime.now().isoformat()
+        )
+        bot_message_obj.metadata.llm = bot_manager.pop_call_telemetry(session_id)
+        message_store.save_message(bot_message_obj)
+        
+        # セッションのメッセージ数をインクリメント
+        session_manager.increment_message_count(session_id)
+        
+        # ボットの応答をブロードキャスト
+        bot_broadcast = {
+            "type": "bot",
+            "client_id": bot_manager.bot_client_id,
+            "internal_id": "bot",  # ボットも固定ID（色生成用）
+            "message": bot_response,
+            "timestamp": bot_message_obj.timestamp,
+        }
+        await broadcast_message(bot_broadcast, target_session_id=session_id)
+        
+    except Exception as e:
+        print(f"Error generating bot response: {e}")
+
 async def broadcast_message(message: dict, target_session_id: str = None):
     """指定されたセッションの接続中のクライアントにメッセージをブロードキャストする
     
@@ -961,6 +1160,20 @@ async def get_sessions():
         "sessions": [s.to_dict() for s in sessions]
     })
 
+@app.get("/api/sessions/idle")
+async def get_idle_sessions(threshold_minutes: Optional[float] = None, admin_token: Optional[str] = Cookie(None)):
+    """長時間非アクティブなセッションを取得（期限管理のメモリ上の情報から、ディスクの全件走査なし）"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    sessions = session_manager.get_idle_sessions(threshold_minutes)
+    return JSONResponse(content={
+        "threshold_minutes": threshold_minutes if threshold_minutes is not None
+        else session_manager.reaper.idle_threshold_minutes,
+        "sessions": [session_manager.get_session_summary(s.session_id) for s in sessions],
+        "reaper": session_manager.reaper.get_stats()
+    })
+
 @app.get("/api/sessions/{session_id}")
 async def get_session(session_id: str):
     """特定のセッション情報を取得"""
@@ -998,6 +1211,66 @@ async def get_current_session_info():
         "statistics": stats
     })
 
+def _prime_chunks(chunks) -> list:
+    """先頭のチャンク（ExcelのBOMのみの場合は次のチャンクまで）を生成して返す"""
+    primed = []
+    for chunk in chunks:
+        primed.append(chunk)
+        if chunk and chunk != UTF8_BOM:
+            break
+    return primed
+
+def _iter_primed_chunks(primed: list, chunks, filename: str):
+    yield from primed
+    try:
+        yield from chunks
+    except Exception as e:
+        print(f"[Export] ❌ Error while streaming {filename}, the download is incomplete: {e}")
+        raise
+
+async def streaming_download(chunks, filename: str, media_type: str,
+                             delta: Optional[ExportDelta] = None) -> StreamingResponse:
+    """エクスポートを生成しながら送信（全体をメモリに持たず、先頭の行からダウンロードが始まる）
+    
+    先頭のチャンクまで（セッションの読み込み・フローの索引などの準備を含む）は応答を返す前に
+    スレッドで生成するため、準備中のエラーは呼び出し元の except で500になる。
+    送信開始後のエラーではステータスを変えられないため接続を途中で切断する
+    （チャンク転送の終端が送られず、クライアントでは不完全なダウンロードとして失敗する）。
+    """
+    chunks = iter(chunks)
+    primed = await asyncio.to_thread(_prime_chunks, chunks)
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    if delta is not None:
+        headers.update(export_delta_headers(delta))
+    return StreamingResponse(_iter_primed_chunks(primed, chunks, filename), media_type=media_type, headers=headers)
+
+def export_delta(since: Optional[str], experiment_id: str) -> ExportDelta:
+    """since（変更シーケンスまたはISO形式の日時）から差分エクスポートの範囲を作成（省略時は全件）
+    
+    差分では、範囲内に削除された実験のセッションも記録する（レスポンスヘッダーで通知）。
+    """
+    if not since:
+        return ExportDelta()
+    try:
+        delta = ExportDelta(since=parse_watermark(since))
+    except (ValueError, OverflowError, OSError):
+        raise HTTPException(status_code=400, detail="since must be a change sequence or an ISO 8601 timestamp")
+    delta.deleted_sessions = session_manager.get_deleted_sessions(delta.since, delta.watermark, experiment_id)
+    return delta
+
+def export_delta_headers(delta: ExportDelta) -> Dict[str, str]:
+    """次回の差分エクスポートで since に指定するウォーターマークと、範囲内に削除されたセッションID（カンマ区切り）"""
+    headers = {"X-Export-Watermark": str(delta.watermark)}
+    if not delta.is_full:
+        headers["X-Export-Since"] = str(delta.since)
+        headers["X-Export-Deleted-Sessions"] = ",".join(
+            quote(str(record["session_id"]), safe="") for record in delta.deleted_sessions
+        )
+    return headers
+
+def delta_filename_suffix(delta: ExportDelta) -> str:
+    return "" if delta.is_full else "_delta"
+
 @app.post("/api/sessions/{session_id}/export")
 async def export_session_data(session_id: str, format: str = "json"):
     """セッションデータをエクスポート（直接ダウンロード）"""
@@ -1006,21 +1279,13 @@ async def export_session_data(session_id: str, format: str = "json"):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         if format == "csv":
-            content = data_exporter.export_messages_to_csv(session_id, message_store)
+            chunks = data_exporter.iter_messages_csv(session_id, message_store)
             filename = f"messages_{session_id}_{timestamp}.csv"
-            return Response(
-                content=content,
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+            return await streaming_download(chunks, filename, "text/csv")
         elif format == "json":
-            content = data_exporter.export_messages_to_json(session_id, message_store)
+            chunks = data_exporter.iter_messages_json(session_id, message_store)
             filename = f"messages_{session_id}_{timestamp}.json"
-            return Response(
-                content=content,
-                media_type="application/json",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+            return await streaming_download(chunks, filename, "application/json")
         else:
             raise HTTPException(status_code=400, detail="Invalid format")
         
@@ -1052,6 +1317,8 @@ async def end_session(session_id: str, admin_token: Optional[str] = Cookie(None)
     
     # セッションを終了
     session_manager.end_session(session_id)
+    bot_manager.release_session(session_id)
+    flow_timers.forget(session_id)
     return JSONResponse(content={"status": "success", "message": "Session ended"})
 
 @app.delete("/api/sessions/{session_id}/delete")
@@ -1097,6 +1364,11 @@ async def change_session_status(session_id: str, request: Request, admin_token:
         
         print(f"[Admin] Session '{session_id}' status changed: {old_status} -> {new_status}" + (f" (note: {admin_note})" if admin_note else ""))
         
+        # 終了系の状態ではボットの設定と会話履歴を破棄
+        if new_status in ['ended', 'cancelled', 'completed', 'abandoned']:
+            bot_manager.release_session(session_id)
+            flow_timers.forget(session_id)
+        
         # セッション終了時は接続中のクライアントに通知
         if new_status in ['ended', 'cancelled', 'completed']:
             session_end_message = {
@@ -1169,6 +1441,7 @@ async def create_new_session(end_previous: bool = True,
         active_sessions = session_manager.get_active_sessions()
         for old_session in active_sessions:
             session_manager.end_session(old_session.session_id)
+            bot_manager.release_session(old_session.session_id)
             print(f"Previous session ended: {old_session.session_id}")
     
     # 新しいセッションを作成
@@ -1198,15 +1471,67 @@ async def create_new_session(end_previous: bool = True,
 
 @app.get("/api/ollama/models")
 async def get_ollama_models(admin_token: Optional[str] = Cookie(None)):
-    """Ollamaから利用可能なモデルのリストを取得"""
+    """Ollamaから利用可能なモデルのリストを取得（バックグラウンド更新のカタログから即座に返す）"""
     if not verify_admin_token(admin_token):
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    models = bot_manager.get_available_models()
+    catalog = bot_manager.model_catalog
+    if catalog.last_refreshed is None:
+        # 起動直後などで未取得の場合のみ取得を待つ
+        await catalog.refresh()
+    catalog_data = catalog.to_dict()
     return JSONResponse(content={
-        "models": models
+        "models": catalog.get_model_names(),
+        "details": catalog_data["models"],
+        "last_refreshed": catalog_data["last_refreshed"],
+        "last_error": catalog_data["last_error"]
     })
 
+@app.get("/api/bot/metrics")
+async def get_bot_metrics(admin_token: Optional[str] = Cookie(None)):
+    """ボット応答生成のメトリクス（完了数・中断数・節約トークン数）を取得"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    return JSONResponse(content=bot_manager.get_generation_metrics())
+
+@app.get("/api/bot/telemetry")
+async def get_bot_telemetry(experiment_id: Optional[str] = None, admin_token: Optional[str] = Cookie(None)):
+    """LLM呼び出しテレメトリのモデル別・実験別集計を取得"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    return JSONResponse(content=bot_manager.get_telemetry_summary(experiment_id))
+
+@app.get("/api/bot/resources")
+async def get_bot_resources(num_ctx: int = 8192, admin_token: Optional[str] = Cookie(None)):
+    """検出したCPU・メモリ資源と、モデルごとの推奨同時セッション数を取得"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    models = {
+        name: {"size": info.size, "parameter_size": info.parameter_size}
+        for name, info in bot_manager.model_catalog.models.items()
+    }
+    
+    return JSONResponse(content=bot_manager.resource_planner.get_report(models, num_ctx))
+
+@app.get("/api/bot/residency")
+async def get_bot_residency(admin_token: Optional[str] = Cookie(None)):
+    """モデルの常駐計画・保留中のAI評価・モデルの追い出し履歴を取得"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    return JSONResponse(content=bot_manager.residency_planner.to_dict())
+
+@app.get("/api/bot/backends")
+async def get_bot_backends(admin_token: Optional[str] = Cookie(None)):
+    """Ollamaバックエンドの状態（正常性・実行中リクエスト数・常駐モデル）を取得"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    return JSONResponse(content=bot_manager.get_backend_status())
+
 @app.get("/api/conditions")
 async def get_conditions(admin_token: Optional[str] = Cookie(None)):
     """全条件を取得"""
@@ -1537,6 +1862,7 @@ async def start_experiment(experiment_id: str, admin_token: Optional[str] = Cook
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     experiment_manager.start_experiment(experiment_id)
+    refresh_residency_plan()
     return JSONResponse(content={"status": "success"})
 
 @app.post("/api/experiments/{experiment_id}/end")
@@ -1546,6 +1872,7 @@ async def end_experiment(experiment_id: str, admin_token: Optional[str] = Cookie
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     experiment_manager.end_experiment(experiment_id)
+    refresh_residency_plan()
     return JSONResponse(content={"status": "success"})
 
 @app.post("/api/experiments/{experiment_id}/pause")
@@ -1555,6 +1882,7 @@ async def pause_experiment(experiment_id: str, admin_token: Optional[str] = Cook
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     experiment_manager.pause_experiment(experiment_id)
+    refresh_residency_plan()
     return JSONResponse(content={"status": "success"})
 
 @app.post("/api/experiments/{experiment_id}/resume")
@@ -1564,6 +1892,7 @@ async def resume_experiment(experiment_id: str, admin_token: Optional[str] = Coo
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     experiment_manager.resume_experiment(experiment_id)
+    refresh_residency_plan()
     return JSONResponse(content={"status": "success"})
 
 @app.delete("/api/experiments/{experiment_id}/delete")
@@ -1682,6 +2011,23 @@ async def get_experiment_statistics(experiment_id: str, admin_token: Optional[st
         "condition_stats": list(condition_stats.values())
     })
 
+@app.get("/api/experiments/{experiment_id}/token_usage")
+async def get_experiment_token_usage(experiment_id: str, admin_token: Optional[str] = Cookie(None)):
+    """実験のトークン使用量（全体とセッションごと、上限による拒否・待機の件数）を取得
+    
+    上限が設定された実行中のセッション以外の使用量は、保存済みボットメッセージの計測値から求める
+    （拒否・待機の件数はセッション終了後は実験の集計にのみ残る）。
+    """
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    stored_sessions = {
+        session.session_id: bot_manager.stored_token_usage(session.session_id)
+        for session in session_manager.get_all_sessions()
+        if session.experiment_id == experiment_id and not bot_manager.token_budgets.has_usage(session.session_id)
+    }
+    return JSONResponse(content=bot_manager.token_budgets.get_experiment_usage(experiment_id, stored_sessions))
+
 @app.post("/api/experiments/{experiment_id}/flow")
 async def save_experiment_flow(experiment_id: str, request: Request, admin_token: Optional[str] = Cookie(None)):
     """🆕 実験レベルのフローを保存"""
@@ -1709,6 +2055,7 @@ async def save_experiment_flow(experiment_id: str, request: Request, admin_token
         experiment_manager.reload_experiment(experiment_id)
         
         print(f"[Flow] Saved {len(experiment_flow)} steps | {experiment.name}")
+        refresh_residency_plan()
         
         return JSONResponse(content={
             "status": "success",
@@ -1750,6 +2097,7 @@ async def submit_survey_response(session_id: str, request: Request):
         # セッションに回答を保存
         session.add_survey_response(client_id, survey_responses)
         session_manager.update_session(session)
+        survey_index.update_session(session, session_manager)
         
         print(f"[Survey] 📝 Survey responses saved for {client_id} in session {session_id}")
         print(f"   Total responses: {len(survey_responses)}")
@@ -1793,6 +2141,7 @@ async def get_current_step(session_id: str, client_id: str = None):
                     if client_id and not session.is_participant_completed(client_id):
                         session.mark_participant_completed(client_id)
                         session_manager.update_session(session)
+                        record_flow_update(session)
                     return JSONResponse(content={
                         "already_completed": True,
                         "message": "You have already completed this experiment. Thank you for your participation!"
@@ -1846,13 +2195,17 @@ async def get_current_step(session_id: str, client_id: str = None):
             f"{current_step.step_type.upper()}: {current_step.title or current_step.step_id}"
         )
         
+        # 時間制限のあるステップに入った時点で期限を設定（再取得では延長しない。経過済みなら expired のまま返す）
+        timer = flow_timers.arm(session_id, current_step)
+        
         return JSONResponse(content={
             "has_flow": True,
             "completed": False,
             "current_step_index": session.current_step_index,
             "total_steps": len(effective_flow),
             "current_step": current_step.to_dict(),
-            "completed_steps": session.completed_steps
+            "completed_steps": session.completed_steps,
+            "timer": timer.to_dict() if timer else None
         })
         
     except Exception as e:
@@ -1895,124 +2248,183 @@ async def advance_step(session_id: str, request: Request):
         if not experiment.experiment_flow or len(experiment.experiment_flow) == 0:
             raise HTTPException(status_code=400, detail="No experiment flow configured")
         
-        # 実験フローをExperimentStepオブジェクトに変換
-        from .models.condition import ExperimentStep
-        effective_flow = [ExperimentStep.from_dict(step) for step in experiment.experiment_flow]
-        
-        # 現在のステップを完了としてマーク
-        if session.current_step_index < len(effective_flow):
-            current_step = effective_flow[session.current_step_index]
-            session.complete_step(current_step.step_id)
-            
-            # 回答データを保存
-            if step_response:
-                session.add_step_response(current_step.step_id, client_id, step_response)
-            
-            # ステップ完了を表示
-            print_info_box("✓ Step Completed", {
-                "Step": f"{current_step.step_type.upper()}: {current_step.title or current_step.step_id}",
-                "Participant": client_id,
-                "Progress": f"{session.current_step_index + 1}/{len(effective_flow)}"
+        # 最小表示時間が経過していないステップは進めない（タイマーはサーバー側で管理）
+        timer = flow_timers.get_timer(session_id)
+        if timer and timer.step_type == "instruction" and timer.remaining() > 0:
+            return JSONResponse(status_code=409, content={
+                "status": "error",
+                "too_early": True,
+                "remaining_seconds": round(timer.remaining(), 1),
+                "message": "Minimum display time has not elapsed"
             })
         
-        # 次のステップに進む
-        session.advance_step()
+        return JSONResponse(content=advance_flow(session, experiment, client_id, step_response))
+        
+    except Exception as e:
+        print(f"[Flow] Error advancing step: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def record_flow_update(session: Session):
+    """フローの処理（回答の記録・条件の割り当て・完了）で保存したセッションのワイド形式テーブル・回答インデックスの行を更新"""
+    wide_tables.update_session(session, session_manager, message_store)
+    survey_index.update_session(session, session_manager)
+
+def advance_flow(session: Session, experiment, client_id: str, step_response=None) -> dict:
+    """現在のステップを完了して次のステップに進め、次に表示するステップの情報を返す
+    
+    参加者の操作（/flow/advance）と、チャットの制限時間が経過したときのサーバー側の自動進行で共通に使用する。
+    次のステップに時間制限があれば期限を設定する。
+    """
+    session_id = session.session_id
+    
+    # 実験フローをExperimentStepオブジェクトに変換
+    from .models.condition import ExperimentStep
+    effective_flow = [ExperimentStep.from_dict(step) for step in experiment.experiment_flow]
+    
+    # 現在のステップを完了としてマーク
+    if session.current_step_index < len(effective_flow):
+        current_step = effective_flow[session.current_step_index]
+        session.complete_step(current_step.step_id)
+        
+        # 回答データを保存
+        if step_response:
+            session.add_step_response(current_step.step_id, client_id, step_response)
+        
+        # ステップ完了を表示
+        print_info_box("✓ Step Completed", {
+            "Step": f"{current_step.step_type.upper()}: {current_step.title or current_step.step_id}",
+            "Participant": client_id,
+            "Progress": f"{session.current_step_index + 1}/{len(effective_flow)}"
+        })
+    
+    # 次のステップに進む
+    session.advance_step()
+    session_manager.update_session(session)
+    if step_response:
+        record_flow_update(session)
+    
+    # 次のステップ情報を返す
+    if session.current_step_index >= len(effective_flow):
+        flow_timers.forget(session_id)
+        
+        # 参加者を完了としてマーク
+        session.mark_participant_completed(client_id)
         session_manager.update_session(session)
+        record_flow_update(session)
         
-        # 次のステップ情報を返す
-        if session.current_step_index >= len(effective_flow):
-            # 参加者を完了としてマーク
-            session.mark_participant_completed(client_id)
-            session_manager.update_session(session)
-            
-            # 参加者コードを "completed" としてマーク
-            if session.participant_code and session.experiment_id:
-                experiment = experiment_manager.get_experiment(session.experiment_id)
-                if experiment:
-                    experiment.mark_code_completed(session.participant_code)
-                    from pathlib import Path
-                    experiment_manager._save_experiment(experiment, Path(experiment.data_directory))
-                    
-                    # メモリキャッシュを更新
-                    experiment_manager.reload_experiment(session.experiment_id)
-                    print(f"[Flow] Code '{session.participant_code}' marked as 'completed'")
-            
-            # 実験完了を表示
-            print_section_header("🎉 PARTICIPANT COMPLETED EXPERIMENT")
-            print_info_box("Completion Summary", {
-                "Participant": client_id,
-                "Participant Code": session.participant_code or "N/A",
-                "Session ID": session_id[:20] + "...",
-                "Experiment": experiment.name if experiment else "N/A",
-                "Total Steps": len(effective_flow),
-                "Completion Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+        # 参加者コードを "completed" としてマーク
+        if session.participant_code and session.experiment_id:
+            experiment = experiment_manager.get_experiment(session.experiment_id)
+            if experiment:
+                experiment.mark_code_completed(session.participant_code)
+                from pathlib import Path
+                experiment_manager._save_experiment(experiment, Path(experiment.data_directory))
+                
+                # メモリキャッシュを更新
+                experiment_manager.reload_experiment(session.experiment_id)
+                print(f"[Flow] Code '{session.participant_code}' marked as 'completed'")
+        
+        # 実験完了を表示
+        print_section_header("🎉 PARTICIPANT COMPLETED EXPERIMENT")
+        print_info_box("Completion Summary", {
+            "Participant": client_id,
+            "Participant Code": session.participant_code or "N/A",
+            "Session ID": session_id[:20] + "...",
+            "Experiment": experiment.name if experiment else "N/A",
+            "Total Steps": len(effective_flow),
+            "Completion Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        
+        return {
+            "status": "success",
+            "completed": True,
+            "message": "All steps completed"
+        }
+    
+    next_step = effective_flow[session.current_step_index]
+    
+    # 🆕 ブランチステップの場合、ランダムにパスを選択してそのステップを返す
+    if next_step.step_type == 'branch':
+        # 元のJSONデータからbranchesを取得
+        original_step_data = experiment.experiment_flow[session.current_step_index]
+        branches = original_step_data.get('branches', [])
+        
+        if branches:
+            import random
+            # ランダムにbranchを選択（weightを考慮）
+            selected_branch = random.choice(branches)
             
-            return JSONResponse(content={
-                "status": "success",
-                "completed": True,
-                "message": "All steps completed"
+            # ブランチ選択を表示
+            print_info_box("🔀 Branch Selected", {
+                "Branch Point": next_step.step_id,
+                "Selected Path": selected_branch.get('branch_id', 'unknown'),
+                "Condition": selected_branch.get('condition_label', 'N/A'),
+                "Participant": client_id
             })
-        
-        next_step = effective_flow[session.current_step_index]
-        next_step_dict = next_step.to_dict()
-        
-        # 🆕 ブランチステップの場合、ランダムにパスを選択してそのステップを返す
-        if next_step.step_type == 'branch':
-            # 元のJSONデータからbranchesを取得
-            original_step_data = experiment.experiment_flow[session.current_step_index]
-            branches = original_step_data.get('branches', [])
             
-            if branches:
-                import random
-                # ランダムにbranchを選択（weightを考慮）
-                selected_branch = random.choice(branches)
+            # ブランチの最初のステップを取得
+            branch_steps = selected_branch.get('steps', [])
+            if branch_steps:
+                branch_step = ExperimentStep.from_dict(branch_steps[0])
                 
-                # ブランチ選択を表示
-                print_info_box("🔀 Branch Selected", {
-                    "Branch Point": next_step.step_id,
-                    "Selected Path": selected_branch.get('branch_id', 'unknown'),
-                    "Condition": selected_branch.get('condition_label', 'N/A'),
-                    "Participant": client_id
+                # ブランチ選択情報をセッションに保存
+                branch_id = selected_branch.get('branch_id', 'unknown')
+                condition_label = selected_branch.get('condition_label', 'N/A')
+                
+                session.add_step_response(next_step.step_id, client_id, {
+                    "branch_selected": branch_id,
+                    "condition_label": condition_label
                 })
                 
-                # ブランチの最初のステップを取得
-                branch_steps = selected_branch.get('steps', [])
-                if branch_steps:
-                    from .models.condition import ExperimentStep
-                    branch_step = ExperimentStep.from_dict(branch_steps[0])
-                    
-                    # ブランチ選択情報をセッションに保存
-                    branch_id = selected_branch.get('branch_id', 'unknown')
-                    condition_label = selected_branch.get('condition_label', 'N/A')
-                    
-                    session.add_step_response(next_step.step_id, client_id, {
-                        "branch_selected": branch_id,
-                        "condition_label": condition_label
-                    })
-                    
-                    # セッションレベルで条件を記録（データ分析用: branch_idを保存）
-                    session.assign_condition(next_step.step_id, branch_id)
-                    session_manager.update_session(session)
-                    
-                    return JSONResponse(content={
-                        "status": "success",
-                        "completed": False,
-                        "current_step_index": session.current_step_index,
-                        "next_step": branch_step.to_dict(),
-                        "is_branch_step": True
-                    })
-        
-        return JSONResponse(content={
-            "status": "success",
-            "completed": False,
-            "current_step_index": session.current_step_index,
-            "next_step": next_step_dict
+                # セッションレベルで条件を記録（データ分析用: branch_idを保存）
+                session.assign_condition(next_step.step_id, branch_id)
+                session_manager.update_session(session)
+                record_flow_update(session)
+                
+                timer = flow_timers.arm(session_id, branch_step)
+                return {
+                    "status": "success",
+                    "completed": False,
+                    "current_step_index": session.current_step_index,
+                    "next_step": branch_step.to_dict(),
+                    "is_branch_step": True,
+                    "timer": timer.to_dict() if timer else None
+                }
+    
+    timer = flow_timers.arm(session_id, next_step)
+    return {
+        "status": "success",
+        "completed": False,
+        "current_step_index": session.current_step_index,
+        "next_step": next_step.to_dict(),
+        "timer": timer.to_dict() if timer else None
+    }
+
+def save_ai_evaluation(session_id: str, step_id: str, questions: List[dict], ai_response: str,
+                       cache_hit: bool) -> dict:
+    """AI評価の回答をパースしてセッションに保存（保留した評価の実行時はセッションを読み直す）"""
+    print(f"[AI Evaluation] AI response: {ai_response}")
+    evaluation_results = {}
+    for i in range(1, len(questions) + 1):
+        match = re.search(rf'Q{i}:\s*(\d+)', ai_response)
+        if match:
+            score = int(match.group(1))
+            if 1 <= score <= 7:
+                q_id = questions[i-1].get('question_id', f'q{i}')
+                evaluation_results[q_id] = score
+    
+    session = session_manager.load_session(session_id)
+    if session:
+        session.add_step_response(step_id, "ai_system", {
+            "evaluation_results": evaluation_results,
+            "raw_response": ai_response,
+            "cache_hit": cache_hit
         })
-        
-    except Exception as e:
-        print(f"[Flow] Error advancing step: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        session_manager.update_session(session)
+        record_flow_update(session)
+    
+    print(f"[AI Evaluation] Saved evaluation results: {evaluation_results}")
+    return evaluation_results
 
 @app.post("/api/sessions/{session_id}/ai_evaluate")
 async def ai_evaluate_chat(session_id: str, request: Request):
@@ -2026,11 +2438,6 @@ async def ai_evaluate_chat(session_id: str, request: Request):
         if not client_id or not step_id:
             raise HTTPException(status_code=400, detail="client_id and step_id are required")
         
-        import ollama
-        import re
-        from pathlib import Path
-        import json
-        
         # セッションを取得
         session = session_manager.load_session(session_id)
         if not session or not session.experiment_id:
@@ -2048,12 +2455,15 @@ async def ai_evaluate_chat(session_id: str, request: Request):
         with open(messages_file, 'r', encoding='utf-8') as f:
             messages_data = json.load(f)
         
-        # ユーザーとボットのメッセージのみを抽出
+        # ユーザーとボットのメッセージのみを抽出（MessageStoreはメッセージの配列として保存）
+        if isinstance(messages_data, dict):
+            messages_data = messages_data.get('messages', [])
         conversation = []
-        for msg in messages_data.get('messages', []):
-            if msg.get('type') in ['user', 'bot']:
-                role = "ユーザー" if msg['type'] == 'user' else "AI"
-                conversation.append(f"{role}: {msg.get('message', '')}")
+        for msg in messages_data:
+            msg_type = msg.get('message_type', msg.get('type'))
+            if msg_type in ['message', 'user', 'bot']:
+                role = "AI" if msg_type == 'bot' else "ユーザー"
+                conversation.append(f"{role}: {msg.get('content', msg.get('message', ''))}")
         
         if len(conversation) < 2:
             raise HTTPException(status_code=400, detail="Not enough messages to evaluate")
@@ -2062,8 +2472,9 @@ async def ai_evaluate_chat(session_id: str, request: Request):
         
         # 評価質問を取得（設定から）
         questions = evaluation_config.get('questions', [])
-        evaluation_model = evaluation_config.get('evaluation_model', 'gemma2:9b')
+        evaluation_model = evaluation_config.get('evaluation_model', DEFAULT_EVALUATION_MODEL)
         context_prompt = evaluation_config.get('context_prompt', '')
+        use_cache = evaluation_config.get('use_cache', ResponseCache.enabled_by_default())
         
         # デフォルト質問（設定がない場合）
         if not questions:
@@ -2099,38 +2510,49 @@ Q2: [1-7の数値]
 数値のみを記載し、他の説明は不要です。"""
         
         # AIに評価を依頼
-        print(f"[AI Evaluation] Evaluating chat session {session_id} using {evaluation_model}...")
-        response = ollama.chat(
-            model=evaluation_model,
-            messages=[{"role": "user", "content": evaluation_prompt}]
-        )
-        
-        ai_response = response['message']['content']
-        print(f"[AI Evaluation] AI response: {ai_response}")
-        
-        # 回答をパース
-        evaluation_results = {}
-        for i in range(1, len(questions) + 1):
-            match = re.search(rf'Q{i}:\s*(\d+)', ai_response)
-            if match:
-                score = int(match.group(1))
-                if 1 <= score <= 7:
-                    q_id = questions[i-1].get('question_id', f'q{i}')
-                    evaluation_results[q_id] = score
-        
-        # セッションに評価結果を保存
-        session.add_step_response(step_id, "ai_system", {
-            "evaluation_results": evaluation_results,
-            "raw_response": ai_response
-        })
-        session_manager.update_session(session)
+        # キャッシュ使用時は再評価で同じ結果になるよう決定的な設定（temperature=0, seed固定）で呼び出す
+        evaluation_messages = [{"role": "user", "content": evaluation_prompt}]
+        evaluation_options = None
+        cache_key = None
+        cached = None
+        if use_cache:
+            evaluation_options = {"temperature": 0, "seed": evaluation_config.get('seed', 0)}
+            cache_key = ResponseCache.make_key(evaluation_model, evaluation_options, evaluation_messages)
+            cached = response_cache.get(cache_key)
+        
+        if cached is not None:
+            print(f"[AI Evaluation] ♻️ Served from cache for session {session_id} ({evaluation_model})")
+            evaluation_results = save_ai_evaluation(session_id, step_id, questions, cached["content"], cache_hit=True)
+            return JSONResponse(content={
+                "status": "success",
+                "results": evaluation_results,
+                "raw_response": cached["content"],
+                "cache_hit": True
+            })
         
-        print(f"[AI Evaluation] Saved evaluation results: {evaluation_results}")
+        async def run_evaluation():
+            print(f"[AI Evaluation] Evaluating chat session {session_id} using {evaluation_model}...")
+            ai_response = await bot_manager.complete(evaluation_model, evaluation_messages, evaluation_options)
+            if cache_key:
+                response_cache.put(cache_key, ai_response, evaluation_model)
+            return ai_response, save_ai_evaluation(session_id, step_id, questions, ai_response, cache_hit=False)
+        
+        # 評価モデルをロードするとチャット中のモデルが追い出される場合は、バッチウィンドウまで保留
+        planner = bot_manager.residency_planner
+        if planner.should_defer(evaluation_model):
+            pending = planner.defer(evaluation_model, f"ai_evaluate:{session_id}", run_evaluation)
+            return JSONResponse(status_code=202, content={
+                "status": "deferred",
+                "message": "Evaluation is queued until the chat models can share memory with the evaluation model",
+                "pending": pending
+            })
         
+        ai_response, evaluation_results = await run_evaluation()
         return JSONResponse(content={
             "status": "success",
             "results": evaluation_results,
-            "raw_response": ai_response
+            "raw_response": ai_response,
+            "cache_hit": False
         })
         
     except Exception as e:
@@ -2159,6 +2581,7 @@ async def submit_step_response(session_id: str, request: Request):
         # 回答を保存
         session.add_step_response(step_id, client_id, response_data)
         session_manager.update_session(session)
+        record_flow_update(session)
         
         print(f"[Flow] Response saved for step '{step_id}' by {client_id}")
         
@@ -2187,13 +2610,26 @@ async def configure_chat(session_id: str, request: Request):
         num_ctx = data.get('num_ctx')
         num_gpu = data.get('num_gpu')
         num_batch = data.get('num_batch')
+        coalesce_window_ms = data.get('coalesce_window_ms')
+        seed = data.get('seed')
+        use_response_cache = data.get('response_cache')
+        supersede_inflight = data.get('supersede_inflight')
+        token_budget = TokenBudget(
+            max_tokens_per_turn=data.get('max_tokens_per_turn'),
+            max_tokens_per_session=data.get('max_tokens_per_session'),
+            max_tokens_per_minute=data.get('max_tokens_per_minute'),
+            action=data.get('token_budget_action')
+        )
         
         # セッションを取得
         session = session_manager.load_session(session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        # bot_managerに設定を適用
+        # bot_managerに設定を適用（同時セッション数の上限からnum_thread等を決める）
+        experiment = experiment_manager.get_experiment(session.experiment_id) if session.experiment_id else None
+        bot_manager.set_experiment(session_id, session.experiment_id,
+                                   experiment.max_concurrent_sessions if experiment else None)
         bot_manager.set_model(session_id, bot_model)
         bot_manager.set_system_prompt(session_id, system_prompt)
         bot_manager.set_temperature(session_id, temperature)
@@ -2205,8 +2641,14 @@ async def configure_chat(session_id: str, request: Request):
         bot_manager.set_num_ctx(session_id, num_ctx)
         bot_manager.set_num_gpu(session_id, num_gpu)
         bot_manager.set_num_batch(session_id, num_batch)
+        bot_manager.set_coalesce_window_ms(session_id, coalesce_window_ms)
+        bot_manager.set_supersede_inflight(session_id, supersede_inflight)
+        bot_manager.set_seed(session_id, seed)
+        bot_manager.set_use_response_cache(session_id, use_response_cache)
+        bot_manager.set_token_budget(session_id, token_budget)
         
         # 詳細なAI設定情報を表示
+        resolved_options = bot_manager.get_session_config(session_id).options
         print_info_box("🤖 AI Configuration Applied", {
             "Session": session_id[:20] + "...",
             "Model": bot_model,
@@ -2215,10 +2657,19 @@ async def configure_chat(session_id: str, request: Request):
             "Top K": f"{top_k} (token selection)",
             "Repeat Penalty": f"{repeat_penalty} (anti-repetition)",
             "Max Tokens": num_predict if num_predict else "Unlimited",
-            "CPU Threads": num_thread if num_thread else "Default (8)",
+            "CPU Threads": num_thread if num_thread else f"Auto ({resolved_options.get('num_thread', 'Ollama default')})",
             "Context Length": num_ctx if num_ctx else "Default (8192)",
-            "GPU Layers": num_gpu if num_gpu is not None else "Default (-1, all)",
-            "Batch Size": num_batch if num_batch else "Default (512)"
+            "GPU Layers": num_gpu if num_gpu is not None else f"Auto ({resolved_options.get('num_gpu', 'Ollama default')})",
+            "Batch Size": num_batch if num_batch else f"Auto ({resolved_options.get('num_batch', 'Ollama default')})",
+            "Coalesce Window": f"{bot_manager.get_coalesce_window_ms(session_id)} ms",
+            "Supersede In-flight": bot_manager.get_supersede_inflight(session_id),
+            "Seed": seed if seed is not None else "Random",
+            "Response Cache": bot_manager.get_use_response_cache(session_id),
+            "Token Budget": (
+                f"turn {token_budget.max_tokens_per_turn or '-'} / session {token_budget.max_tokens_per_session or '-'} / "
+                f"minute {token_budget.max_tokens_per_minute or '-'} ({token_budget.action})"
+                if not token_budget.is_unlimited else "Unlimited"
+            )
         })
         
         return JSONResponse(content={
@@ -2234,7 +2685,12 @@ async def configure_chat(session_id: str, request: Request):
                 "num_thread": num_thread,
                 "num_ctx": num_ctx,
                 "num_gpu": num_gpu,
-                "num_batch": num_batch
+                "num_batch": num_batch,
+                "coalesce_window_ms": bot_manager.get_coalesce_window_ms(session_id),
+                "supersede_inflight": bot_manager.get_supersede_inflight(session_id),
+                "seed": seed,
+                "response_cache": bot_manager.get_use_response_cache(session_id),
+                "token_budget": token_budget.to_dict()
             }
         })
         
@@ -2268,14 +2724,13 @@ async def get_experiment_surveys(experiment_id: str, admin_token: Optional[str]
     if not verify_admin_token(admin_token):
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    # 実験に属するすべてのセッションを取得
-    all_sessions = session_manager.get_all_sessions()
-    exp_sessions = [s for s in all_sessions if s.experiment_id == experiment_id]
+    # 実験に属するすべてのセッションを取得（回答インデックスから、変更されたファイルだけ読み込む）
+    exp_sessions = survey_index.sessions(experiment_id, session_manager)
     
     # 全セッションのアンケート回答を収集
     all_surveys = []
     for session in exp_sessions:
-        for client_id, responses in session.survey_responses.items():
+        for client_id, responses in session.legacy_responses.items():
             all_surveys.append({
                 "session_id": session.session_id,
                 "client_id": client_id,
@@ -2289,6 +2744,93 @@ async def get_experiment_surveys(experiment_id: str, admin_token: Optional[str]
         "survey_data": all_surveys
     })
 
+@app.get("/api/experiments/{experiment_id}/surveys/index")
+async def get_experiment_survey_index(experiment_id: str, admin_token: Optional[str] = Cookie(None)):
+    """実験のアンケート回答インデックスの概要（質問・ステップ・条件ごとの回答数、管理者用）"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    summary = survey_index.summary(experiment_id, session_manager)
+    summary["index"] = next((stats for stats in survey_index.get_stats()
+                             if stats["experiment_id"] == experiment_id), None)
+    return JSONResponse(content=summary)
+
+@app.get("/api/experiments/{experiment_id}/surveys/responses")
+async def query_experiment_survey_responses(experiment_id: str,
+                                            question_id: Optional[str] = None,
+                                            step_id: Optional[str] = None,
+                                            condition: Optional[str] = None,
+                                            source: Optional[str] = None,
+                                            limit: int = 1000,
+                                            offset: int = 0,
+                                            admin_token: Optional[str] = Cookie(None)):
+    """
+    アンケート回答を質問・ステップ・条件で絞り込んで取得（回答インデックスから、管理者用）
+    
+    Args:
+        question_id: 質問ID
+        step_id: アンケートステップのID（旧形式の回答は含まない）
+        condition: branch_id・条件ラベル・experiment_group のいずれか
+        source: 'step'（フローの回答）または 'legacy'（旧形式の survey_responses）
+        limit / offset: ページング（作成日時の降順のセッション → セッション内の回答順）
+    """
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if source is not None and source not in ('step', 'legacy'):
+        raise HTTPException(status_code=400, detail="source must be step or legacy")
+    if limit < 1 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit must be positive and offset must not be negative")
+    
+    responses = []
+    total = 0
+    for session, answer in survey_index.query(experiment_id, session_manager, question_id=question_id,
+                                              step_id=step_id, condition=condition, source=source):
+        if offset <= total < offset + limit:
+            row = answer.to_dict()
+            row.update({
+                "participant_code": session.participant_code,
+                "experiment_group": session.experiment_group,
+                "condition": session.condition,
+            })
+            responses.append(row)
+        total += 1
+    
+    return JSONResponse(content={
+        "experiment_id": experiment_id,
+        "filters": {"question_id": question_id, "step_id": step_id, "condition": condition, "source": source},
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "responses": responses
+    })
+
+@app.get("/api/experiments/{experiment_id}/surveys/analytics")
+async def get_experiment_survey_analytics(experiment_id: str,
+                                          questions: Optional[str] = None,
+                                          effect_sizes: bool = False,
+                                          reference: Optional[str] = None,
+                                          admin_token: Optional[str] = Cookie(None)):
+    """
+    数値回答の質問 × 条件ごとの回答数・平均・標準偏差（操作チェックなど実験中の確認用、管理者用）
+    
+    Args:
+        questions: カンマ区切りの質問ID（省略時は数値回答のある全質問）
+        effect_sizes: Trueの場合、質問ごとの η² と基準条件に対する Cohen's d を追加
+        reference: Cohen's d の基準条件（省略時は名前順で最初の条件）
+    """
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not survey_analytics.is_available():
+        raise HTTPException(status_code=501, detail="Survey analytics requires numpy (pip install numpy)")
+    
+    question_ids = [q.strip() for q in questions.split(',') if q.strip()] if questions else None
+    try:
+        result = survey_index.analytics(experiment_id, session_manager, question_ids=question_ids,
+                                        effect_sizes=effect_sizes, reference=reference)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content=result)
+
 # ========== アンケートデータエクスポート API ==========
 
 @app.post("/api/sessions/{session_id}/export/survey")
@@ -2303,13 +2845,9 @@ async def export_session_survey(session_id: str, format: str = "json",
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         if format == "csv":
-            content = data_exporter.export_survey_responses_to_csv(session_id, session_manager)
+            chunks = data_exporter.iter_survey_responses_csv(session_id, session_manager)
             filename = f"survey_{session_id}_{timestamp}.csv"
-            return Response(
-                content=content,
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+            return await streaming_download(chunks, filename, "text/csv")
         elif format == "json":
             content = data_exporter.export_survey_responses_to_json(session_id, session_manager)
             filename = f"survey_{session_id}_{timestamp}.json"
@@ -2326,35 +2864,30 @@ async def export_session_survey(session_id: str, format: str = "json",
 
 @app.post("/api/experiments/{experiment_id}/export/survey")
 async def export_experiment_survey(experiment_id: str, format: str = "json",
+                                   since: Optional[str] = None,
                                    admin_token: Optional[str] = Cookie(None)):
-    """実験全体のアンケート回答をエクスポート（直接ダウンロード）"""
+    """実験全体のアンケート回答をエクスポート（直接ダウンロード、since指定時は差分のみ）"""
     if not verify_admin_token(admin_token):
         raise HTTPException(status_code=401, detail="Unauthorized")
+    delta = export_delta(since, experiment_id)
     
     try:
         from datetime import datetime
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suffix = delta_filename_suffix(delta)
         
         if format == "csv":
-            content = data_exporter.export_experiment_survey_responses_to_csv(
-                experiment_id, session_manager
-            )
-            filename = f"survey_experiment_{experiment_id}_{timestamp}.csv"
-            return Response(
-                content=content,
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
+            chunks = data_exporter.iter_experiment_survey_responses_csv(
+                experiment_id, session_manager, delta=delta
             )
+            filename = f"survey_experiment_{experiment_id}_{timestamp}{suffix}.csv"
+            return await streaming_download(chunks, filename, "text/csv", delta)
         elif format == "json":
-            content = data_exporter.export_experiment_survey_responses_to_json(
-                experiment_id, session_manager
-            )
-            filename = f"survey_experiment_{experiment_id}_{timestamp}.json"
-            return Response(
-                content=content,
-                media_type="application/json",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
+            chunks = data_exporter.iter_experiment_survey_responses_json(
+                experiment_id, session_manager, delta=delta
             )
+            filename = f"survey_experiment_{experiment_id}_{timestamp}{suffix}.json"
+            return await streaming_download(chunks, filename, "application/json", delta)
         else:
             raise HTTPException(status_code=400, detail="Invalid format")
         
@@ -2363,48 +2896,44 @@ async def export_experiment_survey(experiment_id: str, format: str = "json",
 
 @app.post("/api/experiments/{experiment_id}/export/messages")
 async def export_experiment_messages(experiment_id: str, format: str = "csv",
+                                     since: Optional[str] = None,
                                      admin_token: Optional[str] = Cookie(None)):
-    """実験全体のメッセージデータをエクスポート（直接ダウンロード）"""
+    """実験全体のメッセージデータをエクスポート（直接ダウンロード、since指定時は差分のみ）"""
     if not verify_admin_token(admin_token):
         raise HTTPException(status_code=401, detail="Unauthorized")
+    delta = export_delta(since, experiment_id)
     
     try:
         from datetime import datetime
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        content = data_exporter.export_experiment_all_data_to_csv(
-            experiment_id, session_manager, message_store
-        )
-        filename = f"messages_experiment_{experiment_id}_{timestamp}.csv"
-        return Response(
-            content=content,
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        chunks = data_exporter.iter_experiment_all_data_csv(
+            experiment_id, session_manager, message_store, delta=delta
         )
+        filename = f"messages_experiment_{experiment_id}_{timestamp}{delta_filename_suffix(delta)}.csv"
+        return await streaming_download(chunks, filename, "text/csv", delta)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/experiments/{experiment_id}/export/sessions")
 async def export_experiment_sessions_data(experiment_id: str, format: str = "csv",
+                                          since: Optional[str] = None,
                                           admin_token: Optional[str] = Cookie(None)):
-    """実験全体のセッション情報をエクスポート（直接ダウンロード）"""
+    """実験全体のセッション情報をエクスポート（直接ダウンロード、since指定時は差分のみ）"""
     if not verify_admin_token(admin_token):
         raise HTTPException(status_code=401, detail="Unauthorized")
+    delta = export_delta(since, experiment_id)
     
     try:
         from datetime import datetime
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        content = data_exporter.export_experiment_sessions_to_csv(
-            experiment_id, session_manager
-        )
-        filename = f"sessions_experiment_{experiment_id}_{timestamp}.csv"
-        return Response(
-            content=content,
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        chunks = data_exporter.iter_experiment_sessions_csv(
+            experiment_id, session_manager, delta=delta
         )
+        filename = f"sessions_experiment_{experiment_id}_{timestamp}{delta_filename_suffix(delta)}.csv"
+        return await streaming_download(chunks, filename, "text/csv", delta)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2414,6 +2943,7 @@ async def export_experiment_wide_format(experiment_id: str,
                                         excel_format: bool = False,
                                         missing_value: str = 'blank',
                                         include_codebook: bool = False,
+                                        since: Optional[str] = None,
                                         admin_token: Optional[str] = Cookie(None)):
     """
     実験データをワイド形式CSVでエクスポート（統計分析用）
@@ -2423,9 +2953,14 @@ async def export_experiment_wide_format(experiment_id: str,
         excel_format: Trueの場合、UTF-8 BOM付きでExcel対応形式で出力
         missing_value: 欠損値の表現方法 ('blank'=空白, 'NA'=NA, 'comma'=空セル, 'dot'=ピリオド)
         include_codebook: Trueの場合、コードブック付きZIPで出力（全て数値コード化）
+        since: 前回のエクスポートのウォーターマーク（またはISO形式の日時）。指定するとそれ以降に
+               変更されたセッションの行のみを出力（CSVのみ、コードブック付きZIPは常に全件）
     """
     if not verify_admin_token(admin_token):
         raise HTTPException(status_code=401, detail="Unauthorized")
+    if since and include_codebook:
+        raise HTTPException(status_code=400, detail="since is not supported with include_codebook")
+    delta = export_delta(since, experiment_id)
     
     try:
         from datetime import datetime
@@ -2437,43 +2972,33 @@ async def export_experiment_wide_format(experiment_id: str,
             # コードブック付きZIPで出力
             print(f"[Export] Exporting wide format with codebook ({format_type}, missing={missing_value}) for experiment {experiment_id}")
             
-            zip_content = data_exporter.export_experiment_wide_format_with_codebook(
+            chunks = data_exporter.iter_experiment_wide_format_with_codebook(
                 experiment_id, session_manager, message_store, experiment_manager,
                 excel_format=excel_format,
                 missing_value=missing_value
             )
             
             filename = f"wide_format_{experiment_id}_{timestamp}.zip"
-            print(f"[Export] Wide format ZIP generated: {len(zip_content)} bytes")
-            
-            return Response(
-                content=zip_content,
-                media_type="application/zip",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+            return await streaming_download(chunks, filename, "application/zip")
         else:
             # 通常のCSV出力
             print(f"[Export] Exporting wide format CSV ({format_type}, missing={missing_value}) for experiment {experiment_id}")
             
-            content = data_exporter.export_experiment_wide_format_csv(
+            chunks = data_exporter.iter_experiment_wide_format_csv(
                 experiment_id, session_manager, message_store, experiment_manager,
                 excel_format=excel_format,
-                missing_value=missing_value
+                missing_value=missing_value,
+                delta=delta
             )
             
             # Excel形式の場合はファイル名にexcelを付与
+            suffix = delta_filename_suffix(delta)
             if excel_format:
-                filename = f"wide_format_{experiment_id}_{timestamp}_excel.csv"
+                filename = f"wide_format_{experiment_id}_{timestamp}{suffix}_excel.csv"
             else:
-                filename = f"wide_format_{experiment_id}_{timestamp}.csv"
-            
-            print(f"[Export] Wide format CSV generated: {len(content)} bytes")
+                filename = f"wide_format_{experiment_id}_{timestamp}{suffix}.csv"
             
-            return Response(
-                content=content,
-                media_type="text/csv; charset=utf-8",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+            return await streaming_download(chunks, filename, "text/csv; charset=utf-8", delta)
         
     except Exception as e:
         print(f"[Export] Error generating wide format CSV: {e}")
@@ -2481,6 +3006,177 @@ async def export_experiment_wide_format(experiment_id: str,
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/experiments/{experiment_id}/export/bundle")
+async def export_experiment_bundle(experiment_id: str,
+                                   excel_format: bool = False,
+                                   missing_value: str = 'blank',
+                                   admin_token: Optional[str] = Cookie(None)):
+    """
+    実験データ一式を1つのZIPでエクスポート（生成しながら送信）
+    実験フロー・参加者コードの状態・セッション情報・全メッセージ・ワイド形式・コードブック付きデータを含む
+    
+    Args:
+        excel_format: Trueの場合、ワイド形式・コードブックのCSVをUTF-8 BOM付きで出力
+        missing_value: ワイド形式・コードブック付きデータの欠損値の表現方法
+    """
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not experiment_manager.get_experiment(experiment_id):
+        raise HTTPException(status_code=404, detail="Experiment not found")
+    
+    try:
+        from datetime import datetime
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        print(f"[Export] Exporting full bundle (missing={missing_value}) for experiment {experiment_id}")
+        
+        # メッセージはウォーターマークまでに揃える（次回の差分エクスポートの since に使える）
+        delta = ExportDelta()
+        chunks = data_exporter.iter_experiment_bundle(
+            experiment_id, session_manager, message_store, experiment_manager,
+            excel_format=excel_format,
+            missing_value=missing_value,
+            delta=delta
+        )
+        filename = f"bundle_{experiment_id}_{timestamp}.zip"
+        return await streaming_download(chunks, filename, "application/zip", delta)
+        
+    except Exception as e:
+        print(f"[Export] Error generating bundle: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/experiments/{experiment_id}/export/columnar")
+async def export_experiment_columnar(experiment_id: str,
+                                     dataset: str = "wide",
+                                     format: str = "parquet",
+                                     since: Optional[str] = None,
+                                     admin_token: Optional[str] = Cookie(None)):
+    """
+    実験データを列指向形式（Parquet / Arrow IPC(Feather)）でエクスポート（pyarrow が必要）
+    
+    Args:
+        dataset: 'wide'（1行 = 1参加者）, 'messages'（1行 = 1メッセージ）, 'sessions'
+        format: 'parquet' または 'feather'
+        since: 前回のエクスポートのウォーターマーク（またはISO形式の日時）。指定すると差分のみを出力
+    """
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not columnar_export.is_available():
+        raise HTTPException(status_code=501, detail="Parquet/Feather export requires pyarrow (pip install pyarrow)")
+    if dataset not in COLUMNAR_DATASETS:
+        raise HTTPException(status_code=400, detail=f"dataset must be one of {', '.join(COLUMNAR_DATASETS)}")
+    if format not in COLUMNAR_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(COLUMNAR_FORMATS)}")
+    delta = export_delta(since, experiment_id)
+    
+    extension, media_type = COLUMNAR_FORMATS[format]
+    # 行グループごとに一時ファイルへ書き出し、送信後に削除
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=f".{extension}")
+    os.close(fd)
+    try:
+        print(f"[Export] Exporting {dataset} as {format} for experiment {experiment_id}")
+        rows = await asyncio.to_thread(
+            columnar_exporter.export, dataset, format, path, experiment_id,
+            session_manager, message_store, experiment_manager, delta
+        )
+        print(f"[Export] {format} export generated: {rows} rows, {os.path.getsize(path)} bytes")
+    except Exception as e:
+        os.unlink(path)
+        print(f"[Export] Error generating {format} export: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{dataset}_{experiment_id}_{timestamp}{delta_filename_suffix(delta)}.{extension}"
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}", **export_delta_headers(delta)},
+        background=BackgroundTask(os.unlink, path)
+    )
+
+@app.post("/api/experiments/{experiment_id}/export_jobs")
+async def create_export_job(experiment_id: str,
+                            kind: str = "wide",
+                            format: Optional[str] = None,
+                            excel_format: bool = False,
+                            missing_value: str = 'blank',
+                            dataset: str = "wide",
+                            admin_token: Optional[str] = Cookie(None)):
+    """
+    エクスポートをバックグラウンドのジョブとして開始（完了後に /api/export_jobs/{job_id}/download から取得）
+    
+    同じ条件でデータが変わっていなければ、exports/ に保存済みの成果物を使い即座に完了する。
+    
+    Args:
+        kind: 'wide', 'codebook', 'messages', 'sessions', 'survey', 'columnar'
+        format: survey は 'csv' / 'json'、columnar は 'parquet' / 'feather'
+        excel_format, missing_value: wide / codebook のオプション
+        dataset: columnar のデータセット（'wide', 'messages', 'sessions'）
+    """
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if kind not in EXPORT_JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(EXPORT_JOB_KINDS)}")
+    if kind == 'columnar' and not columnar_export.is_available():
+        raise HTTPException(status_code=501, detail="Parquet/Feather export requires pyarrow (pip install pyarrow)")
+    
+    experiment = experiment_manager.get_experiment(experiment_id)
+    if not experiment:
+        raise HTTPException(status_code=404, detail="Experiment not found")
+    
+    try:
+        job = export_jobs.submit(experiment, kind, {
+            "format": format,
+            "excel_format": excel_format,
+            "missing_value": missing_value,
+            "dataset": dataset,
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return JSONResponse(content=job.to_dict(), status_code=200 if job.status == "completed" else 202)
+
+@app.get("/api/experiments/{experiment_id}/export_jobs")
+async def list_export_jobs(experiment_id: str, admin_token: Optional[str] = Cookie(None)):
+    """実験のエクスポートジョブ（新しい順）"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    return JSONResponse(content={
+        "jobs": [job.to_dict() for job in export_jobs.list_jobs(experiment_id)],
+        "stats": export_jobs.get_stats()
+    })
+
+@app.get("/api/export_jobs/{job_id}")
+async def get_export_job(job_id: str, admin_token: Optional[str] = Cookie(None)):
+    """エクスポートジョブの状態と進捗"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    job = export_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return JSONResponse(content=job.to_dict())
+
+@app.get("/api/export_jobs/{job_id}/download")
+async def download_export_job(job_id: str, admin_token: Optional[str] = Cookie(None)):
+    """完了したエクスポートジョブの成果物をダウンロード"""
+    if not verify_admin_token(admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    job = export_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Export job is {job.status}")
+    if not job.artifact_path.exists():
+        raise HTTPException(status_code=410, detail="Export artifact was removed; start the export again")
+    
+    return FileResponse(
+        job.artifact_path,
+        media_type=job.media_type,
+        headers={"Content-Disposition": f"attachment; filename={job.download_filename()}"}
+    )
+
 @app.post("/api/sessions/export/all")
 async def export_all_sessions(format: str = "csv", admin_token: Optional[str] = Cookie(None)):
     """全セッションの情報をエクスポート（直接ダウンロード）"""
@@ -2492,21 +3188,13 @@ async def export_all_sessions(format: str = "csv", admin_token: Optional[str] =
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         if format == "csv":
-            content = data_exporter.export_all_sessions_to_csv(session_manager)
+            chunks = data_exporter.iter_all_sessions_csv(session_manager)
             filename = f"all_sessions_{timestamp}.csv"
-            return Response(
-                content=content,
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+            return await streaming_download(chunks, filename, "text/csv")
         elif format == "json":
-            content = data_exporter.export_all_sessions_summary(session_manager)
+            chunks = data_exporter.iter_all_sessions_json(session_manager)
             filename = f"all_sessions_{timestamp}.json"
-            return Response(
-                content=content,
-                media_type="application/json",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+            return await streaming_download(chunks, filename, "application/json")
         else:
             raise HTTPException(status_code=400, detail="Invalid format")
         
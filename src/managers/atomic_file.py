@@ -0,0 +1,54 @@
+"""ファイルの置き換えによる書き込みと、JSONファイルの読み直し
+
+エクスポート（ワーカースレッド・プロセスプール）は、イベントループがセッション・メッセージファイルを
+保存している最中にも同じファイルを読み込む。open(..., 'w') で上書きすると、読み込み側が切り詰められた
+途中の内容を見てしまうため、同じディレクトリの一時ファイルに書き込んでから os.replace で置き換える。
+読み込み側には常に置き換え前か置き換え後の完全な内容が見える。
+
+サーバー外のツールが上書き保存しているファイルは途中の内容が見えることがあるため、読み込みは
+JSONとして解釈できなかった場合に少し待って読み直す（read_json）。
+"""
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Union
+
+# 解釈できなかったJSONファイルを読み直す回数と間隔（秒）
+READ_ATTEMPTS = 3
+READ_RETRY_SECONDS = 0.05
+
+
+def write_text_atomic(path: Union[str, Path], text: str, encoding: str = 'utf-8'):
+    """text を path に書き込む（一時ファイルに書いてから置き換える）
+
+    一時ファイルは「.{ファイル名}.*.tmp」のため、*.json の列挙には含まれない。
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_json(path: Union[str, Path], encoding: str = 'utf-8') -> Any:
+    """JSONファイルを読み込む（解釈できなければ READ_ATTEMPTS 回まで読み直し、最後の ValueError を送出）
+
+    ファイルがない場合は FileNotFoundError。
+    """
+    for attempt in range(READ_ATTEMPTS):
+        try:
+            with open(path, 'r', encoding=encoding) as f:
+                return json.load(f)
+        except ValueError:
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+            time.sleep(READ_RETRY_SECONDS)
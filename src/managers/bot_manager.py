@@ -1,140 +1,787 @@
 import asyncio
-from typing import Optional, List, Dict
+import hashlib
+import os
+import time
+from collections import deque
+from typing import Optional, List, Dict, Tuple
 import ollama
 from datetime import datetime
+from ..models.message import LLMCallMetadata
+from .mock_llm_backend import MockAsyncClient, MockLLMConfig
+from .ollama_pool import OllamaBackendPool
+from .response_cache import ResponseCache
+from .resource_planner import ResourcePlanner
+from .model_catalog import ModelCatalog
+from .residency_planner import ResidencyPlanner
+from .token_budget import TokenBudget, TokenBudgetManager, TokenUsage
+
+
+# 会話履歴として保持する最大件数
+MAX_HISTORY_MESSAGES = 100
+
+# 上限を超えた場合に残す割合
+# 1件ずつずらすとプロンプトの先頭が毎ターン変わりOllamaのプレフィックスキャッシュが効かないため、
+# まとめて古い履歴を削除し、以降しばらくは先頭が同一のままになるようにする
+HISTORY_TRIM_RATIO = 0.5
+
+# メッセージ1件あたりのテンプレート分のトークン数（概算）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 履歴の再構築対象となるメッセージタイプとロールの対応
+HISTORY_ROLE_BY_MESSAGE_TYPE = {
+    "message": "user",
+    "user": "user",  # 旧形式
+    "bot": "assistant",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（ASCIIは4文字で1トークン、それ以外は1文字1トークン）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def normalize_prompt(text: str) -> str:
+    """プロンプトを正規化（改行コードと前後の空白を統一し、同じ設定なら常に同一のバイト列にする）"""
+    return (text or "").replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def estimate_prompt_tokens(messages: List[Dict]) -> int:
+    """メッセージ列全体のプロンプトトークン数の概算"""
+    return sum(estimate_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+class StaticPrefix:
+    """ターン・セッション間で共有する固定プレフィックス（システムプロンプト）
+
+    同じステップ設定のセッションは同一のオブジェクトを共有し、
+    Ollamaに送るバイト列が完全に一致するようにする。
+    """
+    __slots__ = ('messages', 'prefix_hash', 'tokens')
+    
+    def __init__(self, system_prompt: str):
+        content = normalize_prompt(system_prompt)
+        # 空の場合もsystemメッセージを送る（モデル既定のシステムプロンプトを使わない従来の挙動を維持）
+        self.messages = [{"role": "system", "content": content}]
+        self.prefix_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+        self.tokens = estimate_prompt_tokens(self.messages)
+
+
+class SessionBotConfig:
+    """セッションごとのボット設定（1セッション = 1レコード）
+
+    Ollamaに渡すoptions辞書は設定変更時にのみ再構築し、
+    応答生成のたびに組み立て直さないようにする。
+    num_thread / num_gpu / num_batch が未指定（None）の場合はリソースプランナーの値を使う。
+    """
+    __slots__ = (
+        'model', 'system_prompt', 'temperature', 'top_p', 'top_k',
+        'repeat_penalty', 'num_predict', 'num_thread', 'num_ctx',
+        'num_gpu', 'num_batch', 'seed', 'coalesce_window_ms', 'supersede_inflight',
+        'use_response_cache', 'experiment_id', '_plan', '_options'
+    )
+    
+    # options辞書に含めるパラメータ（Noneの場合は省略）
+    OPTION_FIELDS = (
+        'temperature', 'top_p', 'top_k', 'repeat_penalty', 'num_predict',
+        'num_thread', 'num_ctx', 'num_gpu', 'num_batch', 'seed'
+    )
+    
+    # 未指定時にリソースプランナーの値で補うパラメータ
+    PLANNED_FIELDS = ('num_thread', 'num_gpu', 'num_batch')
+    
+    def __init__(self, defaults: 'BotManager'):
+        self.model = defaults.default_model
+        self.system_prompt = defaults.default_system_prompt
+        self.temperature = defaults.default_temperature
+        self.top_p = defaults.default_top_p
+        self.top_k = defaults.default_top_k
+        self.repeat_penalty = defaults.default_repeat_penalty
+        self.num_predict = defaults.default_num_predict
+        self.num_thread = defaults.default_num_thread
+        self.num_ctx = defaults.default_num_ctx
+        self.num_gpu = defaults.default_num_gpu
+        self.num_batch = defaults.default_num_batch
+        self.seed = defaults.default_seed
+        self.coalesce_window_ms = defaults.default_coalesce_window_ms
+        self.supersede_inflight = defaults.default_supersede_inflight
+        self.use_response_cache = defaults.default_use_response_cache
+        self.experiment_id: Optional[str] = None  # テレメトリ集計用
+        self._plan = defaults.resource_planner.plan_for(None)
+        self._options: Optional[Dict] = None
+    
+    def update(self, field: str, value):
+        """設定値を更新（options辞書は次回参照時に再構築）"""
+        setattr(self, field, value)
+        if field in self.OPTION_FIELDS:
+            self._options = None
+    
+    def set_plan(self, plan):
+        """リソースプランを設定（同時実行数の上限が変わった場合）"""
+        if plan is not self._plan:
+            self._plan = plan
+            self._options = None
+    
+    @property
+    def options(self) -> Dict:
+        """Ollamaに渡すoptions辞書（キャッシュ済み）"""
+        if self._options is None:
+            options = {}
+            for field in self.OPTION_FIELDS:
+                value = getattr(self, field)
+                if value is None and field in self.PLANNED_FIELDS:
+                    value = self._plan.defaults.get(field)
+                if value is not None:
+                    options[field] = value
+            self._options = options
+        return self._options
+
+
+def _ns_to_ms(value: Optional[int]) -> Optional[float]:
+    """ナノ秒をミリ秒に変換"""
+    return round(value / 1_000_000, 1) if value is not None else None
+
+
+class InflightGeneration:
+    """実行中の応答生成（セッションごとに最大1件）"""
+    __slots__ = (
+        'session_id', 'task', 'streamed_tokens', 'cancel_reason', 'num_predict',
+        'started_at', 'request_at', 'first_token_at', 'final_chunk'
+    )
+    
+    def __init__(self, session_id: str, task: Optional[asyncio.Task], num_predict: Optional[int]):
+        self.session_id = session_id
+        self.task = task
+        self.streamed_tokens = 0  # 中断までに受信したトークン数（ストリームのチャンク数）
+        self.cancel_reason: Optional[str] = None
+        self.num_predict = num_predict
+        # 計測用タイムスタンプ（time.perf_counter）
+        self.started_at = time.perf_counter()
+        self.request_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.final_chunk = None  # done=Trueの最終チャンク（Ollamaの計測値を含む）
+    
+    def build_telemetry(self, model: str) -> LLMCallMetadata:
+        """Ollamaの計測値とクライアント側の計測値からテレメトリを作成"""
+        final = self.final_chunk
+        now = time.perf_counter()
+        request_at = self.request_at or self.started_at
+        ttft_ms = (self.first_token_at - request_at) * 1000 if self.first_token_at else None
+        
+        telemetry = LLMCallMetadata(
+            model=model,
+            wall_ms=round((now - self.started_at) * 1000, 1),
+            ttft_ms=round(ttft_ms, 1) if ttft_ms is not None else None,
+        )
+        if final is not None:
+            telemetry.prompt_tokens = final.get('prompt_eval_count')
+            telemetry.completion_tokens = final.get('eval_count')
+            telemetry.prompt_eval_ms = _ns_to_ms(final.get('prompt_eval_duration'))
+            telemetry.eval_ms = _ns_to_ms(final.get('eval_duration'))
+            telemetry.load_ms = _ns_to_ms(final.get('load_duration'))
+            telemetry.total_ms = _ns_to_ms(final.get('total_duration'))
+            telemetry.done_reason = final.get('done_reason')
+            if telemetry.completion_tokens and telemetry.eval_ms:
+                telemetry.tokens_per_second = round(telemetry.completion_tokens / (telemetry.eval_ms / 1000), 2)
+        
+        # 待ち時間 = 呼び出し前の待ち + 最初のトークンまでの時間のうちロード・プロンプト評価以外
+        local_wait_ms = (request_at - self.started_at) * 1000
+        backend_wait_ms = 0.0
+        if ttft_ms is not None:
+            backend_wait_ms = max(ttft_ms - (telemetry.load_ms or 0) - (telemetry.prompt_eval_ms or 0), 0.0)
+        telemetry.queue_wait_ms = round(local_wait_ms + backend_wait_ms, 1)
+        return telemetry
+
+
+def _percentile(values, pct: float) -> Optional[float]:
+    """パーセンタイル値を計算（最近傍法）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class TelemetryAggregate:
+    """LLM呼び出しテレメトリの集計（モデル別・実験別）"""
+    __slots__ = (
+        'calls', 'prompt_tokens', 'completion_tokens', 'prompt_eval_ms',
+        'eval_ms', 'load_ms', 'prompt_tokens_reuse_base', 'prompt_tokens_reused',
+        '_ttft_ms', '_queue_wait_ms', '_wall_ms'
+    )
+    
+    # パーセンタイル計算に使う直近の計測値の件数
+    WINDOW = 1000
+    
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.prompt_eval_ms = 0.0
+        self.eval_ms = 0.0
+        self.load_ms = 0.0
+        self.prompt_tokens_reuse_base = 0  # 再利用を判定できた呼び出しのプロンプト全体のトークン数
+        self.prompt_tokens_reused = 0
+        self._ttft_ms = deque(maxlen=self.WINDOW)
+        self._queue_wait_ms = deque(maxlen=self.WINDOW)
+        self._wall_ms = deque(maxlen=self.WINDOW)
+    
+    def add(self, telemetry: LLMCallMetadata):
+        self.calls += 1
+        self.prompt_tokens += telemetry.prompt_tokens or 0
+        self.completion_tokens += telemetry.completion_tokens or 0
+        self.prompt_eval_ms += telemetry.prompt_eval_ms or 0
+        self.eval_ms += telemetry.eval_ms or 0
+        self.load_ms += telemetry.load_ms or 0
+        if telemetry.prompt_tokens_reused is not None and telemetry.prompt_tokens is not None:
+            self.prompt_tokens_reuse_base += telemetry.prompt_tokens_reused + telemetry.prompt_tokens
+            self.prompt_tokens_reused += telemetry.prompt_tokens_reused
+        if telemetry.ttft_ms is not None:
+            self._ttft_ms.append(telemetry.ttft_ms)
+        if telemetry.queue_wait_ms is not None:
+            self._queue_wait_ms.append(telemetry.queue_wait_ms)
+        if telemetry.wall_ms is not None:
+            self._wall_ms.append(telemetry.wall_ms)
+    
+    def to_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.calls, 1) if self.calls else None,
+            "avg_completion_tokens": round(self.completion_tokens / self.calls, 1) if self.calls else None,
+            "prompt_tokens_per_second": round(self.prompt_tokens / (self.prompt_eval_ms / 1000), 2) if self.prompt_eval_ms else None,
+            "completion_tokens_per_second": round(self.completion_tokens / (self.eval_ms / 1000), 2) if self.eval_ms else None,
+            "total_load_ms": round(self.load_ms, 1),
+            "prompt_tokens_reused": self.prompt_tokens_reused,
+            "prompt_reuse_ratio": round(self.prompt_tokens_reused / self.prompt_tokens_reuse_base, 3) if self.prompt_tokens_reuse_base else None,
+            "ttft_ms_p50": _percentile(self._ttft_ms, 50),
+            "ttft_ms_p95": _percentile(self._ttft_ms, 95),
+            "queue_wait_ms_p50": _percentile(self._queue_wait_ms, 50),
+            "queue_wait_ms_p95": _percentile(self._queue_wait_ms, 95),
+            "wall_ms_p50": _percentile(self._wall_ms, 50),
+            "wall_ms_p95": _percentile(self._wall_ms, 95),
+        }
+
+
+class GenerationMetrics:
+    """応答生成の完了・中断に関する集計"""
+    
+    def __init__(self):
+        self.completed = 0
+        self.completion_tokens = 0
+        self.aborted: Dict[str, int] = {}  # 中断理由ごとの件数
+        self.tokens_discarded = 0  # 中断により破棄された生成済みトークン数
+        self.tokens_avoided = 0  # 中断により生成せずに済んだトークン数（推定）
+        self.coalesced_turns = 0  # 連続メッセージをまとめたLLMターン数
+        self.coalesced_messages = 0  # まとめられたことで省略されたLLM呼び出し数
+        self.cache_hits = 0  # 応答キャッシュから返した件数
+    
+    def record_cache_hit(self):
+        """応答キャッシュから返したことを記録"""
+        self.cache_hits += 1
+    
+    def record_coalesced(self, message_count: int):
+        """複数メッセージを1ターンにまとめたことを記録"""
+        if message_count > 1:
+            self.coalesced_turns += 1
+            self.coalesced_messages += message_count - 1
+    
+    def record_completion(self, tokens: int):
+        """正常完了した生成を記録"""
+        self.completed += 1
+        self.completion_tokens += tokens
+    
+    def record_abort(self, reason: str, streamed_tokens: int, num_predict: Optional[int]):
+        """中断した生成を記録
+        
+        生成せずに済んだトークン数は、num_predictが指定されていればその上限、
+        なければこれまでの完了応答の平均トークン数から推定する。
+        """
+        self.aborted[reason] = self.aborted.get(reason, 0) + 1
+        self.tokens_discarded += streamed_tokens
+        if num_predict:
+            expected = num_predict
+        elif self.completed:
+            expected = self.completion_tokens / self.completed
+        else:
+            expected = 0
+        self.tokens_avoided += max(int(expected) - streamed_tokens, 0)
+    
+    def to_dict(self) -> Dict:
+        return {
+            "completed": self.completed,
+            "completion_tokens": self.completion_tokens,
+            "aborted": dict(self.aborted),
+            "aborted_total": sum(self.aborted.values()),
+            "tokens_discarded": self.tokens_discarded,
+            "tokens_avoided_estimate": self.tokens_avoided,
+            "coalesced_turns": self.coalesced_turns,
+            "calls_avoided_by_coalescing": self.coalesced_messages,
+            "cache_hits": self.cache_hits,
+        }
 
 
 class BotManager:
     """ローカルLLMボット管理クラス"""
     
-    def __init__(self, default_model: str = "gemma3:4b", bot_client_id: str = "bot"):
+    def __init__(self, default_model: str = "gemma3:4b", bot_client_id: str = "bot",
+                 message_store=None, backend: Optional[str] = None,
+                 backend_hosts: Optional[List[str]] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 resource_planner: Optional[ResourcePlanner] = None):
         """
         初期化
         
         Args:
             default_model: デフォルトで使用するOllamaモデル名（デフォルト: gemma3:4b）
             bot_client_id: ボットのクライアントID
+            message_store: 会話履歴の再構築に使用するMessageStore（省略可）
+            backend: LLMバックエンド（"ollama" または負荷試験用の "mock"。省略時は環境変数 LLM_BACKEND）
+            backend_hosts: 負荷分散するOllamaのホスト一覧（省略時は環境変数 OLLAMA_HOSTS、未設定なら単一のOllama）
+            response_cache: 決定的な呼び出しの応答キャッシュ（省略時はキャッシュしない）
+            resource_planner: CPU・メモリからnum_thread等を決めるプランナー（省略時は起動時に検出）
         """
         self.default_model = default_model
         self.bot_client_id = bot_client_id
+        self.message_store = message_store
+        self.backend = backend or os.environ.get("LLM_BACKEND", "ollama")
         self.conversation_history: Dict[str, List[Dict]] = {}  # セッションIDごとの会話履歴
-        self.system_prompts: Dict[str, str] = {}  # セッションIDごとのシステムプロンプト
-        self.models: Dict[str, str] = {}  # セッションIDごとのモデル
-        self.temperatures: Dict[str, float] = {}  # セッションIDごとのtemperature
-        self.top_ps: Dict[str, float] = {}  # セッションIDごとのtop_p
-        self.top_ks: Dict[str, int] = {}  # セッションIDごとのtop_k
-        self.repeat_penalties: Dict[str, float] = {}  # セッションIDごとのrepeat_penalty
-        self.num_predicts: Dict[str, Optional[int]] = {}  # セッションIDごとのnum_predict
-        self.num_threads: Dict[str, Optional[int]] = {}  # セッションIDごとのnum_thread
-        self.num_ctxs: Dict[str, Optional[int]] = {}  # セッションIDごとのnum_ctx
-        self.num_gpus: Dict[str, Optional[int]] = {}  # セッションIDごとのnum_gpu
-        self.num_batches: Dict[str, Optional[int]] = {}  # セッションIDごとのnum_batch
+        self._static_prefixes: Dict[str, StaticPrefix] = {}  # システムプロンプト → 共有プレフィックス
+        self.session_configs: Dict[str, SessionBotConfig] = {}  # セッションIDごとのボット設定
         self.default_system_prompt = "あなたは親切で役立つAIアシスタントです。ユーザーの質問に丁寧に答えてください。"
         self.default_temperature = 0.7
         self.default_top_p = 0.9
         self.default_top_k = 40
         self.default_repeat_penalty = 1.1
         self.default_num_predict = None
-        # M4最適化デフォルト値
-        self.default_num_thread = 8  # M4の10コアを活用
-        self.default_num_ctx = 8192  # 16GBメモリで余裕を持たせる
-        self.default_num_gpu = -1  # 全GPUレイヤー使用（M4 Neural Engine）
-        self.default_num_batch = 512  # 並列処理最適化
+        # num_thread / num_gpu / num_batch は未指定（None）ならリソースプランナーが
+        # 検出したコア数・NUMA構成と同時実行数の上限から決める
+        # 負荷分散先のOllamaは別のマシンのため、このサーバーのコア数・GPUから num_thread / num_gpu を決めない
+        self.resource_planner = resource_planner or ResourcePlanner(
+            local_backend=True if self.backend == "mock" else (False if backend_hosts else None)
+        )
+        self.default_num_thread = None
+        self.default_num_ctx = 8192
+        self.default_num_gpu = None
+        self.default_num_batch = None
+        self.default_seed = None  # 乱数シード（固定すると応答が再現可能になる）
+        # 連続メッセージの結合（最後のメッセージからこの時間待って1ターンにまとめる）
+        self.default_coalesce_window_ms = int(os.environ.get("BOT_COALESCE_WINDOW_MS", 800))
+        self.default_supersede_inflight = True  # 生成中に新しいメッセージが来たら生成をやり直す
+        # 応答キャッシュ（temperature=0 または seed 固定の呼び出しのみ、セッションごとにオプトイン）
+        self.response_cache = response_cache
+        self.default_use_response_cache = ResponseCache.enabled_by_default()
+        # 設定未登録セッション用の共有デフォルト（読み取り専用として扱う）
+        self._default_config = SessionBotConfig(self)
+        # 実行中の応答生成（中断時にHTTPストリームを閉じるため）
+        self.inflight: Dict[str, InflightGeneration] = {}
+        self.metrics = GenerationMetrics()
+        # セッション・実験ごとのトークン使用量と上限（チャットステップで設定）
+        self.token_budgets = TokenBudgetManager()
+        # 応答待ちのユーザーメッセージ（結合ウィンドウ内に届いたもの）
+        self.pending_messages: Dict[str, List[str]] = {}
+        self.last_user_message_at: Dict[str, float] = {}
+        # LLM呼び出しテレメトリ（直近の呼び出し結果とモデル別・実験別の集計）
+        self.last_telemetry: Dict[str, LLMCallMetadata] = {}
+        # セッションごとの直前の呼び出しのコンテキスト長（prefix_hash, トークン数）。プレフィックスキャッシュの判定用
+        self.prompt_context_tokens: Dict[str, Tuple[str, int]] = {}
+        self.telemetry_by_model: Dict[str, TelemetryAggregate] = {}
+        self.telemetry_by_experiment: Dict[str, TelemetryAggregate] = {}
+        self._client: Optional[ollama.AsyncClient] = None
+        # 複数Ollamaへの負荷分散（mockバックエンドでは使用しない）
+        self.pool: Optional[OllamaBackendPool] = None
+        if self.backend != "mock":
+            self.pool = OllamaBackendPool(backend_hosts) if backend_hosts else OllamaBackendPool.from_env()
+        if self.pool:
+            print(f"[BotManager] Ollama backend pool: {[b.host for b in self.pool.backends]}")
+        # モデル一覧のキャッシュ（プール使用時は全バックエンドを統合）
+        if self.pool:
+            catalog_sources = [(b.host, b.client) for b in self.pool.backends]
+        else:
+            catalog_sources = [("default", self._get_client())]
+        self.model_catalog = ModelCatalog(catalog_sources)
+        # フローで使うモデルの常駐計画（チャットモデルを優先し、評価などの低優先度処理を保留）
+        self.last_chat_activity = time.monotonic()
+        self.residency_planner = ResidencyPlanner(self.model_catalog, self.resource_planner)
+        self.residency_planner.idle_probe = self.seconds_since_chat_activity
+        self.residency_planner.unloader = self.unload_model
+    
+    def _get_client(self) -> ollama.AsyncClient:
+        """Ollamaの非同期クライアントを取得（OLLAMA_HOSTを参照、mockバックエンドではモック）"""
+        if self._client is None:
+            if self.backend == "mock":
+                self._client = MockAsyncClient(MockLLMConfig.from_env())
+                print("[BotManager] Using mock LLM backend (in-process)")
+            else:
+                self._client = ollama.AsyncClient()
+        return self._client
+    
+    def start_backend_health_checks(self):
+        """バックエンドプールのヘルスチェック・モデルカタログの定期更新・保留処理の監視を開始"""
+        if self.pool:
+            self.pool.start_health_checks()
+        self.model_catalog.start()
+        self.residency_planner.start()
+    
+    def get_backend_status(self) -> Dict:
+        """バックエンドの状態（プール未使用時は単一バックエンドとして返す）"""
+        if self.pool:
+            return {"pooled": True, **self.pool.get_status()}
+        return {"pooled": False, "backend": self.backend,
+                "host": os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")}
+    
+    async def _open_chat_stream(self, session_id: str, model: str, messages: List[Dict], options: Dict):
+        """チャットのストリームを開いて逐次返す（プール使用時は送信先を選択し、完了時に解放）"""
+        backend = self.pool.acquire(model, session_id) if self.pool else None
+        client = backend.client if backend else self._get_client()
+        error = None
+        try:
+            stream = await client.chat(
+                model=model,
+                messages=messages,
+                options=options,
+                stream=True,
+                keep_alive=self.residency_planner.keep_alive_for(model)
+            )
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+        except ollama.ResponseError:
+            # バックエンドは応答しているため異常扱いにしない
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.last_chat_activity = time.monotonic()
+            if backend:
+                self.pool.release(backend, error)
+    
+    async def complete(self, model: str, messages: List[Dict], options: Optional[Dict] = None) -> str:
+        """ストリーミングなしで1回分の応答を取得（AI評価など、参加者を待たせない処理用）"""
+        backend = self.pool.acquire(model) if self.pool else None
+        client = backend.client if backend else self._get_client()
+        error = None
+        try:
+            response = await client.chat(
+                model=model,
+                messages=messages,
+                options=options,
+                keep_alive=self.residency_planner.keep_alive_for(model)
+            )
+            return response['message']['content']
+        except ollama.ResponseError:
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if backend:
+                self.pool.release(backend, error)
+    
+    async def unload_model(self, model: str):
+        """モデルをアンロード（keep_alive=0）してメモリを解放"""
+        if self.pool:
+            backends = [b for b in self.pool.backends if b.has_model(model)]
+            for backend in backends:
+                await backend.client.generate(model=model, keep_alive=0)
+                backend.resident_models.discard(model)
+        else:
+            await self._get_client().generate(model=model, keep_alive=0)
+    
+    def seconds_since_chat_activity(self) -> Optional[float]:
+        """チャットの最終活動（生成完了・ユーザー発言）からの経過秒（生成中はNone）"""
+        if self.inflight:
+            return None
+        last = max([self.last_chat_activity, *self.last_user_message_at.values()])
+        return time.monotonic() - last
+    
+    def get_session_config(self, session_id: str) -> SessionBotConfig:
+        """セッションの設定を取得（未設定の場合はデフォルト設定）"""
+        return self.session_configs.get(session_id, self._default_config)
+    
+    def _set_config_value(self, session_id: str, field: str, value):
+        """セッションの設定値を更新（必要ならレコードを作成）"""
+        config = self.session_configs.get(session_id)
+        if config is None:
+            config = SessionBotConfig(self)
+            self.session_configs[session_id] = config
+        config.update(field, value)
+    
+    def release_session(self, session_id: str):
+        """セッション終了時に設定と会話履歴をまとめて破棄（実行中の生成も中断）"""
+        self.cancel_generation(session_id, reason="session_ended")
+        self.session_configs.pop(session_id, None)
+        self.last_telemetry.pop(session_id, None)
+        self.prompt_context_tokens.pop(session_id, None)
+        self.conversation_history.pop(session_id, None)
+        self.pending_messages.pop(session_id, None)
+        self.last_user_message_at.pop(session_id, None)
+        self.token_budgets.release_session(session_id)
+        if self.pool:
+            self.pool.release_session(session_id)
+    
+    def set_experiment(self, session_id: str, experiment_id: Optional[str],
+                       max_concurrent_sessions: Optional[int] = None):
+        """セッションが属する実験を設定
+        
+        Args:
+            experiment_id: テレメトリの実験別集計に使用
+            max_concurrent_sessions: 実験の同時セッション数の上限（num_thread等の決定に使用）
+        """
+        self._set_config_value(session_id, 'experiment_id', experiment_id)
+        self.session_configs[session_id].set_plan(self.resource_planner.plan_for(max_concurrent_sessions))
+    
+    def set_token_budget(self, session_id: str, budget: Optional[TokenBudget]):
+        """セッションのトークン上限を設定（再起動後は保存済みメッセージから使用量を復元）"""
+        experiment_id = self.get_session_config(session_id).experiment_id
+        if budget is not None and not budget.is_unlimited and not self.token_budgets.has_usage(session_id):
+            self._restore_token_usage(session_id, experiment_id)
+        self.token_budgets.set_budget(session_id, budget, experiment_id)
+    
+    def _restore_token_usage(self, session_id: str, experiment_id: Optional[str]):
+        """保存済みボットメッセージのLLM計測値からセッションのトークン使用量を復元"""
+        try:
+            usage = self.stored_token_usage(session_id)
+        except Exception as e:
+            print(f"[BotManager] Failed to restore token usage for {session_id[:12]}...: {e}")
+            return
+        if usage.calls:
+            self.token_budgets.restore(session_id, experiment_id, usage.prompt_tokens,
+                                       usage.completion_tokens, usage.calls)
+            print(f"[BotManager] Restored token usage for session {session_id[:12]}...: "
+                  f"{usage.total_tokens} tokens in {usage.calls} calls")
+    
+    def stored_token_usage(self, session_id: str) -> TokenUsage:
+        """保存済みボットメッセージのLLM計測値から求めたセッションのトークン使用量（応答キャッシュからの応答は除く）"""
+        usage = TokenUsage()
+        if not self.message_store:
+            return usage
+        for msg in self.message_store.iter_messages_reversed(session_id, ["bot"]):
+            llm = msg.metadata.llm if msg.metadata else None
+            if llm is None or llm.cache_hit:
+                continue
+            usage.add_stored(llm.prompt_tokens or 0, llm.completion_tokens or 0, 1)
+        return usage
+    
+    def get_token_budget(self, session_id: str) -> Optional[TokenBudget]:
+        return self.token_budgets.get_budget(session_id)
     
     def set_model(self, session_id: str, model: str):
         """セッションのモデルを設定"""
-        self.models[session_id] = model
+        self._set_config_value(session_id, 'model', model)
     
     def get_model(self, session_id: str) -> str:
         """セッションのモデルを取得"""
-        return self.models.get(session_id, self.default_model)
+        return self.get_session_config(session_id).model
     
     def set_system_prompt(self, session_id: str, prompt: str):
         """セッションのシステムプロンプトを設定"""
-        self.system_prompts[session_id] = prompt
+        self._set_config_value(session_id, 'system_prompt', prompt)
     
     def get_system_prompt(self, session_id: str) -> str:
         """セッションのシステムプロンプトを取得"""
-        return self.system_prompts.get(session_id, self.default_system_prompt)
+        return self.get_session_config(session_id).system_prompt
     
     def set_temperature(self, session_id: str, temperature: float):
         """セッションのtemperatureを設定"""
-        self.temperatures[session_id] = temperature
+        self._set_config_value(session_id, 'temperature', temperature)
     
     def get_temperature(self, session_id: str) -> float:
         """セッションのtemperatureを取得"""
-        return self.temperatures.get(session_id, self.default_temperature)
+        return self.get_session_config(session_id).temperature
     
     def set_top_p(self, session_id: str, top_p: float):
         """セッションのtop_pを設定"""
-        self.top_ps[session_id] = top_p
+        self._set_config_value(session_id, 'top_p', top_p)
     
     def get_top_p(self, session_id: str) -> float:
         """セッションのtop_pを取得"""
-        return self.top_ps.get(session_id, self.default_top_p)
+        return self.get_session_config(session_id).top_p
     
     def set_top_k(self, session_id: str, top_k: int):
         """セッションのtop_kを設定"""
-        self.top_ks[session_id] = top_k
+        self._set_config_value(session_id, 'top_k', top_k)
     
     def get_top_k(self, session_id: str) -> int:
         """セッションのtop_kを取得"""
-        return self.top_ks.get(session_id, self.default_top_k)
+        return self.get_session_config(session_id).top_k
     
     def set_repeat_penalty(self, session_id: str, repeat_penalty: float):
         """セッションのrepeat_penaltyを設定"""
-        self.repeat_penalties[session_id] = repeat_penalty
+        self._set_config_value(session_id, 'repeat_penalty', repeat_penalty)
     
     def get_repeat_penalty(self, session_id: str) -> float:
         """セッションのrepeat_penaltyを取得"""
-        return self.repeat_penalties.get(session_id, self.default_repeat_penalty)
+        return self.get_session_config(session_id).repeat_penalty
     
     def set_num_predict(self, session_id: str, num_predict: Optional[int]):
         """セッションのnum_predictを設定"""
-        self.num_predicts[session_id] = num_predict
+        self._set_config_value(session_id, 'num_predict', num_predict)
     
     def get_num_predict(self, session_id: str) -> Optional[int]:
         """セッションのnum_predictを取得"""
-        return self.num_predicts.get(session_id, self.default_num_predict)
+        return self.get_session_config(session_id).num_predict
     
     def set_num_thread(self, session_id: str, num_thread: Optional[int]):
         """セッションのnum_threadを設定"""
-        self.num_threads[session_id] = num_thread
+        self._set_config_value(session_id, 'num_thread', num_thread)
     
     def get_num_thread(self, session_id: str) -> Optional[int]:
         """セッションのnum_threadを取得"""
-        return self.num_threads.get(session_id, self.default_num_thread)
+        return self.get_session_config(session_id).num_thread
     
     def set_num_ctx(self, session_id: str, num_ctx: Optional[int]):
         """セッションのnum_ctxを設定"""
-        self.num_ctxs[session_id] = num_ctx
+        self._set_config_value(session_id, 'num_ctx', num_ctx)
     
     def get_num_ctx(self, session_id: str) -> Optional[int]:
         """セッションのnum_ctxを取得"""
-        return self.num_ctxs.get(session_id, self.default_num_ctx)
+        return self.get_session_config(session_id).num_ctx
     
     def set_num_gpu(self, session_id: str, num_gpu: Optional[int]):
         """セッションのnum_gpuを設定"""
-        self.num_gpus[session_id] = num_gpu
+        self._set_config_value(session_id, 'num_gpu', num_gpu)
     
     def get_num_gpu(self, session_id: str) -> Optional[int]:
         """セッションのnum_gpuを取得"""
-        return self.num_gpus.get(session_id, self.default_num_gpu)
+        return self.get_session_config(session_id).num_gpu
     
     def set_num_batch(self, session_id: str, num_batch: Optional[int]):
         """セッションのnum_batchを設定"""
-        self.num_batches[session_id] = num_batch
+        self._set_config_value(session_id, 'num_batch', num_batch)
     
     def get_num_batch(self, session_id: str) -> Optional[int]:
         """セッションのnum_batchを取得"""
-        return self.num_batches.get(session_id, self.default_num_batch)
+        return self.get_session_config(session_id).num_batch
+    
+    def set_seed(self, session_id: str, seed: Optional[int]):
+        """セッションの乱数シードを設定"""
+        self._set_config_value(session_id, 'seed', seed)
+    
+    def get_seed(self, session_id: str) -> Optional[int]:
+        """セッションの乱数シードを取得"""
+        return self.get_session_config(session_id).seed
+    
+    def set_use_response_cache(self, session_id: str, enabled: Optional[bool]):
+        """セッションで応答キャッシュを使用するかを設定（Noneでデフォルト）"""
+        if enabled is None:
+            enabled = self.default_use_response_cache
+        self._set_config_value(session_id, 'use_response_cache', bool(enabled))
+    
+    def get_use_response_cache(self, session_id: str) -> bool:
+        """セッションで応答キャッシュを使用するかを取得"""
+        return self.get_session_config(session_id).use_response_cache
+    
+    def get_cache_key(self, model: str, options: Dict, messages: List[Dict]) -> Optional[str]:
+        """キャッシュ可能な呼び出しならキャッシュキーを返す（それ以外はNone）"""
+        if self.response_cache is None or not ResponseCache.is_cacheable(options):
+            return None
+        return ResponseCache.make_key(model, options, messages)
+    
+    def set_coalesce_window_ms(self, session_id: str, window_ms: Optional[int]):
+        """セッションのメッセージ結合ウィンドウ（ミリ秒）を設定（Noneでデフォルト）"""
+        if window_ms is None:
+            window_ms = self.default_coalesce_window_ms
+        self._set_config_value(session_id, 'coalesce_window_ms', max(int(window_ms), 0))
+    
+    def get_coalesce_window_ms(self, session_id: str) -> int:
+        """セッションのメッセージ結合ウィンドウ（ミリ秒）を取得"""
+        return self.get_session_config(session_id).coalesce_window_ms
+    
+    def set_supersede_inflight(self, session_id: str, supersede: Optional[bool]):
+        """生成中に届いたメッセージで実行中の生成をやり直すかを設定（Noneでデフォルト）"""
+        if supersede is None:
+            supersede = self.default_supersede_inflight
+        self._set_config_value(session_id, 'supersede_inflight', bool(supersede))
+    
+    def get_supersede_inflight(self, session_id: str) -> bool:
+        """生成中に届いたメッセージで実行中の生成をやり直すかを取得"""
+        return self.get_session_config(session_id).supersede_inflight
+    
+    def queue_user_message(self, session_id: str, user_message: str):
+        """応答待ちのユーザーメッセージを追加（次のLLMターンでまとめて送信）"""
+        self.pending_messages.setdefault(session_id, []).append(user_message)
+        self.last_user_message_at[session_id] = time.monotonic()
+    
+    def has_pending_messages(self, session_id: str) -> bool:
+        """応答待ちのユーザーメッセージがあるか"""
+        return bool(self.pending_messages.get(session_id))
+    
+    async def wait_for_coalesced_turn(self, session_id: str) -> Optional[str]:
+        """結合ウィンドウの間に新しいメッセージが来なくなるまで待ち、まとめたユーザーターンを返す
+        
+        ウィンドウ内に届いたメッセージは改行で連結して1回のLLM呼び出しにまとめる。
+        応答待ちのメッセージがない場合はNoneを返す。
+        """
+        while self.pending_messages.get(session_id):
+            window = self.get_coalesce_window_ms(session_id) / 1000
+            elapsed = time.monotonic() - self.last_user_message_at.get(session_id, 0.0)
+            if elapsed >= window:
+                break
+            await asyncio.sleep(window - elapsed)
+        
+        messages = self.pending_messages.pop(session_id, None)
+        if not messages:
+            return None
+        self.metrics.record_coalesced(len(messages))
+        if len(messages) > 1:
+            print(f"[BotManager] Coalesced {len(messages)} messages into one turn for session {session_id[:12]}...")
+        return "\n".join(messages)
     
     def get_conversation_history(self, session_id: str) -> List[Dict]:
-        """セッションの会話履歴を取得"""
+        """セッションの会話履歴を取得（キャッシュがなければ永続化データから再構築）"""
         if session_id not in self.conversation_history:
-            self.conversation_history[session_id] = []
+            self.conversation_history[session_id] = self._rehydrate_history(session_id)
         return self.conversation_history[session_id]
     
+    def _get_history_token_budget(self, session_id: str) -> int:
+        """再構築する履歴に割り当てるトークン数を計算"""
+        config = self.get_session_config(session_id)
+        num_ctx = config.num_ctx or self.default_num_ctx
+        # 応答生成分（num_predict、未指定時はコンテキストの1/4）を確保
+        reserve = config.num_predict if config.num_predict else num_ctx // 4
+        budget = num_ctx - reserve - estimate_tokens(config.system_prompt or "")
+        return max(budget, 0)
+    
+    def _rehydrate_history(self, session_id: str) -> List[Dict]:
+        """MessageStoreから会話履歴の末尾を再構築
+        
+        サーバー再起動後などメモリ上の履歴がない場合に、保存済みの
+        ユーザー・ボットメッセージを新しい順に読み、トークン予算に収まる分だけ復元する。
+        """
+        if not self.message_store:
+            return []
+        
+        budget = self._get_history_token_budget(session_id)
+        used_tokens = 0
+        history: List[Dict] = []
+        try:
+            for msg in self.message_store.iter_messages_reversed(
+                session_id, HISTORY_ROLE_BY_MESSAGE_TYPE.keys()
+            ):
+                tokens = estimate_tokens(msg.content)
+                if used_tokens + tokens > budget or len(history) >= MAX_HISTORY_MESSAGES:
+                    break
+                used_tokens += tokens
+                role = HISTORY_ROLE_BY_MESSAGE_TYPE[msg.message_type]
+                if role == "user" and history and history[-1]["role"] == "user":
+                    # 連続したユーザーメッセージは1ターンにまとめて送信されているため結合
+                    history[-1]["content"] = msg.content + "\n" + history[-1]["content"]
+                    continue
+                history.append({"role": role, "content": msg.content})
+        except Exception as e:
+            print(f"[BotManager] Failed to rehydrate history for {session_id[:12]}...: {e}")
+            return []
+        
+        history.reverse()
+        if history:
+            print(f"[BotManager] Rehydrated {len(history)} messages (~{used_tokens} tokens) for session {session_id[:12]}...")
+        return history
+    
     def add_to_history(self, session_id: str, role: str, content: str):
         """会話履歴に追加
         
@@ -147,14 +794,71 @@ class BotManager:
             "content": content
         })
         
-        # 履歴が長くなりすぎないように制限（最新100件まで保持）
-        if len(history) > 100:
-            self.conversation_history[session_id] = history[-100:]
+        # 履歴が長くなりすぎないように制限（最大100件、超えたらまとめて削減）
+        if len(history) > MAX_HISTORY_MESSAGES:
+            self._trim_history(session_id, int(MAX_HISTORY_MESSAGES * HISTORY_TRIM_RATIO), None)
+    
+    def _trim_history(self, session_id: str, keep_messages: int, token_budget: Optional[int]):
+        """古い履歴をまとめて削除（先頭がユーザーターンになるように揃える）"""
+        history = self.conversation_history.get(session_id, [])
+        start = max(len(history) - keep_messages, 0)
+        if token_budget is not None:
+            used = 0
+            for index in range(len(history) - 1, start - 1, -1):
+                used += estimate_tokens(history[index].get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+                if used > token_budget:
+                    start = index + 1
+                    break
+        while start < len(history) - 1 and history[start].get("role") != "user":
+            start += 1
+        if start > 0:
+            self.conversation_history[session_id] = history[start:]
+            # 先頭が変わるため、次の呼び出しは前回のコンテキストを再利用できない
+            self.prompt_context_tokens.pop(session_id, None)
+            print(f"[BotManager] Trimmed {start} old messages for session {session_id[:12]}... "
+                  f"(prompt prefix stays stable until the next trim)")
+    
+    def _fit_history_to_context(self, session_id: str):
+        """履歴がコンテキスト長を超える場合、Ollama側で1件ずつ切り詰められる前にまとめて削減"""
+        history = self.conversation_history.get(session_id, [])
+        budget = self._get_history_token_budget(session_id)
+        if estimate_prompt_tokens(history) > budget:
+            self._trim_history(session_id, len(history), int(budget * HISTORY_TRIM_RATIO))
+    
+    def get_static_prefix(self, session_id: str) -> StaticPrefix:
+        """セッションの固定プレフィックスを取得（同じシステムプロンプトのセッション間で共有）"""
+        system_prompt = self.get_session_config(session_id).system_prompt or ""
+        prefix = self._static_prefixes.get(system_prompt)
+        if prefix is None:
+            prefix = StaticPrefix(system_prompt)
+            self._static_prefixes[system_prompt] = prefix
+        return prefix
+    
+    def _add_user_turn(self, session_id: str, user_message: str):
+        """ユーザーメッセージを履歴に追加
+        
+        履歴を永続化データから再構築した直後は、保存済みの今回のメッセージが
+        既に末尾に含まれているため二重に追加しない（再構築では応答のない連続したユーザーメッセージを
+        1ターンに結合するため、末尾のユーザーターンが今回のメッセージで終わっているかで判定する）。
+        直前のユーザーターンに応答がない場合（置き換えられた生成）はそのターンに結合する。
+        """
+        rehydrating = session_id not in self.conversation_history
+        history = self.get_conversation_history(session_id)
+        if rehydrating and history and history[-1].get("role") == "user":
+            content = history[-1].get("content", "")
+            if content == user_message or content.endswith("\n" + user_message):
+                return
+        if history and history[-1].get("role") == "user":
+            # 置き換えられた生成のユーザーターンが残っている場合は1ターンに結合
+            history[-1]["content"] += "\n" + user_message
+            return
+        self.add_to_history(session_id, "user", user_message)
     
     def clear_history(self, session_id: str):
         """会話履歴をクリア"""
         if session_id in self.conversation_history:
             del self.conversation_history[session_id]
+        self.prompt_context_tokens.pop(session_id, None)
     
     async def generate_response(self, user_message: str, session_id: str, 
                                client_id: str, timeout: float = 300.0) -> str:
@@ -169,57 +873,61 @@ class BotManager:
             
         Returns:
             ボットの応答メッセージ
+            
+        Raises:
+            TokenBudgetExceeded: セッションのトークン上限を超えた場合（ユーザーメッセージは履歴に追加しない）
         """
+        # トークン上限の確認（1分あたりの上限では、下回るまで他のセッションに譲って待機）
+        num_predict_cap = await self.token_budgets.admit(
+            session_id, estimate_tokens(user_message),
+            others_busy=lambda: any(sid != session_id for sid in self.inflight)
+        )
+        
         try:
             # ユーザーメッセージを履歴に追加
-            self.add_to_history(session_id, "user", user_message)
+            self._add_user_turn(session_id, user_message)
+            self._fit_history_to_context(session_id)
             
             # 会話履歴を取得
             history = self.get_conversation_history(session_id)
             
-            # メッセージリストを構築（システムプロンプト + 会話履歴）
-            messages = [
-                {
-                    "role": "system",
-                    "content": self.get_system_prompt(session_id)
-                }
-            ]
-            messages.extend(history)
-            
-            # Ollamaを使って応答を生成
-            options = {
-                'temperature': self.get_temperature(session_id),
-                'top_p': self.get_top_p(session_id),
-                'top_k': self.get_top_k(session_id),
-                'repeat_penalty': self.get_repeat_penalty(session_id)
-            }
-            
-            # オプションパラメータを追加（Noneでない場合のみ）
-            num_predict = self.get_num_predict(session_id)
-            if num_predict is not None:
-                options['num_predict'] = num_predict
+            # メッセージリストを構築（固定プレフィックス + 会話履歴）
+            # プレフィックスは同じステップの全ターン・全セッションでバイト単位で同一になり、
+            # Ollamaのプロンプトキャッシュで再評価を省略できる
+            prefix = self.get_static_prefix(session_id)
+            messages = prefix.messages + history
             
-            num_thread = self.get_num_thread(session_id)
-            if num_thread is not None:
-                options['num_thread'] = num_thread
-            
-            num_ctx = self.get_num_ctx(session_id)
-            if num_ctx is not None:
-                options['num_ctx'] = num_ctx
-            
-            num_gpu = self.get_num_gpu(session_id)
-            if num_gpu is not None:
-                options['num_gpu'] = num_gpu
-            
-            num_batch = self.get_num_batch(session_id)
-            if num_batch is not None:
-                options['num_batch'] = num_batch
+            # Ollamaを使って応答を生成（options辞書はセッション設定にキャッシュ済み）
+            config = self.get_session_config(session_id)
+            options = config.options
+            num_predict = config.num_predict
+            if num_predict_cap is not None and (num_predict is None or num_predict_cap < num_predict):
+                # トークン上限の残りに合わせて生成トークン数を制限
+                num_predict = num_predict_cap
+                options = {**options, 'num_predict': num_predict}
             
             # モニタリング情報を出力
-            model = self.get_model(session_id)
-            system_prompt = self.get_system_prompt(session_id)
+            model = config.model
+            system_prompt = config.system_prompt
             system_prompt_preview = system_prompt[:80] + "..." if len(system_prompt) > 80 else system_prompt
             
+            # 決定的な呼び出しはキャッシュから応答（Ollamaを呼ばない）
+            cache_key = self.get_cache_key(model, options, messages) if config.use_response_cache else None
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    bot_message = cached["content"]
+                    self.metrics.record_cache_hit()
+                    self.last_telemetry[session_id] = LLMCallMetadata(
+                        model=model,
+                        completion_tokens=cached.get("metadata", {}).get("completion_tokens"),
+                        cache_hit=True
+                    )
+                    print(f"♻️ [BotManager] Response served from cache for session {session_id[:12]}... "
+                          f"({len(bot_message)} chars)")
+                    self.add_to_history(session_id, "assistant", bot_message)
+                    return bot_message
+            
             print("\n" + "=" * 70)
             print("🤖 OLLAMA MODEL INVOCATION")
             print("=" * 70)
@@ -232,36 +940,64 @@ class BotManager:
             print(f"  top_k            : {options.get('top_k', 'N/A')}")
             print(f"  repeat_penalty   : {options.get('repeat_penalty', 'N/A')}")
             print(f"  num_predict      : {options.get('num_predict', 'Default (unlimited)')}")
-            print(f"  num_thread       : {options.get('num_thread', 'Default (8)')}")
+            print(f"  num_thread       : {options.get('num_thread', 'Ollama default')}")
             print(f"  num_ctx          : {options.get('num_ctx', 'Default (8192)')}")
-            print(f"  num_gpu          : {options.get('num_gpu', 'Default (-1, all)')}")
-            print(f"  num_batch        : {options.get('num_batch', 'Default (512)')}")
+            print(f"  num_gpu          : {options.get('num_gpu', 'Ollama default')}")
+            print(f"  num_batch        : {options.get('num_batch', 'Ollama default')}")
             print(f"\nConversation History: {len(messages) - 1} messages")
             print(f"Timeout: {timeout}s")
             print("=" * 70 + "\n")
             
-            # タイムアウト付きで応答を生成
+            # タイムアウト付きで応答を生成（ストリーミングで受信し、中断時は接続を閉じる）
+            generation = InflightGeneration(session_id, asyncio.current_task(), num_predict)
+            self.inflight[session_id] = generation
             try:
-                response = await asyncio.wait_for(
-                    asyncio.to_thread(
-                        ollama.chat,
-                        model=model,
-                        messages=messages,
-                        options=options
-                    ),
+                bot_message = await asyncio.wait_for(
+                    self._stream_chat(model, messages, options, generation),
                     timeout=timeout
                 )
             except asyncio.TimeoutError:
                 print(f"⚠️ Response generation timed out after {timeout}s")
+                self._record_abort(generation, "timeout")
                 # タイムアウト時は履歴から最後のユーザーメッセージを削除（応答がないため）
                 if history and history[-1].get("role") == "user":
                     history.pop()
                 return None  # タイムアウト時はNoneを返す
+            except asyncio.CancelledError:
+                reason = generation.cancel_reason or "cancelled"
+                print(f"⚠️ [BotManager] Response generation aborted ({reason}) for session {session_id[:12]}... "
+                      f"after {generation.streamed_tokens} tokens")
+                self._record_abort(generation, reason)
+                # 中断を要求したのはBotManager自身のため、呼び出し元のタスクは継続できるようにする
+                if generation.cancel_reason and generation.task is asyncio.current_task() \
+                        and hasattr(generation.task, 'uncancel'):
+                    generation.task.uncancel()
+                # 新しいメッセージによる置き換えの場合、ユーザーメッセージは次の生成で使うため残す
+                if reason != "superseded" and history and history[-1].get("role") == "user":
+                    history.pop()
+                return None  # キャンセル時はNoneを返す
+            finally:
+                if self.inflight.get(session_id) is generation:
+                    del self.inflight[session_id]
             
-            bot_message = response['message']['content']
+            self.metrics.record_completion(generation.streamed_tokens)
+            telemetry = generation.build_telemetry(model)
+            telemetry.prefix_hash = prefix.prefix_hash
+            telemetry.prompt_tokens_estimated = estimate_prompt_tokens(messages)
+            telemetry.prompt_tokens_reused = self._update_prompt_context(session_id, telemetry)
+            self._record_telemetry(session_id, config.experiment_id, telemetry)
+            if cache_key:
+                self.response_cache.put(cache_key, bot_message, model, {
+                    "completion_tokens": telemetry.completion_tokens,
+                    "done_reason": telemetry.done_reason,
+                })
             
             # 応答の統計情報を出力
-            print(f"✅ Response generated: {len(bot_message)} chars\n")
+            print(f"✅ Response generated: {len(bot_message)} chars | "
+                  f"prompt {telemetry.prompt_tokens} tok / {telemetry.prompt_eval_ms} ms | "
+                  f"completion {telemetry.completion_tokens} tok / {telemetry.eval_ms} ms "
+                  f"({telemetry.tokens_per_second} tok/s) | load {telemetry.load_ms} ms | "
+                  f"ttft {telemetry.ttft_ms} ms | wait {telemetry.queue_wait_ms} ms\n")
             
             # ボットの応答を履歴に追加
             self.add_to_history(session_id, "assistant", bot_message)
@@ -281,6 +1017,119 @@ class BotManager:
             print(f"[BotManager] Error generating response: {e}")
             return error_message
     
+    async def _stream_chat(self, model: str, messages: List[Dict], options: Dict,
+                           generation: InflightGeneration) -> str:
+        """Ollamaからストリーミングで応答を受信して連結
+        
+        キャンセルされた場合はストリームを明示的に閉じ、HTTP接続を切断することで
+        バックエンド側のデコードも即座に停止させる。
+        """
+        parts = []
+        generation.request_at = time.perf_counter()
+        stream = self._open_chat_stream(generation.session_id, model, messages, options)
+        try:
+            async for chunk in stream:
+                content = chunk['message']['content']
+                if content:
+                    if generation.first_token_at is None:
+                        generation.first_token_at = time.perf_counter()
+                    parts.append(content)
+                    generation.streamed_tokens += 1
+                if chunk.get('done'):
+                    generation.final_chunk = chunk
+        finally:
+            await stream.aclose()
+        return ''.join(parts)
+    
+    def _update_prompt_context(self, session_id: str, telemetry: LLMCallMetadata) -> Optional[int]:
+        """Ollamaのプレフィックスキャッシュで評価を省略できたトークン数（Ollamaのトークン数のみから判定）
+        
+        前回の呼び出しのコンテキスト（プロンプト全体 + 生成）は、今回のプロンプトの先頭と一致する。
+        Ollamaのprompt_eval_countはキャッシュ済みの部分を含まないため、同じプレフィックスで今回の
+        prompt_eval_countが前回のコンテキスト長より小さければ、前回のコンテキストが再利用されたとみなす。
+        前回の呼び出しがない場合（最初のターン、再起動後、履歴の削減後、プレフィックスの変更後）はNone。
+        """
+        if telemetry.prompt_tokens is None:
+            self.prompt_context_tokens.pop(session_id, None)
+            return None
+        reused = None
+        previous = self.prompt_context_tokens.get(session_id)
+        if previous is not None and previous[0] == telemetry.prefix_hash:
+            reused = previous[1] if telemetry.prompt_tokens < previous[1] else 0
+        self.prompt_context_tokens[session_id] = (
+            telemetry.prefix_hash,
+            (reused or 0) + telemetry.prompt_tokens + (telemetry.completion_tokens or 0)
+        )
+        return reused
+    
+    def _record_telemetry(self, session_id: str, experiment_id: Optional[str],
+                          telemetry: LLMCallMetadata):
+        """テレメトリを保持し、モデル別・実験別に集計"""
+        self.last_telemetry[session_id] = telemetry
+        model_key = telemetry.model or "unknown"
+        self.telemetry_by_model.setdefault(model_key, TelemetryAggregate()).add(telemetry)
+        self.token_budgets.record(session_id, experiment_id,
+                                  telemetry.prompt_tokens or 0, telemetry.completion_tokens or 0)
+        if experiment_id:
+            self.telemetry_by_experiment.setdefault(experiment_id, TelemetryAggregate()).add(telemetry)
+    
+    def pop_call_telemetry(self, session_id: str) -> Optional[LLMCallMetadata]:
+        """直近の応答生成のテレメトリを取り出す（ボットメッセージのメタデータ保存用）"""
+        return self.last_telemetry.pop(session_id, None)
+    
+    def get_telemetry_summary(self, experiment_id: Optional[str] = None) -> Dict:
+        """テレメトリの集計を取得
+        
+        Args:
+            experiment_id: 指定した場合はその実験の集計のみ
+        """
+        if experiment_id is not None:
+            aggregate = self.telemetry_by_experiment.get(experiment_id)
+            return {
+                "experiment_id": experiment_id,
+                "summary": aggregate.to_dict() if aggregate else TelemetryAggregate().to_dict()
+            }
+        return {
+            "by_model": {model: agg.to_dict() for model, agg in self.telemetry_by_model.items()},
+            "by_experiment": {exp_id: agg.to_dict() for exp_id, agg in self.telemetry_by_experiment.items()}
+        }
+    
+    def _record_abort(self, generation: InflightGeneration, reason: str):
+        """中断した生成をメトリクスに記録（中断までに生成したトークンも使用量に含める）"""
+        self.metrics.record_abort(reason, generation.streamed_tokens, generation.num_predict)
+        config = self.session_configs.get(generation.session_id)
+        self.token_budgets.record(generation.session_id, config.experiment_id if config else None,
+                                  0, generation.streamed_tokens)
+    
+    def is_generating(self, session_id: str) -> bool:
+        """セッションで応答生成が実行中かどうか"""
+        return session_id in self.inflight
+    
+    def cancel_generation(self, session_id: str, reason: str = "cancelled") -> bool:
+        """セッションの実行中の応答生成を中断
+        
+        Args:
+            session_id: セッションID
+            reason: 中断理由（disconnect, superseded, session_ended など）
+            
+        Returns:
+            中断対象の生成があった場合True
+        """
+        generation = self.inflight.get(session_id)
+        if not generation or not generation.task or generation.task.done():
+            return False
+        generation.cancel_reason = reason
+        generation.task.cancel()
+        return True
+    
+    def get_generation_metrics(self) -> Dict:
+        """応答生成のメトリクスを取得"""
+        metrics = self.metrics.to_dict()
+        metrics["inflight"] = len(self.inflight)
+        if self.response_cache is not None:
+            metrics["response_cache"] = self.response_cache.get_stats()
+        return metrics
+    
     async def stream_response(self, user_message: str, session_id: str, 
                              client_id: str):
         """
@@ -296,52 +1145,21 @@ class BotManager:
         """
         try:
             # ユーザーメッセージを履歴に追加
-            self.add_to_history(session_id, "user", user_message)
+            self._add_user_turn(session_id, user_message)
             
             # 会話履歴を取得
             history = self.get_conversation_history(session_id)
             
             # メッセージリストを構築
-            messages = [
-                {
-                    "role": "system",
-                    "content": self.get_system_prompt(session_id)
-                }
-            ]
-            messages.extend(history)
-            
-            # オプションを構築
-            options = {
-                'temperature': self.get_temperature(session_id),
-                'top_p': self.get_top_p(session_id),
-                'top_k': self.get_top_k(session_id),
-                'repeat_penalty': self.get_repeat_penalty(session_id)
-            }
-            
-            # オプションパラメータを追加（Noneでない場合のみ）
-            num_predict = self.get_num_predict(session_id)
-            if num_predict is not None:
-                options['num_predict'] = num_predict
-            
-            num_thread = self.get_num_thread(session_id)
-            if num_thread is not None:
-                options['num_thread'] = num_thread
+            messages = self.get_static_prefix(session_id).messages + history
             
-            num_ctx = self.get_num_ctx(session_id)
-            if num_ctx is not None:
-                options['num_ctx'] = num_ctx
-            
-            num_gpu = self.get_num_gpu(session_id)
-            if num_gpu is not None:
-                options['num_gpu'] = num_gpu
-            
-            num_batch = self.get_num_batch(session_id)
-            if num_batch is not None:
-                options['num_batch'] = num_batch
+            # オプションを取得（セッション設定にキャッシュ済み）
+            config = self.get_session_config(session_id)
+            options = config.options
             
             # モニタリング情報を出力
-            model = self.get_model(session_id)
-            system_prompt = self.get_system_prompt(session_id)
+            model = config.model
+            system_prompt = config.system_prompt
             system_prompt_preview = system_prompt[:80] + "..." if len(system_prompt) > 80 else system_prompt
             
             print("\n" + "=" * 70)
@@ -356,28 +1174,25 @@ class BotManager:
             print(f"  top_k            : {options.get('top_k', 'N/A')}")
             print(f"  repeat_penalty   : {options.get('repeat_penalty', 'N/A')}")
             print(f"  num_predict      : {options.get('num_predict', 'Default (unlimited)')}")
-            print(f"  num_thread       : {options.get('num_thread', 'Default (8)')}")
+            print(f"  num_thread       : {options.get('num_thread', 'Ollama default')}")
             print(f"  num_ctx          : {options.get('num_ctx', 'Default (8192)')}")
-            print(f"  num_gpu          : {options.get('num_gpu', 'Default (-1, all)')}")
-            print(f"  num_batch        : {options.get('num_batch', 'Default (512)')}")
+            print(f"  num_gpu          : {options.get('num_gpu', 'Ollama default')}")
+            print(f"  num_batch        : {options.get('num_batch', 'Ollama default')}")
             print(f"\nConversation History: {len(messages) - 1} messages")
             print("=" * 70 + "\n")
             
-            # ストリーミング応答を生成
+            # ストリーミング応答を生成（非同期クライアントでイベントループをブロックしない）
             full_response = ""
-            stream = await asyncio.to_thread(
-                ollama.chat,
-                model=model,
-                messages=messages,
-                options=options,
-                stream=True
-            )
+            stream = self._open_chat_stream(session_id, model, messages, options)
             
-            for chunk in stream:
-                if 'message' in chunk and 'content' in chunk['message']:
+            try:
+                async for chunk in stream:
                     content = chunk['message']['content']
-                    full_response += content
-                    yield content
+                    if content:
+                        full_response += content
+                        yield content
+            finally:
+                await stream.aclose()
             
             # 応答の統計情報を出力
             print(f"✅ Streaming response completed: {len(full_response)} chars\n")
@@ -394,63 +1209,50 @@ class BotManager:
         """クライアントIDがボットかどうかを判定"""
         return client_id == self.bot_client_id
     
-    @staticmethod
-    def get_available_models() -> list:
-        """Ollamaから利用可能なモデルのリストを取得"""
-        try:
-            models = ollama.list()
-            
-            # ollama-python 0.4.x は ListResponse オブジェクトを返す
-            if hasattr(models, 'models'):
-                # 各モデルは Model オブジェクトで、.model 属性にモデル名がある
-                model_list = [model.model for model in models.models]
-                print(f"[BotManager] Successfully loaded {len(model_list)} models: {model_list}")
-                return model_list
-            elif isinstance(models, dict) and 'models' in models:
-                # 旧バージョン対応: 辞書形式
-                model_list = [model.get('name', model.get('model', '')) for model in models['models']]
-                print(f"[BotManager] Successfully loaded {len(model_list)} models (dict format): {model_list}")
-                return model_list
-            else:
-                print(f"[BotManager] WARNING: Unexpected response format from ollama.list()")
-                print(f"[BotManager] Response type: {type(models)}")
-                return []
-        except Exception as e:
-            print(f"[BotManager] Failed to get available models: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+    def get_available_models(self) -> list:
+        """利用可能なモデル名のリストを取得（モデルカタログのキャッシュから即座に返す）"""
+        return self.model_catalog.get_model_names()
     
     async def check_model_availability(self, model: str) -> bool:
         """
-        指定されたOllamaモデルが利用可能かチェック
+        指定されたOllamaモデルが利用可能かチェック（ない場合はプル）
+        
+        プール使用時は、モデルがインストールされていない正常なバックエンドそれぞれにプルする。
         
         Args:
             model: チェックするモデル名
-            
+        
         Returns:
-            モデルが利用可能な場合True
+            モデルが利用可能な場合True（プールではプルしたすべてのバックエンドで成功した場合）
         """
         try:
-            # モデルリストを取得
-            models = await asyncio.to_thread(ollama.list)
-            available_models = [model_info['name'] for model_info in models.get('models', [])]
-            
-            # 指定されたモデルが利用可能かチェック
-            is_available = any(model in model_name for model_name in available_models)
-            
-            if not is_available:
-                print(f"[BotManager] Warning: Model '{model}' not found in available models.")
-                print(f"[BotManager] Available models: {available_models}")
-                print(f"[BotManager] Attempting to pull model...")
-                
-                # モデルをプル
-                await asyncio.to_thread(ollama.pull, model)
-                print(f"[BotManager] Successfully pulled model '{model}'")
+            await self.model_catalog.ensure_fresh()
+            info = self.model_catalog.get(model)
+            if self.pool:
+                installed_on = set(info.installed_on) if info is not None else set()
+                targets = [(b.host, b.client) for b in self.pool.backends
+                           if b.healthy and b.host not in installed_on]
+            else:
+                targets = [] if info is not None else [("default", self._get_client())]
+            if not targets:
                 return True
             
-            return True
+            print(f"[BotManager] Warning: Model '{model}' not found on {[host for host, _ in targets]}.")
+            print(f"[BotManager] Available models: {self.model_catalog.get_model_names()}")
+            print(f"[BotManager] Attempting to pull model...")
             
+            # モデルをプル（非同期クライアントでイベントループをブロックしない、バックエンドごとに並行）
+            results = await asyncio.gather(*(client.pull(model) for _, client in targets), return_exceptions=True)
+            pulled = True
+            for (host, _), result in zip(targets, results):
+                if isinstance(result, Exception):
+                    print(f"[BotManager] Failed to pull model '{model}' on {host}: {result}")
+                    pulled = False
+                else:
+                    print(f"[BotManager] Successfully pulled model '{model}' on {host}")
+            await self.model_catalog.refresh()
+            return pulled
+        
         except Exception as e:
             print(f"[BotManager] Error checking model availability: {e}")
             return False
@@ -0,0 +1,52 @@
+"""セッション・メッセージの変更シーケンス（差分エクスポートのウォーターマーク）
+
+セッションの保存・メッセージの追加のたびに単調増加する整数を付与する。値はナノ秒単位のUNIX時刻を基にしており
+（同じ時刻に複数の変更があれば +1）、カウンタをファイルに保存しなくても再起動後に大小関係が保たれ、
+日時で指定されたウォーターマークとも比較できる。
+
+エクスポートは開始時点の current_change_seq() をウォーターマークとして返し、次回は since にその値を指定すると
+それ以降に作成・変更されたセッションとメッセージだけを受け取れる。
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Union
+
+# ファイルの更新時刻で読み込みを省略する際の余裕（ファイルシステムの時刻の粒度・保存までの遅れを吸収）
+MTIME_MARGIN_NS = 2_000_000_000
+
+_lock = threading.Lock()
+_last_seq = 0
+
+
+def next_change_seq() -> int:
+    """変更1件分のシーケンスを発行"""
+    global _last_seq
+    with _lock:
+        _last_seq = max(_last_seq + 1, time.time_ns())
+        return _last_seq
+
+
+def current_change_seq() -> int:
+    """現在のウォーターマーク（これ以降に発行されるシーケンスは必ずこの値より大きい）"""
+    global _last_seq
+    with _lock:
+        _last_seq = max(_last_seq, time.time_ns())
+        return _last_seq
+
+
+def parse_watermark(value: Union[str, int]) -> int:
+    """since パラメータ（変更シーケンスまたはISO形式の日時）を変更シーケンスに変換
+
+    タイムゾーンのない日時はサーバーのローカル時刻として扱う。変換できない場合は ValueError。
+    """
+    text = str(value).strip()
+    if text.isdigit():
+        return int(text)
+    parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    return int(parsed.timestamp()) * 1_000_000_000 + parsed.microsecond * 1000
+
+
+def may_contain_changes_since(mtime_ns: int, since: int) -> bool:
+    """更新時刻が mtime_ns のファイルに since より後の変更が含まれうるか"""
+    return mtime_ns >= since - MTIME_MARGIN_NS
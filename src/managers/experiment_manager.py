@@ -4,6 +4,7 @@ from typing import Optional, List
 from pathlib import Path
 from datetime import datetime
 from ..models.experiment_group import ExperimentGroup
+from .atomic_file import write_text_atomic
 
 
 class ExperimentManager:
@@ -313,8 +314,7 @@ class ExperimentManager:
         exp_file = data_dir / "experiment.json"
         exp_file.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(exp_file, 'w', encoding='utf-8') as f:
-            json.dump(experiment.to_dict(), f, ensure_ascii=False, indent=2)
+        write_text_atomic(exp_file, json.dumps(experiment.to_dict(), ensure_ascii=False, indent=2))
     
     def recalculate_experiment_statistics(self, experiment_id: str, session_manager):
         """実験の統計を実際のセッションデータから再計算
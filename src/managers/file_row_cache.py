@@ -0,0 +1,132 @@
+"""セッションファイルごとの行のキャッシュ（ファイルの状態が変わった行だけ読み直す）
+
+ワイド形式テーブル（exporters.wide_table）とアンケート回答インデックス（survey_index）が共通で使う。
+
+- 行はセッションファイル名（session_id）ごとに持ち、作成時のファイルの状態（更新時刻とサイズ）を記録する
+- フローの処理で保存した直後のセッションは、ファイルを読み直さずに行を置き換える（_put）
+- 参照時（_refresh）はファイルを列挙して状態を比べ、変わっていたファイルだけを読み直し、なくなったファイルの行を除く
+
+ファイルの列挙・読み直しはロックの外で行う。その間にフローから置き換えられた行は、読み直した行で上書きしない
+（行を書き込んだ時点の世代で判定する）。
+"""
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ファイルの状態（更新時刻ns, サイズ）。ファイルがない場合は None
+FileState = Optional[Tuple[int, int]]
+
+
+def file_state(path: Path) -> FileState:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class CachedRow:
+    __slots__ = ('value', 'state', 'generation')
+
+    def __init__(self, value: Any, state: Any, generation: int):
+        self.value = value  # None: 他の実験のセッション、または読み込めなかったファイル
+        self.state = state  # 行を作成したときのファイルの状態（_refresh に渡す states の戻り値）
+        self.generation = generation  # 行を書き込んだ時点の世代（読み直し中のフローからの更新を優先するため）
+
+
+class FileRowCache:
+    """セッションファイルごとの行と、作成日時の降順に並べた行の一覧
+
+    サブクラスは _created_at（並び順）を実装する。行の置き換えに合わせて別の索引を更新する場合は
+    _row_replaced を上書きする。
+    """
+
+    def __init__(self, sessions_dir: Path):
+        self.sessions_dir = Path(sessions_dir)
+        self.rows: Dict[str, CachedRow] = {}  # セッションファイル名（session_id）→ 行
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._cleared_generation = 0  # 最後に全行を破棄した世代（それ以前に始めた読み直しは反映しない）
+        self._snapshot: Optional[List[Any]] = None  # 並び順の行（行とファイルの一覧が変わるまで使い回す）
+        self._snapshot_files: Tuple[str, ...] = ()
+        self.updates = 0  # フローの処理から更新した行数
+        self.refreshes = 0  # 参照時に読み直した行数
+        self.last_refreshed = 0
+
+    def _created_at(self, value: Any) -> str:
+        raise NotImplementedError
+
+    def _row_replaced(self, old: Optional[CachedRow], new: Optional[CachedRow]):
+        """行が置き換えられた・除かれたときに呼ばれる（ロック内）"""
+
+    def _set_row(self, name: str, row: Optional[CachedRow]):
+        """行を置き換える（row が None なら除く、ロック内で呼ぶ）"""
+        old = self.rows.pop(name, None)
+        if row is not None:
+            self.rows[name] = row
+        self._row_replaced(old, row)
+        self._generation += 1
+        self._snapshot = None
+
+    def _put(self, name: str, value: Any, state: Any):
+        """保存直後のセッションの行を置き換える（ロック内で呼ぶ）"""
+        self._set_row(name, CachedRow(value, state, self._generation + 1))
+        self.updates += 1
+
+    def _clear(self):
+        """全行を破棄する（ロック内で呼ぶ、実行中の読み直しの結果も反映しない）"""
+        for name in list(self.rows):
+            self._set_row(name, None)
+        self._generation += 1
+        self._cleared_generation = self._generation
+        self._snapshot = None
+
+    def _refresh(self, states: Callable[[Path], Any],
+                 load: Callable[[List[Tuple[Path, Any]]], Dict[int, Any]]) -> List[Any]:
+        """並び順（作成日時の降順、同時刻はファイルの列挙順）の行。状態が変わったファイルの行だけ読み直す
+
+        Args:
+            states: セッションファイルのパス → 行が依存するファイルの状態
+            load: 読み直す (パス, 状態) のリスト → 位置 → 行の値（含まれない位置の行は None）
+        """
+        with self._lock:
+            rows = dict(self.rows)
+            started_generation = self._generation
+
+        # ファイルの列挙・状態の確認・読み直しはロックの外で行う（フローの処理を待たせない）
+        files = list(self.sessions_dir.glob("*.json"))
+        present = set()
+        stale: List[Tuple[Path, Any]] = []
+        for path in files:
+            present.add(path.stem)
+            state = states(path)
+            row = rows.get(path.stem)
+            if row is None or row.state != state:
+                stale.append((path, state))
+        loaded = load(stale)
+
+        with self._lock:
+            if self._cleared_generation <= started_generation:
+                for i, (path, state) in enumerate(stale):
+                    current = self.rows.get(path.stem)
+                    if current is not None and current.generation > started_generation:
+                        continue
+                    self._set_row(path.stem, CachedRow(loaded.get(i), state, started_generation))
+                for name in [name for name, row in self.rows.items()
+                             if name not in present and row.generation <= started_generation]:
+                    self._set_row(name, None)
+                self.refreshes += len(stale)
+                self.last_refreshed = len(stale)
+
+            file_names = tuple(path.stem for path in files)
+            if self._snapshot is None or self._snapshot_files != file_names:
+                # SessionManager.get_all_sessions と同じ順序: ファイルの列挙順 → 作成日時の降順（安定ソート）
+                snapshot = [row.value for row in (self.rows.get(name) for name in file_names)
+                            if row is not None and row.value is not None]
+                snapshot.sort(key=self._created_at, reverse=True)
+                self._snapshot, self._snapshot_files = snapshot, file_names
+            return self._snapshot
+
+    def row_count(self) -> int:
+        """実験に属する行の数（ロック内で呼ぶ）"""
+        return sum(1 for row in self.rows.values() if row.value is not None)
@@ -0,0 +1,201 @@
+"""実験フローのステップタイマー（チャットの制限時間・教示文の最小表示時間）
+
+参加者が時間制限のあるステップに入った時点でサーバー側で期限を設定し、
+1つのスケジューラタスクがすべてのセッションの期限をヒープで管理する（セッションごとの待機タスクは作らない）。
+期限が来ると登録されたコールバックを発火ごとのタスクで実行し（遅いクライアントや大きなトランスクリプトの処理で
+他のセッションの期限が遅れないよう、スケジューラは完了を待たない）、WebSocketで以下のフレームを送信する:
+
+- time_warning : チャットの残り時間が FLOW_TIMER_WARNING_SECONDS になった
+- time_up      : 制限時間・最小表示時間が経過した（チャットは締め切って次のステップへ進める）
+
+クライアントのカウントダウンは表示用で、ステップの締め切り・進行の判定はサーバーが行う。
+
+設定（環境変数）:
+    FLOW_TIMER_WARNING_SECONDS : チャット終了前に警告を送る時間（秒、デフォルト: 60、0で無効）
+"""
+import asyncio
+import heapq
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+KIND_WARNING = "time_warning"
+KIND_TIME_UP = "time_up"
+
+
+class FlowTimer:
+    """セッションの現在のステップに設定された期限"""
+    __slots__ = ('session_id', 'step_id', 'step_type', 'duration', 'started_at', 'deadline', 'version', 'expired')
+
+    def __init__(self, session_id: str, step_id: str, step_type: str, duration: float, version: int):
+        self.session_id = session_id
+        self.step_id = step_id
+        self.step_type = step_type
+        self.duration = duration
+        self.started_at = time.time()
+        self.deadline = self.started_at + duration
+        self.version = version
+        self.expired = False  # time_up を発火済み
+
+    def remaining(self, now: Optional[float] = None) -> float:
+        if self.expired:
+            return 0.0
+        return max(self.deadline - (now if now is not None else time.time()), 0.0)
+
+    def to_dict(self) -> Dict:
+        return {
+            "step_id": self.step_id,
+            "duration_seconds": self.duration,
+            "remaining_seconds": round(self.remaining(), 1),
+            "expired": self.expired,
+        }
+
+
+def step_duration(step) -> Optional[float]:
+    """ステップの制限時間（秒）。チャットは time_limit_minutes、教示文は min_display_seconds"""
+    step_type = getattr(step, "step_type", None)
+    if step_type == "chat" and (step.time_limit_minutes or 0) > 0:
+        return float(step.time_limit_minutes) * 60
+    if step_type == "instruction" and (step.min_display_seconds or 0) > 0:
+        return float(step.min_display_seconds)
+    return None
+
+
+class FlowTimerService:
+    """すべてのセッションのステップタイマーを1つのタスクで処理する"""
+
+    def __init__(self, warning_seconds: Optional[float] = None):
+        self.warning_seconds = warning_seconds if warning_seconds is not None else float(
+            os.environ.get("FLOW_TIMER_WARNING_SECONDS", 60))
+        self.timers: Dict[str, FlowTimer] = {}  # セッションID → 現在のステップの期限
+        # セッションID → 期限が経過した現在のステップのタイマー（ステップが変わるまで保持し、再取得で期限を設定し直さない）
+        self.expired: Dict[str, FlowTimer] = {}
+        self.closed_chats: Set[str] = set()  # 制限時間を過ぎて締め切ったチャットのセッションID
+        self._heap: List[Tuple[float, int, str, str]] = []  # (発火時刻, バージョン, セッションID, 種類)
+        self._version = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._handlers: Set[asyncio.Task] = set()  # 実行中の発火時の処理（完了まで参照を保持）
+        self.fired = {KIND_WARNING: 0, KIND_TIME_UP: 0}
+
+    def arm(self, session_id: str, step) -> Optional[FlowTimer]:
+        """ステップに入った時点で期限を設定（同じステップの再取得では期限を延長しない）
+
+        期限が経過済みのステップを再取得した場合は、経過済みのタイマー（残り0秒、expired）を返す。
+        """
+        duration = step_duration(step)
+        current = self.timers.get(session_id) or self.expired.get(session_id)
+        if current is not None and current.step_id == step.step_id:
+            return current
+        self.disarm(session_id)
+        if step.step_type == "chat":
+            self.closed_chats.discard(session_id)
+        if duration is None:
+            return None
+
+        self._version += 1
+        timer = FlowTimer(session_id, step.step_id, step.step_type, duration, self._version)
+        self.timers[session_id] = timer
+        heapq.heappush(self._heap, (timer.deadline, timer.version, session_id, KIND_TIME_UP))
+        if step.step_type == "chat" and 0 < self.warning_seconds < duration:
+            heapq.heappush(self._heap, (timer.deadline - self.warning_seconds, timer.version,
+                                        session_id, KIND_WARNING))
+        if len(self._heap) > 4 * len(self.timers) + 64:
+            self._compact()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return timer
+
+    def disarm(self, session_id: str):
+        """期限と経過済みの記録を解除（ヒープ内の期限は取り出し時に読み捨てる）"""
+        self.timers.pop(session_id, None)
+        self.expired.pop(session_id, None)
+
+    def forget(self, session_id: str):
+        """セッション終了時に期限とチャットの締め切り状態を削除"""
+        self.disarm(session_id)
+        self.closed_chats.discard(session_id)
+
+    def _compact(self):
+        """ステップの進行で古くなった期限が溜まった場合にヒープを作り直す"""
+        self._heap = [item for item in self._heap
+                      if item[2] in self.timers and self.timers[item[2]].version == item[1]]
+        heapq.heapify(self._heap)
+
+    def get_timer(self, session_id: str, step_id: Optional[str] = None) -> Optional[FlowTimer]:
+        timer = self.timers.get(session_id)
+        if timer is None or (step_id is not None and timer.step_id != step_id):
+            return None
+        return timer
+
+    def remaining(self, session_id: str, step_id: Optional[str] = None) -> float:
+        """現在のステップの残り時間（秒、期限がない場合は0）"""
+        timer = self.get_timer(session_id, step_id)
+        return timer.remaining() if timer else 0.0
+
+    def is_chat_closed(self, session_id: str) -> bool:
+        return session_id in self.closed_chats
+
+    def pop_due(self, now: Optional[float] = None) -> List[Tuple[FlowTimer, str]]:
+        """発火時刻を過ぎた (期限, 種類) を取り出す"""
+        now = now if now is not None else time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, version, session_id, kind = heapq.heappop(self._heap)
+            timer = self.timers.get(session_id)
+            if timer is None or timer.version != version:
+                continue  # ステップが進んだ・解除された古い期限
+            if kind == KIND_TIME_UP:
+                timer.expired = True
+                self.expired[session_id] = self.timers.pop(session_id)
+                if timer.step_type == "chat":
+                    self.closed_chats.add(session_id)
+            self.fired[kind] += 1
+            due.append((timer, kind))
+        return due
+
+    @staticmethod
+    async def _handle(on_fire: Callable[[FlowTimer, str], Awaitable[None]], timer: FlowTimer, kind: str):
+        try:
+            await on_fire(timer, kind)
+        except Exception as e:
+            print(f"[FlowTimer] Error handling {kind} for session {timer.session_id[:12]}...: {e}")
+
+    def dispatch(self, on_fire: Callable[[FlowTimer, str], Awaitable[None]], timer: FlowTimer, kind: str) -> asyncio.Task:
+        """発火したタイマーの処理を別タスクで開始（スケジューラは完了を待たない）"""
+        task = asyncio.create_task(self._handle(on_fire, timer, kind))
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+        return task
+
+    async def run(self, on_fire: Callable[[FlowTimer, str], Awaitable[None]]):
+        """期限を待ち、発火したタイマーを on_fire に渡し続ける"""
+        self._wakeup = asyncio.Event()
+        while True:
+            for timer, kind in self.pop_due():
+                self.dispatch(on_fire, timer, kind)
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(self._heap[0][0] - time.time(), 0.0)
+                if timeout == 0.0:
+                    continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, on_fire: Callable[[FlowTimer, str], Awaitable[None]]):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(on_fire))
+
+    def get_stats(self) -> Dict:
+        return {
+            "armed": len(self.timers),
+            "expired": len(self.expired),
+            "pending_events": len(self._heap),
+            "handling": len(self._handlers),
+            "closed_chats": len(self.closed_chats),
+            "fired": dict(self.fired),
+            "warning_seconds": self.warning_seconds,
+        }
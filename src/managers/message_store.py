@@ -1,8 +1,10 @@
 import json
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Iterator, Iterable
 from pathlib import Path
 from datetime import datetime
 from ..models.message import Message
+from .atomic_file import read_json, write_text_atomic
+from .change_sequence import next_change_seq, may_contain_changes_since
 
 
 class MessageStore:
@@ -44,24 +46,83 @@ class MessageStore:
                     messages = []
         
         # 新しいメッセージを追加
+        message.change_seq = next_change_seq()
         messages.append(message.to_dict())
         
-        # ファイルに保存
-        with open(session_file, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
+        # ファイルに保存（エクスポートが書き込み途中の内容を読まないよう置き換えで保存）
+        write_text_atomic(session_file, json.dumps(messages, ensure_ascii=False, indent=2))
     
     def get_messages_by_session(self, session_id: str) -> List[Message]:
-        """セッションIDでメッセージを取得"""
+        """セッションIDでメッセージを取得（読み込めないファイルは空として扱う）"""
+        try:
+            return self._load_messages(self.data_dir / f"{session_id}.json")
+        except FileNotFoundError:
+            return []
+        except ValueError as e:
+            print(f"Error loading messages for session {session_id}: {e}")
+            return []
+    
+    def _load_messages(self, session_file: Path) -> List[Message]:
+        """メッセージファイルを読み込む（解釈できなければ読み直し、それでも駄目なら ValueError）"""
+        return [Message.from_dict(msg) for msg in read_json(session_file)]
+    
+    def get_messages_changed_since(self, session_id: str, since: Optional[int],
+                                   until: Optional[int] = None) -> List[Message]:
+        """変更シーケンスが since より大きく until 以下のメッセージを取得（差分エクスポート用）
+        
+        since が None の場合は下限なし。更新時刻が since より十分古いファイルは読み込まない。
+        読み込めないファイルは空として扱わず ValueError を送出する（ウォーターマークがそのメッセージを越えないよう、
+        エクスポートを失敗させる）。
+        """
         session_file = self.data_dir / f"{session_id}.json"
-        if not session_file.exists():
+        try:
+            if since is not None and not may_contain_changes_since(session_file.stat().st_mtime_ns, since):
+                return []
+            messages = self._load_messages(session_file)
+        except FileNotFoundError:
             return []
+        return [
+            msg for msg in messages
+            if (since is None or msg.change_seq > since) and (until is None or msg.change_seq <= until)
+        ]
+    
+    def get_session_ids_changed_since(self, since: int) -> List[str]:
+        """since より後にメッセージが追加された可能性のあるセッションID（ファイルの更新時刻で判定）"""
+        session_ids = []
+        for message_file in self.data_dir.glob("*.json"):
+            try:
+                if may_contain_changes_since(message_file.stat().st_mtime_ns, since):
+                    session_ids.append(message_file.stem)
+            except FileNotFoundError:
+                continue
+        return session_ids
+    
+    def iter_messages_reversed(self, session_id: str,
+                               message_types: Optional[Iterable[str]] = None) -> Iterator[Message]:
+        """セッションのメッセージを新しい順に返す
+        
+        ファイルは1つのJSON配列のため全体を読み込んでから返す（読み込み量はメッセージ数に比例する）。
+        途中で打ち切った場合に省けるのは、残りのメッセージの Message オブジェクトの生成のみ。
+        
+        Args:
+            session_id: セッションID
+            message_types: 対象とするメッセージタイプ（Noneの場合は全て）
+        """
+        session_file = self.data_dir / f"{session_id}.json"
+        if not session_file.exists():
+            return
         
         with open(session_file, 'r', encoding='utf-8') as f:
             try:
                 data = json.load(f)
-                return [Message.from_dict(msg) for msg in data]
             except json.JSONDecodeError:
-                return []
+                return
+        
+        types = set(message_types) if message_types is not None else None
+        for msg in reversed(data):
+            if types is not None and msg.get('message_type') not in types:
+                continue
+            yield Message.from_dict(msg)
     
     def get_messages_by_client(self, session_id: str, client_id: str) -> List[Message]:
         """特定のクライアントのメッセージを取得"""
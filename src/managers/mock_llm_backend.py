@@ -0,0 +1,345 @@
+"""負荷試験用のモックLLMバックエンド
+
+実際のOllamaやモデルなしでサーバー全体のスループットを計測するためのバックエンド。
+応答内容・遅延は入力（モデル名・メッセージ・シード）から決定的に生成される。
+
+使い方:
+    # プロセス内モック（BotManagerがOllamaの代わりに使用）
+    LLM_BACKEND=mock uvicorn src.main:app
+
+    # Ollama互換のHTTPサーバー（/api/chat, /api/tags, /api/ps, /api/generate はロード・アンロードのみ）
+    python -m src.managers.mock_llm_backend --port 11435
+    OLLAMA_HOST=http://127.0.0.1:11435 uvicorn src.main:app
+
+設定（環境変数）:
+    MOCK_LLM_TOKENS_PER_SEC : 生成速度（トークン/秒、デフォルト: 30）
+    MOCK_LLM_TTFT_MS        : 最初のトークンまでの時間（ミリ秒、デフォルト: 200）
+    MOCK_LLM_JITTER         : 遅延のばらつき（0.0〜1.0の割合、デフォルト: 0.1）
+    MOCK_LLM_FAILURE_RATE   : エラーを返す確率（0.0〜1.0、デフォルト: 0）
+    MOCK_LLM_MAX_TOKENS     : 応答トークン数（num_predict未指定時、デフォルト: 64）
+    MOCK_LLM_SEED           : 乱数シード（デフォルト: 0）
+    MOCK_LLM_MODELS         : /api/tags で返すモデル名（カンマ区切り）
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import ollama
+
+
+# 応答文の生成に使う語彙（トークン単位）
+MOCK_VOCABULARY = [
+    "これは", "モック", "の", "応答", "です", "。", "ご", "質問", "について",
+    "考えて", "みましょう", "、", "なるほど", "そう", "ですね", "もう少し",
+    "詳しく", "教えて", "ください", "ありがとう", "ございます",
+]
+
+
+class MockLLMConfig:
+    """モックバックエンドの設定"""
+
+    def __init__(self, tokens_per_second: float = 30.0, ttft_ms: float = 200.0,
+                 jitter: float = 0.1, failure_rate: float = 0.0,
+                 max_tokens: int = 64, seed: int = 0,
+                 models: Optional[List[str]] = None):
+        self.tokens_per_second = tokens_per_second
+        self.ttft_ms = ttft_ms
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.models = models or ["gemma3:4b", "gemma2:9b", "mock:latest"]
+
+    @classmethod
+    def from_env(cls) -> 'MockLLMConfig':
+        """環境変数から設定を作成"""
+        models = os.environ.get("MOCK_LLM_MODELS")
+        return cls(
+            tokens_per_second=float(os.environ.get("MOCK_LLM_TOKENS_PER_SEC", 30.0)),
+            ttft_ms=float(os.environ.get("MOCK_LLM_TTFT_MS", 200.0)),
+            jitter=float(os.environ.get("MOCK_LLM_JITTER", 0.1)),
+            failure_rate=float(os.environ.get("MOCK_LLM_FAILURE_RATE", 0.0)),
+            max_tokens=int(os.environ.get("MOCK_LLM_MAX_TOKENS", 64)),
+            seed=int(os.environ.get("MOCK_LLM_SEED", 0)),
+            models=[m.strip() for m in models.split(",") if m.strip()] if models else None,
+        )
+
+
+def shared_prefix_length(previous: Optional[List[Dict]], messages: List[Dict]) -> int:
+    """前回のリクエストと先頭から一致するメッセージ数（Ollamaのプロンプトキャッシュの模擬）"""
+    count = 0
+    for old, new in zip(previous or [], messages):
+        if old != new:
+            break
+        count += 1
+    return count
+
+
+class MockGeneration:
+    """1回分の応答生成計画（トークン列と遅延）
+
+    同じモデル・メッセージ・オプション・シードからは常に同じ計画が生成される。
+    """
+
+    def __init__(self, config: MockLLMConfig, model: str, messages: List[Dict],
+                 options: Optional[Dict] = None, cached_messages: int = 0):
+        options = options or {}
+        payload = json.dumps(
+            {"model": model, "messages": messages, "options": options, "seed": config.seed},
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        digest = hashlib.sha256(payload.encode('utf-8')).digest()
+        rng = random.Random(int.from_bytes(digest[:8], 'big'))
+
+        self.model = model
+        self.failed = rng.random() < config.failure_rate
+        num_tokens = options.get('num_predict') or config.max_tokens
+        if num_tokens < 0:
+            num_tokens = config.max_tokens
+        self.tokens = [rng.choice(MOCK_VOCABULARY) for _ in range(num_tokens)]
+        # 前回と一致する先頭のメッセージは評価済みとしてprompt_eval_countに含めない
+        evaluated = messages[cached_messages:]
+        self.prompt_tokens = sum(len(str(m.get('content', ''))) for m in evaluated) // 2 + len(evaluated)
+
+        def jittered(seconds: float) -> float:
+            return max(seconds * (1 + config.jitter * rng.uniform(-1, 1)), 0.0)
+
+        self.ttft = jittered(config.ttft_ms / 1000)
+        per_token = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        self.token_delays = [jittered(per_token) for _ in self.tokens[1:]]
+
+    def chunk(self, content: str, done: bool = False) -> Dict:
+        """Ollamaの/api/chatレスポンスと同じ形式のチャンクを作成"""
+        chunk = {
+            "model": self.model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+        if done:
+            eval_ns = int(sum(self.token_delays) * 1e9)
+            prompt_ns = int(self.ttft * 1e9)
+            chunk.update({
+                "done_reason": "stop",
+                "total_duration": prompt_ns + eval_ns,
+                "load_duration": 0,
+                "prompt_eval_count": self.prompt_tokens,
+                "prompt_eval_duration": prompt_ns,
+                "eval_count": len(self.tokens),
+                "eval_duration": eval_ns,
+            })
+        return chunk
+
+    def error(self) -> ollama.ResponseError:
+        return ollama.ResponseError("mock failure injected", 500)
+
+
+class MockAsyncClient:
+    """ollama.AsyncClientと同じインターフェースのプロセス内モック"""
+
+    def __init__(self, config: Optional[MockLLMConfig] = None):
+        self.config = config or MockLLMConfig.from_env()
+        self.loaded_models: List[str] = []
+        self.last_messages: Dict[str, List[Dict]] = {}  # モデルごとの前回のリクエスト
+
+    async def chat(self, model: str = '', messages: Optional[List[Dict]] = None,
+                   options: Optional[Dict] = None, stream: bool = False, **kwargs):
+        messages = list(messages or [])
+        generation = MockGeneration(self.config, model, messages, options,
+                                    shared_prefix_length(self.last_messages.get(model), messages))
+        self.last_messages[model] = messages
+        if model not in self.loaded_models:
+            self.loaded_models.append(model)
+        if stream:
+            return self._stream(generation)
+
+        await asyncio.sleep(generation.ttft + sum(generation.token_delays))
+        if generation.failed:
+            raise generation.error()
+        final = generation.chunk(''.join(generation.tokens), done=True)
+        return ollama.ChatResponse(**final)
+
+    async def _stream(self, generation: MockGeneration):
+        await asyncio.sleep(generation.ttft)
+        if generation.failed:
+            raise generation.error()
+        for index, token in enumerate(generation.tokens):
+            if index > 0:
+                await asyncio.sleep(generation.token_delays[index - 1])
+            yield ollama.ChatResponse(**generation.chunk(token))
+        yield ollama.ChatResponse(**generation.chunk('', done=True))
+
+    async def generate(self, model: str = '', prompt: Optional[str] = None, keep_alive=None, **kwargs):
+        """モデルのロード・アンロードのみ対応（keep_alive=0 でアンロード）"""
+        if keep_alive == 0:
+            if model in self.loaded_models:
+                self.loaded_models.remove(model)
+        elif model not in self.loaded_models:
+            self.loaded_models.append(model)
+        return ollama.GenerateResponse(model=model, response='', done=True)
+
+    async def list(self) -> ollama.ListResponse:
+        return ollama.ListResponse(models=[
+            ollama.ListResponse.Model(model=name, size=0, digest=hashlib.sha256(name.encode()).hexdigest())
+            for name in self.config.models
+        ])
+
+    async def ps(self) -> ollama.ProcessResponse:
+        return ollama.ProcessResponse(models=[
+            ollama.ProcessResponse.Model(model=name, size=0) for name in self.loaded_models
+        ])
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Ollama互換APIのリクエストハンドラ"""
+
+    config: MockLLMConfig = MockLLMConfig()
+    loaded_models: List[str] = []  # /api/chat で使用されたモデル（/api/ps で常駐として返す）
+    last_messages: Dict[str, List[Dict]] = {}  # モデルごとの前回のリクエスト
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # リクエストごとのログは出力しない
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [
+                {
+                    "name": name,
+                    "model": name,
+                    "modified_at": datetime.now(timezone.utc).isoformat(),
+                    "size": 0,
+                    "digest": hashlib.sha256(name.encode()).hexdigest(),
+                    "details": {"family": "mock", "parameter_size": "0B", "quantization_level": "none"},
+                }
+                for name in self.config.models
+            ]})
+        elif self.path == "/api/ps":
+            self._send_json(200, {"models": [
+                {"name": name, "model": name, "size": 0, "size_vram": 0}
+                for name in list(self.loaded_models)
+            ]})
+        elif self.path in ("/", "/api/version"):
+            self._send_json(200, {"version": "mock"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/generate":
+            # モデルのロード・アンロードのみ対応（keep_alive=0 でアンロード）
+            model = request.get("model", "")
+            if request.get("keep_alive") == 0:
+                if model in self.loaded_models:
+                    self.loaded_models.remove(model)
+            elif model not in self.loaded_models:
+                self.loaded_models.append(model)
+            self._send_json(200, {"model": model, "response": "", "done": True})
+            return
+        if self.path != "/api/chat":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        model, messages = request.get("model", ""), request.get("messages", [])
+        generation = MockGeneration(
+            self.config, model, messages, request.get("options"),
+            shared_prefix_length(self.last_messages.get(model), messages)
+        )
+        self.last_messages[model] = messages
+        if generation.model not in self.loaded_models:
+            self.loaded_models.append(generation.model)
+
+        time.sleep(generation.ttft)
+        if generation.failed:
+            self._send_json(500, {"error": "mock failure injected"})
+            return
+
+        if not request.get("stream", True):
+            time.sleep(sum(generation.token_delays))
+            self._send_json(200, generation.chunk(''.join(generation.tokens), done=True))
+            return
+
+        # NDJSONをchunked転送で送信（クライアント切断時は生成を打ち切る）
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for index, token in enumerate(generation.tokens):
+                if index > 0:
+                    time.sleep(generation.token_delays[index - 1])
+                self._write_chunk(generation.chunk(token))
+            self._write_chunk(generation.chunk('', done=True))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _write_chunk(self, payload: Dict):
+        line = (json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8')
+        self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(host: str = "127.0.0.1", port: int = 11435, config: Optional[MockLLMConfig] = None):
+    """Ollama互換のモックHTTPサーバーを起動（ブロッキング）"""
+    handler = type("ConfiguredMockOllamaHandler", (MockOllamaHandler,), {
+        "config": config or MockLLMConfig.from_env(),
+        "loaded_models": [],
+        "last_messages": {},
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"[MockLLM] Serving Ollama-compatible API on http://{host}:{port} "
+          f"({handler.config.tokens_per_second} tok/s, ttft {handler.config.ttft_ms} ms, "
+          f"failure rate {handler.config.failure_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama-compatible mock LLM server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens-per-sec", type=float, default=None)
+    parser.add_argument("--ttft-ms", type=float, default=None)
+    parser.add_argument("--jitter", type=float, default=None)
+    parser.add_argument("--failure-rate", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = MockLLMConfig.from_env()
+    if args.tokens_per_sec is not None:
+        config.tokens_per_second = args.tokens_per_sec
+    if args.ttft_ms is not None:
+        config.ttft_ms = args.ttft_ms
+    if args.jitter is not None:
+        config.jitter = args.jitter
+    if args.failure_rate is not None:
+        config.failure_rate = args.failure_rate
+    if args.seed is not None:
+        config.seed = args.seed
+    serve(args.host, args.port, config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Ollamaのモデルカタログ（バックグラウンド更新のキャッシュ）
+
+インストール済みモデル（/api/tags）と常駐中のモデル（/api/ps）を一定間隔で取得してキャッシュし、
+管理画面のモデル一覧・起動時チェック・モデルの事前確認にイベントループを止めずに即座に返す。
+
+設定（環境変数）:
+    MODEL_CATALOG_TTL : 更新間隔（秒、デフォルト: 30）
+"""
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .resource_planner import parse_parameter_size
+
+
+class ModelInfo:
+    """カタログ内の1モデルの情報"""
+
+    __slots__ = (
+        'name', 'size', 'digest', 'modified_at', 'family', 'parameter_size',
+        'quantization_level', 'installed_on', 'resident_on', 'loaded_size', 'size_vram', 'expires_at'
+    )
+
+    def __init__(self, name: str):
+        self.name = name
+        self.size: Optional[int] = None
+        self.digest: Optional[str] = None
+        self.modified_at: Optional[str] = None
+        self.family: Optional[str] = None
+        self.parameter_size: Optional[str] = None
+        self.quantization_level: Optional[str] = None
+        self.installed_on: List[str] = []  # インストールされているバックエンド（/api/tags）
+        self.resident_on: List[str] = []  # 常駐しているバックエンド
+        self.loaded_size: Optional[int] = None  # ロード時のメモリ使用量（/api/ps、KVキャッシュを含む）
+        self.size_vram: Optional[int] = None
+        self.expires_at: Optional[str] = None
+
+    @property
+    def parameter_billions(self) -> Optional[float]:
+        return parse_parameter_size(self.parameter_size)
+
+    @property
+    def resident(self) -> bool:
+        return bool(self.resident_on)
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "size_gb": round(self.size / 1024 ** 3, 2) if self.size else None,
+            "digest": self.digest,
+            "modified_at": self.modified_at,
+            "family": self.family,
+            "parameter_size": self.parameter_size,
+            "parameter_billions": self.parameter_billions,
+            "quantization_level": self.quantization_level,
+            "resident": self.resident,
+            "installed_on": list(self.installed_on),
+            "resident_on": list(self.resident_on),
+            "loaded_size": self.loaded_size,
+            "size_vram": self.size_vram,
+            "expires_at": self.expires_at,
+        }
+
+
+def _isoformat(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+class ModelCatalog:
+    """Ollamaのモデル一覧のキャッシュ
+
+    sources はOllamaクライアント（AsyncClient互換）とその表示名の組のリスト。
+    複数のバックエンドを指定した場合はインストール済みモデルを統合し、常駐先をバックエンドごとに記録する。
+    """
+
+    def __init__(self, sources: List[Tuple[str, object]], ttl: Optional[float] = None):
+        self.sources = sources
+        self.ttl = ttl if ttl is not None else float(os.environ.get("MODEL_CATALOG_TTL", 30))
+        self.models: Dict[str, ModelInfo] = {}
+        self.last_refreshed: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._refresh_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """更新のたびに呼び出すコールバックを登録（引数: ModelCatalog）"""
+        self._listeners.append(callback)
+
+    async def _fetch_source(self, label: str, client) -> Tuple[str, object, object]:
+        listed, running = await asyncio.gather(client.list(), client.ps())
+        return label, listed, running
+
+    async def refresh(self) -> bool:
+        """Ollamaから最新の一覧を取得（同時に呼ばれた場合は1回にまとめる）
+
+        Returns:
+            1つ以上のバックエンドから取得できた場合True
+        """
+        if self._refresh_lock.locked():
+            async with self._refresh_lock:
+                return self.last_error is None
+        async with self._refresh_lock:
+            results = await asyncio.gather(
+                *(self._fetch_source(label, client) for label, client in self.sources),
+                return_exceptions=True
+            )
+            models: Dict[str, ModelInfo] = {}
+            errors = []
+            for (label, _), result in zip(self.sources, results):
+                if isinstance(result, Exception):
+                    errors.append(f"{label}: {result}")
+                    continue
+                _, listed, running = result
+                for model in listed.models:
+                    info = models.get(model.model) or ModelInfo(model.model)
+                    info.installed_on.append(label)
+                    info.size = model.size
+                    info.digest = model.digest
+                    info.modified_at = _isoformat(model.modified_at)
+                    if model.details:
+                        info.family = model.details.family
+                        info.parameter_size = model.details.parameter_size
+                        info.quantization_level = model.details.quantization_level
+                    models[model.model] = info
+                for model in running.models:
+                    info = models.get(model.model) or ModelInfo(model.model)
+                    info.resident_on.append(label)
+                    info.loaded_size = model.size
+                    info.size_vram = model.size_vram
+                    info.expires_at = _isoformat(model.expires_at)
+                    if info.size is None:
+                        info.size = model.size
+                    models[model.model] = info
+
+            if len(errors) == len(self.sources):
+                self.last_error = "; ".join(errors)
+                print(f"[ModelCatalog] Failed to refresh: {self.last_error}")
+                return False
+
+            self.models = models
+            self.last_refreshed = time.time()
+            self.last_error = "; ".join(errors) if errors else None
+            for callback in self._listeners:
+                try:
+                    callback(self)
+                except Exception as e:
+                    print(f"[ModelCatalog] Listener error: {e}")
+            return True
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl)
+            await self.refresh()
+
+    def start(self):
+        """バックグラウンド更新を開始（イベントループ内で呼び出す）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    def is_stale(self) -> bool:
+        return self.last_refreshed is None or time.time() - self.last_refreshed > self.ttl
+
+    async def ensure_fresh(self) -> bool:
+        """期限切れの場合のみ更新"""
+        if self.is_stale():
+            return await self.refresh()
+        return True
+
+    def get(self, name: str) -> Optional[ModelInfo]:
+        """モデル情報を取得（タグ省略時は :latest とみなす）"""
+        info = self.models.get(name)
+        if info is None and ':' not in name:
+            info = self.models.get(f"{name}:latest")
+        return info
+
+    def get_model_names(self) -> List[str]:
+        return list(self.models.keys())
+
+    def get_resident_models(self) -> List[str]:
+        return [name for name, info in self.models.items() if info.resident]
+
+    def to_dict(self) -> Dict:
+        return {
+            "models": [info.to_dict() for info in self.models.values()],
+            "last_refreshed": self.last_refreshed,
+            "ttl": self.ttl,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,173 @@
+"""複数のOllamaバックエンドへの負荷分散
+
+研究室内の複数マシン（または同一マシンの複数ポート）で動作するOllamaを束ね、
+リクエストごとに以下の優先順位で送信先を選択する。
+
+1. セッションが固定されているバックエンド（正常かつモデルが常駐している場合）
+2. モデルが常駐している正常なバックエンドのうち実行中リクエストが最少のもの
+   （ただし全て上限 OLLAMA_POOL_MAX_INFLIGHT 以上なら、より空いている正常なバックエンドへ）
+3. 正常なバックエンドのうち実行中リクエストが最少のもの
+4. すべて異常な場合は実行中リクエストが最少のもの（復旧している可能性があるため）
+
+設定（環境変数）:
+    OLLAMA_HOSTS             : バックエンドのホスト（カンマ区切り、例: http://127.0.0.1:11434,http://127.0.0.1:11435）
+    OLLAMA_POOL_MAX_INFLIGHT : 1台あたりの実行中リクエスト数の目安（デフォルト: 4）
+"""
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+import ollama
+
+
+class OllamaBackend:
+    """1台のOllamaバックエンドの状態"""
+
+    __slots__ = (
+        'host', 'client', 'healthy', 'inflight', 'resident_models',
+        'last_checked', 'last_error', 'consecutive_failures', 'total_requests'
+    )
+
+    def __init__(self, host: str):
+        self.host = host
+        self.client = ollama.AsyncClient(host=host)
+        self.healthy = True  # 初回のヘルスチェックまでは正常とみなす
+        self.inflight = 0
+        self.resident_models: Set[str] = set()
+        self.last_checked: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        self.total_requests = 0
+
+    def has_model(self, model: str) -> bool:
+        """モデルが常駐しているか（タグ省略時は :latest とみなす）"""
+        if model in self.resident_models:
+            return True
+        return ':' not in model and f"{model}:latest" in self.resident_models
+
+    def to_dict(self) -> Dict:
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "inflight": self.inflight,
+            "resident_models": sorted(self.resident_models),
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+        }
+
+
+class OllamaBackendPool:
+    """Ollamaバックエンドのプール（ヘルスチェック・負荷分散・セッション固定）"""
+
+    HEALTH_CHECK_INTERVAL = 10.0  # ヘルスチェック間隔（秒）
+    HEALTH_CHECK_TIMEOUT = 5.0
+    MAX_FAILURES = 2  # 連続失敗でこの回数に達したら異常とみなす
+
+    def __init__(self, hosts: List[str], max_inflight_per_backend: Optional[int] = None):
+        if not hosts:
+            raise ValueError("At least one Ollama host is required")
+        self.max_inflight_per_backend = max_inflight_per_backend or int(
+            os.environ.get("OLLAMA_POOL_MAX_INFLIGHT", 4)
+        )
+        self.backends = [OllamaBackend(host) for host in hosts]
+        self.session_affinity: Dict[str, OllamaBackend] = {}
+        self._health_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> Optional['OllamaBackendPool']:
+        """環境変数 OLLAMA_HOSTS からプールを作成（未設定の場合はNone）"""
+        hosts = [h.strip() for h in os.environ.get("OLLAMA_HOSTS", "").split(",") if h.strip()]
+        return cls(hosts) if hosts else None
+
+    async def check_backend(self, backend: OllamaBackend):
+        """1台のヘルスチェック（/api/ps で常駐モデルも更新）"""
+        try:
+            response = await asyncio.wait_for(backend.client.ps(), timeout=self.HEALTH_CHECK_TIMEOUT)
+            backend.resident_models = {model.model for model in response.models if model.model}
+            self._mark_success(backend)
+        except Exception as e:
+            self.mark_failure(backend, e)
+        backend.last_checked = time.time()
+
+    async def refresh(self):
+        """全バックエンドのヘルスチェックを並行実行"""
+        await asyncio.gather(*(self.check_backend(backend) for backend in self.backends))
+
+    async def _health_check_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.HEALTH_CHECK_INTERVAL)
+
+    def start_health_checks(self):
+        """バックグラウンドのヘルスチェックを開始（イベントループ内で呼び出す）"""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_check_loop())
+
+    def _mark_success(self, backend: OllamaBackend):
+        if not backend.healthy:
+            print(f"[OllamaPool] ✅ Backend recovered: {backend.host}")
+        backend.healthy = True
+        backend.consecutive_failures = 0
+        backend.last_error = None
+
+    def mark_failure(self, backend: OllamaBackend, error: Exception):
+        """接続エラーを記録（連続失敗で異常とし、固定セッションを解除）"""
+        backend.consecutive_failures += 1
+        backend.last_error = str(error)
+        if backend.healthy and backend.consecutive_failures >= self.MAX_FAILURES:
+            backend.healthy = False
+            print(f"[OllamaPool] ❌ Backend unhealthy: {backend.host} ({error})")
+            for session_id in [s for s, b in self.session_affinity.items() if b is backend]:
+                del self.session_affinity[session_id]
+
+    def select(self, model: str, session_id: Optional[str] = None) -> OllamaBackend:
+        """リクエストの送信先バックエンドを選択"""
+        healthy = [b for b in self.backends if b.healthy]
+        resident = [b for b in healthy if b.has_model(model)]
+
+        sticky = self.session_affinity.get(session_id) if session_id else None
+        if sticky is not None and sticky.healthy and (sticky.has_model(model) or not resident):
+            return sticky
+
+        # 同数の場合はリスト順（先頭のバックエンドを優先）
+        if resident:
+            best = min(resident, key=lambda b: b.inflight)
+            if best.inflight < self.max_inflight_per_backend:
+                return best
+            # 常駐先が混雑している場合はモデルのロードを伴っても空いているバックエンドへ
+            least_loaded = min(healthy, key=lambda b: b.inflight)
+            return least_loaded if least_loaded.inflight < best.inflight else best
+        return min(healthy or self.backends, key=lambda b: b.inflight)
+
+    def acquire(self, model: str, session_id: Optional[str] = None) -> OllamaBackend:
+        """バックエンドを選択し、実行中リクエスト数を加算（release()と対で呼ぶ）"""
+        backend = self.select(model, session_id)
+        backend.inflight += 1
+        backend.total_requests += 1
+        # 送信先でモデルがロードされるため常駐扱いにする（次回のヘルスチェックで補正）
+        backend.resident_models.add(model)
+        if session_id:
+            self.session_affinity[session_id] = backend
+        return backend
+
+    def release(self, backend: OllamaBackend, error: Optional[Exception] = None):
+        """リクエスト完了時に実行中リクエスト数を減算"""
+        backend.inflight = max(backend.inflight - 1, 0)
+        if error is not None:
+            self.mark_failure(backend, error)
+        else:
+            self._mark_success(backend)
+
+    def release_session(self, session_id: str):
+        """セッションの固定を解除"""
+        self.session_affinity.pop(session_id, None)
+
+    def get_status(self) -> Dict:
+        return {
+            "backends": [backend.to_dict() for backend in self.backends],
+            "sticky_sessions": len(self.session_affinity),
+            "max_inflight_per_backend": self.max_inflight_per_backend,
+        }
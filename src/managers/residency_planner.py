@@ -0,0 +1,343 @@
+"""モデル常駐プランナー
+
+稼働中の実験フローで使われるモデル（チャットステップの bot_model、AI評価ステップの evaluation_model）の
+メモリ使用量（モデル本体 + KVキャッシュの概算）をモデルカタログから見積もり、常駐させるモデルを決める。
+
+- チャットモデル（参加者が応答を待つ）を優先して常駐させ、keep_alive を延長してアンロードを防ぐ
+- AI評価などの低優先度の処理は、そのモデルをロードするとチャットモデルが追い出される場合に保留し、
+  バッチウィンドウ（メモリに空きができた／チャットが一定時間ない／保留時間が上限に達した）でまとめて実行する。
+  実行後はモデルをアンロードしてチャットモデルの領域を空ける
+- 常駐モデルのアンロード（追い出し）はすべてログに記録する（検出はモデルカタログの更新間隔ごと）
+
+設定（環境変数）:
+    LLM_MODEL_RAM_GB             : モデルに使えるメモリ（GB、省略時は 総メモリ - LLM_RESERVED_RAM_GB）
+    RESIDENCY_KEEP_ALIVE         : 常駐させるチャットモデルの keep_alive（デフォルト: 30m）
+    RESIDENCY_BATCH_INTERVAL     : 保留中の処理を確認する間隔（秒、デフォルト: 15）
+    RESIDENCY_BATCH_IDLE_SECONDS : チャットの生成がこの時間ない場合にバッチを実行（秒、デフォルト: 60）
+    RESIDENCY_MAX_DEFER_SECONDS  : 保留の上限時間（秒、デフォルト: 900）
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .resource_planner import GIB
+
+PRIORITY_CHAT = "chat"
+PRIORITY_LOW = "low"
+
+DEFAULT_EVALUATION_MODEL = "gemma2:9b"
+DEFAULT_NUM_CTX = 8192
+
+
+class DeferredJob:
+    """バッチウィンドウまで保留された低優先度の処理"""
+    __slots__ = ('model', 'label', 'run', 'enqueued_at')
+
+    def __init__(self, model: str, label: str, run: Callable[[], Awaitable]):
+        self.model = model
+        self.label = label
+        self.run = run
+        self.enqueued_at = time.time()
+
+
+def collect_flow_models(flow: Optional[List[Dict]], default_chat_model: str,
+                        default_evaluation_model: str = DEFAULT_EVALUATION_MODEL) -> Dict[str, Dict]:
+    """フロー（ブランチ・ランダマイザー内を含む）で使われるモデルと優先度を収集
+
+    Returns:
+        モデル名 → {"priority", "num_ctx", "steps"}（チャットと評価の両方で使われる場合はチャット扱い）
+    """
+    models: Dict[str, Dict] = {}
+
+    def add(model: str, priority: str, num_ctx: Optional[int]):
+        entry = models.setdefault(model, {"priority": priority, "num_ctx": DEFAULT_NUM_CTX, "steps": 0})
+        if priority == PRIORITY_CHAT:
+            entry["priority"] = PRIORITY_CHAT
+        entry["num_ctx"] = max(entry["num_ctx"], num_ctx or DEFAULT_NUM_CTX)
+        entry["steps"] += 1
+
+    def visit(steps):
+        for step in steps or []:
+            if not isinstance(step, dict):
+                continue
+            step_type = step.get('step_type')
+            if step_type == 'chat':
+                add(step.get('bot_model') or default_chat_model, PRIORITY_CHAT, step.get('num_ctx'))
+            elif step_type == 'ai_evaluation':
+                add(step.get('evaluation_model') or default_evaluation_model, PRIORITY_LOW, None)
+            for branch in step.get('branches') or []:
+                visit(branch.get('steps'))
+            visit(step.get('steps'))
+
+    visit(flow)
+    return models
+
+
+class ResidencyPlanner:
+    """モデルの常駐計画と低優先度処理の保留・バッチ実行"""
+
+    def __init__(self, catalog, resource_planner, ram_budget_bytes: Optional[int] = None,
+                 keep_alive: Optional[str] = None):
+        """
+        Args:
+            catalog: モデルサイズと常駐状態の取得元（ModelCatalog）
+            resource_planner: メモリ量とKVキャッシュの見積もりに使用（ResourcePlanner）
+            ram_budget_bytes: モデルに使えるメモリ（省略時は環境変数または検出値）
+            keep_alive: 常駐させるチャットモデルの keep_alive
+        """
+        self.catalog = catalog
+        self.resource_planner = resource_planner
+        if ram_budget_bytes is None:
+            configured = os.environ.get("LLM_MODEL_RAM_GB")
+            ram_budget_bytes = int(float(configured) * GIB) if configured else resource_planner.model_ram_budget
+        self.ram_budget_bytes = ram_budget_bytes
+        self.keep_alive = keep_alive or os.environ.get("RESIDENCY_KEEP_ALIVE", "30m")
+        self.batch_interval = float(os.environ.get("RESIDENCY_BATCH_INTERVAL", 15))
+        self.batch_idle_seconds = float(os.environ.get("RESIDENCY_BATCH_IDLE_SECONDS", 60))
+        self.max_defer_seconds = float(os.environ.get("RESIDENCY_MAX_DEFER_SECONDS", 900))
+
+        # 実験ID → フローで使われるモデル
+        self.flow_models: Dict[str, Dict[str, Dict]] = {}
+        self.pinned: List[str] = []  # 常駐させるチャットモデル
+        self.overflow: List[str] = []  # 予算に収まらないチャットモデル（入れ替わりが発生する）
+        self.pinned_bytes = 0
+        self.deferred: Dict[str, List[DeferredJob]] = {}
+
+        # チャットの最終生成からの経過秒（生成中はNone）と、モデルのアンロード処理（BotManagerが設定）
+        self.idle_probe: Optional[Callable[[], Optional[float]]] = None
+        self.unloader: Optional[Callable[[str], Awaitable]] = None
+
+        self._resident: Set[Tuple[str, str]] = set()  # (モデル, バックエンド)
+        self._resident_initialized = False
+        self._expected_unloads: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.evictions = deque(maxlen=100)
+        self.eviction_count = 0
+        self.pinned_eviction_count = 0
+        self.jobs_deferred = 0
+        self.batches_run = 0
+
+        catalog.add_listener(self._on_catalog_refresh)
+
+    # ---------- 見積もり ----------
+
+    def _canonical(self, model: str) -> str:
+        info = self.catalog.get(model)
+        return info.name if info else model
+
+    def footprint(self, model: str, num_ctx: int = DEFAULT_NUM_CTX) -> Optional[int]:
+        """モデルのメモリ使用量の概算（本体 + コンテキスト1本分のKVキャッシュ、不明ならNone）"""
+        info = self.catalog.get(model)
+        if info is None or not info.size:
+            return None
+        kv = self.resource_planner.kv_cache_bytes(info.size, info.parameter_billions, num_ctx)
+        return info.size + kv
+
+    def _resident_bytes(self) -> int:
+        """現在常駐しているモデルの使用量（/api/ps の値、なければ見積もり）"""
+        total = 0
+        for info in self.catalog.models.values():
+            if info.resident:
+                total += info.loaded_size or self.footprint(info.name) or 0
+        return total
+
+    def _is_resident(self, model: str) -> bool:
+        info = self.catalog.get(model)
+        return bool(info and info.resident)
+
+    # ---------- 計画 ----------
+
+    def set_experiment_flows(self, flows: Dict[str, Optional[List[Dict]]], default_chat_model: str):
+        """稼働中の実験のフローを登録して常駐計画を更新"""
+        self.flow_models = {
+            experiment_id: collect_flow_models(flow, default_chat_model)
+            for experiment_id, flow in flows.items()
+        }
+        self._replan(log=True)
+
+    def _merged_models(self) -> Dict[str, Dict]:
+        merged: Dict[str, Dict] = {}
+        for models in self.flow_models.values():
+            for name, entry in models.items():
+                name = self._canonical(name)
+                current = merged.setdefault(name, {"priority": PRIORITY_LOW, "num_ctx": DEFAULT_NUM_CTX, "steps": 0})
+                if entry["priority"] == PRIORITY_CHAT:
+                    current["priority"] = PRIORITY_CHAT
+                current["num_ctx"] = max(current["num_ctx"], entry["num_ctx"])
+                current["steps"] += entry["steps"]
+        return merged
+
+    def _replan(self, log: bool = False):
+        """チャットモデルを使用ステップ数の多い順に予算内で常駐させる"""
+        merged = self._merged_models()
+        chat_models = sorted(
+            (name for name, entry in merged.items() if entry["priority"] == PRIORITY_CHAT),
+            key=lambda name: -merged[name]["steps"]
+        )
+        pinned, overflow, used = [], [], 0
+        for name in chat_models:
+            size = self.footprint(name, merged[name]["num_ctx"]) or 0
+            if self.ram_budget_bytes is None or used + size <= self.ram_budget_bytes:
+                pinned.append(name)
+                used += size
+            else:
+                overflow.append(name)
+
+        changed = pinned != self.pinned or overflow != self.overflow
+        self.pinned, self.overflow, self.pinned_bytes = pinned, overflow, used
+        if log or changed:
+            budget = f"{self.ram_budget_bytes / GIB:.1f} GB" if self.ram_budget_bytes else "unknown"
+            low = [name for name, entry in merged.items() if entry["priority"] == PRIORITY_LOW]
+            print(f"[Residency] Plan: resident={pinned} ({used / GIB:.1f} GB / budget {budget}), low priority={low}")
+            if overflow:
+                print(f"[Residency] ⚠️ Chat models exceed the RAM budget and will be swapped: {overflow}")
+
+    def keep_alive_for(self, model: str) -> Optional[str]:
+        """リクエストに指定する keep_alive（常駐させるチャットモデルのみ延長、それ以外はOllamaの既定値）"""
+        return self.keep_alive if self._canonical(model) in self.pinned else None
+
+    def should_defer(self, model: str, num_ctx: int = DEFAULT_NUM_CTX) -> bool:
+        """低優先度の処理を保留すべきか（ロードすると常駐中のチャットモデルが追い出される場合True）"""
+        if self._canonical(model) in self.pinned or self._is_resident(model):
+            return False
+        size = self.footprint(model, num_ctx)
+        if size is None or self.ram_budget_bytes is None:
+            return False
+        if self._resident_bytes() + size <= self.ram_budget_bytes:
+            return False
+        return any(self._is_resident(name) for name in self.pinned)
+
+    # ---------- 保留とバッチ実行 ----------
+
+    def defer(self, model: str, label: str, run: Callable[[], Awaitable]) -> int:
+        """処理を保留（run はバッチウィンドウで呼び出すコルーチン関数）
+
+        Returns:
+            このモデルで保留中の件数
+        """
+        jobs = self.deferred.setdefault(self._canonical(model), [])
+        jobs.append(DeferredJob(model, label, run))
+        self.jobs_deferred += 1
+        print(f"[Residency] ⏸️ Deferred {label} on {model} ({len(jobs)} pending) to avoid evicting {self.pinned}")
+        return len(jobs)
+
+    def _window_reason(self, model: str, jobs: List[DeferredJob]) -> Optional[str]:
+        """バッチを実行できる理由（まだ実行しない場合はNone）"""
+        if not self.should_defer(model):
+            return "memory_available"
+        idle = self.idle_probe() if self.idle_probe else None
+        if idle is not None and idle >= self.batch_idle_seconds:
+            return "chat_idle"
+        if time.time() - jobs[0].enqueued_at >= self.max_defer_seconds:
+            return "max_wait"
+        return None
+
+    async def run_due_batches(self):
+        """実行可能になったモデルの保留処理をまとめて実行"""
+        for model in list(self.deferred):
+            jobs = self.deferred.get(model)
+            if not jobs:
+                self.deferred.pop(model, None)
+                continue
+            reason = self._window_reason(model, jobs)
+            if reason is not None:
+                await self._run_batch(model, reason)
+
+    async def _run_batch(self, model: str, reason: str):
+        jobs = self.deferred.pop(model, [])
+        print(f"[Residency] ▶️ Running {len(jobs)} deferred job(s) on {model} ({reason})")
+        for job in jobs:
+            try:
+                await job.run()
+            except Exception as e:
+                print(f"[Residency] Deferred job failed ({job.label}): {e}")
+        self.batches_run += 1
+
+        # チャットモデルの領域を空けるため、使い終わったモデルをすぐにアンロード
+        if self.unloader and model not in self.pinned:
+            self._expected_unloads.add(model)
+            try:
+                await self.unloader(model)
+            except Exception as e:
+                self._expected_unloads.discard(model)
+                print(f"[Residency] Failed to unload {model}: {e}")
+        await self.catalog.refresh()
+        self._expected_unloads.discard(model)
+
+    async def _batch_loop(self):
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            try:
+                await self.run_due_batches()
+            except Exception as e:
+                print(f"[Residency] Batch loop error: {e}")
+
+    def start(self):
+        """バッチウィンドウの監視を開始（イベントループ内で呼び出す）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._batch_loop())
+
+    # ---------- 追い出しの記録 ----------
+
+    def _on_catalog_refresh(self, catalog):
+        current = {
+            (name, backend)
+            for name, info in catalog.models.items()
+            for backend in info.resident_on
+        }
+        if self._resident_initialized:
+            for name, backend in sorted(current - self._resident):
+                print(f"[Residency] 📥 Loaded {name} on {backend}")
+            for name, backend in sorted(self._resident - current):
+                self._record_unload(name, backend)
+        self._resident = current
+        self._resident_initialized = True
+        self._replan()
+
+    def _record_unload(self, model: str, backend: str):
+        expected = model in self._expected_unloads
+        self._expected_unloads.discard(model)
+        pinned = model in self.pinned
+        self.evictions.append({
+            "model": model,
+            "backend": backend,
+            "at": time.time(),
+            "pinned": pinned,
+            "reason": "batch_unload" if expected else "evicted",
+        })
+        if expected:
+            print(f"[Residency] 📤 Unloaded {model} on {backend} after deferred batch")
+            return
+        self.eviction_count += 1
+        if pinned:
+            self.pinned_eviction_count += 1
+            print(f"[Residency] ⚠️ Pinned chat model evicted: {model} on {backend}")
+        else:
+            print(f"[Residency] 📤 Model evicted: {model} on {backend}")
+
+    def to_dict(self) -> Dict:
+        merged = self._merged_models()
+        return {
+            "ram_budget_gb": round(self.ram_budget_bytes / GIB, 1) if self.ram_budget_bytes else None,
+            "resident_bytes": self._resident_bytes(),
+            "pinned": list(self.pinned),
+            "pinned_gb": round(self.pinned_bytes / GIB, 2),
+            "overflow": list(self.overflow),
+            "keep_alive": self.keep_alive,
+            "models": {
+                name: {
+                    **entry,
+                    "footprint_gb": round(size / GIB, 2) if (size := self.footprint(name, entry["num_ctx"])) else None,
+                    "resident": self._is_resident(name),
+                }
+                for name, entry in merged.items()
+            },
+            "deferred": {model: len(jobs) for model, jobs in self.deferred.items() if jobs},
+            "jobs_deferred": self.jobs_deferred,
+            "batches_run": self.batches_run,
+            "eviction_count": self.eviction_count,
+            "pinned_eviction_count": self.pinned_eviction_count,
+            "recent_evictions": list(self.evictions)[-20:],
+        }
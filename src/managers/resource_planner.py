@@ -0,0 +1,330 @@
+"""推論リソースプランナー
+
+起動時にCPUコア数・NUMA構成・メモリ量を検出し、
+同時実行数の上限からリクエストごとのOllamaパラメータ（num_thread, num_gpu, num_batch）を決める。
+また、モデルごとに推奨する同時セッション数（max_concurrent_sessions）を算出する。
+
+num_thread はOllamaのランナー起動時の設定でもあり、値が変わるとモデルが再ロードされるため、
+実行中のリクエスト数ではなく同時実行数の「上限」から決め、上限が変わらない限り一定にする。
+上限が設定されていない場合は、1リクエストあたり DEFAULT_THREADS_PER_REQUEST スレッドになる同時実行数を使う
+（全コアを1リクエストに割り当てると、同時に届いたリクエストがコアを奪い合うため）。
+
+検出した資源はこのサーバーのものであるため、Ollamaが別のマシンで動いている場合
+（OLLAMA_HOSTS、またはローカル以外の OLLAMA_HOST）は num_thread / num_gpu を指定せずOllamaに任せる。
+
+設定（環境変数）:
+    LLM_MAX_CONCURRENCY   : 同時実行数の上限（実験の max_concurrent_sessions が未設定の場合に使用）
+    LLM_RESERVED_RAM_GB   : OSや本サーバー用に確保するメモリ（GB、デフォルト: 2）
+"""
+import os
+import platform
+import shutil
+from pathlib import Path
+from urllib.parse import urlparse
+from typing import Dict, List, Optional
+
+
+GIB = 1024 ** 3
+
+# 1リクエストに割り当てる最小スレッド数（これ未満では生成速度が大きく落ちる）
+MIN_THREADS_PER_REQUEST = 2
+
+# 同時実行数の上限が未設定の場合の1リクエストあたりのスレッド数
+DEFAULT_THREADS_PER_REQUEST = 4
+
+# ローカルのOllamaとみなすホスト名
+LOCAL_HOSTNAMES = ("localhost", "127.0.0.1", "::1", "0.0.0.0", "")
+
+# KVキャッシュのトークンあたりのサイズ（パラメータ10億あたりの概算、f16）
+KV_BYTES_PER_TOKEN_PER_BILLION_PARAMS = 32 * 1024
+
+# 量子化モデルのパラメータあたりのバイト数（Q4系の概算、パラメータ数不明時の推定に使用）
+BYTES_PER_PARAM_ESTIMATE = 0.6
+
+
+def _parse_cpu_list(text: str) -> List[int]:
+    """"0-3,8-11" 形式のCPUリストを展開"""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def ollama_is_local() -> bool:
+    """Ollamaがこのサーバーと同じマシンで動いているか（環境変数 OLLAMA_HOSTS / OLLAMA_HOST から判定）"""
+    if os.environ.get("OLLAMA_HOSTS", "").strip():
+        return False
+    host = os.environ.get("OLLAMA_HOST", "").strip()
+    if not host:
+        return True
+    if "://" not in host:
+        host = "http://" + host
+    try:
+        hostname = urlparse(host).hostname or ""
+    except ValueError:
+        return False
+    return hostname in LOCAL_HOSTNAMES
+
+
+def parse_parameter_size(value: Optional[str]) -> Optional[float]:
+    """Ollamaの parameter_size（例: "4.3B", "270M"）を10億単位に変換"""
+    if not value:
+        return None
+    value = value.strip().upper()
+    try:
+        if value.endswith('B'):
+            return float(value[:-1])
+        if value.endswith('M'):
+            return float(value[:-1]) / 1000
+    except ValueError:
+        return None
+    return None
+
+
+class SystemResources:
+    """検出したハードウェア資源"""
+
+    def __init__(self, logical_cpus: int, physical_cores: int, numa_nodes: List[int],
+                 total_ram_bytes: Optional[int], available_ram_bytes: Optional[int],
+                 apple_silicon: bool = False, gpu_available: bool = False):
+        self.logical_cpus = logical_cpus
+        self.physical_cores = physical_cores
+        self.numa_nodes = numa_nodes  # ノードごとの物理コア数
+        self.total_ram_bytes = total_ram_bytes
+        self.available_ram_bytes = available_ram_bytes
+        self.apple_silicon = apple_silicon
+        self.gpu_available = gpu_available
+
+    @classmethod
+    def detect(cls) -> 'SystemResources':
+        """実行中のマシンの資源を検出"""
+        try:
+            allowed = sorted(os.sched_getaffinity(0))
+        except AttributeError:  # macOS / Windows
+            allowed = list(range(os.cpu_count() or 1))
+
+        physical_of = cls._physical_core_map(allowed)
+        physical_cores = len(set(physical_of.values())) if physical_of else 0
+        if not physical_cores:
+            physical_cores = cls._sysctl_int("hw.physicalcpu") or len(allowed)
+
+        numa_nodes = cls._numa_nodes(allowed, physical_of)
+        if not numa_nodes:
+            numa_nodes = [physical_cores]
+
+        total_ram, available_ram = cls._memory()
+        apple_silicon = platform.system() == "Darwin" and platform.machine() == "arm64"
+        gpu_available = apple_silicon or shutil.which("nvidia-smi") is not None \
+            or shutil.which("rocm-smi") is not None
+        return cls(len(allowed), physical_cores, numa_nodes, total_ram, available_ram,
+                   apple_silicon, gpu_available)
+
+    @staticmethod
+    def _physical_core_map(cpus: List[int]) -> Dict[int, tuple]:
+        """論理CPU → (パッケージID, コアID) の対応（Linuxのsysfsから取得）"""
+        mapping = {}
+        for cpu in cpus:
+            topology = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology")
+            try:
+                package = (topology / "physical_package_id").read_text().strip()
+                core = (topology / "core_id").read_text().strip()
+            except OSError:
+                return {}
+            mapping[cpu] = (package, core)
+        return mapping
+
+    @staticmethod
+    def _numa_nodes(cpus: List[int], physical_of: Dict[int, tuple]) -> List[int]:
+        """NUMAノードごとの物理コア数（利用可能なCPUのみ）"""
+        node_root = Path("/sys/devices/system/node")
+        if not node_root.exists():
+            return []
+        allowed = set(cpus)
+        nodes = []
+        for node in sorted(node_root.glob("node[0-9]*")):
+            try:
+                node_cpus = set(_parse_cpu_list((node / "cpulist").read_text())) & allowed
+            except (OSError, ValueError):
+                continue
+            if not node_cpus:
+                continue
+            if physical_of:
+                nodes.append(len({physical_of[c] for c in node_cpus if c in physical_of}))
+            else:
+                nodes.append(len(node_cpus))
+        return nodes
+
+    @staticmethod
+    def _memory() -> tuple:
+        """(総メモリ, 利用可能メモリ) をバイト単位で取得"""
+        total = available = None
+        try:
+            with open("/proc/meminfo", 'r') as f:
+                for line in f:
+                    key, _, rest = line.partition(':')
+                    if key in ("MemTotal", "MemAvailable"):
+                        value = int(rest.split()[0]) * 1024
+                        if key == "MemTotal":
+                            total = value
+                        else:
+                            available = value
+        except OSError:
+            pass
+        if total is None:
+            try:
+                total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+            except (ValueError, OSError, AttributeError):
+                total = SystemResources._sysctl_int("hw.memsize")
+        return total, available if available is not None else total
+
+    @staticmethod
+    def _sysctl_int(name: str) -> Optional[int]:
+        """macOSのsysctl値を取得"""
+        if platform.system() != "Darwin":
+            return None
+        try:
+            import subprocess
+            output = subprocess.run(["sysctl", "-n", name], capture_output=True, text=True, timeout=2)
+            return int(output.stdout.strip())
+        except Exception:
+            return None
+
+    def to_dict(self) -> Dict:
+        return {
+            "logical_cpus": self.logical_cpus,
+            "physical_cores": self.physical_cores,
+            "numa_nodes": self.numa_nodes,
+            "total_ram_gb": round(self.total_ram_bytes / GIB, 1) if self.total_ram_bytes else None,
+            "available_ram_gb": round(self.available_ram_bytes / GIB, 1) if self.available_ram_bytes else None,
+            "apple_silicon": self.apple_silicon,
+            "gpu_available": self.gpu_available,
+        }
+
+
+class ResourcePlan:
+    """同時実行数の上限ごとのOllamaパラメータ（フロー側で未指定の項目に使用）"""
+    __slots__ = ('concurrency', 'defaults')
+
+    def __init__(self, concurrency: int, defaults: Dict):
+        self.concurrency = concurrency
+        self.defaults = defaults
+
+
+class ResourcePlanner:
+    """ハードウェア資源と同時実行数からOllamaパラメータと推奨同時セッション数を決める"""
+
+    def __init__(self, resources: Optional[SystemResources] = None,
+                 reserved_ram_bytes: Optional[int] = None,
+                 default_concurrency: Optional[int] = None,
+                 local_backend: Optional[bool] = None):
+        """
+        Args:
+            local_backend: Ollamaがこのサーバーと同じマシンで動いているか（省略時は環境変数から判定）。
+                Falseの場合は num_thread / num_gpu をOllamaに任せる
+        """
+        self.resources = resources or SystemResources.detect()
+        if reserved_ram_bytes is None:
+            reserved_ram_bytes = int(float(os.environ.get("LLM_RESERVED_RAM_GB", 2)) * GIB)
+        self.reserved_ram_bytes = reserved_ram_bytes
+        if default_concurrency is None and os.environ.get("LLM_MAX_CONCURRENCY"):
+            default_concurrency = int(os.environ["LLM_MAX_CONCURRENCY"])
+        if default_concurrency is None:
+            default_concurrency = self.resources.physical_cores // DEFAULT_THREADS_PER_REQUEST
+        self.default_concurrency = max(default_concurrency, 1)
+        self.local_backend = ollama_is_local() if local_backend is None else local_backend
+        self._plans: Dict[int, ResourcePlan] = {}
+
+    def plan_for(self, concurrency_limit: Optional[int] = None) -> ResourcePlan:
+        """同時実行数の上限に対するプラン（同じ上限では同一のオブジェクトを返す）"""
+        concurrency = max(concurrency_limit or self.default_concurrency, 1)
+        plan = self._plans.get(concurrency)
+        if plan is None:
+            plan = ResourcePlan(concurrency, {
+                "num_thread": self.num_thread_for(concurrency) if self.local_backend else None,
+                "num_gpu": self.num_gpu,
+                "num_batch": 512,
+            })
+            self._plans[concurrency] = plan
+        return plan
+
+    def num_thread_for(self, concurrency: int) -> int:
+        """1リクエストあたりのスレッド数（物理コアを同時実行数で分割、NUMAノードをまたがない）"""
+        resources = self.resources
+        per_request = resources.physical_cores // max(concurrency, 1)
+        largest_node = max(resources.numa_nodes) if resources.numa_nodes else resources.physical_cores
+        return max(min(per_request, largest_node), 1)
+
+    @property
+    def num_gpu(self) -> Optional[int]:
+        """GPUレイヤー数（Apple Siliconは全レイヤー、GPUなしは0、リモートのOllamaやそれ以外はOllamaに任せる）"""
+        if not self.local_backend:
+            return None
+        if self.resources.apple_silicon:
+            return -1
+        if not self.resources.gpu_available:
+            return 0
+        return None
+
+    @property
+    def model_ram_budget(self) -> Optional[int]:
+        """モデル（本体+KVキャッシュ）に使えるメモリ量（総メモリ - 予約分）"""
+        if not self.resources.total_ram_bytes:
+            return None
+        return max(self.resources.total_ram_bytes - self.reserved_ram_bytes, 0)
+
+    @staticmethod
+    def kv_cache_bytes(model_size_bytes: Optional[int], parameter_billions: Optional[float] = None,
+                       num_ctx: int = 8192) -> int:
+        """1セッション（コンテキスト1本）あたりのKVキャッシュの概算サイズ"""
+        if parameter_billions is None and model_size_bytes:
+            parameter_billions = model_size_bytes / BYTES_PER_PARAM_ESTIMATE / 1e9
+        return int(num_ctx * KV_BYTES_PER_TOKEN_PER_BILLION_PARAMS * (parameter_billions or 1))
+
+    def recommend_max_concurrent_sessions(self, model_size_bytes: Optional[int],
+                                          parameter_billions: Optional[float] = None,
+                                          num_ctx: int = 8192) -> Dict:
+        """モデルの推奨同時セッション数
+
+        メモリ: (利用可能メモリ - 予約分 - モデル本体) / セッションあたりのKVキャッシュ
+        CPU   : 物理コア数 / 1リクエストあたりの最小スレッド数
+        """
+        resources = self.resources
+        kv_per_session = self.kv_cache_bytes(model_size_bytes, parameter_billions, num_ctx)
+
+        by_ram = None
+        if resources.total_ram_bytes and model_size_bytes:
+            free_for_kv = resources.total_ram_bytes - self.reserved_ram_bytes - model_size_bytes
+            by_ram = max(free_for_kv // kv_per_session, 0) if kv_per_session else None
+        by_cpu = max(resources.physical_cores // MIN_THREADS_PER_REQUEST, 1)
+
+        candidates = [v for v in (by_ram, by_cpu) if v is not None]
+        return {
+            "recommended": min(candidates) if candidates else None,
+            "by_ram": by_ram,
+            "by_cpu": by_cpu,
+            "kv_cache_per_session_mb": round(kv_per_session / 1024 ** 2, 1),
+            "num_thread_at_recommended": self.num_thread_for(min(candidates)) if candidates else None,
+        }
+
+    def get_report(self, models: Optional[Dict[str, Dict]] = None, num_ctx: int = 8192) -> Dict:
+        """検出した資源・プラン・モデル別の推奨値（models: モデル名 → {size, parameter_size}）"""
+        plan = self.plan_for()
+        report = {
+            "resources": self.resources.to_dict(),
+            "reserved_ram_gb": round(self.reserved_ram_bytes / GIB, 1),
+            "default_concurrency": self.default_concurrency,
+            "local_backend": self.local_backend,
+            "default_options": dict(plan.defaults),
+            "models": {},
+        }
+        for name, info in (models or {}).items():
+            report["models"][name] = self.recommend_max_concurrent_sessions(
+                info.get("size"), parse_parameter_size(info.get("parameter_size")), num_ctx
+            )
+        return report
@@ -0,0 +1,155 @@
+"""決定的なLLM呼び出しの応答キャッシュ
+
+モデル・options・メッセージが同一で、temperature=0 または seed 固定の呼び出しは
+同じ応答を返すため、応答をディスクに保存して再利用する。
+パイロット実施や同じ会話の再評価を、Ollamaを呼ばずにほぼ無コストで行うためのもの。
+
+キャッシュはキーごとに1つのJSONファイルとして保存し、合計サイズが上限を超えた場合は
+最後に使用された時刻が古いものから削除する（LRU）。
+
+設定（環境変数）:
+    LLM_RESPONSE_CACHE        : "1" の場合、チャットステップで未指定時もキャッシュを使用
+    LLM_RESPONSE_CACHE_DIR    : 保存先ディレクトリ（デフォルト: data/llm_cache）
+    LLM_RESPONSE_CACHE_MAX_MB : 合計サイズの上限（MB、デフォルト: 256）
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class ResponseCache:
+    """応答キャッシュ（ディスク保存・サイズ上限付きLRU）"""
+
+    def __init__(self, cache_dir: str = "data/llm_cache", max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # キー → ファイルサイズ（先頭が最も古く使用されたもの）
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._load_index()
+
+    @classmethod
+    def from_env(cls) -> 'ResponseCache':
+        """環境変数から作成"""
+        return cls(
+            cache_dir=os.environ.get("LLM_RESPONSE_CACHE_DIR", "data/llm_cache"),
+            max_bytes=int(float(os.environ.get("LLM_RESPONSE_CACHE_MAX_MB", 256)) * 1024 * 1024),
+        )
+
+    @staticmethod
+    def enabled_by_default() -> bool:
+        """環境変数でキャッシュが既定で有効になっているか"""
+        return os.environ.get("LLM_RESPONSE_CACHE", "").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def is_cacheable(options: Optional[Dict]) -> bool:
+        """応答が決定的になる設定か（temperature=0 または seed 指定）"""
+        options = options or {}
+        return options.get('temperature') == 0 or options.get('seed') is not None
+
+    @staticmethod
+    def make_key(model: str, options: Optional[Dict], messages: List[Dict]) -> str:
+        """モデル・options・メッセージからキャッシュキーを作成"""
+        payload = json.dumps(
+            {"model": model, "options": options or {}, "messages": messages},
+            ensure_ascii=False, sort_keys=True, separators=(',', ':')
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _load_index(self):
+        """既存のキャッシュファイルを最終使用時刻順に読み込む"""
+        if not self.cache_dir.exists():
+            return
+        files = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key: str) -> Optional[Dict]:
+        """キャッシュを取得（ない場合はNone）"""
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)  # 最終使用時刻を更新（再起動後のLRU順序に使用）
+        except (OSError, json.JSONDecodeError):
+            self._discard(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, content: str, model: str, metadata: Optional[Dict] = None):
+        """応答を保存し、上限を超えた分を古い順に削除"""
+        entry = {
+            "content": content,
+            "model": model,
+            "created_at": time.time(),
+            "metadata": metadata or {},
+        }
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        if len(data) > self.max_bytes:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[ResponseCache] Failed to write cache entry: {e}")
+            return
+
+        self._total_bytes -= self._entries.pop(key, 0)
+        self._entries[key] = len(data)
+        self._total_bytes += len(data)
+        self._evict()
+
+    def _discard(self, key: str):
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        """全エントリを削除"""
+        for key in list(self._entries):
+            self._discard(key)
+
+    def get_stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
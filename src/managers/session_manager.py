@@ -4,6 +4,12 @@ from datetime import datetime
 from typing import Optional, List, Dict
 from pathlib import Path
 from ..models.session import Session
+from .session_reaper import SessionReaper
+from .atomic_file import read_json, write_text_atomic
+from .change_sequence import next_change_seq, may_contain_changes_since
+
+# 削除したセッションの記録（1行 = 1件のJSON、セッションファイルの *.json とは別の拡張子）
+DELETIONS_LOG = "deletions.jsonl"
 
 
 class SessionManager:
@@ -14,6 +20,8 @@ class SessionManager:
         self.experiment_manager = experiment_manager
         # ディレクトリは実際に使用する時（data_dirプロパティ）で作成される
         self.current_session: Optional[Session] = None
+        # アクティブなセッションの期限管理（保存のたびに更新、空セッションの終了とアイドル判定に使用）
+        self.reaper = SessionReaper()
     
     def _get_current_session_dir(self) -> Path:
         """現在のアクティブな実験のセッションディレクトリを取得"""
@@ -50,12 +58,10 @@ class SessionManager:
     def load_session(self, session_id: str) -> Optional[Session]:
         """指定されたセッションをロード"""
         session_file = self.data_dir / f"{session_id}.json"
-        if not session_file.exists():
+        try:
+            return Session.from_dict(read_json(session_file))
+        except FileNotFoundError:
             return None
-        
-        with open(session_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return Session.from_dict(data)
     
     def get_session(self, session_id: str) -> Optional[Session]:
         """指定されたセッションを取得（load_sessionのエイリアス）"""
@@ -66,9 +72,7 @@ class SessionManager:
         sessions = []
         for session_file in self.data_dir.glob("*.json"):
             try:
-                with open(session_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    sessions.append(Session.from_dict(data))
+                sessions.append(Session.from_dict(read_json(session_file)))
             except Exception as e:
                 print(f"Error loading session {session_file}: {e}")
         
@@ -76,29 +80,57 @@ class SessionManager:
         sessions.sort(key=lambda s: s.created_at, reverse=True)
         return sessions
     
+    def get_sessions_changed_since(self, since: int) -> List[Session]:
+        """変更シーケンスが since より大きいセッションを取得（差分エクスポート用）
+        
+        更新時刻が since より十分古いファイルは読み込まない。並び順は get_all_sessions と同じ。
+        読み込めないファイルは読み飛ばさず ValueError を送出する（ウォーターマークがそのセッションの変更を
+        越えないよう、エクスポートを失敗させる）。一覧の取得後に削除されたファイルは削除記録で通知される。
+        """
+        sessions = []
+        for session_file in self.data_dir.glob("*.json"):
+            try:
+                if not may_contain_changes_since(session_file.stat().st_mtime_ns, since):
+                    continue
+                session = Session.from_dict(read_json(session_file))
+            except FileNotFoundError:
+                continue
+            except ValueError as e:
+                print(f"[Export] ❌ Cannot read session file {session_file.name}: {e}")
+                raise
+            if session.change_seq > since:
+                sessions.append(session)
+        
+        sessions.sort(key=lambda s: s.created_at, reverse=True)
+        return sessions
+    
     def get_active_sessions(self) -> List[Session]:
         """アクティブなセッションのみを取得"""
         return [s for s in self.get_all_sessions() if s.status == "active"]
     
-    def get_idle_sessions(self, threshold_minutes: int = 30) -> List[Session]:
+    def rebuild_activity_index(self, active_sessions: Optional[List[Session]] = None):
+        """アクティブなセッションを期限管理に登録（起動時に1回だけ使用、省略時は全件を読み込む）"""
+        for session in active_sessions if active_sessions is not None else self.get_active_sessions():
+            self.reaper.track(session)
+    
+    def get_idle_sessions(self, threshold_minutes: Optional[float] = None) -> List[Session]:
         """長時間非アクティブなセッションを取得（情報提供のみ、自動終了はしない）
         
+        期限管理のメモリ上の情報から該当するセッションだけを読み込む。
+        
         Args:
-            threshold_minutes: 非アクティブと判定する閾値（分）
+            threshold_minutes: 非アクティブと判定する閾値（分、省略時は SESSION_IDLE_THRESHOLD_MINUTES）
             
         Returns:
-            閾値以上非アクティブなアクティブセッションのリスト
+            閾値以上非アクティブなアクティブセッションのリスト（最も放置されているものが先頭）
         """
-        active_sessions = self.get_active_sessions()
         idle_sessions = []
-        
-        for session in active_sessions:
-            idle_minutes = session.get_idle_minutes()
-            if idle_minutes >= threshold_minutes:
+        for session_id, _ in self.reaper.get_idle(threshold_minutes):
+            session = self.load_session(session_id)
+            if session and session.status == "active":
                 idle_sessions.append(session)
-        
-        # アイドル時間の降順でソート（最も放置されているものが先頭）
-        idle_sessions.sort(key=lambda s: s.get_idle_seconds(), reverse=True)
+            else:
+                self.reaper.forget(session_id)
         return idle_sessions
     
     def update_session(self, session: Session):
@@ -164,8 +196,10 @@ class SessionManager:
     def _save_session(self, session: Session):
         """セッションをファイルに保存"""
         session_file = self.data_dir / f"{session.session_id}.json"
-        with open(session_file, 'w', encoding='utf-8') as f:
-            f.write(session.to_json())
+        session.change_seq = next_change_seq()
+        # エクスポートが書き込み途中の内容を読まないよう置き換えで保存
+        write_text_atomic(session_file, session.to_json())
+        self.reaper.track(session)
     
     def _calculate_duration(self, session: Session) -> Optional[str]:
         """セッションの継続時間を計算"""
@@ -186,10 +220,49 @@ class SessionManager:
             return None
     
     def delete_session(self, session_id: str) -> bool:
-        """セッションを削除"""
+        """セッションを削除（差分エクスポート用に削除記録を残す）"""
         session_file = self.data_dir / f"{session_id}.json"
+        self.reaper.forget(session_id)
         if session_file.exists():
+            session = self.load_session(session_id)
+            self._record_deletion(session_id, session.experiment_id if session else None)
             os.remove(session_file)
             return True
         return False
+    
+    def _record_deletion(self, session_id: str, experiment_id: Optional[str]):
+        """削除記録（変更シーケンス付き）をセッションディレクトリの削除ログに追記"""
+        record = {
+            "session_id": session_id,
+            "experiment_id": experiment_id,
+            "deleted_at": datetime.now().isoformat(),
+            "change_seq": next_change_seq(),
+        }
+        with open(self.data_dir / DELETIONS_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    
+    def get_deleted_sessions(self, since: int, until: Optional[int] = None,
+                             experiment_id: Optional[str] = None) -> List[Dict]:
+        """since より後（until 以下）に削除されたセッションの削除記録（差分エクスポート用）
+        
+        削除後に同じIDで作り直されたセッションは含めない（作り直したセッションは変更として出力される）。
+        """
+        log_file = self.data_dir / DELETIONS_LOG
+        if not log_file.exists():
+            return []
+        deleted = {}
+        with open(log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    change_seq = int(record["change_seq"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # 書き込み途中の行など
+                if change_seq <= since or (until is not None and change_seq > until):
+                    continue
+                if experiment_id is not None and record.get("experiment_id") != experiment_id:
+                    continue
+                deleted[record.get("session_id")] = record
+        return [record for session_id, record in deleted.items()
+                if not (self.data_dir / f"{session_id}.json").exists()]
 
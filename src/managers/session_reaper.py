@@ -0,0 +1,164 @@
+"""セッションの最終アクティビティに基づく期限管理（空セッションの終了・アイドル判定）
+
+アクティブなセッションを最終アクティビティ時刻と参加者数からメモリ上のヒープに登録し、
+期限を過ぎたセッションだけを処理する。セッションファイルを定期的に全件読み込む必要がない。
+
+- 参加者0のセッション: 最終アクティビティから SESSION_EMPTY_GRACE_SECONDS 経過で終了
+- 参加者ありのセッション: 最終アクティビティから SESSION_IDLE_THRESHOLD_MINUTES 経過でアイドルとして記録
+  （情報提供のみ、自動終了はしない）
+
+セッションが保存されるたびに期限を更新し、古い期限はヒープから取り出した時点で読み捨てる。
+
+設定（環境変数）:
+    SESSION_EMPTY_GRACE_SECONDS    : 空セッションを終了するまでの時間（秒、デフォルト: 30）
+    SESSION_IDLE_THRESHOLD_MINUTES : アイドルと判定する時間（分、デフォルト: 30）
+"""
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+KIND_EMPTY = "empty"
+KIND_IDLE = "idle"
+
+# 期限の確認間隔の上限（秒）。新しい期限が追加されても最大この時間で処理される
+MAX_SLEEP_SECONDS = 5.0
+
+# ヒープの要素数が管理中のセッション数のこの倍を超えたら古い期限を除いて作り直す
+COMPACT_RATIO = 4
+
+
+def _to_epoch(timestamp: Optional[str]) -> float:
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class SessionActivity:
+    """期限管理中の1セッションの状態"""
+    __slots__ = ('session_id', 'last_activity', 'participant_count', 'version', 'idle', 'deadline', 'kind')
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.last_activity = 0.0
+        self.participant_count = 0
+        self.version = 0
+        self.idle = False
+        self.deadline = 0.0
+        self.kind = KIND_EMPTY
+
+
+class SessionReaper:
+    """セッションの期限ヒープと空セッションの終了処理"""
+
+    def __init__(self, empty_grace_seconds: Optional[float] = None,
+                 idle_threshold_minutes: Optional[float] = None):
+        self.empty_grace_seconds = empty_grace_seconds if empty_grace_seconds is not None else float(
+            os.environ.get("SESSION_EMPTY_GRACE_SECONDS", 30))
+        self.idle_threshold_minutes = idle_threshold_minutes if idle_threshold_minutes is not None else float(
+            os.environ.get("SESSION_IDLE_THRESHOLD_MINUTES", 30))
+        self.entries: Dict[str, SessionActivity] = {}
+        self._heap: List[Tuple[float, int, str, str]] = []  # (期限, バージョン, セッションID, 種類)
+        self._task: Optional[asyncio.Task] = None
+        self.reaped = 0
+
+    def track(self, session):
+        """セッションの保存時に期限を更新（アクティブでないセッションは管理対象から外す）"""
+        if session.status != "active":
+            self.forget(session.session_id)
+            return
+        entry = self.entries.get(session.session_id)
+        if entry is None:
+            entry = self.entries[session.session_id] = SessionActivity(session.session_id)
+        last_activity = _to_epoch(session.last_activity)
+        if last_activity != entry.last_activity:
+            entry.idle = False
+        entry.last_activity = last_activity
+        entry.participant_count = len(session.participants)
+        entry.version += 1
+
+        if entry.participant_count == 0:
+            deadline, kind = last_activity + self.empty_grace_seconds, KIND_EMPTY
+        else:
+            deadline, kind = last_activity + self.idle_threshold_minutes * 60, KIND_IDLE
+        entry.deadline, entry.kind = deadline, kind
+        heapq.heappush(self._heap, (deadline, entry.version, session.session_id, kind))
+        if len(self._heap) > COMPACT_RATIO * len(self.entries) + 64:
+            self._compact()
+
+    def _compact(self):
+        """更新で古くなった期限が溜まった場合にヒープを作り直す"""
+        self._heap = [
+            (entry.deadline, entry.version, entry.session_id, entry.kind)
+            for entry in self.entries.values()
+            if not (entry.kind == KIND_IDLE and entry.idle)
+        ]
+        heapq.heapify(self._heap)
+
+    def forget(self, session_id: str):
+        """管理対象から外す（ヒープ内の期限は取り出し時に読み捨てる）"""
+        self.entries.pop(session_id, None)
+
+    def pop_due(self, now: Optional[float] = None) -> List[str]:
+        """期限を過ぎた空セッションのIDを取り出す（アイドルのセッションは印を付けるのみ）"""
+        now = now if now is not None else time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, version, session_id, kind = heapq.heappop(self._heap)
+            entry = self.entries.get(session_id)
+            if entry is None or entry.version != version:
+                continue  # その後に更新された古い期限
+            if kind == KIND_EMPTY:
+                # 終了処理で保存されると管理対象から外れる。失敗しても次の保存で再登録される
+                self.forget(session_id)
+                due.append(session_id)
+            elif not entry.idle:
+                entry.idle = True
+                print(f"[Reaper] 💤 Session idle for {self.idle_threshold_minutes:.0f}+ min: {session_id}")
+        return due
+
+    def next_deadline(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def get_idle(self, threshold_minutes: Optional[float] = None) -> List[Tuple[str, float]]:
+        """閾値以上アクティビティのないセッション（ID, アイドル秒数）をアイドル時間の降順で返す"""
+        threshold = (threshold_minutes if threshold_minutes is not None else self.idle_threshold_minutes) * 60
+        now = time.time()
+        idle = [
+            (entry.session_id, now - entry.last_activity)
+            for entry in self.entries.values()
+            if now - entry.last_activity >= threshold
+        ]
+        idle.sort(key=lambda item: item[1], reverse=True)
+        return idle
+
+    async def run(self, on_empty: Callable[[str], bool]):
+        """期限を過ぎた空セッションを on_empty で終了させ続ける（on_empty は終了した場合True）"""
+        while True:
+            try:
+                for session_id in self.pop_due():
+                    if on_empty(session_id):
+                        self.reaped += 1
+            except Exception as e:
+                print(f"[Reaper] Error during cleanup: {e}")
+            next_deadline = self.next_deadline()
+            delay = MAX_SLEEP_SECONDS if next_deadline is None else next_deadline - time.time()
+            await asyncio.sleep(min(max(delay, 0.1), MAX_SLEEP_SECONDS))
+
+    def start(self, on_empty: Callable[[str], bool]):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(on_empty))
+
+    def get_stats(self) -> Dict:
+        return {
+            "tracked_sessions": len(self.entries),
+            "pending_deadlines": len(self._heap),
+            "idle_sessions": sum(1 for entry in self.entries.values() if entry.idle),
+            "empty_sessions": sum(1 for entry in self.entries.values() if entry.participant_count == 0),
+            "reaped": self.reaped,
+            "empty_grace_seconds": self.empty_grace_seconds,
+            "idle_threshold_minutes": self.idle_threshold_minutes,
+        }
@@ -0,0 +1,267 @@
+"""アンケート回答の条件別集計（NumPy によるベクトル化）
+
+実験の進行中に操作チェックなどを確認できるよう、質問 × 条件ごとの回答数・平均・標準偏差
+（任意で効果量）を、CSVをエクスポートせずに求める。
+
+数値として集計できる回答（リッカート・数値入力・数値の文字列）は、アンケート回答インデックスの行が
+作られるたびに NumericAnswerColumns の配列（質問コード・条件コード・値）の末尾に追記する。
+1セッションの回答は連続した範囲に置き、行が作り直されたら古い範囲を無効にして追記し直す
+（条件の割り当て後に作り直されるため、割り当て前の回答も割り当てられた条件で集計される）。
+無効な値が有効な値より多くなったら配列を詰め直す。
+
+集計は「質問コード × 条件数 + 条件コード」をキーにした np.bincount で全質問・全条件を一度に計算する。
+標準偏差は平均からの偏差の2乗和から求める（2パス、大きな値でも桁落ちしない）。
+
+効果量（effect_sizes=True）:
+- eta_squared: 質問ごとの一元配置の η²（条件間平方和 / 全体平方和）
+- cohens_d: 基準条件との平均の差 / プールした標準偏差
+条件が未割り当ての回答は記述統計のみに含め、効果量には含めない。
+
+使い方:
+    pip install numpy
+"""
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy は任意の依存
+    np = None
+
+# 条件が割り当てられていないセッション（ブランチ前・ブランチのない実験）の回答
+UNASSIGNED_CONDITION = '(unassigned)'
+
+# 配列の初期容量（以降は2倍ずつ拡張）
+INITIAL_CAPACITY = 1024
+
+# 無効な値がこれ未満なら詰め直さない
+COMPACT_MIN_INVALID = 4096
+
+
+def is_available() -> bool:
+    """numpy がインストールされているか"""
+    return np is not None
+
+
+def numeric_answer(answer: Any) -> Optional[float]:
+    """数値として集計できる回答の値（真偽値・配列・数値でない文字列・非有限値は None）"""
+    if answer is None or isinstance(answer, bool):
+        return None
+    if isinstance(answer, (int, float)):
+        value = float(answer)
+    elif isinstance(answer, str):
+        try:
+            value = float(answer.strip())
+        except ValueError:
+            return None
+    else:
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _cell(n: int, mean: float, sd: float) -> Dict[str, Any]:
+    return {
+        "n": n,
+        "mean": None if math.isnan(mean) else mean,
+        "sd": None if math.isnan(sd) else sd,
+    }
+
+
+class NumericAnswerColumns:
+    """1実験分の数値回答の列（質問コード・条件コード・値・有効フラグ）
+
+    呼び出し側（ExperimentSurveyIndex）のロックの中で使う。
+    """
+
+    def __init__(self):
+        self.question_ids: List[str] = []  # 質問コード → question_id
+        self._question_codes: Dict[str, int] = {}
+        self.conditions: List[str] = []  # 条件コード → 条件
+        self._condition_codes: Dict[str, int] = {}
+        self.question = np.empty(INITIAL_CAPACITY, dtype=np.int32)
+        self.condition = np.empty(INITIAL_CAPACITY, dtype=np.int32)
+        self.value = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.valid = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self.size = 0  # 使用中の長さ（無効な値を含む）
+        self.invalid = 0
+        self.ranges: Dict[str, Tuple[int, int]] = {}  # session_id → 回答の範囲 [start, end)
+        self.compactions = 0
+
+    @staticmethod
+    def _code(codes: Dict[str, int], names: List[str], name: str) -> int:
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+
+    def _reserve(self, count: int):
+        needed = self.size + count
+        capacity = len(self.value)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ('question', 'condition', 'value', 'valid'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype) if name == 'valid' else np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def replace_session(self, session_id: str, condition: str, answers: Iterable[Tuple[str, float]]):
+        """セッションの数値回答を置き換える（古い範囲を無効にして末尾に追記）"""
+        self.remove_session(session_id)
+        codes = []
+        values = []
+        for question_id, value in answers:
+            codes.append(self._code(self._question_codes, self.question_ids, question_id))
+            values.append(value)
+        if not values:
+            return
+        self._reserve(len(values))
+        start, end = self.size, self.size + len(values)
+        self.question[start:end] = codes
+        self.condition[start:end] = self._code(self._condition_codes, self.conditions,
+                                               condition or UNASSIGNED_CONDITION)
+        self.value[start:end] = values
+        self.valid[start:end] = True
+        self.size = end
+        self.ranges[session_id] = (start, end)
+
+    def remove_session(self, session_id: str):
+        removed = self.ranges.pop(session_id, None)
+        if removed is None:
+            return
+        start, end = removed
+        self.valid[start:end] = False
+        self.invalid += end - start
+        if self.invalid >= COMPACT_MIN_INVALID and self.invalid * 2 > self.size:
+            self._compact()
+
+    def _compact(self):
+        """無効な値を除いて詰め直す（各セッションの範囲は有効な値の累積数で付け替える）"""
+        valid = self.valid[:self.size]
+        prefix = np.concatenate(([0], np.cumsum(valid)))
+        keep = np.flatnonzero(valid)
+        count = len(keep)
+        for name in ('question', 'condition', 'value'):
+            column = getattr(self, name)
+            column[:count] = column[keep]
+        self.valid[:count] = True
+        self.valid[count:self.size] = False
+        self.ranges = {session_id: (int(prefix[start]), int(prefix[end]))
+                       for session_id, (start, end) in self.ranges.items()}
+        self.size = count
+        self.invalid = 0
+        self.compactions += 1
+
+    def summarize(self, question_ids: Optional[List[str]] = None, effect_sizes: bool = False,
+                  reference: Optional[str] = None) -> Dict[str, Any]:
+        """質問 × 条件ごとの回答数・平均・標準偏差（任意で η² と基準条件に対する Cohen's d）
+
+        基準条件が条件の一覧にない場合は ValueError。
+        """
+        mask = self.valid[:self.size]
+        if question_ids is not None:
+            selected = [self._question_codes[q] for q in question_ids if q in self._question_codes]
+            mask = mask & np.isin(self.question[:self.size], np.asarray(selected, dtype=np.int32))
+        q = self.question[:self.size][mask].astype(np.int64)
+        c = self.condition[:self.size][mask]
+        v = self.value[:self.size][mask]
+
+        nq, nc = len(self.question_ids), len(self.conditions)
+        cells = nq * nc
+        key = q * nc + c
+
+        counts = np.bincount(key, minlength=cells).reshape(nq, nc)
+        sums = np.bincount(key, weights=v, minlength=cells).reshape(nq, nc)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+            deviation = v - means.ravel()[key]
+            squares = np.bincount(key, weights=deviation * deviation, minlength=cells).reshape(nq, nc)
+            sds = np.sqrt(squares / (counts - 1))
+
+            # 質問ごと（全条件）
+            q_counts = counts.sum(axis=1)
+            q_means = sums.sum(axis=1) / q_counts
+            q_deviation = v - q_means[q]
+            q_squares = np.bincount(q, weights=q_deviation * q_deviation, minlength=nq)
+            q_sds = np.sqrt(q_squares / (q_counts - 1))
+        sds[counts < 2] = np.nan
+        q_sds[q_counts < 2] = np.nan
+
+        # 出力する条件（割り当て済みの条件は名前順、未割り当ては最後）
+        order = sorted(range(nc), key=lambda code: (self.conditions[code] == UNASSIGNED_CONDITION,
+                                                    self.conditions[code]))
+        order = [code for code in order if counts[:, code].any()]
+        assigned = [code for code in order if self.conditions[code] != UNASSIGNED_CONDITION]
+
+        result: Dict[str, Any] = {
+            "conditions": [self.conditions[code] for code in order],
+            "total_values": int(len(v)),
+        }
+
+        eta_squared = cohens_d = None
+        if effect_sizes:
+            if reference is not None and reference not in [self.conditions[code] for code in assigned]:
+                raise ValueError(f"Unknown reference condition: {reference}")
+            ref_code = self._condition_codes[reference] if reference is not None else (assigned[0] if assigned else None)
+            result["reference_condition"] = self.conditions[ref_code] if ref_code is not None else None
+            eta_squared, cohens_d = self._effect_sizes(counts, means, squares, assigned, ref_code)
+
+        counts_list, means_list, sds_list = counts.tolist(), means.tolist(), sds.tolist()
+        q_counts_list, q_means_list, q_sds_list = q_counts.tolist(), q_means.tolist(), q_sds.tolist()
+        eta_list = eta_squared.tolist() if eta_squared is not None else None
+        d_list = cohens_d.tolist() if cohens_d is not None else None
+
+        questions = []
+        for code, question_id in enumerate(self.question_ids):
+            if not q_counts_list[code]:
+                continue
+            question = {"question_id": question_id}
+            question.update(_cell(q_counts_list[code], q_means_list[code], q_sds_list[code]))
+            by_condition = {}
+            for condition_code in order:
+                n = counts_list[code][condition_code]
+                if not n:
+                    continue
+                cell = _cell(n, means_list[code][condition_code], sds_list[code][condition_code])
+                if d_list is not None and condition_code in assigned:
+                    d = d_list[code][condition_code]
+                    cell["cohens_d"] = None if math.isnan(d) else d
+                by_condition[self.conditions[condition_code]] = cell
+            question["by_condition"] = by_condition
+            if eta_list is not None:
+                eta = eta_list[code]
+                question["eta_squared"] = None if math.isnan(eta) else eta
+            questions.append(question)
+        result["questions"] = questions
+        return result
+
+    @staticmethod
+    def _effect_sizes(counts, means, squares, assigned: List[int],
+                      ref_code: Optional[int]) -> Tuple[Any, Any]:
+        """η²（質問ごと）と基準条件に対する Cohen's d（質問 × 条件）。割り当て済みの条件のみ"""
+        nq, nc = counts.shape
+        cohens_d = np.full((nq, nc), np.nan)
+        if not assigned:
+            return np.full(nq, np.nan), cohens_d
+        n = counts[:, assigned].astype(np.float64)
+        m = means[:, assigned]
+        ss = squares[:, assigned]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total_n = n.sum(axis=1)
+            grand_mean = np.nansum(np.where(n > 0, m * n, 0.0), axis=1) / total_n
+            between = np.nansum(np.where(n > 0, n * (m - grand_mean[:, None]) ** 2, 0.0), axis=1)
+            within = ss.sum(axis=1)
+            eta_squared = between / (between + within)
+
+            if ref_code is not None:
+                ref_n = counts[:, ref_code][:, None].astype(np.float64)
+                ref_m = means[:, ref_code][:, None]
+                ref_ss = squares[:, ref_code][:, None]
+                pooled = np.sqrt((ss + ref_ss) / (n + ref_n - 2))
+                d = (m - ref_m) / pooled
+                d[(n < 2) | (ref_n < 2)] = np.nan
+                cohens_d[:, assigned] = d
+        return eta_squared, cohens_d
@@ -0,0 +1,345 @@
+"""実験ごとのアンケート回答インデックス
+
+アンケート回答はセッションJSONの step_responses[step_id][client_id]['survey_responses'（ランダマイザーは
+'randomizer_responses'）] と旧形式の survey_responses に入れ子で保存されている。回答の一覧・集計・エクスポートの
+たびに全セッションを読み込んで展開しないよう、実験ごとに
+question_id → (session_id, 条件, 回答, 回答時刻) の索引をメモリ上に持つ。
+
+- 回答の送信（フローの回答の記録・旧形式の /survey）で保存したセッションは、保存直後の Session から行を作り直す
+- フローを通らない変更（管理画面からの変更、セッションの削除、サーバー外でのファイル編集）は、参照時に
+  セッションファイルの状態（更新時刻とサイズ）を確認し、変わっていたファイルだけを読み直す（file_row_cache）
+
+numpy がインストールされている場合は、数値の回答を条件別集計用の列（survey_analytics.NumericAnswerColumns）にも追記する。
+
+インデックスは実験の最初の参照時に全セッションから作成する。行の並びは SessionManager.get_all_sessions と同じ
+（作成日時の降順）ため、インデックスから作成したエクスポートは全セッションから作成した場合と一致する。
+"""
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from ..models.session import Session, SurveyResponse
+from . import survey_analytics
+from .file_row_cache import CachedRow, FileRowCache, file_state
+from .session_manager import SessionManager
+
+# ステップの回答のうちアンケート回答を含むキー（SessionColumns と同じ）
+STEP_SURVEY_KEYS = ('survey_responses', 'randomizer_responses')
+
+
+class SurveyAnswer:
+    """1件の回答（step_id が None の場合は旧形式の survey_responses）"""
+    __slots__ = ('session_id', 'client_id', 'step_id', 'question_id', 'answer', 'answered_at')
+
+    def __init__(self, session_id: str, client_id: str, step_id: Optional[str], question_id: str,
+                 answer: Any, answered_at: Optional[str]):
+        self.session_id = session_id
+        self.client_id = client_id
+        self.step_id = step_id
+        self.question_id = question_id
+        self.answer = answer
+        self.answered_at = answered_at
+
+    @property
+    def source(self) -> str:
+        return 'legacy' if self.step_id is None else 'step'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "client_id": self.client_id,
+            "step_id": self.step_id,
+            "source": self.source,
+            "question_id": self.question_id,
+            "answer": self.answer,
+            "answered_at": self.answered_at,
+        }
+
+
+class SurveySession:
+    """インデックス内の1セッション（条件の情報と展開済みの回答）"""
+    __slots__ = ('session_id', 'experiment_id', 'created_at', 'change_seq', 'participant_code',
+                 'experiment_group', 'condition_id', 'assigned_conditions', 'condition_labels',
+                 'answers', 'legacy_responses')
+
+    def __init__(self, session: Session):
+        self.session_id = session.session_id
+        self.experiment_id = session.experiment_id
+        self.created_at = session.created_at
+        self.change_seq = session.change_seq
+        self.participant_code = session.participant_code
+        self.experiment_group = session.experiment_group
+        self.condition_id = session.condition_id
+        self.assigned_conditions: Dict[str, str] = dict(session.assigned_conditions or {})  # ブランチ → branch_id
+        self.condition_labels: Dict[str, str] = {}  # ブランチ → 条件ラベル
+        self.answers: List[SurveyAnswer] = []
+        # 旧形式の回答（既存のエクスポート・APIと同じ形で出力するため SurveyResponse のまま持つ）
+        self.legacy_responses: Dict[str, List[SurveyResponse]] = {
+            client_id: list(responses) for client_id, responses in (session.survey_responses or {}).items()
+        }
+
+        for step_id, step_data in (session.step_responses or {}).items():
+            if not isinstance(step_data, dict):
+                continue
+            for client_id, client_data in step_data.items():
+                if not isinstance(client_data, dict):
+                    continue
+                if 'condition_label' in client_data:
+                    self.condition_labels.setdefault(step_id, client_data['condition_label'])
+                for key in STEP_SURVEY_KEYS:
+                    responses = client_data.get(key)
+                    if not isinstance(responses, list):
+                        continue
+                    for response in responses:
+                        if isinstance(response, dict) and 'question_id' in response:
+                            self.answers.append(SurveyAnswer(
+                                self.session_id, client_id, step_id, response['question_id'],
+                                response.get('answer'), response.get('answered_at')))
+
+        for client_id, responses in self.legacy_responses.items():
+            for response in responses:
+                self.answers.append(SurveyAnswer(self.session_id, client_id, None, response.question_id,
+                                                 response.answer, response.answered_at))
+
+    @property
+    def condition(self) -> str:
+        """分析用の条件（割り当てられた branch_id、複数のブランチがある場合は '+' で連結）"""
+        if self.assigned_conditions:
+            return '+'.join(str(value) for value in self.assigned_conditions.values())
+        return self.experiment_group or ''
+
+    def matches_condition(self, condition: str) -> bool:
+        """condition が branch_id・条件ラベル・experiment_group・condition_id のいずれかに一致するか"""
+        return (condition == self.condition
+                or condition in self.assigned_conditions.values()
+                or condition in self.condition_labels.values()
+                or condition in (self.experiment_group, self.condition_id))
+
+    def numeric_answers(self) -> List[Tuple[str, float]]:
+        """数値として集計できる回答の (question_id, 値)"""
+        values = []
+        for answer in self.answers:
+            value = survey_analytics.numeric_answer(answer.answer)
+            if value is not None:
+                values.append((answer.question_id, value))
+        return values
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "participant_code": self.participant_code,
+            "experiment_group": self.experiment_group,
+            "condition": self.condition,
+            "assigned_conditions": self.assigned_conditions,
+            "condition_labels": self.condition_labels,
+        }
+
+
+class ExperimentSurveyIndex(FileRowCache):
+    """1実験分の回答インデックス"""
+
+    def __init__(self, experiment_id: str, sessions_dir: Path):
+        super().__init__(sessions_dir)
+        self.experiment_id = experiment_id
+        self.by_question: Dict[str, Dict[str, List[SurveyAnswer]]] = {}  # question_id → session_id → 回答
+        # 数値回答の列（条件別集計用、numpy がない場合は None）
+        self.numeric = survey_analytics.NumericAnswerColumns() if survey_analytics.is_available() else None
+
+    def _created_at(self, entry: SurveySession) -> str:
+        return entry.created_at
+
+    def _row_replaced(self, old: Optional[CachedRow], new: Optional[CachedRow]):
+        """question_id の索引と数値回答の列を更新"""
+        if old is not None and old.value is not None:
+            for answer in old.value.answers:
+                by_session = self.by_question.get(answer.question_id)
+                if by_session is not None:
+                    by_session.pop(old.value.session_id, None)
+                    if not by_session:
+                        del self.by_question[answer.question_id]
+        if new is not None and new.value is not None:
+            for answer in new.value.answers:
+                self.by_question.setdefault(answer.question_id, {}).setdefault(
+                    new.value.session_id, []).append(answer)
+        if self.numeric is not None:
+            if new is not None and new.value is not None:
+                self.numeric.replace_session(new.value.session_id, new.value.condition,
+                                             new.value.numeric_answers())
+            elif old is not None and old.value is not None:
+                self.numeric.remove_session(old.value.session_id)
+
+    def update_session(self, session: Session):
+        """保存直後のセッションの行を作り直す（セッションファイルは読み直さない）"""
+        # 状態は行を作る前に記録する（途中で書き換えられても次の参照で読み直される）
+        state = file_state(self.sessions_dir / f"{session.session_id}.json")
+        entry = SurveySession(session) if session.experiment_id == self.experiment_id else None
+        with self._lock:
+            self._put(session.session_id, entry, state)
+
+    def sessions(self) -> List[SurveySession]:
+        """実験のセッション（作成日時の降順、同時刻はファイルの列挙順）。状態が変わったファイルの行だけ読み直す"""
+        return self._refresh(file_state, lambda stale: {i: self._load(path) for i, (path, _) in enumerate(stale)})
+
+    def _load(self, path: Path) -> Optional[SurveySession]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                session = Session.from_dict(json.load(f))
+        except Exception as e:
+            print(f"Error loading session {path}: {e}")
+            return None
+        if session.experiment_id != self.experiment_id:
+            return None
+        return SurveySession(session)
+
+    def answers_for(self, question_id: str) -> Dict[str, List[SurveyAnswer]]:
+        """question_id の回答（session_id → 回答、sessions() の後に呼ぶ）"""
+        with self._lock:
+            return {session_id: list(answers)
+                    for session_id, answers in self.by_question.get(question_id, {}).items()}
+
+    def summarize_numeric(self, question_ids: Optional[List[str]] = None, effect_sizes: bool = False,
+                          reference: Optional[str] = None) -> Dict[str, Any]:
+        """数値回答の条件別集計（sessions() の後に呼ぶ）"""
+        with self._lock:
+            return self.numeric.summarize(question_ids, effect_sizes, reference)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "experiment_id": self.experiment_id,
+                "sessions": self.row_count(),
+                "questions": len(self.by_question),
+                "numeric_values": self.numeric.size - self.numeric.invalid if self.numeric is not None else None,
+                "updates": self.updates,
+                "refreshes": self.refreshes,
+                "last_refreshed": self.last_refreshed,
+            }
+
+
+class SurveyIndexStore:
+    """実験ごとのアンケート回答インデックス（実験の最初の参照で作成）"""
+
+    def __init__(self):
+        self._indexes: Dict[Tuple[str, str], ExperimentSurveyIndex] = {}
+        self._lock = threading.Lock()
+
+    def _index(self, experiment_id: str, sessions_dir: Path, create: bool = True) -> Optional[ExperimentSurveyIndex]:
+        key = (experiment_id, str(sessions_dir))
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None and create:
+                index = self._indexes[key] = ExperimentSurveyIndex(experiment_id, sessions_dir)
+            return index
+
+    def sessions(self, experiment_id: str, session_manager: SessionManager) -> List[SurveySession]:
+        """実験の全セッション（get_all_sessions と同じ並び順）"""
+        started = time.time()
+        index = self._index(experiment_id, session_manager.data_dir)
+        sessions = index.sessions()
+        if index.last_refreshed:
+            print(f"[Survey] 🗂️  Survey index {experiment_id}: {len(sessions)} sessions "
+                  f"({index.last_refreshed} files reloaded, {time.time() - started:.2f}s)")
+        return sessions
+
+    def query(self, experiment_id: str, session_manager: SessionManager,
+              question_id: Optional[str] = None, step_id: Optional[str] = None,
+              condition: Optional[str] = None,
+              source: Optional[str] = None) -> Iterator[Tuple[SurveySession, SurveyAnswer]]:
+        """条件に合う回答を (セッション, 回答) の組で順に返す（セッションの並び順 → セッション内の回答順）
+
+        Args:
+            question_id: 質問ID
+            step_id: アンケートステップのID（旧形式の回答は含まない）
+            condition: branch_id・条件ラベル・experiment_group・condition_id のいずれか
+            source: 'step'（フローの回答）または 'legacy'（旧形式の survey_responses）
+        """
+        sessions = self.sessions(experiment_id, session_manager)
+        by_session = None
+        if question_id is not None:
+            index = self._index(experiment_id, session_manager.data_dir)
+            by_session = index.answers_for(question_id)
+
+        for entry in sessions:
+            if condition is not None and not entry.matches_condition(condition):
+                continue
+            if by_session is not None:
+                answers = by_session.get(entry.session_id)
+                if not answers:
+                    continue
+            else:
+                answers = entry.answers
+            for answer in answers:
+                if step_id is not None and answer.step_id != step_id:
+                    continue
+                if source is not None and answer.source != source:
+                    continue
+                yield entry, answer
+
+    def summary(self, experiment_id: str, session_manager: SessionManager) -> Dict[str, Any]:
+        """質問・ステップ・条件ごとの回答数"""
+        sessions = self.sessions(experiment_id, session_manager)
+        questions: Dict[str, Dict[str, Any]] = {}
+        steps: Dict[str, int] = {}
+        conditions: Dict[str, int] = {}
+        for entry in sessions:
+            conditions[entry.condition] = conditions.get(entry.condition, 0) + 1
+            for answer in entry.answers:
+                question = questions.get(answer.question_id)
+                if question is None:
+                    question = questions[answer.question_id] = {"responses": 0, "sessions": set(), "steps": []}
+                question["responses"] += 1
+                question["sessions"].add(entry.session_id)
+                step_key = answer.step_id if answer.step_id is not None else 'legacy'
+                if step_key not in question["steps"]:
+                    question["steps"].append(step_key)
+                steps[step_key] = steps.get(step_key, 0) + 1
+        return {
+            "experiment_id": experiment_id,
+            "total_sessions": len(sessions),
+            "questions": {
+                question_id: {"responses": q["responses"], "sessions": len(q["sessions"]), "steps": q["steps"]}
+                for question_id, q in questions.items()
+            },
+            "steps": steps,
+            "conditions": conditions,
+        }
+
+    def analytics(self, experiment_id: str, session_manager: SessionManager,
+                  question_ids: Optional[List[str]] = None, effect_sizes: bool = False,
+                  reference: Optional[str] = None) -> Dict[str, Any]:
+        """質問 × 条件ごとの回答数・平均・標準偏差（numpy が必要、survey_analytics を参照）
+
+        基準条件が不正な場合は ValueError。
+        """
+        if not survey_analytics.is_available():
+            raise RuntimeError("Survey analytics requires numpy")
+        started = time.time()
+        sessions = self.sessions(experiment_id, session_manager)
+        index = self._index(experiment_id, session_manager.data_dir)
+        result = {"experiment_id": experiment_id, "total_sessions": len(sessions)}
+        result.update(index.summarize_numeric(question_ids, effect_sizes, reference))
+        result["elapsed_ms"] = round((time.time() - started) * 1000, 2)
+        return result
+
+    def update_session(self, session: Session, session_manager: SessionManager):
+        """回答を保存したセッションの行を更新
+
+        インデックスがまだない実験では何もしない（最初の参照で全件から作成する）。
+        """
+        if not session.experiment_id:
+            return
+        index = self._index(session.experiment_id, session_manager.data_dir, create=False)
+        if index is None:
+            return
+        try:
+            index.update_session(session)
+        except Exception as e:
+            # 次の参照でファイルの状態から読み直されるため、回答の保存は止めない
+            print(f"[Survey] ⚠️  Failed to update survey index for {session.session_id}: {e}")
+
+    def get_stats(self) -> List[Dict]:
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return [index.get_stats() for index in indexes]
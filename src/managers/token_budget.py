@@ -0,0 +1,303 @@
+"""トークン予算（セッション・実験ごとのトークン使用量の集計と上限の適用）
+
+Ollamaが返すトークン数（prompt_eval_count + eval_count）をセッションごと・実験ごとに集計し、
+チャットステップで設定された上限を超える要求を拒否または低優先度で待機させる。
+長文の貼り付けや想定以上に長い会話で、1人の参加者が推論資源を占有することを防ぐ。
+
+上限（チャットステップで設定、未設定の項目は無制限）:
+    max_tokens_per_turn    : 1ターンあたり（ユーザー入力の概算 + 生成トークン数）
+    max_tokens_per_session : セッション全体（プロンプト + 生成）
+    max_tokens_per_minute  : 直近60秒間（プロンプト + 生成）
+    token_budget_action    : 1分あたりの上限を超えた場合の動作（"queue": 待機（デフォルト）、"reject": 拒否）
+
+1ターン・セッションの上限は生成トークン数（num_predict）も残りの範囲に制限する。
+
+メモリに持つのは、上限が設定された実行中のセッションの使用量と実験ごとの集計のみ。
+セッションの使用量はセッション終了時に破棄し（実験の集計には記録時に加算済み）、
+終了したセッションや上限のないセッションの使用量は保存済みボットメッセージの計測値（MessageMetadata.llm）から求める。
+実験ごとの集計は最初の参照時に experiment_loader で保存済みメッセージから復元する（再起動で0に戻らない）。
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+
+WINDOW_SECONDS = 60.0
+
+# 低優先度の要求が他のセッションの生成に譲る最大時間（秒）
+LOW_PRIORITY_MAX_YIELD_SECONDS = 30.0
+
+# 参加者に表示するメッセージ
+REJECTION_MESSAGES = {
+    "turn": "（メッセージが長すぎるため応答できません。短くして再度送信してください）",
+    "session": "（このチャットで利用できる応答の上限に達しました）",
+    "minute": "（短時間に多くのメッセージが送信されたため応答できません。少し待ってから再度送信してください）",
+}
+
+
+class TokenBudgetExceeded(Exception):
+    """トークン予算を超えたため応答しない場合の例外"""
+
+    def __init__(self, scope: str, used: int, limit: int):
+        super().__init__(f"Token budget exceeded ({scope}: {used}/{limit})")
+        self.scope = scope
+        self.used = used
+        self.limit = limit
+
+    @property
+    def user_message(self) -> str:
+        return REJECTION_MESSAGES[self.scope]
+
+
+class TokenBudget:
+    """チャットステップで設定されたトークン上限"""
+    __slots__ = ('max_tokens_per_turn', 'max_tokens_per_session', 'max_tokens_per_minute', 'action')
+
+    def __init__(self, max_tokens_per_turn: Optional[int] = None,
+                 max_tokens_per_session: Optional[int] = None,
+                 max_tokens_per_minute: Optional[int] = None,
+                 action: Optional[str] = None):
+        self.max_tokens_per_turn = max_tokens_per_turn or None
+        self.max_tokens_per_session = max_tokens_per_session or None
+        self.max_tokens_per_minute = max_tokens_per_minute or None
+        self.action = action if action in ("queue", "reject") else "queue"
+
+    @property
+    def is_unlimited(self) -> bool:
+        return not (self.max_tokens_per_turn or self.max_tokens_per_session or self.max_tokens_per_minute)
+
+    def to_dict(self) -> Dict:
+        return {
+            "max_tokens_per_turn": self.max_tokens_per_turn,
+            "max_tokens_per_session": self.max_tokens_per_session,
+            "max_tokens_per_minute": self.max_tokens_per_minute,
+            "action": self.action,
+        }
+
+
+class TokenUsage:
+    """トークン使用量の集計（セッション単位・実験単位で共通）"""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self.rejected: Dict[str, int] = {}  # 上限の種類ごとの拒否件数
+        self.queued = 0
+        self.queued_wait_ms = 0.0
+        self._window = deque()  # (時刻, トークン数)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens: int, completion_tokens: int, now: Optional[float] = None):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.calls += 1
+        self._window.append((now if now is not None else time.monotonic(), prompt_tokens + completion_tokens))
+
+    def add_stored(self, prompt_tokens: int, completion_tokens: int, calls: int):
+        """保存済みメッセージの使用量を加算（直近60秒間の集計には含めない）"""
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.calls += calls
+
+    def minute_tokens(self, now: Optional[float] = None) -> int:
+        """直近60秒間のトークン数"""
+        now = now if now is not None else time.monotonic()
+        while self._window and now - self._window[0][0] > WINDOW_SECONDS:
+            self._window.popleft()
+        return sum(tokens for _, tokens in self._window)
+
+    def seconds_until_below(self, limit: int, now: Optional[float] = None) -> float:
+        """直近60秒間のトークン数が上限を下回るまでの秒数"""
+        now = now if now is not None else time.monotonic()
+        total = self.minute_tokens(now)
+        if total < limit:
+            return 0.0
+        for timestamp, tokens in self._window:
+            total -= tokens
+            if total < limit:
+                return max(WINDOW_SECONDS - (now - timestamp), 0.0)
+        return 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "calls": self.calls,
+            "tokens_last_minute": self.minute_tokens(),
+            "rejected": dict(self.rejected),
+            "queued": self.queued,
+            "queued_wait_ms": round(self.queued_wait_ms, 1),
+        }
+
+
+class TokenBudgetManager:
+    """セッション・実験ごとのトークン使用量と予算の管理"""
+
+    def __init__(self, experiment_loader: Optional[Callable[[str], Tuple[int, int, int]]] = None):
+        """
+        Args:
+            experiment_loader: 実験ID → 保存済みメッセージの (prompt_tokens, completion_tokens, calls)。
+                実験の集計を最初に参照したときに呼び、再起動前の使用量を復元する
+        """
+        self.budgets: Dict[str, TokenBudget] = {}  # セッションID → 上限
+        self.session_usage: Dict[str, TokenUsage] = {}  # 上限が設定された実行中のセッションのみ
+        self.session_experiment: Dict[str, str] = {}
+        self.experiment_usage: Dict[str, TokenUsage] = {}
+        self.experiment_loader = experiment_loader
+
+    def set_budget(self, session_id: str, budget: Optional[TokenBudget], experiment_id: Optional[str] = None):
+        if budget is None or budget.is_unlimited:
+            self.release_session(session_id)
+            return
+        self.budgets[session_id] = budget
+        if experiment_id:
+            self.session_experiment[session_id] = experiment_id
+
+    def get_budget(self, session_id: str) -> Optional[TokenBudget]:
+        return self.budgets.get(session_id)
+
+    def has_usage(self, session_id: str) -> bool:
+        return session_id in self.session_usage
+
+    def _usage(self, session_id: str, experiment_id: Optional[str]) -> TokenUsage:
+        if experiment_id:
+            self.session_experiment[session_id] = experiment_id
+        return self.session_usage.setdefault(session_id, TokenUsage())
+
+    def _experiment_usage(self, experiment_id: Optional[str]) -> Optional[TokenUsage]:
+        """実験の集計（最初の参照時に保存済みメッセージから復元）"""
+        if not experiment_id:
+            return None
+        usage = self.experiment_usage.get(experiment_id)
+        if usage is None:
+            usage = self.experiment_usage[experiment_id] = TokenUsage()
+            if self.experiment_loader is not None:
+                try:
+                    prompt_tokens, completion_tokens, calls = self.experiment_loader(experiment_id)
+                except Exception as e:
+                    print(f"[TokenBudget] Failed to restore token usage for experiment {experiment_id}: {e}")
+                else:
+                    usage.add_stored(prompt_tokens, completion_tokens, calls)
+        return usage
+
+    def record(self, session_id: str, experiment_id: Optional[str],
+               prompt_tokens: int, completion_tokens: int):
+        """Ollamaが返したトークン数を記録（ボットメッセージの保存前に呼ぶ）"""
+        if not prompt_tokens and not completion_tokens:
+            return
+        experiment_id = experiment_id or self.session_experiment.get(session_id)
+        # 実験の集計を先に作成する（復元時に読む保存済みメッセージには今回の呼び出しがまだ含まれない）
+        experiment = self._experiment_usage(experiment_id)
+        if experiment is not None:
+            experiment.add(prompt_tokens, completion_tokens)
+        if session_id in self.budgets:
+            self._usage(session_id, experiment_id).add(prompt_tokens, completion_tokens)
+
+    def restore(self, session_id: str, experiment_id: Optional[str],
+                prompt_tokens: int, completion_tokens: int, calls: int):
+        """保存済みメッセージから再起動前のセッションの使用量を復元（実験の集計は experiment_loader で復元する）"""
+        self._usage(session_id, experiment_id).add_stored(prompt_tokens, completion_tokens, calls)
+
+    def _reject(self, session_id: str, scope: str, used: int, limit: int):
+        for usage in (self.session_usage.get(session_id),
+                      self._experiment_usage(self.session_experiment.get(session_id))):
+            if usage is not None:
+                usage.rejected[scope] = usage.rejected.get(scope, 0) + 1
+        print(f"[TokenBudget] ⛔ Rejected turn for session {session_id[:12]}... ({scope}: {used}/{limit} tokens)")
+        raise TokenBudgetExceeded(scope, used, limit)
+
+    async def admit(self, session_id: str, input_tokens: int,
+                    others_busy: Optional[Callable[[], bool]] = None) -> Optional[int]:
+        """ターンを開始してよいか判定（上限超過時は TokenBudgetExceeded、1分あたりの上限では待機）
+
+        Args:
+            session_id: セッションID
+            input_tokens: 今回のユーザー入力のトークン数（概算）
+            others_busy: 他のセッションが生成中かどうか（低優先度で待機中は生成中のセッションに譲る）
+
+        Returns:
+            生成トークン数の上限（num_predictに適用、制限がない場合はNone）
+        """
+        budget = self.budgets.get(session_id)
+        if budget is None:
+            return None
+        usage = self._usage(session_id, None)
+
+        if budget.max_tokens_per_turn and input_tokens >= budget.max_tokens_per_turn:
+            self._reject(session_id, "turn", input_tokens, budget.max_tokens_per_turn)
+        if budget.max_tokens_per_session and usage.total_tokens >= budget.max_tokens_per_session:
+            self._reject(session_id, "session", usage.total_tokens, budget.max_tokens_per_session)
+
+        limit = budget.max_tokens_per_minute
+        if limit and usage.minute_tokens() >= limit:
+            if budget.action == "reject":
+                self._reject(session_id, "minute", usage.minute_tokens(), limit)
+            await self._wait_low_priority(session_id, usage, limit, others_busy)
+
+        caps = []
+        if budget.max_tokens_per_turn:
+            caps.append(budget.max_tokens_per_turn - input_tokens)
+        if budget.max_tokens_per_session:
+            caps.append(budget.max_tokens_per_session - usage.total_tokens)
+        return max(min(caps), 1) if caps else None
+
+    async def _wait_low_priority(self, session_id: str, usage: TokenUsage, limit: int,
+                                 others_busy: Optional[Callable[[], bool]]):
+        """1分あたりの上限を下回るまで待機し、その後も他のセッションの生成中は譲る"""
+        started = time.monotonic()
+        wait = usage.seconds_until_below(limit)
+        print(f"[TokenBudget] ⏳ Queued turn for session {session_id[:12]}... "
+              f"({usage.minute_tokens()}/{limit} tokens in the last minute, ~{wait:.0f}s)")
+        experiment = self._experiment_usage(self.session_experiment.get(session_id))
+        for counter in (usage, experiment):
+            if counter is not None:
+                counter.queued += 1
+        while usage.minute_tokens() >= limit:
+            await asyncio.sleep(max(min(usage.seconds_until_below(limit), 1.0), 0.05))
+        yield_deadline = time.monotonic() + LOW_PRIORITY_MAX_YIELD_SECONDS
+        while others_busy and others_busy() and time.monotonic() < yield_deadline:
+            await asyncio.sleep(0.25)
+        waited_ms = (time.monotonic() - started) * 1000
+        for counter in (usage, experiment):
+            if counter is not None:
+                counter.queued_wait_ms += waited_ms
+
+    def release_session(self, session_id: str):
+        """セッション終了時に上限設定と使用量を破棄（実験の集計には記録時に加算済み）"""
+        self.budgets.pop(session_id, None)
+        self.session_usage.pop(session_id, None)
+        self.session_experiment.pop(session_id, None)
+
+    def get_experiment_usage(self, experiment_id: str,
+                             stored_sessions: Optional[Dict[str, TokenUsage]] = None) -> Dict:
+        """実験のトークン使用量（全体とセッションごと）
+
+        Args:
+            stored_sessions: メモリにないセッション（終了済み・上限なし）の保存済みメッセージから求めた使用量
+        """
+        usage = self._experiment_usage(experiment_id) or TokenUsage()
+        sessions = []
+        for session_id, session_experiment in self.session_experiment.items():
+            if session_experiment != experiment_id:
+                continue
+            budget = self.budgets.get(session_id)
+            sessions.append({
+                "session_id": session_id,
+                **(self.session_usage.get(session_id) or TokenUsage()).to_dict(),
+                "budget": budget.to_dict() if budget else None,
+            })
+        live = {row["session_id"] for row in sessions}
+        for session_id, stored in (stored_sessions or {}).items():
+            if session_id not in live and stored.calls:
+                sessions.append({"session_id": session_id, **stored.to_dict(), "budget": None})
+        sessions.sort(key=lambda s: s["total_tokens"], reverse=True)
+        return {
+            "experiment_id": experiment_id,
+            "summary": usage.to_dict(),
+            "sessions": sessions,
+        }
@@ -1,5 +1,5 @@
 from .session import Session, SessionMetadata
-from .message import Message, MessageMetadata
+from .message import Message, MessageMetadata, LLMCallMetadata
 
-__all__ = ["Session", "SessionMetadata", "Message", "MessageMetadata"]
+__all__ = ["Session", "SessionMetadata", "Message", "MessageMetadata", "LLMCallMetadata"]
 
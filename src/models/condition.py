@@ -75,6 +75,14 @@ class ExperimentStep(BaseModel):
     num_ctx: Optional[int] = None  # コンテキスト長（Noneでデフォルト: 8192）
     num_gpu: Optional[int] = None  # GPUレイヤー数（Noneでデフォルト: -1、全レイヤー）
     num_batch: Optional[int] = None  # バッチサイズ（Noneでデフォルト: 512）
+    coalesce_window_ms: Optional[int] = None  # 連続メッセージを1ターンにまとめる待ち時間（ミリ秒、Noneでデフォルト: 800）
+    supersede_inflight: Optional[bool] = None  # 生成中に新しいメッセージが来たら生成をやり直す（Noneでデフォルト: True）
+    seed: Optional[int] = None  # 乱数シード（固定すると応答が再現可能になる）
+    response_cache: Optional[bool] = None  # 決定的な応答（temperature=0 / seed固定）をキャッシュから返す
+    max_tokens_per_turn: Optional[int] = None  # 1ターンあたりのトークン上限（入力 + 生成、Noneで無制限）
+    max_tokens_per_session: Optional[int] = None  # セッション全体のトークン上限（Noneで無制限）
+    max_tokens_per_minute: Optional[int] = None  # 直近1分間のトークン上限（Noneで無制限）
+    token_budget_action: Optional[str] = None  # 1分あたりの上限超過時: "queue"（待機、デフォルト）/ "reject"（拒否）
     
     # AI評価用
     evaluation_model: Optional[str] = None  # AI評価用のモデル名
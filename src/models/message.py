@@ -5,6 +5,28 @@ import json
 import uuid
 
 
+class LLMCallMetadata(BaseModel):
+    """ボット応答1回分のLLM呼び出し計測値（時間はミリ秒）"""
+    model_config = ConfigDict(extra='ignore', protected_namespaces=())
+    
+    model: Optional[str] = None
+    prompt_tokens: Optional[int] = None  # prompt_eval_count
+    completion_tokens: Optional[int] = None  # eval_count
+    prompt_eval_ms: Optional[float] = None
+    eval_ms: Optional[float] = None
+    load_ms: Optional[float] = None
+    total_ms: Optional[float] = None  # Ollama側の総処理時間
+    queue_wait_ms: Optional[float] = None  # 呼び出しから処理開始までの待ち時間（推定）
+    ttft_ms: Optional[float] = None  # 最初のトークンまでの時間
+    wall_ms: Optional[float] = None  # 呼び出し全体の経過時間
+    tokens_per_second: Optional[float] = None
+    done_reason: Optional[str] = None
+    prompt_tokens_estimated: Optional[int] = None  # プロンプト全体のトークン数（概算）
+    prompt_tokens_reused: Optional[int] = None  # Ollamaのプレフィックスキャッシュで評価を省略できたトークン数（前回の呼び出しがない場合はNone）
+    prefix_hash: Optional[str] = None  # 固定プレフィックス（システムプロンプト）の識別子
+    cache_hit: bool = False  # 応答キャッシュから返した場合True（Ollamaは呼ばれていない）
+
+
 class MessageMetadata(BaseModel):
     """メッセージのメタデータ"""
     model_config = ConfigDict(extra='ignore')
@@ -12,6 +34,7 @@ class MessageMetadata(BaseModel):
     char_count: int = 0
     word_count: int = 0
     client_color: Optional[str] = None
+    llm: Optional[LLMCallMetadata] = None  # ボットメッセージのLLM計測値
 
 
 class Message(BaseModel):
@@ -26,6 +49,7 @@ class Message(BaseModel):
     content: str
     timestamp: str = Field(default_factory=lambda: datetime.now().isoformat())
     metadata: MessageMetadata = Field(default_factory=MessageMetadata)
+    change_seq: int = 0  # 保存時の変更シーケンス（差分エクスポート用、0は導入前のメッセージ）
     
     def __init__(self, **data):
         super().__init__(**data)
@@ -63,6 +63,9 @@ class Session(BaseModel):
     completed_participants: List[str] = Field(default_factory=list)  # 実験を完了した参加者のclient_id一覧
     assigned_conditions: Dict[str, str] = Field(default_factory=dict)  # ブランチポイント -> 割り当てられた条件ラベル
     
+    # 差分エクスポート
+    change_seq: int = 0  # 最終保存時の変更シーケンス（0は導入前のセッション）
+    
     def add_participant(self, client_id: str):
         """参加者を追加"""
         if client_id not in self.participants:
@@ -155,7 +158,15 @@ class Session(BaseModel):
             self.update_activity()
     
     def add_step_response(self, step_id: str, client_id: str, response_data: Any):
-        """ステップの回答を保存"""
+        """ステップの回答を保存（アンケートの各回答に回答時刻がなければ記録する）"""
+        if isinstance(response_data, dict):
+            answered_at = datetime.now().isoformat()
+            for key in ('survey_responses', 'randomizer_responses'):
+                responses = response_data.get(key)
+                if isinstance(responses, list):
+                    for response in responses:
+                        if isinstance(response, dict) and 'question_id' in response:
+                            response.setdefault('answered_at', answered_at)
         if step_id not in self.step_responses:
             self.step_responses[step_id] = {}
         self.step_responses[step_id][client_id] = response_data
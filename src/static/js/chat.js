@@ -184,6 +184,11 @@ async function connect() {
                 alert('Session has been ended. Please login again.');
                 window.location.href = '/';
             }, 3000);
+        } else if (data.type === 'time_warning' || data.type === 'time_up') {
+            // サーバーのステップタイマーからの通知
+            if (typeof experimentFlow !== 'undefined' && experimentFlow) {
+                experimentFlow.handleTimerFrame(data);
+            }
         } else if (data.type === 'bot') {
             // ボットメッセージの処理
             hideAILoadingSpinner();
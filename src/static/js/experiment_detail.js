@@ -18,6 +18,7 @@ document.addEventListener('DOMContentLoaded', function() {
     loadParticipantCodes();
     loadSessions();
     loadAvailableModels();
+    loadTokenUsage();
 });
 
 // ========== Experiment Status & Action Buttons ==========
@@ -630,6 +631,79 @@ window.closeSessionStatusModal = closeSessionStatusModal;
 window.submitSessionStatusChange = submitSessionStatusChange;
 
 
+// ========== Token Usage ==========
+
+async function loadTokenUsage() {
+    const container = document.getElementById('tokenUsageDisplay');
+    if (!container) return;
+    try {
+        const response = await fetch(`/api/experiments/${experimentId}/token_usage`, { credentials: 'include' });
+        if (!response.ok) throw new Error('Failed to load token usage');
+        const data = await response.json();
+        const summary = data.summary;
+        const sessions = data.sessions || [];
+        const rejected = Object.values(summary.rejected || {}).reduce((a, b) => a + b, 0);
+        
+        const card = (value, label, bg, color) => `
+            <div style="flex: 1; min-width: 110px; padding: 8px; background: ${bg}; border-radius: 6px; text-align: center;">
+                <div style="font-size: 18px; font-weight: 600; color: ${color};">${value}</div>
+                <div style="font-size: 10px; color: ${color};">${label}</div>
+            </div>`;
+        
+        let html = `
+            <div style="display: flex; gap: 8px; margin-bottom: 15px; flex-wrap: wrap;">
+                ${card(summary.total_tokens.toLocaleString(), 'Total Tokens', '#cce5ff', '#004085')}
+                ${card(summary.prompt_tokens.toLocaleString(), 'Prompt', '#e2e3e5', '#383d41')}
+                ${card(summary.completion_tokens.toLocaleString(), 'Completion', '#e2e3e5', '#383d41')}
+                ${card(summary.tokens_last_minute.toLocaleString(), 'Last Minute', '#d4edda', '#155724')}
+                ${card(summary.queued, 'Queued', '#fff3cd', '#856404')}
+                ${card(rejected, 'Rejected', '#f8d7da', '#721c24')}
+            </div>
+            <div style="font-size: 11px; color: #999; margin-bottom: 10px;">Counted by Ollama since server start (restored from saved messages for sessions with a token budget)</div>
+        `;
+        
+        if (sessions.length > 0) {
+            html += `
+                <table style="width: 100%; border-collapse: collapse;">
+                    <thead>
+                        <tr style="background: #f5f5f5; border-bottom: 2px solid #ddd;">
+                            <th style="padding: 8px; text-align: left;">Session ID</th>
+                            <th style="padding: 8px; text-align: right;">Calls</th>
+                            <th style="padding: 8px; text-align: right;">Total Tokens</th>
+                            <th style="padding: 8px; text-align: right;">Last Minute</th>
+                            <th style="padding: 8px; text-align: right;">Session Budget</th>
+                            <th style="padding: 8px; text-align: center;">Queued / Rejected</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        ${sessions.map(s => {
+                            const limit = s.budget && s.budget.max_tokens_per_session;
+                            const percent = limit ? Math.min(100, Math.round(s.total_tokens / limit * 100)) : null;
+                            const sessionRejected = Object.values(s.rejected || {}).reduce((a, b) => a + b, 0);
+                            return `
+                                <tr style="border-bottom: 1px solid #eee;">
+                                    <td style="padding: 8px; font-family: monospace; font-size: 12px;">${escapeHtml(s.session_id)}</td>
+                                    <td style="padding: 8px; text-align: right;">${s.calls}</td>
+                                    <td style="padding: 8px; text-align: right;">${s.total_tokens.toLocaleString()}</td>
+                                    <td style="padding: 8px; text-align: right;">${s.tokens_last_minute.toLocaleString()}</td>
+                                    <td style="padding: 8px; text-align: right;">${limit ? `${percent}% of ${limit.toLocaleString()}` : '-'}</td>
+                                    <td style="padding: 8px; text-align: center;">${s.queued} / ${sessionRejected}</td>
+                                </tr>
+                            `;
+                        }).join('')}
+                    </tbody>
+                </table>
+            `;
+        } else {
+            html += '<p style="color: #999; text-align: center; padding: 10px;">No LLM calls recorded yet</p>';
+        }
+        container.innerHTML = html;
+    } catch (error) {
+        console.error('Failed to load token usage:', error);
+        container.innerHTML = '<p style="color: #e74c3c; text-align: center; padding: 20px;">Failed to load token usage</p>';
+    }
+}
+
 function toggleSessions() {
     const list = document.getElementById('sessionsList');
     const toggle = document.getElementById('sessions-toggle');
@@ -1860,6 +1934,8 @@ async function exportWideFormat() {
     // 選択された形式を取得
     const formatSelect = document.getElementById('exportFormatSelect');
     const isExcelFormat = formatSelect ? formatSelect.value === 'excel' : false;
+    // Parquet / Feather は列指向形式（型付き、サーバーに pyarrow が必要）
+    const columnarFormat = formatSelect && ['parquet', 'feather'].includes(formatSelect.value) ? formatSelect.value : null;
     
     // 欠損値の表現方法を取得
     const missingSelect = document.getElementById('missingValueSelect');
@@ -1869,13 +1945,15 @@ async function exportWideFormat() {
     const codebookCheckbox = document.getElementById('includeCodebook');
     const includeCodebook = codebookCheckbox ? codebookCheckbox.checked : false;
     
-    const formatLabel = isExcelFormat ? 'Excel' : 'UTF-8';
+    const formatLabel = columnarFormat || (isExcelFormat ? 'Excel' : 'UTF-8');
     const codebookLabel = includeCodebook ? ' + Codebook' : '';
     console.log(`[Export] Exporting wide format (${formatLabel}, missing=${missingValue}${codebookLabel})...`);
     
     try {
         // クエリパラメータでexcel_format, missing_value, include_codebookを指定
-        const url = `/api/experiments/${experimentId}/export/wide?excel_format=${isExcelFormat}&missing_value=${missingValue}&include_codebook=${includeCodebook}`;
+        const url = columnarFormat
+            ? `/api/experiments/${experimentId}/export/columnar?dataset=wide&format=${columnarFormat}`
+            : `/api/experiments/${experimentId}/export/wide?excel_format=${isExcelFormat}&missing_value=${missingValue}&include_codebook=${includeCodebook}`;
         const response = await fetch(url, {
             method: 'POST',
             credentials: 'include'  // cookieを送信
@@ -1922,6 +2000,146 @@ async function exportWideFormat() {
     }
 }
 
+// ==================== Export Full Bundle ====================
+// 実験フロー・参加者コード・セッション・メッセージ・ワイド形式・コードブックを1つのZIPでダウンロード
+async function exportBundle() {
+    const formatSelect = document.getElementById('exportFormatSelect');
+    const isExcelFormat = formatSelect ? formatSelect.value === 'excel' : false;
+    const missingSelect = document.getElementById('missingValueSelect');
+    const missingValue = missingSelect ? missingSelect.value : 'blank';
+    
+    console.log(`[Export] Exporting full bundle (missing=${missingValue})...`);
+    
+    try {
+        const response = await fetch(`/api/experiments/${experimentId}/export/bundle?excel_format=${isExcelFormat}&missing_value=${missingValue}`, {
+            method: 'POST',
+            credentials: 'include'
+        });
+        
+        if (response.status === 401) {
+            alert('Session expired. Please login again.');
+            window.location.href = '/admin/login';
+            return;
+        }
+        
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || 'Export failed');
+        }
+        
+        const blob = await response.blob();
+        const blobUrl = window.URL.createObjectURL(blob);
+        const a = document.createElement('a');
+        a.href = blobUrl;
+        
+        const contentDisposition = response.headers.get('Content-Disposition');
+        let filename = `bundle_${experimentId}.zip`;
+        if (contentDisposition) {
+            const filenameMatch = contentDisposition.match(/filename=(.+)/);
+            if (filenameMatch && filenameMatch[1]) {
+                filename = filenameMatch[1];
+            }
+        }
+        
+        a.download = filename;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        window.URL.revokeObjectURL(blobUrl);
+        
+        console.log('[Export] Bundle downloaded:', filename);
+        
+    } catch (error) {
+        console.error('[Export] Error exporting bundle:', error);
+        alert(`Failed to export bundle: ${error.message}`);
+    }
+}
+
+// ==================== Background Export Jobs ====================
+// 画面で選択した形式のエクスポートをサーバー側のジョブとして作成し、完了後にダウンロードリンクを表示する
+function getExportJobParams() {
+    const formatSelect = document.getElementById('exportFormatSelect');
+    const format = formatSelect ? formatSelect.value : 'standard';
+    const missingSelect = document.getElementById('missingValueSelect');
+    const missingValue = missingSelect ? missingSelect.value : 'blank';
+    const codebookCheckbox = document.getElementById('includeCodebook');
+    const includeCodebook = codebookCheckbox ? codebookCheckbox.checked : false;
+    
+    if (['parquet', 'feather'].includes(format)) {
+        return new URLSearchParams({ kind: 'columnar', dataset: 'wide', format: format });
+    }
+    return new URLSearchParams({
+        kind: includeCodebook ? 'codebook' : 'wide',
+        excel_format: format === 'excel',
+        missing_value: missingValue
+    });
+}
+
+function renderExportJob(job) {
+    const statusDiv = document.getElementById('exportJobStatus');
+    if (!statusDiv) return;
+    statusDiv.style.display = 'block';
+    
+    const progress = job.progress || {};
+    const sizeMb = ((progress.bytes_written || 0) / (1024 * 1024)).toFixed(1);
+    if (job.status === 'completed') {
+        const cached = job.cache_hit ? ' (cached, data unchanged)' : '';
+        statusDiv.innerHTML = `✅ Export ready${cached}: <a href="${job.download_url}">${escapeHtml(job.filename)}</a> (${sizeMb} MB)`;
+    } else if (job.status === 'failed') {
+        statusDiv.innerHTML = `❌ Export failed: ${escapeHtml(job.error || 'unknown error')}`;
+    } else if (job.status === 'queued') {
+        statusDiv.textContent = '⏳ Export queued...';
+    } else {
+        const percent = progress.percent !== null && progress.percent !== undefined ? ` ${progress.percent}%` : '';
+        statusDiv.textContent = `⏳ Exporting${percent} — ${progress.rows_written || 0} rows, ${sizeMb} MB written`;
+    }
+}
+
+async function startExportJob() {
+    try {
+        const response = await fetch(`/api/experiments/${experimentId}/export_jobs?${getExportJobParams()}`, {
+            method: 'POST',
+            credentials: 'include'
+        });
+        
+        if (response.status === 401) {
+            alert('Session expired. Please login again.');
+            window.location.href = '/admin/login';
+            return;
+        }
+        
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.detail || 'Failed to start export');
+        }
+        
+        console.log('[Export] Export job started:', job.job_id, job.status);
+        renderExportJob(job);
+        if (job.status !== 'completed') {
+            pollExportJob(job.job_id);
+        }
+    } catch (error) {
+        console.error('[Export] Error starting export job:', error);
+        alert(`Failed to start export: ${error.message}`);
+    }
+}
+
+async function pollExportJob(jobId) {
+    try {
+        const response = await fetch(`/api/export_jobs/${jobId}`, { credentials: 'include' });
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const job = await response.json();
+        renderExportJob(job);
+        if (job.status === 'queued' || job.status === 'running') {
+            setTimeout(() => pollExportJob(jobId), 1000);
+        }
+    } catch (error) {
+        console.error('[Export] Error polling export job:', error);
+    }
+}
+
 // Export functions to global scope for onclick handlers
 window.addStep = addStep;
 window.addStepAt = addStepAt;
@@ -1941,6 +2159,8 @@ window.openFlowModal = openFlowModal;
 window.closeFlowModal = closeFlowModal;
 window.saveFlow = saveFlow;
 window.exportWideFormat = exportWideFormat;
+window.exportBundle = exportBundle;
+window.startExportJob = startExportJob;
 
 console.log('✅ experiment_detail.js loaded (2024-12-03 - Status Management & Admin History)');
 
@@ -233,8 +233,8 @@ function generateStepEditForm(step) {
                 </div>
                 <div class="form-group">
                     <label>CPU Threads (num_thread)</label>
-                    <input type="number" id="edit_num_thread" class="form-control" value="${step.num_thread || ''}" placeholder="Default: 8 (M4 optimized)" min="1" max="16" step="1">
-                    <div class="form-hint">Number of CPU threads (default: 8 for M4, leave empty for auto)</div>
+                    <input type="number" id="edit_num_thread" class="form-control" value="${step.num_thread || ''}" placeholder="Auto (from CPU cores and concurrency limit)" min="1" max="256" step="1">
+                    <div class="form-hint">Number of CPU threads (leave empty to derive from detected cores and the experiment's concurrent session limit)</div>
                 </div>
                 <div class="form-group">
                     <label>Context Length (num_ctx)</label>
@@ -243,14 +243,54 @@ function generateStepEditForm(step) {
                 </div>
                 <div class="form-group">
                     <label>GPU Layers (num_gpu)</label>
-                    <input type="number" id="edit_num_gpu" class="form-control" value="${step.num_gpu !== undefined ? step.num_gpu : ''}" placeholder="Default: -1 (all layers)" min="-1" max="100" step="1">
-                    <div class="form-hint">Number of GPU layers (-1 = all, default: -1 for M4 Neural Engine, leave empty for auto)</div>
+                    <input type="number" id="edit_num_gpu" class="form-control" value="${step.num_gpu !== undefined ? step.num_gpu : ''}" placeholder="Auto (detected hardware)" min="-1" max="100" step="1">
+                    <div class="form-hint">Number of GPU layers (-1 = all, 0 = CPU only, leave empty for auto: all on Apple Silicon, 0 without a GPU)</div>
                 </div>
                 <div class="form-group">
                     <label>Batch Size (num_batch)</label>
                     <input type="number" id="edit_num_batch" class="form-control" value="${step.num_batch || ''}" placeholder="Default: 512" min="1" max="2048" step="32">
                     <div class="form-hint">Batch processing size (default: 512, leave empty for auto)</div>
                 </div>
+                <div class="form-group">
+                    <label>Message Coalescing Window (ms)</label>
+                    <input type="number" id="edit_coalesce_window_ms" class="form-control" value="${step.coalesce_window_ms ?? ''}" placeholder="Default: 800" min="0" max="10000" step="100">
+                    <div class="form-hint">Messages sent in quick succession within this window are answered as one turn (0 = reply to each message immediately)</div>
+                </div>
+                <div class="form-group">
+                    <label>
+                        <input type="checkbox" id="edit_supersede_inflight" ${step.supersede_inflight !== false ? 'checked' : ''}>
+                        Restart reply when a new message arrives during generation
+                    </label>
+                </div>
+                <div class="form-group">
+                    <label>Seed</label>
+                    <input type="number" id="edit_seed" class="form-control" value="${step.seed ?? ''}" placeholder="Leave empty for random" step="1">
+                    <div class="form-hint">Fixed seed makes replies reproducible (optional)</div>
+                </div>
+                <div class="form-group">
+                    <label>
+                        <input type="checkbox" id="edit_response_cache" ${step.response_cache ? 'checked' : ''}>
+                        Reuse cached replies for identical requests (requires temperature 0 or a fixed seed)
+                    </label>
+                </div>
+                <div class="form-group">
+                    <label>Max Tokens per Turn</label>
+                    <input type="number" id="edit_max_tokens_per_turn" class="form-control" value="${step.max_tokens_per_turn ?? ''}" placeholder="Leave empty for no limit" min="1" step="100">
+                    <div class="form-hint">Participant message plus reply; longer messages are rejected and replies are shortened to fit</div>
+                </div>
+                <div class="form-group">
+                    <label>Max Tokens per Session</label>
+                    <input type="number" id="edit_max_tokens_per_session" class="form-control" value="${step.max_tokens_per_session ?? ''}" placeholder="Leave empty for no limit" min="1" step="1000">
+                    <div class="form-hint">Prompt and reply tokens counted by Ollama; the bot stops replying once reached</div>
+                </div>
+                <div class="form-group">
+                    <label>Max Tokens per Minute</label>
+                    <input type="number" id="edit_max_tokens_per_minute" class="form-control" value="${step.max_tokens_per_minute ?? ''}" placeholder="Leave empty for no limit" min="1" step="100">
+                    <select id="edit_token_budget_action" class="form-control" style="margin-top: 6px;">
+                        <option value="queue" ${step.token_budget_action !== 'reject' ? 'selected' : ''}>Queue with low priority when exceeded</option>
+                        <option value="reject" ${step.token_budget_action === 'reject' ? 'selected' : ''}>Reject when exceeded</option>
+                    </select>
+                </div>
                 <div class="form-group">
                     <label>Time Limit (minutes)</label>
                     <input type="number" id="edit_time_limit" class="form-control" value="${step.time_limit_minutes || ''}" placeholder="Leave empty for no time limit" min="1">
@@ -948,6 +988,14 @@ async function saveStepEdit() {
                 step.num_gpu = num_gpu;
                 const num_batch = getNumberValueOrFallback('edit_num_batch', null);
                 step.num_batch = num_batch;
+                step.coalesce_window_ms = getNumberValueOrFallback('edit_coalesce_window_ms', null);
+                step.supersede_inflight = getCheckboxValueOrFallback('edit_supersede_inflight', step.supersede_inflight ?? true);
+                step.seed = getNumberValueOrFallback('edit_seed', null);
+                step.response_cache = getCheckboxValueOrFallback('edit_response_cache', step.response_cache ?? false);
+                step.max_tokens_per_turn = getNumberValueOrFallback('edit_max_tokens_per_turn', null);
+                step.max_tokens_per_session = getNumberValueOrFallback('edit_max_tokens_per_session', null);
+                step.max_tokens_per_minute = getNumberValueOrFallback('edit_max_tokens_per_minute', null);
+                step.token_budget_action = document.getElementById('edit_token_budget_action')?.value || 'queue';
                 const timeLimit = getNumberValueOrFallback('edit_time_limit', null);
                 step.time_limit_minutes = timeLimit;
                 step.required = getCheckboxValueOrFallback('edit_required', step.required ?? true);
@@ -11,6 +11,7 @@ class ExperimentFlow {
         this.totalSteps = 0;
         this.currentStepIndex = 0;
         this.hasFlow = false;
+        this.stepTimer = null;  // サーバーが設定したステップの期限（残り時間など）
         
         // DOM要素のキャッシュ
         this.flowContainer = null;
@@ -65,6 +66,7 @@ class ExperimentFlow {
             this.currentStep = data.current_step;
             this.currentStepIndex = data.current_step_index;
             this.totalSteps = data.total_steps;
+            this.stepTimer = data.timer || null;
             
             // フロー用コンテナを作成（存在しなければ）
             if (!document.getElementById('flowContainer')) {
@@ -216,9 +218,12 @@ class ExperimentFlow {
         `;
         
         // Start timer if min_display_seconds is set
+        // 表示用のカウントダウン（期限はサーバーが管理し、経過時に time_up で通知される）
         if (minDisplaySeconds && minDisplaySeconds > 0) {
-            console.log(`[Flow] Starting ${minDisplaySeconds}s timer for instruction`);
-            let remainingSeconds = minDisplaySeconds;
+            let remainingSeconds = this.stepTimer && this.stepTimer.step_id === this.currentStep.step_id
+                ? Math.ceil(this.stepTimer.remaining_seconds)
+                : minDisplaySeconds;
+            console.log(`[Flow] Starting ${remainingSeconds}s timer for instruction`);
             const timerElement = document.getElementById('instructionTimer');
             const actionsElement = document.getElementById('instructionActions');
             
@@ -636,7 +641,15 @@ class ExperimentFlow {
                     num_thread: this.currentStep.num_thread || null,
                     num_ctx: this.currentStep.num_ctx || null,
                     num_gpu: this.currentStep.num_gpu !== undefined ? this.currentStep.num_gpu : null,
-                    num_batch: this.currentStep.num_batch || null
+                    num_batch: this.currentStep.num_batch || null,
+                    coalesce_window_ms: this.currentStep.coalesce_window_ms ?? null,
+                    supersede_inflight: this.currentStep.supersede_inflight ?? null,
+                    seed: this.currentStep.seed ?? null,
+                    response_cache: this.currentStep.response_cache ?? null,
+                    max_tokens_per_turn: this.currentStep.max_tokens_per_turn ?? null,
+                    max_tokens_per_session: this.currentStep.max_tokens_per_session ?? null,
+                    max_tokens_per_minute: this.currentStep.max_tokens_per_minute ?? null,
+                    token_budget_action: this.currentStep.token_budget_action ?? null
                 })
             });
             console.log('[Flow] Chat configuration applied:', {
@@ -670,39 +683,38 @@ class ExperimentFlow {
             }
         }
         
-        // タイムリミットを設定（必要なら）
-        if (this.currentStep.time_limit_minutes && this.currentStep.time_limit_minutes > 0) {
-            this.startChatTimer(this.currentStep.time_limit_minutes);
-        }
+        // タイムリミットはサーバーが管理し、time_warning / time_up フレームで通知される
     }
     
     /**
-     * チャットタイマーを開始
+     * サーバーのステップタイマーからの通知（time_warning / time_up）
      */
-    startChatTimer(minutes) {
-        const milliseconds = minutes * 60 * 1000;
-        
-        setTimeout(async () => {
-            // チャットセッションを終了してアンケートへ
-            const endMessage = {
-                type: 'system',
-                message: `⏱️ Time limit reached (${minutes} minutes). Moving to next step...`,
-                timestamp: new Date().toISOString()
-            };
-            
-            // メッセージを表示（chat.jsのdisplayMessage関数を使用）
+    async handleTimerFrame(data) {
+        if (!this.currentStep || data.step_id !== this.currentStep.step_id) {
+            return;  // すでに次のステップに進んでいる
+        }
+        
+        if (data.type === 'time_warning') {
             if (typeof displayMessage === 'function') {
-                displayMessage(endMessage);
-            }
-            
-            // WebSocketを閉じる
-            if (typeof ws !== 'undefined' && ws) {
-                ws.close();
+                displayMessage({ type: 'system', message: data.message, timestamp: data.timestamp });
             }
-            
-            // 次のステップに進む
-            await this.advanceToNextStep();
-        }, milliseconds);
+            return;
+        }
+        
+        if (data.action === 'unlock') {
+            // 最小表示時間の経過：次へボタンを表示
+            const actionsElement = document.getElementById('instructionActions');
+            const timerElement = document.getElementById('instructionTimer');
+            if (actionsElement) actionsElement.style.display = '';
+            if (timerElement) timerElement.remove();
+            return;
+        }
+        
+        // チャットの制限時間：サーバー側ですでに次のステップへ進んでいる
+        if (typeof displayMessage === 'function') {
+            displayMessage({ type: 'system', message: data.message, timestamp: data.timestamp });
+        }
+        await this.applyAdvanceResult(data.flow);
     }
     
     /**
@@ -743,16 +755,13 @@ class ExperimentFlow {
             
             const data = await response.json();
             
-            if (data.completed) {
-                // すべてのステップが完了
-                this.showCompletionMessage();
+            if (data.too_early) {
+                // 最小表示時間が経過していない（サーバー側の判定）
+                console.log(`[Flow] Step not yet available (${data.remaining_seconds}s remaining)`);
                 return;
             }
             
-            // 次のステップを表示
-            this.currentStep = data.next_step;
-            this.currentStepIndex = data.current_step_index;
-            await this.showCurrentStep();
+            await this.applyAdvanceResult(data);
             
         } catch (error) {
             console.error('[Flow] Error advancing to next step:', error);
@@ -760,6 +769,24 @@ class ExperimentFlow {
         }
     }
     
+    /**
+     * ステップ進行の結果を反映して次のステップを表示
+     */
+    async applyAdvanceResult(data) {
+        if (data.completed) {
+            // すべてのステップが完了
+            this.stepTimer = null;
+            this.showCompletionMessage();
+            return;
+        }
+        
+        // 次のステップを表示
+        this.currentStep = data.next_step;
+        this.currentStepIndex = data.current_step_index;
+        this.stepTimer = data.timer || null;
+        await this.showCurrentStep();
+    }
+    
     /**
      * 実験を終了
      */
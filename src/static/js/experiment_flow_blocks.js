@@ -541,6 +541,14 @@ function createNewStep(stepType) {
             newStep.num_ctx = null;
             newStep.num_gpu = null;
             newStep.num_batch = null;
+            newStep.coalesce_window_ms = null;
+            newStep.supersede_inflight = true;
+            newStep.seed = null;
+            newStep.response_cache = false;
+            newStep.max_tokens_per_turn = null;
+            newStep.max_tokens_per_session = null;
+            newStep.max_tokens_per_minute = null;
+            newStep.token_budget_action = 'queue';
             newStep.time_limit_minutes = null;
             break;
         case 'ai_evaluation':
@@ -0,0 +1,43 @@
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# リポジトリのルートを import パスに追加（`src.managers...` として読み込む）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.exporters.export_benchmark import build_experiment  # noqa: E402
+from src.managers.experiment_manager import ExperimentManager  # noqa: E402
+from src.managers.message_store import MessageStore  # noqa: E402
+from src.managers.session_manager import SessionManager  # noqa: E402
+
+
+@pytest.fixture
+def bench_experiment(tmp_path):
+    """ベンチマークと同じ合成実験（40セッション × 4メッセージ）とそのマネージャー"""
+    experiment_id = build_experiment(tmp_path, sessions=40, messages_per_session=4)
+    experiment_manager = ExperimentManager(base_dir=str(tmp_path))
+    data_dir = Path(experiment_manager.get_experiment(experiment_id).data_directory)
+    experiment_manager.current_data_dir = data_dir
+    return SimpleNamespace(
+        experiment_id=experiment_id,
+        experiment_manager=experiment_manager,
+        session_manager=SessionManager(experiment_manager=experiment_manager),
+        message_store=MessageStore(experiment_manager=experiment_manager),
+        sessions_dir=data_dir / "sessions",
+        messages_dir=data_dir / "messages",
+    )
+
+
+def _edit_session_file(path: Path, edit):
+    data = json.loads(path.read_text(encoding='utf-8'))
+    edit(data)
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+@pytest.fixture
+def edit_session_file():
+    """サーバーを通さずにセッションファイルを書き換える関数（edit は読み込んだ辞書を変更する）"""
+    return _edit_session_file
@@ -0,0 +1,79 @@
+"""保存中のファイルを別スレッドから読み込んでも途中の内容が見えないこと（エクスポートと保存の並行）"""
+import json
+import threading
+
+import pytest
+
+from src.managers.atomic_file import read_json, write_text_atomic
+from src.managers.message_store import MessageStore
+from src.managers.session_manager import SessionManager
+from src.models.message import Message
+
+
+def test_write_text_atomic_leaves_no_temporary_files(tmp_path):
+    path = tmp_path / "a.json"
+    write_text_atomic(path, '{"a": 1}')
+    write_text_atomic(path, '{"a": 2}')
+    assert json.loads(path.read_text(encoding='utf-8')) == {"a": 2}
+    assert [p.name for p in tmp_path.iterdir()] == ["a.json"]
+
+
+def test_read_json_retries_partially_written_file(tmp_path):
+    path = tmp_path / "a.json"
+    path.write_text('{"a": ', encoding='utf-8')
+    # 別のプロセスが書き込みを終えるまでの間に読み直す
+    timer = threading.Timer(0.02, lambda: path.write_text('{"a": 1}', encoding='utf-8'))
+    timer.start()
+    try:
+        assert read_json(path) == {"a": 1}
+    finally:
+        timer.join()
+
+
+def test_read_json_gives_up_on_broken_file(tmp_path):
+    path = tmp_path / "a.json"
+    path.write_text('{"a": ', encoding='utf-8')
+    with pytest.raises(ValueError):
+        read_json(path)
+    with pytest.raises(FileNotFoundError):
+        read_json(tmp_path / "missing.json")
+
+
+def test_messages_read_during_saves_are_never_empty(tmp_path):
+    message_store = MessageStore(str(tmp_path))
+    for _ in range(20):
+        message_store.save_message(Message(session_id="s1", client_id="p1", content="x" * 200))
+
+    def writer():
+        for _ in range(300):
+            message_store.save_message(Message(session_id="s1", client_id="p1", content="x" * 200))
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    counts = []
+    while thread.is_alive():
+        counts.append(len(message_store.get_messages_by_session("s1")))
+    thread.join()
+
+    assert counts and min(counts) >= 20
+    assert counts == sorted(counts)
+
+
+def test_sessions_read_during_saves_are_complete(tmp_path):
+    session_manager = SessionManager(str(tmp_path))
+    session = session_manager.create_session("s1")
+
+    def writer():
+        for i in range(300):
+            session.metadata.notes = "n" * (i % 50)
+            session_manager._save_session(session)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    loaded = 0
+    while thread.is_alive():
+        assert session_manager.load_session("s1").session_id == "s1"
+        assert [s.session_id for s in session_manager.get_all_sessions()] == ["s1"]
+        loaded += 1
+    thread.join()
+    assert loaded
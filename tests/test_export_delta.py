@@ -0,0 +1,198 @@
+"""差分エクスポート（parse_watermark・ExportDelta の範囲・削除記録）
+
+since=前回のウォーターマーク で続けて取得したとき、メッセージ・削除記録に漏れも重複もないことを確認する。
+"""
+import csv
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+from src.exporters.data_exporter import DataExporter, ExportDelta
+from src.managers.change_sequence import current_change_seq, next_change_seq, parse_watermark
+from src.managers.message_store import MessageStore
+from src.managers.session_manager import SessionManager
+from src.models.message import Message
+
+EXPERIMENT_ID = "exp1"
+
+
+@pytest.fixture
+def stores(tmp_path):
+    (tmp_path / "sessions").mkdir()
+    (tmp_path / "messages").mkdir()
+    return SessionManager(str(tmp_path / "sessions")), MessageStore(str(tmp_path / "messages"))
+
+
+def new_session(session_manager: SessionManager, session_id: str, experiment_id: str = EXPERIMENT_ID):
+    session = session_manager.create_session(session_id)
+    session.experiment_id = experiment_id
+    session_manager._save_session(session)
+    return session
+
+
+def add_message(message_store: MessageStore, session_id: str, content: str) -> Message:
+    message = Message(session_id=session_id, client_id="p1", content=content)
+    message_store.save_message(message)
+    return message
+
+
+def read_csv(chunks):
+    rows = list(csv.reader(io.StringIO(''.join(chunks))))
+    header, body = rows[0], rows[1:]
+    return [dict(zip(header, row)) for row in body]
+
+
+def pull(session_manager: SessionManager, message_store: MessageStore, since=None, watermark=None):
+    """差分エクスポート1回分（ExportDelta, メッセージID, セッションID, 削除されたセッションID）"""
+    delta = ExportDelta(since=since, watermark=watermark)
+    exporter = DataExporter()
+    messages = read_csv(exporter.iter_experiment_all_data_csv(EXPERIMENT_ID, session_manager, message_store,
+                                                              delta=delta))
+    sessions = read_csv(exporter.iter_experiment_sessions_csv(EXPERIMENT_ID, session_manager, delta=delta))
+    deleted = [] if delta.is_full else [
+        record["session_id"]
+        for record in session_manager.get_deleted_sessions(delta.since, delta.watermark, EXPERIMENT_ID)
+    ]
+    return (delta, [row["message_id"] for row in messages], [row["session_id"] for row in sessions], deleted)
+
+
+def test_parse_watermark_accepts_sequences_and_timestamps():
+    assert parse_watermark("1792386683563935905") == 1792386683563935905
+    assert parse_watermark(42) == 42
+    assert parse_watermark(" 7 ") == 7
+    assert parse_watermark("2026-01-01T00:00:00Z") == 1767225600 * 1_000_000_000
+    assert parse_watermark("2026-01-01T09:00:00+09:00") == 1767225600 * 1_000_000_000
+    assert parse_watermark("2026-01-01T00:00:00.000123+00:00") == 1767225600 * 1_000_000_000 + 123_000
+    # タイムゾーンのない日時はローカル時刻
+    local = datetime(2026, 1, 1, 12, 30, 0)
+    assert parse_watermark(local.isoformat()) == int(local.timestamp()) * 1_000_000_000
+    with pytest.raises(ValueError):
+        parse_watermark("yesterday")
+
+
+def test_timestamp_watermark_orders_with_change_sequence():
+    before = datetime.now(timezone.utc)
+    seq = next_change_seq()
+    assert parse_watermark(before.isoformat()) < seq
+    assert current_change_seq() >= seq
+    assert next_change_seq() > seq
+
+
+def test_consecutive_message_pulls_have_no_gaps_or_duplicates(stores):
+    session_manager, message_store = stores
+    new_session(session_manager, "s1")
+    new_session(session_manager, "s2")
+    new_session(session_manager, "other", experiment_id="exp2")
+    all_ids = [add_message(message_store, "s1", "hello").message_id,
+               add_message(message_store, "s2", "hi").message_id]
+    add_message(message_store, "other", "not exported")
+
+    first, first_ids, _, _ = pull(session_manager, message_store)
+    # ウォーターマークより後に保存されたメッセージは次回に回る
+    all_ids.append(add_message(message_store, "s1", "after first").message_id)
+    new_session(session_manager, "s3")
+    all_ids.append(add_message(message_store, "s3", "new session").message_id)
+
+    second, second_ids, _, _ = pull(session_manager, message_store, since=first.watermark)
+    all_ids.append(add_message(message_store, "s2", "after second").message_id)
+    third, third_ids, _, _ = pull(session_manager, message_store, since=second.watermark)
+    _, fourth_ids, _, _ = pull(session_manager, message_store, since=third.watermark)
+
+    pulled = first_ids + second_ids + third_ids + fourth_ids
+    assert sorted(pulled) == sorted(all_ids)
+    assert len(pulled) == len(set(pulled))
+    assert fourth_ids == []
+
+
+def test_message_at_watermark_belongs_to_earlier_pull(stores):
+    session_manager, message_store = stores
+    new_session(session_manager, "s1")
+    messages = [add_message(message_store, "s1", f"m{i}") for i in range(4)]
+    boundary = messages[1].change_seq
+
+    _, first_ids, _, _ = pull(session_manager, message_store, watermark=boundary)
+    _, second_ids, _, _ = pull(session_manager, message_store, since=boundary)
+
+    assert first_ids == [m.message_id for m in messages[:2]]
+    assert second_ids == [m.message_id for m in messages[2:]]
+
+
+def test_session_pulls_return_only_changed_sessions(stores):
+    session_manager, message_store = stores
+    new_session(session_manager, "s1")
+    s2 = new_session(session_manager, "s2")
+
+    first, _, first_sessions, _ = pull(session_manager, message_store)
+    assert sorted(first_sessions) == ["s1", "s2"]
+
+    s2.change_status("completed")
+    session_manager._save_session(s2)
+    new_session(session_manager, "s3")
+    second, _, second_sessions, _ = pull(session_manager, message_store, since=first.watermark)
+    assert sorted(second_sessions) == ["s2", "s3"]
+
+    _, _, third_sessions, _ = pull(session_manager, message_store, since=second.watermark)
+    assert third_sessions == []
+
+
+def test_deleted_sessions_are_reported_once(stores):
+    session_manager, message_store = stores
+    for session_id in ("s1", "s2", "s3"):
+        new_session(session_manager, session_id)
+    new_session(session_manager, "other", experiment_id="exp2")
+
+    first, _, _, first_deleted = pull(session_manager, message_store)
+    assert first_deleted == []
+
+    session_manager.delete_session("s1")
+    session_manager.delete_session("other")
+    second, _, second_sessions, second_deleted = pull(session_manager, message_store, since=first.watermark)
+    assert second_deleted == ["s1"]
+    assert second_sessions == []
+
+    session_manager.delete_session("s2")
+    third, _, _, third_deleted = pull(session_manager, message_store, since=second.watermark)
+    assert third_deleted == ["s2"]
+
+    _, _, _, fourth_deleted = pull(session_manager, message_store, since=third.watermark)
+    assert fourth_deleted == []
+
+
+def test_recreated_session_is_not_reported_as_deleted(stores):
+    session_manager, message_store = stores
+    new_session(session_manager, "s1")
+    first, _, _, _ = pull(session_manager, message_store)
+
+    session_manager.delete_session("s1")
+    new_session(session_manager, "s1")
+    _, _, sessions, deleted = pull(session_manager, message_store, since=first.watermark)
+    assert deleted == []
+    assert sessions == ["s1"]
+
+
+def test_unreadable_message_file_fails_delta_instead_of_skipping(stores):
+    session_manager, message_store = stores
+    new_session(session_manager, "s1")
+    add_message(message_store, "s1", "hello")
+    first, _, _, _ = pull(session_manager, message_store)
+
+    add_message(message_store, "s1", "after first")
+    (message_store.data_dir / "s1.json").write_text('[{"message_id": "trunc', encoding='utf-8')
+    with pytest.raises(ValueError):
+        pull(session_manager, message_store, since=first.watermark)
+
+
+def test_unreadable_session_file_fails_delta_instead_of_skipping(stores):
+    session_manager, message_store = stores
+    new_session(session_manager, "s1")
+    first, _, _, _ = pull(session_manager, message_store)
+
+    new_session(session_manager, "s2")
+    (session_manager.data_dir / "s2.json").write_text('{"session_id": "s2", "crea', encoding='utf-8')
+    with pytest.raises(ValueError):
+        pull(session_manager, message_store, since=first.watermark)
+    exporter = DataExporter()
+    with pytest.raises(ValueError):
+        ''.join(exporter.iter_experiment_wide_format_csv(EXPERIMENT_ID, session_manager, message_store,
+                                                         delta=ExportDelta(since=first.watermark)))
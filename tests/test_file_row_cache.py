@@ -0,0 +1,81 @@
+"""FileRowCache の読み直し（状態が変わったファイルだけ・読み直し中の更新と破棄の扱い）"""
+import json
+
+import pytest
+
+from src.managers.file_row_cache import FileRowCache, file_state
+
+
+class NameCache(FileRowCache):
+    """行の値はセッションファイルの name（読み込み時に during_load を一度だけ呼ぶ）"""
+
+    def __init__(self, sessions_dir):
+        super().__init__(sessions_dir)
+        self.loaded = []
+        self.during_load = None
+
+    def _created_at(self, value):
+        return value["created_at"]
+
+    def _load_names(self, stale):
+        if self.during_load is not None:
+            during_load, self.during_load = self.during_load, None
+            during_load()
+        self.loaded.extend(path.stem for path, _ in stale)
+        return {i: json.loads(path.read_text(encoding='utf-8')) for i, (path, _) in enumerate(stale)}
+
+    def values(self):
+        return self._refresh(file_state, self._load_names)
+
+
+def write(sessions_dir, name, created_at):
+    (sessions_dir / f"{name}.json").write_text(json.dumps({"name": name, "created_at": created_at}),
+                                               encoding='utf-8')
+
+
+@pytest.fixture
+def cache(tmp_path):
+    for i in range(3):
+        write(tmp_path, f"s{i}", f"2026-01-0{i + 1}")
+    return NameCache(tmp_path)
+
+
+def test_only_changed_files_are_reloaded(cache):
+    assert [value["name"] for value in cache.values()] == ["s2", "s1", "s0"]
+    cache.loaded.clear()
+    assert cache.values() is cache.values()
+    assert cache.loaded == []
+
+    write(cache.sessions_dir, "s0", "2026-02-01")
+    (cache.sessions_dir / "s1.json").unlink()
+    assert [value["name"] for value in cache.values()] == ["s0", "s2"]
+    assert cache.loaded == ["s0"]
+
+
+def test_update_during_refresh_is_kept(cache):
+    cache.values()
+    write(cache.sessions_dir, "s1", "2026-01-02")
+
+    def put_from_flow():
+        with cache._lock:
+            cache._put("s1", {"name": "from flow", "created_at": "2026-01-02"},
+                       file_state(cache.sessions_dir / "s1.json"))
+
+    cache.during_load = put_from_flow
+    names = [value["name"] for value in cache.values()]
+    assert names == ["s2", "from flow", "s0"]
+
+
+def test_clear_during_refresh_discards_loaded_rows(cache):
+    cache.values()
+    write(cache.sessions_dir, "s1", "2026-01-02")
+
+    def clear():
+        with cache._lock:
+            cache._clear()
+
+    cache.during_load = clear
+    assert cache.values() == []
+    cache.loaded.clear()
+    assert [value["name"] for value in cache.values()] == ["s2", "s1", "s0"]
+    assert sorted(cache.loaded) == ["s0", "s1", "s2"]
@@ -0,0 +1,174 @@
+"""FlowTimerService の期限ヒープ（順序・ステップ移動での付け替え・解除）と発火時の処理の分離"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from src.managers.flow_timer import KIND_TIME_UP, KIND_WARNING, FlowTimerService
+
+
+def chat_step(step_id: str, minutes: float):
+    return SimpleNamespace(step_id=step_id, step_type="chat", time_limit_minutes=minutes, min_display_seconds=None)
+
+
+def instruction_step(step_id: str, seconds: float):
+    return SimpleNamespace(step_id=step_id, step_type="instruction", time_limit_minutes=None,
+                           min_display_seconds=seconds)
+
+
+def fired(due):
+    return [(timer.session_id, timer.step_id, kind) for timer, kind in due]
+
+
+def test_events_fire_in_deadline_order():
+    service = FlowTimerService(warning_seconds=60)
+    chat = service.arm("a", chat_step("chat", 2))
+    instruction = service.arm("b", instruction_step("intro", 10))
+
+    assert service.pop_due(instruction.deadline - 0.01) == []
+    assert fired(service.pop_due(chat.deadline)) == [
+        ("b", "intro", KIND_TIME_UP),
+        ("a", "chat", KIND_WARNING),
+        ("a", "chat", KIND_TIME_UP),
+    ]
+    # 締め切ったチャットのみ記録し、期限は解除される
+    assert service.is_chat_closed("a")
+    assert not service.is_chat_closed("b")
+    assert service.timers == {}
+    assert service.fired == {KIND_WARNING: 1, KIND_TIME_UP: 2}
+
+
+def test_warning_only_when_shorter_than_limit():
+    service = FlowTimerService(warning_seconds=60)
+    timer = service.arm("a", chat_step("chat", 0.5))
+    assert fired(service.pop_due(timer.deadline)) == [("a", "chat", KIND_TIME_UP)]
+
+
+def test_same_step_keeps_deadline():
+    service = FlowTimerService(warning_seconds=0)
+    first = service.arm("a", chat_step("chat", 1))
+    assert service.arm("a", chat_step("chat", 1)) is first
+    assert len(service._heap) == 1
+
+
+def test_next_step_replaces_deadline():
+    service = FlowTimerService(warning_seconds=60)
+    chat = service.arm("a", chat_step("chat", 2))
+    instruction = service.arm("a", instruction_step("outro", 300))
+
+    # 前のステップの警告・期限は読み捨てられる
+    assert service.pop_due(chat.deadline + 1) == []
+    assert fired(service.pop_due(instruction.deadline)) == [("a", "outro", KIND_TIME_UP)]
+
+
+def test_entering_chat_reopens_closed_chat():
+    service = FlowTimerService(warning_seconds=0)
+    timer = service.arm("a", chat_step("chat1", 1))
+    service.pop_due(timer.deadline)
+    assert service.is_chat_closed("a")
+
+    service.arm("a", chat_step("chat2", 1))
+    assert not service.is_chat_closed("a")
+
+
+def test_refetch_after_time_up_does_not_rearm():
+    service = FlowTimerService(warning_seconds=0)
+    step = instruction_step("intro", 10)
+    timer = service.arm("a", step)
+    service.pop_due(timer.deadline)
+
+    # ページの再読み込み（/flow/current）では期限を設定し直さず、経過済みのタイマーを返す
+    again = service.arm("a", step)
+    assert again is timer
+    assert again.to_dict()["remaining_seconds"] == 0 and again.to_dict()["expired"]
+    assert service._heap == []
+    # /flow/advance の too_early 判定に使う期限は残らない
+    assert service.get_timer("a") is None
+    assert service.remaining("a") == 0
+
+    # ステップが変わると経過済みの記録は消え、次のステップの期限を設定する
+    outro = service.arm("a", instruction_step("outro", 5))
+    assert outro is not timer and outro.remaining() > 0
+    assert service.expired == {}
+    assert service.arm("a", step) is not timer
+
+
+def test_disarm_and_forget_cancel_events():
+    service = FlowTimerService(warning_seconds=60)
+    a = service.arm("a", chat_step("chat", 2))
+    service.arm("b", chat_step("chat", 2))
+    service.arm("c", chat_step("chat", 2))
+    service.closed_chats.add("c")
+
+    service.disarm("a")
+    service.forget("c")
+
+    assert fired(service.pop_due(a.deadline + 1)) == [("b", "chat", KIND_WARNING), ("b", "chat", KIND_TIME_UP)]
+    assert not service.is_chat_closed("c")
+
+
+def test_compaction_drops_stale_events():
+    service = FlowTimerService(warning_seconds=0)
+    for i in range(200):
+        timer = service.arm("a", instruction_step(f"step{i}", 10))
+    assert len(service._heap) <= 4 * len(service.timers) + 64
+    assert fired(service.pop_due(timer.deadline)) == [("a", "step199", KIND_TIME_UP)]
+
+
+def test_slow_handler_does_not_delay_other_timers():
+    async def scenario():
+        service = FlowTimerService(warning_seconds=0)
+        handled = {}
+        release = asyncio.Event()
+
+        async def on_fire(timer, kind):
+            if timer.session_id == "slow":
+                await release.wait()
+            handled[timer.session_id] = time.monotonic()
+
+        started = time.monotonic()
+        service.arm("slow", instruction_step("intro", 0.05))
+        service.arm("fast", instruction_step("intro", 0.15))
+        service.start(on_fire)
+        try:
+            for _ in range(100):
+                if "fast" in handled:
+                    break
+                await asyncio.sleep(0.01)
+            assert "fast" in handled and "slow" not in handled
+            assert handled["fast"] - started < 0.5
+            assert service.get_stats()["handling"] == 1
+
+            release.set()
+            await asyncio.sleep(0.05)
+            assert "slow" in handled
+            assert service.get_stats()["handling"] == 0
+        finally:
+            service._task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_handler_errors_do_not_stop_scheduler():
+    async def scenario():
+        service = FlowTimerService(warning_seconds=0)
+        handled = []
+
+        async def on_fire(timer, kind):
+            if timer.session_id == "broken":
+                raise RuntimeError("send failed")
+            handled.append(timer.session_id)
+
+        service.arm("broken", instruction_step("intro", 0.01))
+        service.start(on_fire)
+        try:
+            await asyncio.sleep(0.05)
+            service.arm("ok", instruction_step("intro", 0.01))
+            for _ in range(50):
+                if handled:
+                    break
+                await asyncio.sleep(0.01)
+            assert handled == ["ok"]
+        finally:
+            service._task.cancel()
+
+    asyncio.run(scenario())
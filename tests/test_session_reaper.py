@@ -0,0 +1,89 @@
+"""SessionReaper の期限ヒープ（順序・期限の更新・管理対象からの除外）"""
+from datetime import datetime
+
+from src.managers.session_reaper import SessionReaper
+from src.models.session import Session
+
+BASE = datetime(2026, 1, 1, 9, 0, 0).timestamp()
+
+
+def make_session(session_id: str, offset: float, participants=(), status: str = "active") -> Session:
+    """最終アクティビティが BASE + offset 秒のセッション"""
+    return Session(
+        session_id=session_id,
+        status=status,
+        participants=list(participants),
+        last_activity=datetime.fromtimestamp(BASE + offset).isoformat(),
+    )
+
+
+def make_reaper() -> SessionReaper:
+    return SessionReaper(empty_grace_seconds=30, idle_threshold_minutes=1)
+
+
+def test_empty_sessions_are_due_in_deadline_order():
+    reaper = make_reaper()
+    reaper.track(make_session("c", 20))
+    reaper.track(make_session("a", 0))
+    reaper.track(make_session("b", 10))
+
+    assert reaper.next_deadline() == BASE + 30
+    assert reaper.pop_due(BASE + 29.9) == []
+    assert reaper.pop_due(BASE + 40) == ["a", "b"]
+    assert reaper.pop_due(BASE + 100) == ["c"]
+    # 取り出したセッションは管理対象から外れ、再度は返らない
+    assert reaper.pop_due(BASE + 1000) == []
+    assert reaper.entries == {}
+
+
+def test_new_activity_reschedules_deadline():
+    reaper = make_reaper()
+    reaper.track(make_session("a", 0))
+    reaper.track(make_session("a", 25))
+
+    # 古い期限（BASE + 30）は読み捨てられる
+    assert reaper.pop_due(BASE + 31) == []
+    assert reaper.pop_due(BASE + 55) == ["a"]
+
+
+def test_joining_participant_switches_to_idle_deadline():
+    reaper = make_reaper()
+    reaper.track(make_session("a", 0))
+    reaper.track(make_session("a", 0, participants=["p1"]))
+
+    # 参加者がいるセッションは終了せず、アイドル期限（60秒）で印を付けるのみ
+    assert reaper.pop_due(BASE + 31) == []
+    assert not reaper.entries["a"].idle
+    assert reaper.pop_due(BASE + 61) == []
+    assert reaper.entries["a"].idle
+    assert reaper.get_stats()["idle_sessions"] == 1
+
+    # 参加者が退室すると空セッションの期限に戻る
+    reaper.track(make_session("a", 70))
+    assert not reaper.entries["a"].idle
+    assert reaper.pop_due(BASE + 101) == ["a"]
+
+
+def test_forget_and_inactive_status_cancel_deadline():
+    reaper = make_reaper()
+    reaper.track(make_session("a", 0))
+    reaper.track(make_session("b", 0))
+    reaper.track(make_session("c", 0))
+
+    reaper.forget("a")
+    reaper.track(make_session("b", 5, status="ended"))
+
+    assert reaper.pop_due(BASE + 100) == ["c"]
+    assert set(reaper.entries) == set()
+
+
+def test_compaction_keeps_only_current_deadlines():
+    reaper = make_reaper()
+    for i in range(200):
+        reaper.track(make_session("a", i))
+    reaper.track(make_session("b", 0))
+
+    assert len(reaper._heap) <= 4 * len(reaper.entries) + 64
+    assert reaper.pop_due(BASE + 31) == ["b"]
+    assert reaper.pop_due(BASE + 199 + 29) == []
+    assert reaper.pop_due(BASE + 199 + 30) == ["a"]
@@ -0,0 +1,126 @@
+"""ExperimentSurveyIndex からの出力が、毎回全セッションから作成した場合と一致すること
+
+アンケート回答のエクスポート（CSV・JSON）・回答数の集計・条件別の数値集計を、
+フローからの更新とサーバーを通さないファイルの編集・削除・追加の後に比べる。
+"""
+import json
+import shutil
+
+import pytest
+
+from src.exporters.data_exporter import DataExporter
+from src.managers import survey_analytics
+from src.managers.survey_index import SurveyIndexStore
+
+
+def survey_exports(exporter: DataExporter, bench):
+    csv_text = ''.join(exporter.iter_experiment_survey_responses_csv(bench.experiment_id, bench.session_manager))
+    data = json.loads(''.join(exporter.iter_experiment_survey_responses_json(bench.experiment_id,
+                                                                            bench.session_manager)))
+    data.pop("exported_at")
+    return csv_text, data
+
+
+def rounded(value):
+    """浮動小数点の加算順の違いを除いて比べる"""
+    if isinstance(value, float):
+        return round(value, 9)
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items() if key != "elapsed_ms"}
+    if isinstance(value, list):
+        return [rounded(item) for item in value]
+    return value
+
+
+@pytest.fixture
+def indexed():
+    store = SurveyIndexStore()
+    return store, DataExporter(survey_index=store)
+
+
+def assert_matches_full_rebuild(bench, store: SurveyIndexStore, exporter: DataExporter):
+    assert survey_exports(exporter, bench) == survey_exports(DataExporter(), bench)
+    fresh = SurveyIndexStore()
+    assert store.summary(bench.experiment_id, bench.session_manager) == \
+        fresh.summary(bench.experiment_id, bench.session_manager)
+    if survey_analytics.is_available():
+        assert rounded(store.analytics(bench.experiment_id, bench.session_manager, effect_sizes=True)) == \
+            rounded(fresh.analytics(bench.experiment_id, bench.session_manager, effect_sizes=True))
+
+
+def test_initial_index_matches(bench_experiment, indexed):
+    store, exporter = indexed
+    assert_matches_full_rebuild(bench_experiment, store, exporter)
+    assert store.summary(bench_experiment.experiment_id, bench_experiment.session_manager)["total_sessions"] == 40
+
+
+def test_out_of_band_edits_are_picked_up(bench_experiment, indexed, edit_session_file):
+    store, exporter = indexed
+    bench = bench_experiment
+    survey_exports(exporter, bench)
+
+    def change_answers(data):
+        pre = next(iter(data["step_responses"]["pre"].values()))
+        pre["survey_responses"][1]["answer"] = "7"
+        pre["survey_responses"].append({"question_id": "pre_extra", "answer": 3.5})
+        data["assigned_conditions"] = {"branch1": "neutral"}
+
+    edit_session_file(bench.sessions_dir / "sess_000002.json", change_answers)
+    assert_matches_full_rebuild(bench, store, exporter)
+    answers = [answer.answer for _, answer in store.query(bench.experiment_id, bench.session_manager,
+                                                          question_id="pre_extra")]
+    assert answers == [3.5]
+
+
+def test_out_of_band_deletions_and_additions(bench_experiment, indexed, edit_session_file):
+    store, exporter = indexed
+    bench = bench_experiment
+    survey_exports(exporter, bench)
+
+    for name in ("sess_000001.json", "sess_000004.json"):
+        (bench.sessions_dir / name).unlink()
+    assert_matches_full_rebuild(bench, store, exporter)
+
+    copied = bench.sessions_dir / "sess_copy.json"
+    shutil.copy(bench.sessions_dir / "sess_000009.json", copied)
+    edit_session_file(copied, lambda data: data.update(session_id="sess_copy", created_at="2027-01-01T00:00:00"))
+    edit_session_file(bench.sessions_dir / "sess_000011.json", lambda data: data.update(experiment_id="another"))
+    assert_matches_full_rebuild(bench, store, exporter)
+    assert store.summary(bench.experiment_id, bench.session_manager)["total_sessions"] == 38
+
+
+def test_flow_updates_match_full_rebuild(bench_experiment, indexed):
+    store, exporter = indexed
+    bench = bench_experiment
+    survey_exports(exporter, bench)
+
+    session = bench.session_manager.load_session("sess_000013")
+    session.add_step_response("post", session.client_id, {
+        "survey_responses": [{"question_id": "post_2", "answer": 2}, {"question_id": "post_new", "answer": 5}],
+    })
+    session.assign_condition("branch1", "empathy")
+    bench.session_manager._save_session(session)
+    store.update_session(session, bench.session_manager)
+
+    assert_matches_full_rebuild(bench, store, exporter)
+
+
+@pytest.mark.skipif(not survey_analytics.is_available(), reason="numpy is not installed")
+def test_numeric_columns_compact_without_changing_results(bench_experiment, indexed, monkeypatch):
+    store, _ = indexed
+    bench = bench_experiment
+    monkeypatch.setattr(survey_analytics, "COMPACT_MIN_INVALID", 1)
+    store.analytics(bench.experiment_id, bench.session_manager)
+
+    # 同じセッションを何度も作り直して無効な値を溜め、詰め直しを起こす
+    session = bench.session_manager.load_session("sess_000020")
+    for i in range(60):
+        session.add_step_response("pre", session.client_id, {
+            "survey_responses": [{"question_id": f"pre_{k}", "answer": i % 7 + 1} for k in range(1, 6)],
+        })
+        bench.session_manager._save_session(session)
+        store.update_session(session, bench.session_manager)
+
+    index = store._index(bench.experiment_id, bench.session_manager.data_dir)
+    assert index.numeric.compactions >= 1
+    assert_matches_full_rebuild(bench, store, DataExporter(survey_index=store))
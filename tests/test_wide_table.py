@@ -0,0 +1,126 @@
+"""MaterializedWideTable からのワイド形式の出力が、毎回全件から作成した場合と一致すること
+
+フローの処理による更新に加え、サーバーを通さないファイルの編集・削除・追加の後も確認する。
+"""
+import io
+import shutil
+import zipfile
+
+import pytest
+
+from src.exporters.data_exporter import DataExporter
+from src.exporters.wide_table import WideTableStore
+from src.models.message import Message
+
+
+def wide_csv(exporter: DataExporter, bench) -> str:
+    return ''.join(exporter.iter_experiment_wide_format_csv(
+        bench.experiment_id, bench.session_manager, bench.message_store, bench.experiment_manager))
+
+
+def codebook_members(exporter: DataExporter, bench) -> dict:
+    content = exporter.export_experiment_wide_format_with_codebook(
+        bench.experiment_id, bench.session_manager, bench.message_store, bench.experiment_manager)
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+@pytest.fixture
+def exporters():
+    store = WideTableStore()
+    return store, DataExporter(wide_tables=store), DataExporter()
+
+
+def assert_matches_full_rebuild(bench, materialized: DataExporter, fresh: DataExporter):
+    assert wide_csv(materialized, bench) == wide_csv(fresh, bench)
+    assert codebook_members(materialized, bench) == codebook_members(fresh, bench)
+
+
+def test_initial_export_matches_and_is_reused(bench_experiment, exporters):
+    store, materialized, fresh = exporters
+    assert_matches_full_rebuild(bench_experiment, materialized, fresh)
+
+    table_stats = store.get_stats()[0]
+    assert table_stats["rows"] == 40
+    wide_csv(materialized, bench_experiment)
+    assert store.get_stats()[0]["last_refreshed"] == 0
+
+
+def test_out_of_band_edits_are_picked_up(bench_experiment, exporters, edit_session_file):
+    store, materialized, fresh = exporters
+    wide_csv(materialized, bench_experiment)
+
+    def change_answers(data):
+        data["status"] = "cancelled"
+        pre = next(iter(data["step_responses"]["pre"].values()))
+        pre["survey_responses"][0]["answer"] = 7
+        pre["survey_responses"].append({"question_id": "pre_extra", "answer": "added by hand"})
+
+    edit_session_file(bench_experiment.sessions_dir / "sess_000003.json", change_answers)
+    assert_matches_full_rebuild(bench_experiment, materialized, fresh)
+    assert "pre_extra" in wide_csv(materialized, bench_experiment).splitlines()[0]
+    assert store.get_stats()[0]["refreshes"] >= 1
+
+
+def test_out_of_band_deletions_and_additions(bench_experiment, exporters, edit_session_file):
+    _, materialized, fresh = exporters
+    wide_csv(materialized, bench_experiment)
+
+    # セッション・メッセージファイルの削除（列の登録も作り直される）
+    (bench_experiment.sessions_dir / "sess_000005.json").unlink()
+    (bench_experiment.messages_dir / "sess_000005.json").unlink()
+    (bench_experiment.messages_dir / "sess_000006.json").unlink()
+    assert_matches_full_rebuild(bench_experiment, materialized, fresh)
+
+    # 別のセッションのコピーを追加
+    copied = bench_experiment.sessions_dir / "sess_copy.json"
+    shutil.copy(bench_experiment.sessions_dir / "sess_000007.json", copied)
+    edit_session_file(copied, lambda data: data.update(session_id="sess_copy", created_at="2027-01-01T00:00:00"))
+    assert_matches_full_rebuild(bench_experiment, materialized, fresh)
+
+    # 他の実験に移されたセッションは行から外れる
+    edit_session_file(bench_experiment.sessions_dir / "sess_000008.json",
+                      lambda data: data.update(experiment_id="another"))
+    assert_matches_full_rebuild(bench_experiment, materialized, fresh)
+    assert "sess_000008" not in wide_csv(materialized, bench_experiment)
+
+
+def test_new_messages_update_message_counts(bench_experiment, exporters):
+    _, materialized, fresh = exporters
+    wide_csv(materialized, bench_experiment)
+
+    bench_experiment.message_store.save_message(
+        Message(session_id="sess_000010", client_id="p10", message_type="user", content="one more message"))
+    assert_matches_full_rebuild(bench_experiment, materialized, fresh)
+
+
+def test_flow_updates_match_full_rebuild(bench_experiment, exporters):
+    store, materialized, fresh = exporters
+    bench = bench_experiment
+    wide_csv(materialized, bench)
+
+    session = bench.session_manager.load_session("sess_000012")
+    session.add_step_response("post", session.client_id, {
+        "survey_responses": [{"question_id": "post_1", "answer": 1}, {"question_id": "post_new", "answer": "x"}],
+    })
+    session.change_status("completed")
+    bench.session_manager._save_session(session)
+    store.update_session(session, bench.session_manager, bench.message_store)
+
+    assert store.get_stats()[0]["updates"] == 1
+    assert wide_csv(materialized, bench) == wide_csv(fresh, bench)
+    # フローから更新した行は読み直さない
+    assert store.get_stats()[0]["last_refreshed"] == 0
+    assert codebook_members(materialized, bench) == codebook_members(fresh, bench)
+
+
+def test_flow_change_rebuilds_rows(bench_experiment, exporters):
+    _, materialized, fresh = exporters
+    bench = bench_experiment
+    wide_csv(materialized, bench)
+
+    experiment = bench.experiment_manager.get_experiment(bench.experiment_id)
+    experiment.experiment_flow[2]["branches"][0]["steps"][0]["bot_name"] = "AI-E2"
+    bench.experiment_manager._save_experiment(experiment, bench.sessions_dir.parent)
+    assert_matches_full_rebuild(bench, materialized, fresh)
+    assert "AI-E2" in wide_csv(materialized, bench)